@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+"""
+Throughput benchmarks for the crawlers in twitter_crawler.py.
+
+Each scenario drives a crawler against the mock Twitter API in
+mock_twitter_server.py on a virtual clock, so that 15 minute rate
+limit windows pass in milliseconds, and reports:
+
+  users_per_hour     -- users crawled per (virtual) hour
+  calls_per_window   -- API calls made per 15 minute window
+  quota_utilisation  -- fraction of the endpoint's rate limit used over
+                        every window the run reached into
+  idle_fraction      -- fraction of (virtual) time spent sleeping
+  bytes_per_second   -- bytes written to disk per (virtual) second
+  cpu_ms_per_record  -- crawler (not mock) CPU time per Tweet/ID/user
+  peak_rss_kb        -- peak resident set size of the scenario
+
+Every scenario runs in its own process, so peak RSS is per scenario.
+Results can be saved as a baseline and later runs compared against it:
+
+  ./benchmark_crawlers.py --save-baseline benchmark_baseline.json
+  ./benchmark_crawlers.py --baseline benchmark_baseline.json
+
+The comparison exits with status 1 if any metric is worse than the
+baseline by more than --tolerance.
+"""
+
+# Standard Library modules
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import ujson as json #much quicker
+except:
+    import json
+
+# Local modules
+import twitter_crawler
+from twitter_crawler import (CrawlTwitterTimelines, FindFollowers, UserLookup,
+                             save_tweets_to_json_file)
+from mock_twitter_server import (MockTwitterAPI, MockTwython, SyntheticTwitterData, VirtualClock,
+                                 RATE_LIMIT_WINDOW_SECONDS)
+
+
+# For each metric, whether a bigger number is better.  CPU and memory
+# depend on the machine, the others only on the code and the mock.
+METRICS = [
+    ('users_per_hour', True),
+    ('calls_per_window', True),
+    ('quota_utilisation', True),
+    ('idle_fraction', False),
+    ('bytes_per_second', True),
+    ('cpu_ms_per_record', False),
+    ('peak_rss_kb', False),
+]
+
+# Virtual seconds each API request takes
+DEFAULT_LATENCY = 0.25
+
+
+class CrawlerClock:
+    """
+    Stands in for the time module inside twitter_crawler, counting how
+    long the crawlers sleep separately from the time spent waiting on
+    (mock) requests.
+    """
+    def __init__(self, clock):
+        self._clock = clock
+        self.seconds_slept = 0.0
+
+    def time(self):
+        return self._clock.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.seconds_slept += seconds
+        self._clock.sleep(seconds)
+
+
+class TimedMockTwython(MockTwython):
+    """
+    MockTwython that keeps track of the CPU time spent generating
+    responses, so that it can be left out of the crawlers' CPU time.
+    """
+    def __init__(self, mock_api=None, token='default'):
+        MockTwython.__init__(self, mock_api, token)
+        self.cpu_seconds = 0.0
+
+    def get(self, endpoint, params=None, version='1.1'):
+        start_cpu = time.clock()
+        try:
+            return MockTwython.get(self, endpoint, params, version)
+        finally:
+            self.cpu_seconds += time.clock() - start_cpu
+
+
+class Scenario:
+    """
+    One benchmark: crawl `user_count` users with a crawler that uses
+    `endpoint` and return how many records were retrieved.
+    """
+    endpoint = None
+
+    def __init__(self, twython, output_directory, user_count, logger):
+        self.twython = twython
+        self.output_directory = output_directory
+        self.user_count = user_count
+        self.logger = logger
+
+    def user_ids(self):
+        return range(1, self.user_count + 1)
+
+    def run(self):
+        raise NotImplementedError
+
+
+class TimelineScenario(Scenario):
+    """
+    CrawlTwitterTimelines.get_all_timeline_tweets_for_id() followed by
+    save_tweets_to_json_file(), as in save_timelines_to_json_gz.py
+    """
+    endpoint = 'statuses/user_timeline'
+
+    def run(self):
+        crawler = CrawlTwitterTimelines(self.twython, self.logger)
+        tweet_count = 0
+        for user_id in self.user_ids():
+            tweets = crawler.get_all_timeline_tweets_for_id(user_id)
+            save_tweets_to_json_file(tweets, os.path.join(self.output_directory, '%d.tweets.gz' % user_id))
+            tweet_count += len(tweets)
+        return tweet_count
+
+
+class FollowerScenario(Scenario):
+    """
+    FindFollowers.get_follower_ids_for_id(), fetching every page
+    """
+    endpoint = 'followers/ids'
+
+    def run(self):
+        crawler = FindFollowers(self.twython, self.logger)
+        id_count = 0
+        for user_id in self.user_ids():
+            id_count += len(crawler.get_follower_ids_for_id(user_id, count=sys.maxint))
+        return id_count
+
+
+class UserLookupScenario(Scenario):
+    """
+    UserLookup.lookup_users() in batches of 100 IDs
+    """
+    endpoint = 'users/lookup'
+
+    def run(self):
+        crawler = UserLookup(self.twython, self.logger)
+        return len(crawler.lookup_users(self.user_ids()))
+
+
+SCENARIOS = {
+    'timelines': (TimelineScenario, 400),
+    'followers': (FollowerScenario, 60),
+    'user_lookup': (UserLookupScenario, 20000),
+}
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, filename)) for filename in os.listdir(directory))
+
+
+def run_scenario(name, user_count=None, latency=DEFAULT_LATENCY, seed=0):
+    """
+    Runs the named scenario and returns a dictionary of its metrics.
+    """
+    scenario_class, default_user_count = SCENARIOS[name]
+    if user_count is None:
+        user_count = default_user_count
+
+    logger = logging.getLogger('benchmark_crawlers')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    clock = VirtualClock()
+    crawler_clock = CrawlerClock(clock)
+    mock_api = MockTwitterAPI(SyntheticTwitterData(user_count=max(user_count, 1000), seed=seed, clock=clock),
+                              latency=latency, seed=seed, clock=clock)
+    output_directory = tempfile.mkdtemp()
+
+    real_time = twitter_crawler.time
+    twitter_crawler.time = crawler_clock
+    try:
+        twython = TimedMockTwython(mock_api)
+        scenario = scenario_class(twython, output_directory, user_count, logger)
+        # time.clock() is processor time, with much finer resolution than os.times()
+        start_cpu = time.clock()
+        start_wall = time.time()
+        start_virtual = clock.time()
+        record_count = scenario.run()
+        cpu_seconds = time.clock() - start_cpu - twython.cpu_seconds
+        wall_seconds = time.time() - start_wall
+        virtual_seconds = clock.time() - start_virtual
+        bytes_written = directory_size(output_directory)
+    finally:
+        twitter_crawler.time = real_time
+        shutil.rmtree(output_directory)
+
+    api_calls = mock_api.endpoint_counts.get(scenario.endpoint, 0)
+    # Every rate limit window the run reached into, including the last,
+    # partly used one
+    windows = max(math.ceil(virtual_seconds / RATE_LIMIT_WINDOW_SECONDS), 1)
+    return {
+        'scenario': name,
+        'users': user_count,
+        'records': record_count,
+        'api_calls': api_calls,
+        'virtual_seconds': virtual_seconds,
+        'wall_seconds': wall_seconds,
+        'bytes_written': bytes_written,
+        'users_per_hour': user_count * 3600.0 / max(virtual_seconds, 1.0),
+        'calls_per_window': float(api_calls) / windows,
+        'quota_utilisation': float(api_calls) / (mock_api.rate_limits[scenario.endpoint] * windows),
+        'idle_fraction': crawler_clock.seconds_slept / max(virtual_seconds, 1.0),
+        'bytes_per_second': bytes_written / max(virtual_seconds, 1.0),
+        'cpu_ms_per_record': 1000.0 * cpu_seconds / max(record_count, 1),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _run_scenario_in_pool(args):
+    return run_scenario(*args)
+
+
+def run_scenarios(names, user_count=None, latency=DEFAULT_LATENCY, seed=0):
+    """
+    Runs each scenario in a fresh process, so that peak RSS and the
+    module level state in twitter_crawler are not shared between them.
+    """
+    results = {}
+    for name in names:
+        pool = multiprocessing.Pool(1)
+        try:
+            results[name] = pool.apply(_run_scenario_in_pool, [(name, user_count, latency, seed)])
+        finally:
+            pool.terminate()
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.1, machine_tolerance=0.5):
+    """
+    Returns a list of (scenario, metric, baseline value, value) tuples
+    for metrics that are worse than the baseline by more than
+    `tolerance`.  CPU and memory vary between machines and runs, so
+    they are held to the looser `machine_tolerance`.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        for metric, bigger_is_better in METRICS:
+            expected = baseline[name].get(metric)
+            if expected is None:
+                continue
+            allowed = machine_tolerance if metric in ('cpu_ms_per_record', 'peak_rss_kb') else tolerance
+            value = result[metric]
+            if bigger_is_better:
+                worse = value < expected * (1 - allowed)
+            else:
+                # Allow a little absolute slack for metrics near zero
+                worse = value > expected * (1 + allowed) + 1e-3
+            if worse:
+                regressions.append((name, metric, expected, value))
+    return regressions
+
+
+def format_results(results, baseline=None):
+    lines = []
+    header = '%-12s' % 'scenario' + ''.join('%20s' % metric for metric, bigger_is_better in METRICS)
+    lines.append(header)
+    for name, result in sorted(results.items()):
+        lines.append('%-12s' % name + ''.join('%20.3f' % result[metric] for metric, bigger_is_better in METRICS))
+        if baseline and name in baseline:
+            lines.append('%-12s' % '  baseline' +
+                         ''.join('%20.3f' % baseline[name].get(metric, float('nan'))
+                                 for metric, bigger_is_better in METRICS))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark crawl throughput against a mock Twitter API.")
+    parser.add_argument('--scenario', dest='scenarios', action='append', choices=sorted(SCENARIOS),
+                        help='Scenario to run (may be repeated; default: all).')
+    parser.add_argument('--users', dest='user_count', type=int, default=None,
+                        help='Number of users each scenario crawls (default: per scenario).')
+    parser.add_argument('--latency', dest='latency', type=float, default=DEFAULT_LATENCY,
+                        help='Virtual seconds each API request takes.')
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    parser.add_argument('--baseline', dest='baseline',
+                        help='Compare against the results in this JSON file.')
+    parser.add_argument('--save-baseline', dest='save_baseline',
+                        help='Save the results to this JSON file.')
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.1,
+                        help='Fraction by which a metric may be worse than the baseline.')
+    args = parser.parse_args()
+
+    results = run_scenarios(args.scenarios or sorted(SCENARIOS), args.user_count, args.latency, args.seed)
+
+    baseline = None
+    if args.baseline:
+        baseline = json.load(open(args.baseline))
+    print format_results(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            baseline_file.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+    if baseline:
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for name, metric, expected, value in regressions:
+            print "REGRESSION %s %s: %.3f (baseline %.3f)" % (name, metric, value, expected)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
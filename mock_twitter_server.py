@@ -0,0 +1,759 @@
+#!/usr/bin/env python
+"""
+A local stand-in for the parts of the Twitter REST API that trawler
+uses, for exercising the crawlers without live credentials.
+
+MockTwitterAPI implements 'statuses/user_timeline', 'statuses/lookup',
+'followers/ids', 'friends/ids', 'users/lookup', 'lists/memberships',
+'lists/members', 'lists/statuses', 'search/tweets' and
+'application/rate_limit_status'
+over synthetic (but deterministic) users and Tweets generated from
+template Tweets such as testdata/shears.txt.  It enforces 15 minute
+rate limit windows per (token, endpoint) and can inject 5xx bursts,
+empty responses and latency.
+
+It can be used in-process through MockTwython, a drop-in replacement
+for twython.Twython, or served over HTTP:
+
+  ./mock_twitter_server.py --port 8000 --error-rate 0.01
+
+and reached with get_mock_connection('localhost', 8000).
+"""
+
+# Standard Library modules
+import argparse
+import BaseHTTPServer
+import codecs
+import datetime
+import os
+import random
+import SocketServer
+import threading
+import time
+import urlparse
+import zlib
+
+try:
+    import ujson as json #much quicker
+except:
+    import json
+
+# Third party modules
+from twython import Twython, TwythonError, TwythonRateLimitError
+
+
+# Requests per 15 minute window for application-only authentication
+#   https://developer.twitter.com/en/docs/basics/rate-limits
+DEFAULT_RATE_LIMITS = {
+    'application/rate_limit_status': 180,
+    'followers/ids': 15,
+    'friends/ids': 15,
+    'lists/members': 75,
+    'lists/memberships': 75,
+    'lists/statuses': 900,
+    'search/tweets': 450,
+    'statuses/lookup': 300,
+    'statuses/user_timeline': 1500,
+    'users/lookup': 300,
+}
+
+RATE_LIMIT_WINDOW_SECONDS = 15 * 60
+
+DEFAULT_TEMPLATE_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                         'testdata', 'shears.txt')
+
+# Synthetic timeline Tweet IDs are laid out so that each user's
+# timeline is a strictly decreasing sequence of IDs that never collides
+# with another's:
+#   timeline Tweet k of user u:  TIMELINE_ID_BASE - k * ID_STRIDE + u
+ID_STRIDE = 2 ** 20
+TIMELINE_ID_BASE = 900000000000000000
+
+# Search Tweet IDs are snowflake-like, so that they are ordered by
+# creation time across terms, as the search API's since_id and max_id
+# assume:
+#   (milliseconds since TWITTER_EPOCH_MS) << 22 | hash(t) << 10 | k % 1024
+TWITTER_EPOCH_MS = 1288834974657
+
+# The user timeline API only reaches back this far
+MAXIMUM_TIMELINE_TWEETS = 3200
+
+TWITTER_TIME_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+
+
+class VirtualClock:
+    """
+    A clock whose time only moves when sleep() is called, so that code
+    that waits out 15 minute rate limit windows runs in milliseconds.
+    Has the same time() and sleep() functions as the time module.
+    """
+    def __init__(self, start_time=None):
+        if start_time is None:
+            start_time = time.time()
+        self._now = float(start_time)
+        self.seconds_slept = 0.0
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self._now
+
+    def sleep(self, seconds):
+        with self._lock:
+            if seconds > 0:
+                self._now += seconds
+                self.seconds_slept += seconds
+
+
+class ScaledClock:
+    """
+    A clock that runs `speedup` times faster than real time.  Unlike
+    with a VirtualClock, threads that sleep at the same time really do
+    wait side by side, so code that waits on several rate limits at once
+    can be timed.  Time spent computing is sped up too, so this is only
+    suitable for code that mostly sleeps.
+    """
+    def __init__(self, speedup=1000.0, start_time=None):
+        if start_time is None:
+            start_time = time.time()
+        self._speedup = float(speedup)
+        self._start_time = float(start_time)
+        self._real_start_time = time.time()
+
+    def time(self):
+        return self._start_time + (time.time() - self._real_start_time) * self._speedup
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds / self._speedup)
+
+
+class EmptyResponse(Exception):
+    """
+    Raised by MockTwitterAPI when it should respond with nothing at all.
+    """
+    pass
+
+
+class SyntheticTwitterData:
+    """
+    Deterministic synthetic users, timelines, follower graphs, lists and
+    search results.  The same `seed` always produces the same data, and
+    nothing is generated until it is requested, so very large
+    populations cost nothing to set up.
+
+    User IDs run from 1 to `user_count` and user `u` has screen name
+    'user[u]'.  One user in `missing_user_every` does not exist and one
+    in `protected_user_every` is protected.
+    """
+    def __init__(self, user_count=100000, list_count=10000, seed=0, template_filename=None,
+                 missing_user_every=97, protected_user_every=53, mean_statuses_count=800,
+                 mean_followers_count=400, search_tweets_per_second=0.1, search_backlog=1000,
+                 deleted_tweet_rate=0.01, clock=time):
+        self.user_count = user_count
+        self.list_count = list_count
+        self._seed = seed
+        self._missing_user_every = missing_user_every
+        self._protected_user_every = protected_user_every
+        self._mean_statuses_count = mean_statuses_count
+        self._mean_followers_count = mean_followers_count
+        self._search_tweets_per_second = search_tweets_per_second
+        self._search_backlog = search_backlog
+        self._deleted_tweet_rate = deleted_tweet_rate
+        self._clock = clock
+        self._start_time = clock.time()
+        # Timelines are generated a user at a time, so the most recent
+        # user's profile is kept for the Tweets that follow
+        self._timeline_user = (None, None)
+
+        # Kept as JSON strings, since decoding a fresh copy is much
+        # quicker than copy.deepcopy()
+        self._template_tweets = []
+        for line in codecs.open(template_filename or DEFAULT_TEMPLATE_FILENAME, 'r', 'utf-8'):
+            if line.strip():
+                self._template_tweets.append(json.dumps(json.loads(line)))
+
+    def _random(self, *key):
+        # Seeding from the repr (rather than hash()) keeps the data the
+        # same across processes
+        return random.Random(repr((self._seed,) + key))
+
+    ### Users ###
+
+    def user_id_for_screen_name(self, screen_name):
+        screen_name = screen_name.lower()
+        if screen_name.startswith('user') and screen_name[4:].isdigit():
+            return int(screen_name[4:])
+        return None
+
+    def user_exists(self, user_id):
+        return (user_id is not None and 1 <= user_id <= self.user_count and
+                user_id % self._missing_user_every != 0)
+
+    def user_is_protected(self, user_id):
+        return user_id % self._protected_user_every == 0
+
+    def statuses_count(self, user_id):
+        rng = self._random('statuses_count', user_id)
+        # A few inactive accounts, and a long tail of very active ones
+        if rng.random() < 0.05:
+            return 0
+        return int(rng.expovariate(1.0 / self._mean_statuses_count))
+
+    def followers_count(self, user_id):
+        return int(self._random('followers_count', user_id).paretovariate(1.2) *
+                   self._mean_followers_count / 6.0)
+
+    def friends_count(self, user_id):
+        return int(self._random('friends_count', user_id).expovariate(1.0 / 300))
+
+    def user(self, user_id, include_status=True):
+        rng = self._random('user', user_id)
+        user = json.loads(rng.choice(self._template_tweets))['user']
+        created_at = self._start_time - rng.randint(30, 3000) * 86400
+        user.update({
+            'id': user_id,
+            'id_str': str(user_id),
+            'screen_name': 'user%d' % user_id,
+            'name': 'Synthetic User %d' % user_id,
+            'protected': self.user_is_protected(user_id),
+            'statuses_count': self.statuses_count(user_id),
+            'followers_count': self.followers_count(user_id),
+            'friends_count': self.friends_count(user_id),
+            'created_at': format_twitter_time(created_at),
+        })
+        if include_status and user['statuses_count'] and not user['protected']:
+            status = self.timeline_tweet(user_id, 0)
+            del status['user']
+            user['status'] = status
+        return user
+
+    ### Timelines ###
+
+    def _tweet_interval(self, user_id):
+        # Seconds between a user's Tweets
+        return 600 + self._random('interval', user_id).expovariate(1.0 / 20000)
+
+    def timeline_tweet(self, user_id, k):
+        rng = self._random('tweet', user_id, k)
+        tweet = json.loads(rng.choice(self._template_tweets))
+        tweet_id = TIMELINE_ID_BASE - k * ID_STRIDE + user_id
+        if self._timeline_user[0] != user_id:
+            self._timeline_user = (user_id, json.dumps(self.user(user_id, include_status=False)))
+        tweet.update({
+            'id': tweet_id,
+            'id_str': str(tweet_id),
+            'created_at': format_twitter_time(self._start_time - k * self._tweet_interval(user_id)),
+            'user': json.loads(self._timeline_user[1]),
+        })
+        return tweet
+
+    def _tweet_is_deleted(self, user_id, k):
+        return self._random('deleted', user_id, k).random() < self._deleted_tweet_rate
+
+    def tweet(self, tweet_id):
+        """
+        Returns the timeline Tweet with ID `tweet_id`, or None if there
+        is no such Tweet, it has been deleted or its user is protected
+        """
+        user_id = (tweet_id - TIMELINE_ID_BASE) % ID_STRIDE
+        k = (TIMELINE_ID_BASE + user_id - tweet_id) // ID_STRIDE
+        if (not self.user_exists(user_id) or self.user_is_protected(user_id) or
+                not 0 <= k < min(self.statuses_count(user_id), MAXIMUM_TIMELINE_TWEETS) or
+                self._tweet_is_deleted(user_id, k)):
+            return None
+        return self.timeline_tweet(user_id, k)
+
+    def timeline(self, user_id, count=20, max_id=None, since_id=None):
+        """
+        Returns up to `count` of the user's Tweets, newest first, with
+        IDs in the range (`since_id`, `max_id`].  As with the real API,
+        deleted Tweets are removed after `count` has been applied.
+        """
+        available = min(self.statuses_count(user_id), MAXIMUM_TIMELINE_TWEETS)
+        first = 0
+        if max_id is not None:
+            first = max(0, -((int(max_id) - TIMELINE_ID_BASE - user_id) // ID_STRIDE))
+        last = min(first + count, available)
+        if since_id is not None:
+            last = min(last, (TIMELINE_ID_BASE + user_id - int(since_id) + ID_STRIDE - 1) // ID_STRIDE)
+        return [self.timeline_tweet(user_id, k) for k in range(first, last)
+                if not self._tweet_is_deleted(user_id, k)]
+
+    ### Graph ###
+
+    def follower_ids(self, user_id):
+        rng = self._random('followers', user_id)
+        return [rng.randint(1, self.user_count) for i in range(self.followers_count(user_id))]
+
+    def friend_ids(self, user_id):
+        rng = self._random('friends', user_id)
+        return [rng.randint(1, self.user_count) for i in range(self.friends_count(user_id))]
+
+    ### Lists ###
+
+    def list_exists(self, list_id):
+        return 1 <= list_id <= self.list_count
+
+    def list_member_count(self, list_id):
+        return int(self._random('list_size', list_id).paretovariate(1.1) * 20)
+
+    def list_member_ids(self, list_id):
+        rng = self._random('list_members', list_id)
+        return [rng.randint(1, self.user_count) for i in range(self.list_member_count(list_id))]
+
+    def list_membership_ids(self, user_id):
+        rng = self._random('list_memberships', user_id)
+        membership_count = int(rng.paretovariate(1.3) * 3) - 3
+        return [rng.randint(1, self.list_count) for i in range(membership_count)]
+
+    def list(self, list_id):
+        owner_id = self._random('list_owner', list_id).randint(1, self.user_count)
+        return {
+            'id': list_id,
+            'id_str': str(list_id),
+            'name': 'list %d' % list_id,
+            'slug': 'list-%d' % list_id,
+            'full_name': '@user%d/list-%d' % (owner_id, list_id),
+            'member_count': self.list_member_count(list_id),
+            'subscriber_count': 0,
+            'mode': 'public',
+            'user': self.user(owner_id, include_status=False),
+        }
+
+    ### Search ###
+
+    def _search_rate(self, term):
+        # Tweets per second for `term`; some terms are much busier than others
+        return self._search_tweets_per_second * (1 + zlib.crc32(term.encode('utf-8')) % 20)
+
+    def _search_time(self, term, k):
+        return self._start_time + (k - self._search_backlog) / self._search_rate(term)
+
+    def _search_id(self, term, k):
+        milliseconds = int(self._search_time(term, k) * 1000) - TWITTER_EPOCH_MS
+        return (milliseconds << 22) | ((zlib.crc32(term.encode('utf-8')) % 4096) << 10) | (k % 1024)
+
+    def _search_index(self, term, tweet_id, available):
+        """
+        Returns the number of the first `available` Tweets for `term`
+        with IDs no greater than `tweet_id`.
+        """
+        low, high = 0, available
+        while low < high:
+            middle = (low + high) // 2
+            if self._search_id(term, middle) <= tweet_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _search_tweet(self, term, k):
+        tweet_id = self._search_id(term, k)
+        rng = self._random('search', term, k)
+        tweet = json.loads(rng.choice(self._template_tweets))
+        user_id = rng.randint(1, self.user_count)
+        tweet.update({
+            'id': tweet_id,
+            'id_str': str(tweet_id),
+            'text': u'%s %s' % (tweet['text'], term),
+            'created_at': format_twitter_time(self._search_time(term, k)),
+            'user': self.user(user_id, include_status=False),
+        })
+        return tweet
+
+    def search(self, query, count=15, max_id=None, since_id=None):
+        """
+        Returns up to `count` Tweets matching any of the OR-separated
+        terms in `query`, newest first.  New Tweets arrive for each term
+        at its own steady rate as the clock advances.
+        """
+        term_ids = []
+        elapsed = self._clock.time() - self._start_time
+        for term in [term.strip().strip('()') for term in query.split(' OR ')]:
+            available = self._search_backlog + int(elapsed * self._search_rate(term))
+            last = available - 1
+            if max_id is not None:
+                last = self._search_index(term, int(max_id), available) - 1
+            first = 0
+            if since_id is not None:
+                first = self._search_index(term, int(since_id), available)
+            for k in range(last, max(first, last - count + 1) - 1, -1):
+                term_ids.append((self._search_id(term, k), term, k))
+        term_ids.sort(reverse=True)
+        return [self._search_tweet(term, k) for tweet_id, term, k in term_ids[:count]]
+
+
+class MockTwitterAPI:
+    """
+    Answers Twitter API requests from a SyntheticTwitterData instance,
+    enforcing per (token, endpoint) rate limit windows.
+
+    handle() returns an (HTTP status, headers, body) tuple, or raises
+    EmptyResponse.  Faults are injected at random (but reproducibly,
+    given `seed`):
+
+      error_rate -- chance that a request starts a burst of
+                    `error_burst_length` 502/503/504 responses
+      empty_response_rate -- chance of an empty HTTP response
+      latency -- seconds each request takes; either a number or a
+                 (minimum, maximum) tuple
+
+    All timing uses `clock`, which may be a VirtualClock.
+    """
+    def __init__(self, data=None, rate_limits=None, error_rate=0.0, error_burst_length=3,
+                 empty_response_rate=0.0, latency=0.0, seed=0, clock=time):
+        self._clock = clock
+        self.data = data or SyntheticTwitterData(clock=clock)
+        self.rate_limits = dict(DEFAULT_RATE_LIMITS)
+        self.rate_limits.update(rate_limits or {})
+        self._error_rate = error_rate
+        self._error_burst_length = error_burst_length
+        self._empty_response_rate = empty_response_rate
+        self._latency = latency
+        self._random = random.Random(seed)
+        self._errors_remaining_in_burst = 0
+        self._windows = {}
+        self._lock = threading.Lock()
+
+        # Counters, for benchmarks and tests
+        self.request_count = 0
+        self.status_counts = {}
+        self.endpoint_counts = {}
+
+    def _window(self, token, endpoint):
+        """
+        Returns the [reset_time, calls_remaining] of the current window,
+        starting a new window if the previous one has ended.
+        """
+        now = self._clock.time()
+        window = self._windows.get((token, endpoint))
+        if window is None or window[0] <= now:
+            window = [int(now) + RATE_LIMIT_WINDOW_SECONDS, self.rate_limits[endpoint]]
+            self._windows[(token, endpoint)] = window
+        return window
+
+    def rate_limit_headers(self, token, endpoint):
+        reset, remaining = self._window(token, endpoint)
+        return {'x-rate-limit-limit': str(self.rate_limits[endpoint]),
+                'x-rate-limit-remaining': str(max(remaining, 0)),
+                'x-rate-limit-reset': str(reset)}
+
+    def handle(self, endpoint, params, token='default'):
+        if self._latency:
+            if isinstance(self._latency, tuple):
+                self._clock.sleep(self._random.uniform(*self._latency))
+            else:
+                self._clock.sleep(self._latency)
+
+        with self._lock:
+            self.request_count += 1
+            status, body = self._handle(endpoint, params, token)
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            self.endpoint_counts[endpoint] = self.endpoint_counts.get(endpoint, 0) + 1
+            if endpoint in self.rate_limits:
+                headers = self.rate_limit_headers(token, endpoint)
+            else:
+                headers = {}
+        return status, headers, body
+
+    def _handle(self, endpoint, params, token):
+        if endpoint not in self.rate_limits:
+            return 404, error_body(34, 'Sorry, that page does not exist.')
+
+        # Faults happen before the request is counted against the limit
+        if self._errors_remaining_in_burst or self._random.random() < self._error_rate:
+            if not self._errors_remaining_in_burst:
+                self._errors_remaining_in_burst = self._error_burst_length
+            self._errors_remaining_in_burst -= 1
+            return self._random.choice([502, 503, 504]), error_body(130, 'Over capacity')
+        if self._random.random() < self._empty_response_rate:
+            raise EmptyResponse()
+
+        window = self._window(token, endpoint)
+        if window[1] <= 0:
+            return 429, error_body(88, 'Rate limit exceeded')
+        window[1] -= 1
+
+        handler = getattr(self, '_' + endpoint.replace('/', '_'))
+        return handler(params, token)
+
+    ### Endpoints ###
+
+    def _user_id_param(self, params):
+        if 'user_id' in params:
+            return int(params['user_id'])
+        if 'screen_name' in params:
+            return self.data.user_id_for_screen_name(params['screen_name'])
+        return None
+
+    def _cursored(self, ids, params, field, page_size):
+        cursor = int(params.get('cursor', -1))
+        count = min(int(params.get('count', page_size)), page_size)
+        offset = 0 if cursor == -1 else cursor
+        next_offset = offset + count if offset + count < len(ids) else 0
+        previous_offset = offset - count if offset else 0
+        return {field: ids[offset:offset + count],
+                'next_cursor': next_offset, 'next_cursor_str': str(next_offset),
+                'previous_cursor': -previous_offset, 'previous_cursor_str': str(-previous_offset)}
+
+    def _application_rate_limit_status(self, params, token):
+        families = params.get('resources', '').split(',')
+        resources = {}
+        for endpoint, limit in self.rate_limits.items():
+            family = endpoint.split('/')[0]
+            if families != [''] and family not in families:
+                continue
+            reset, remaining = self._window(token, endpoint)
+            resources.setdefault(family, {})['/' + endpoint] = {
+                'limit': limit, 'remaining': max(remaining, 0), 'reset': reset}
+        return 200, {'rate_limit_context': {'application': token}, 'resources': resources}
+
+    def _statuses_user_timeline(self, params, token):
+        user_id = self._user_id_param(params)
+        if not self.data.user_exists(user_id):
+            return 404, error_body(34, 'Sorry, that page does not exist.')
+        if self.data.user_is_protected(user_id):
+            return 401, {'request': '/1.1/statuses/user_timeline.json', 'error': 'Not authorized.'}
+        tweets = self.data.timeline(user_id, count=min(int(params.get('count', 20)), 200),
+                                    max_id=params.get('max_id'), since_id=params.get('since_id'))
+        if params.get('tweet_mode') == 'extended':
+            for tweet in tweets:
+                tweet['full_text'] = tweet.pop('text')
+        return 200, tweets
+
+    def _statuses_lookup(self, params, token):
+        # As with the real API, missing Tweets are left out rather than
+        # reported, and an empty list is not an error
+        tweets = []
+        for tweet_id in str(params.get('id', '')).split(',')[:100]:
+            if tweet_id.strip():
+                tweet = self.data.tweet(int(tweet_id))
+                if tweet is not None:
+                    tweets.append(tweet)
+        if params.get('tweet_mode') == 'extended':
+            for tweet in tweets:
+                tweet['full_text'] = tweet.pop('text')
+        return 200, tweets
+
+    def _graph_ids(self, params, ids_function):
+        user_id = self._user_id_param(params)
+        if not self.data.user_exists(user_id):
+            return 404, error_body(34, 'Sorry, that page does not exist.')
+        if self.data.user_is_protected(user_id):
+            return 401, {'request': '/1.1/followers/ids.json', 'error': 'Not authorized.'}
+        return 200, self._cursored(ids_function(user_id), params, 'ids', 5000)
+
+    def _followers_ids(self, params, token):
+        return self._graph_ids(params, self.data.follower_ids)
+
+    def _friends_ids(self, params, token):
+        return self._graph_ids(params, self.data.friend_ids)
+
+    def _users_lookup(self, params, token):
+        user_ids = []
+        for user_id in str(params.get('user_id', '')).split(','):
+            if user_id.strip():
+                user_ids.append(int(user_id))
+        for screen_name in params.get('screen_name', '').split(','):
+            if screen_name.strip():
+                user_ids.append(self.data.user_id_for_screen_name(screen_name.strip()))
+        users = [self.data.user(user_id) for user_id in user_ids[:100] if self.data.user_exists(user_id)]
+        if not users:
+            return 404, error_body(17, 'No user matches for specified terms.')
+        return 200, users
+
+    def _lists_memberships(self, params, token):
+        user_id = self._user_id_param(params)
+        if not self.data.user_exists(user_id):
+            return 404, error_body(34, 'Sorry, that page does not exist.')
+        page = self._cursored(self.data.list_membership_ids(user_id), params, 'lists', 1000)
+        page['lists'] = [self.data.list(list_id) for list_id in page['lists']]
+        return 200, page
+
+    def _lists_members(self, params, token):
+        list_id = int(params.get('list_id', 0))
+        if not self.data.list_exists(list_id):
+            return 404, error_body(34, 'Sorry, that page does not exist.')
+        page = self._cursored(self.data.list_member_ids(list_id), params, 'users', 5000)
+        page['users'] = [self.data.user(user_id, include_status=not params.get('skip_status'))
+                         for user_id in page['users'] if self.data.user_exists(user_id)]
+        return 200, page
+
+    def _lists_statuses(self, params, token):
+        list_id = int(params.get('list_id', 0))
+        if not self.data.list_exists(list_id):
+            return 404, error_body(34, 'Sorry, that page does not exist.')
+        count = min(int(params.get('count', 20)), 200)
+        member_ids = self.data.list_member_ids(list_id)[:count]
+        tweets = [self.data.timeline_tweet(user_id, 0) for user_id in member_ids
+                  if self.data.user_exists(user_id) and self.data.statuses_count(user_id)]
+        tweets.sort(key=lambda tweet: tweet['id'], reverse=True)
+        return 200, tweets
+
+    def _search_tweets(self, params, token):
+        query = params.get('q', '')
+        if not query:
+            return 400, error_body(25, 'Query parameters are missing.')
+        tweets = self.data.search(query, count=min(int(params.get('count', 15)), 100),
+                                  max_id=params.get('max_id'), since_id=params.get('since_id'))
+        if params.get('tweet_mode') == 'extended':
+            for tweet in tweets:
+                tweet['full_text'] = tweet.pop('text')
+        return 200, {'statuses': tweets,
+                     'search_metadata': {'count': len(tweets), 'query': query}}
+
+
+class MockTwython:
+    """
+    In-process replacement for twython.Twython that answers requests
+    from a MockTwitterAPI instead of the network.  Errors are raised as
+    the same TwythonError exceptions Twython raises, and empty responses
+    produce the error text RateLimitedTwitterEndpoint looks for.
+    """
+    def __init__(self, mock_api=None, token='default'):
+        self.mock_api = mock_api or MockTwitterAPI()
+        self.token = token
+        self.app_key = token
+
+    def get(self, endpoint, params=None, version='1.1'):
+        params = dict((k, v) for k, v in (params or {}).items() if v is not None)
+        try:
+            status, headers, body = self.mock_api.handle(endpoint, params, self.token)
+        except EmptyResponse:
+            raise TwythonError("HTTPSConnectionPool(host='api.twitter.com', port=443): Max retries exceeded "
+                               "(Caused by <class 'httplib.BadStatusLine'>: '')")
+        if status == 429:
+            raise TwythonRateLimitError(body['errors'][0]['message'], error_code=status,
+                                        retry_after=headers.get('x-rate-limit-reset'))
+        if status > 304:
+            if 'errors' in body:
+                message = body['errors'][0]['message']
+            else:
+                message = body.get('error', 'An error occurred processing your request.')
+            raise TwythonError(message, error_code=status)
+        return body
+
+    def get_application_rate_limit_status(self, **params):
+        return self.get('application/rate_limit_status', params=params)
+
+
+class MockTwitterRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves a MockTwitterAPI (the server's `mock_api`) over HTTP at
+    /1.1/[endpoint].json, plus /oauth2/token for bearer tokens.
+    """
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        path = url.path.strip('/')
+        if path.startswith('1.1/'):
+            path = path[len('1.1/'):]
+        if path.endswith('.json'):
+            path = path[:-len('.json')]
+
+        token = self.headers.get('Authorization', 'Bearer default').split(' ')[-1]
+        try:
+            status, headers, body = self.server.mock_api.handle(path, params, token)
+        except EmptyResponse:
+            # Closing the connection without a status line is what
+            # Twitter's servers occasionally do
+            self.close_connection = 1
+            return
+        self._respond(status, headers, body)
+
+    def do_POST(self):
+        if self.path.strip('/').startswith('oauth2/token'):
+            # Every app gets a bearer token named after its consumer key,
+            # so each app has its own rate limit windows
+            authorization = self.headers.get('Authorization', '')
+            try:
+                token = authorization.split(' ')[-1].decode('base64').split(':')[0]
+            except Exception:
+                token = 'default'
+            self._respond(200, {}, {'token_type': 'bearer', 'access_token': token or 'default'})
+        else:
+            self._respond(404, {}, error_body(34, 'Sorry, that page does not exist.'))
+
+    def _respond(self, status, headers, body):
+        content = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockTwitterServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='localhost', port=8000, mock_api=None):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), MockTwitterRequestHandler)
+        self.mock_api = mock_api or MockTwitterAPI()
+
+    def start(self):
+        """
+        Serve requests on a background thread, returns the thread.
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+###  Functions  ###
+
+def error_body(code, message):
+    return {'errors': [{'code': code, 'message': message}]}
+
+def format_twitter_time(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp).strftime(TWITTER_TIME_FORMAT)
+
+def get_mock_connection(host='localhost', port=8000, consumer_key='default', consumer_secret='secret'):
+    """
+    Returns a twython.Twython instance that talks to a MockTwitterServer
+    on `host` and `port` instead of api.twitter.com.
+    """
+    # The mock server speaks plain HTTP, which oauthlib refuses to send
+    # bearer tokens over unless told otherwise
+    os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+    api_url = 'http://%s:%s/%%s' % (host, port)
+    oauth = Twython(consumer_key, consumer_secret, oauth_version=2)
+    oauth.request_token_url = api_url % 'oauth2/token'
+    access_token = oauth.obtain_access_token()
+    twython = Twython(consumer_key, access_token=access_token)
+    twython.api_url = api_url
+    return twython
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock Twitter API for offline testing.")
+    parser.add_argument('--host', dest='host', default='localhost')
+    parser.add_argument('--port', dest='port', type=int, default=8000)
+    parser.add_argument('--users', dest='user_count', type=int, default=100000,
+                        help='Number of synthetic users.')
+    parser.add_argument('--templates', dest='template_filename', default=None,
+                        help='File of template Tweets, one JSON object per line (default: testdata/shears.txt).')
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0.0,
+                        help='Chance that a request starts a burst of 5xx errors.')
+    parser.add_argument('--empty-response-rate', dest='empty_response_rate', type=float, default=0.0)
+    parser.add_argument('--latency', dest='latency', type=float, default=0.0,
+                        help='Seconds of latency added to each request.')
+    args = parser.parse_args()
+
+    data = SyntheticTwitterData(user_count=args.user_count, seed=args.seed,
+                                template_filename=args.template_filename)
+    mock_api = MockTwitterAPI(data, error_rate=args.error_rate, seed=args.seed,
+                              empty_response_rate=args.empty_response_rate, latency=args.latency)
+    server = MockTwitterServer(args.host, args.port, mock_api)
+    print "Serving mock Twitter API on http://%s:%d/" % (args.host, args.port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
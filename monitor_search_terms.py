@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+This script continuously monitors the search API for a list of terms.
+
+The script takes as input a text file which lists one search term per
+line of the file.  New Tweets for each term are appended to
+[term].NNNNN.json.gz files in the output directory as they are found,
+and the newest Tweet ID seen for each term is checkpointed, so the
+script can be stopped and restarted without missing or repeating
+Tweets (as far as the search API's 7 day horizon allows).
+Instantiate with -h option to view help info.
+"""
+
+# Standard Library modules
+import argparse
+import codecs
+import os
+import sys
+
+# Local modules
+from token_interface import get_tokens_from_file
+from twitter_crawler import (CursorCheckpoint, RotatingJSONWriter, SearchMonitor,
+                             get_connection, get_console_info_logger, get_search_crawler,
+                             search_term_filenames)
+
+
+def main():
+    # Make stdout output UTF-8, preventing "'ascii' codec can't encode" errors
+    sys.stdout = codecs.getwriter('utf8')(sys.stdout)
+
+    # Parse and document command line options
+    parser = argparse.ArgumentParser(description="")
+    parser.add_argument('--input', dest='term_file', required=True,
+                   help='A text file with one search term per line.')
+    parser.add_argument('--token', dest='token_file', default=os.path.expanduser("~") + "/.trawler/default.yaml",
+                    help='A configuration file with Twitter API access tokens. See example_token_file.yaml or twitter_oauth_settings.sample.py')
+    parser.add_argument('--output', dest='output', default='./',
+                    help='Where to output the resulting data.')
+    parser.add_argument('--calls-per-window', dest='calls_per_window', type=int, default=450,
+                    help='search/tweets calls allowed per 15 minute window for these tokens.')
+    parser.add_argument('--max-lag', dest='max_poll_interval', type=int, default=15*60,
+                    help='Poll every term at least this often (seconds).')
+    args = parser.parse_args()
+
+    logger = get_console_info_logger()
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+
+    tokens = get_tokens_from_file(args.token_file)
+    twython = get_connection(tokens['consumer_key'], tokens['consumer_secret'])
+    search_crawler = get_search_crawler(twython, logger=logger)
+
+    terms = [line.strip() for line in codecs.open(args.term_file, 'r', 'utf-8') if line.strip()]
+
+    filenames = search_term_filenames(terms)
+    writers = {}
+    def output(term, tweets):
+        if term not in writers:
+            writers[term] = RotatingJSONWriter(os.path.join(args.output, filenames[term]))
+        writers[term].write_tweets(tweets)
+
+    checkpoint = CursorCheckpoint(os.path.join(args.output, 'search_monitor_checkpoint.tsv'))
+    monitor = SearchMonitor(search_crawler, terms, output, calls_per_window=args.calls_per_window,
+                            max_poll_interval=args.max_poll_interval, checkpoint=checkpoint,
+                            logger=logger)
+    try:
+        monitor.run()
+    finally:
+        for writer in writers.values():
+            writer.close()
+        checkpoint.close()
+
+
+if __name__ == "__main__":
+    main()
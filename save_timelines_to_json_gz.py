@@ -4,9 +4,14 @@
 This script downloads all available Tweets for a given list of
 usernames.
 
-The script takes as input a text file which lists one Twitter username
-per line of the file.  The script creates a [username].tweets file for
-each username specified in the directory.
+The script takes as input a text file which lists one Twitter user ID
+per line of the file.  The script creates a [user_id].tweets.gz file for
+each user ID specified in the output directory.
+
+Users are crawled in the order planned by TimelinePlanner for the goal
+given by --plan, from profiles cached in --profiles (looked up for
+users not yet cached), skipping protected and empty accounts.  Use
+--plan input_order to crawl users in the order they are listed.
 
 Your Twitter OAuth credentials should be stored in the file
 twitter_oauth_settings.py.
@@ -23,8 +28,9 @@ import gzip
 from twython import Twython, TwythonError
 
 # Local modules
-from twitter_crawler import (CrawlTwitterTimelines, RateLimitedTwitterEndpoint, 
-                             get_console_info_logger, get_screen_names_from_file, save_tweets_to_json_file)
+from twitter_crawler import (CrawlTwitterTimelines, ProfileStore, RateLimitedTwitterEndpoint, TimelinePlanner, UserLookup,
+                             get_connection, get_console_info_logger, get_ids_from_file, invalidate_token,
+                             is_invalid_token_error, save_tweets_to_json_file)
 try:
     from twitter_oauth_settings import access_token, access_token_secret, consumer_key, consumer_secret
 except ImportError:
@@ -43,6 +49,12 @@ def main():
     parser.add_argument('id_file')
     parser.add_argument('output_loc')
     parser.add_argument('--token_file',dest='token_file',default=None)
+    parser.add_argument('--plan', choices=TimelinePlanner.GOALS + ('input_order',), default='users_per_hour',
+                        help="Crawl the users that complete quickest, or give the most Tweets per call, first")
+    parser.add_argument('--profiles', default=None,
+                        help="File to cache user profiles in (default [output_loc]profiles.json.gz)")
+    parser.add_argument('--inactive-days', type=int, default=None,
+                        help="Skip users who have not Tweeted for this many days")
     args = parser.parse_args()
 
     logger = get_console_info_logger()
@@ -54,12 +66,10 @@ def main():
         print "Using tokens from:", oauth_settings_file_loc
         exec(open(oauth_settings_file_loc).read())
 
-    ACCESS_TOKEN = Twython(consumer_key, consumer_secret, oauth_version=2).obtain_access_token()
-    twython = Twython(consumer_key, access_token=ACCESS_TOKEN)
+    twython = get_connection(consumer_key, consumer_secret)
     crawler = CrawlTwitterTimelines(twython, logger)
 
-    twitter_ids = get_screen_names_from_file(args.id_file)
-    twitter_ids.reverse() #HARDCODE
+    twitter_ids = get_ids_from_file(args.id_file)
     output_loc = args.output_loc
 
     tempfile_loc = 'tmp/'
@@ -68,13 +78,25 @@ def main():
     #load previously broken ID files so we don't try to read them again
     broken_ids = set([]) #Defaults to an empty set
     try:
-        broken_ids = set([long(x).strip() for x in open(tempfile_loc + '404d').readlines()])
+        broken_ids = set([long(x.strip()) for x in open(tempfile_loc + '404d').readlines()])
     except:
         pass
     try:
-        broken_ids = broken_ids.union(set([long(x).strip() for x in open(tempfile_loc + '401d').readlines()]))
+        broken_ids = broken_ids.union(set([long(x.strip()) for x in open(tempfile_loc + '401d').readlines()]))
     except:
         pass
+
+    if args.plan != 'input_order':
+        # Only plan (and look up) the users still to be downloaded
+        twitter_ids = [twitter_id for twitter_id in twitter_ids if twitter_id not in broken_ids and
+                       not os.path.exists(output_loc + "%s.tweets.gz" % twitter_id)]
+        profile_store = ProfileStore(args.profiles or output_loc + 'profiles.json.gz')
+        planner = TimelinePlanner(profile_store.users(), UserLookup(twython, logger), profile_store,
+                                  goal=args.plan, inactive_days=args.inactive_days, logger=logger)
+        twitter_ids = planner.plan(twitter_ids)
+        profile_store.close()
+        for twitter_id, reason in sorted(planner.skipped.items()):
+            print '%s is %s, not trying to download.' % (twitter_id, reason)
     
     for twitter_id in twitter_ids:
         if twitter_id in broken_ids:
@@ -92,15 +114,18 @@ def main():
                     logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % twitter_id)
                     with open(tempfile_loc + '404d','a') as OUT:
                         OUT.write('%s\n' % twitter_id)
-                elif e.error_code == 401:
+                elif e.error_code == 401 and not is_invalid_token_error(e):
                     logger.warn("HTTP 401 error - Most likely, Twitter user '%s' no longer publicly accessible" % twitter_id)
                     with open(tempfile_loc + '401d','a') as OUT:
                         OUT.write('%s\n' % twitter_id)
                 else:
                     # Unhandled exception
                     print e 
-                    #Reconnect and try again
-                    twython = Twython(consumer_key, access_token=ACCESS_TOKEN)
+                    #Reconnect (reusing the cached token, unless Twitter rejected it, and the
+                    #pooled connections) and try again
+                    if is_invalid_token_error(e):
+                        invalidate_token(twython)
+                    twython = get_connection(consumer_key, consumer_secret)
                     crawler = CrawlTwitterTimelines(twython, logger)
             else:
                 save_tweets_to_json_file(tweets, tweet_filename, gzip_out=True)
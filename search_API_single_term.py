@@ -1,17 +1,17 @@
-from twitter_crawler import get_search_crawler, get_connection
-import yaml,gzip
+from twitter_crawler import get_search_crawler, get_connection, CursorCheckpoint, SearchHarvester
+import sys
+import yaml
 from twython import Twython, TwythonError
 
-search_term = 'qntfy'
-
-import ujson as json
+#Terms can be given on the command line, otherwise default to a single term
+search_terms = sys.argv[1:] or ['qntfy']
 
 token_file = 'default_tokens.yaml'
 tokens = yaml.safe_load(open(token_file))
 
 
 # Set up API access
-twython = Twython(app_key=tokens['app_key'], 
+twython = Twython(app_key=tokens['app_key'],
                   app_secret=tokens['app_secret_key'],
                   oauth_token=tokens['oauth_token'],
                   oauth_token_secret=tokens['oauth_token_secret'])
@@ -23,10 +23,12 @@ search_crawler = get_search_crawler( twython )
 #tweets = search_crawler.get_all_search_tweets_for_term( search_term )
 #tweets = search_crawler.get_all_search_tweets_for_term( search_term, max_id=653333775389229055 )#id of the latest tweet -1
 #tweets = search_crawler.get_all_search_tweets_for_term( search_term, result_type='recent' ) #Other options include 'mixed'(default) and 'popular'
-tweets = search_crawler.get_all_search_tweets_for_term( search_term, max_id=653333775389229055, result_type='recent' )#id of the latest tweet -1
-
-with gzip.open('%s.json.gz' % search_term,'w') as OUT:
-    for t in tweets:
-        OUT.write('%s\n' % json.dumps(t))
-
 
+#Each page is appended to '[term].NNNNN.json.gz' as it arrives, and the
+#oldest and newest Tweet IDs written per term are checkpointed, so
+#re-running this script resumes an interrupted harvest instead of
+#starting over, or fetches just the Tweets newer than a finished one.
+checkpoint = CursorCheckpoint('search_checkpoint.tsv')
+harvester = SearchHarvester( search_crawler, '.', checkpoint=checkpoint )
+harvester.harvest( search_terms, result_type='recent' )
+checkpoint.close()
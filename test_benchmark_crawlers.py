@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+"""
+Tests for benchmark_crawlers.py
+"""
+
+# Standard Library modules
+import unittest
+
+# Local modules
+from benchmark_crawlers import compare_to_baseline, run_scenario
+
+
+class TestBenchmarkCrawlers(unittest.TestCase):
+    def test_follower_scenario_is_rate_limited(self):
+        result = run_scenario('followers', user_count=30)
+        self.assertEqual(result['api_calls'], 31)
+        self.assertTrue(result['idle_fraction'] > 0.9)
+        self.assertTrue(0 < result['quota_utilisation'] <= 1)
+
+    def test_compare_to_baseline(self):
+        baseline = {'timelines': {'users_per_hour': 1000.0, 'idle_fraction': 0.5, 'cpu_ms_per_record': 0.1}}
+        results = {'timelines': {'users_per_hour': 950.0, 'idle_fraction': 0.7, 'cpu_ms_per_record': 0.14}}
+        self.assertEqual(compare_to_baseline(results, baseline),
+                         [('timelines', 'idle_fraction', 0.5, 0.7)])
+
+
+if __name__ == '__main__':
+    unittest.main()
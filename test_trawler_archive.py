@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+Tests for trawler_archive.py, over files of synthetic timeline Tweets
+"""
+
+# Standard Library modules
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import ujson as json #much quicker
+except:
+    import json
+
+# Local modules
+from trawler_archive import *
+from twitter_crawler import parse_twitter_time, save_tweets_to_json_file
+from mock_twitter_server import SyntheticTwitterData
+
+
+class TestBlockGzipWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'lines.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_blocks_are_read_back_one_at_a_time(self):
+        writer = BlockGzipWriter(self.filename, lines_per_block=3)
+        positions = [writer.write_line('line %d' % i) for i in range(7)]
+        writer.close()
+        # Any gzip reader sees one stream
+        self.assertEqual(gzip.open(self.filename).read().splitlines(), ['line %d' % i for i in range(7)])
+        blocks = list(iter_gzip_blocks(self.filename, chunk_size=16))
+        self.assertEqual([data.splitlines() for offset, data in blocks],
+                         [['line 0', 'line 1', 'line 2'], ['line 3', 'line 4', 'line 5'], ['line 6']])
+        self.assertEqual([position[1] for position in positions], [0, 1, 2, 0, 1, 2, 0])
+        self.assertEqual(sorted(set(position[0] for position in positions)), [offset for offset, data in blocks])
+        offset, line = positions[4]
+        self.assertEqual(read_gzip_block(self.filename, offset).splitlines()[line], 'line 4')
+
+
+class TestArchiveIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data = SyntheticTwitterData(user_count=100)
+        self.index = ArchiveIndex(os.path.join(self.directory, 'archive.db'))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def save_timeline(self, user_id, count=500, lines_per_block=None):
+        """
+        Saves `user_id`'s timeline to a gzip file (of one block unless
+        `lines_per_block` is given) and returns the Tweets and filename
+        """
+        tweets = self.data.timeline(user_id, count=count)
+        filename = os.path.join(self.directory, '%d.tweets.gz' % user_id)
+        save_tweets_to_json_file(tweets, filename)
+        if lines_per_block:
+            rewrite_in_blocks(filename, lines_per_block=lines_per_block)
+        return tweets, filename
+
+    def test_tweets_are_fetched_by_id(self):
+        tweets, filename = self.save_timeline(1, lines_per_block=50)
+        self.assertEqual(self.index.index_file(filename), len(tweets))
+        for tweet in tweets[::37]:
+            self.assertEqual(self.index.get_tweet(tweet['id']), tweet)
+        self.assertEqual(self.index.get_tweet(12345), None)
+
+    def test_files_gzipped_in_one_block_can_be_indexed(self):
+        tweets, filename = self.save_timeline(2)
+        self.index.index_file(filename)
+        self.assertEqual(self.index.get_tweet(tweets[-1]['id']), tweets[-1])
+
+    def test_user_tweets_are_fetched_by_time(self):
+        first_tweets, first_filename = self.save_timeline(1, lines_per_block=50)
+        second_tweets, second_filename = self.save_timeline(2, lines_per_block=50)
+        self.index.index_file(first_filename)
+        self.index.index_file(second_filename)
+        times = [parse_twitter_time(tweet['created_at']) for tweet in first_tweets]
+        since, until = times[300], times[100]
+        self.assertEqual(self.index.user_tweets(1, since, until),
+                         [tweet for tweet, created_at in zip(first_tweets, times) if since <= created_at < until])
+        self.assertEqual(self.index.user_tweets(2), second_tweets)
+        self.assertEqual(self.index.user_ranges(1), {
+            'tweet_count': len(first_tweets),
+            'min_tweet_id': first_tweets[-1]['id'], 'max_tweet_id': first_tweets[0]['id'],
+            'first_created_at': times[-1], 'last_created_at': times[0]})
+        self.assertEqual(self.index.user_ranges(3), None)
+
+    def test_reindexed_files_replace_their_entries(self):
+        tweets, filename = self.save_timeline(1, count=300)
+        self.index.index_file(filename)
+        save_tweets_to_json_file(tweets[:100], filename)
+        self.index.index_file(filename)
+        self.assertEqual(self.index.user_ranges(1)['tweet_count'], len(tweets[:100]))
+        self.assertEqual(self.index.get_tweet(tweets[-1]['id']), None)
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
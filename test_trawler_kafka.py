@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+"""
+Tests for trawler_kafka.py, using in-memory stand-ins for the pykafka
+client, producer and consumer so that no Kafka broker is needed.
+"""
+
+# Standard Library modules
+import json
+import logging
+import Queue
+import unittest
+
+# Local modules
+from trawler_kafka import *
+
+
+class FakeMessage:
+    def __init__(self, value, partition_key=None):
+        self.value = value
+        self.partition_key = partition_key
+
+
+class FakeProducer:
+    """
+    Holds every produced message until a delivery report is asked for
+    with block=True, like a broker that only acknowledges messages when
+    the producer waits for it.  Messages for which `fail(message)` is
+    True are reported as failed.
+
+    Each message is given a partition by the producer's `partitioner`
+    (set by FakeTopic.get_producer()), which, as with pykafka, raises
+    ValueError for a hashing partitioner and no key.
+    """
+    partitions = range(8)
+
+    def __init__(self, fail=None):
+        self.partitioner = None
+        self.messages = []
+        self.unacknowledged = []
+        self.blocking_waits = 0
+        self.max_unacknowledged = 0
+        self.stopped = False
+        self._fail = fail or (lambda message: False)
+
+    def produce(self, message, partition_key=None):
+        message = FakeMessage(message, partition_key)
+        if self.partitioner:
+            message.partition = self.partitioner(self.partitions, partition_key)
+        self.messages.append(message)
+        self.unacknowledged.append(message)
+        self.max_unacknowledged = max(self.max_unacknowledged, len(self.unacknowledged))
+
+    def get_delivery_report(self, block=True, timeout=None):
+        if not block or not self.unacknowledged:
+            raise Queue.Empty()
+        self.blocking_waits += 1
+        message = self.unacknowledged.pop(0)
+        if self._fail(message):
+            return message, Exception('Broker rejected message')
+        return message, None
+
+    def stop(self):
+        self.stopped = True
+
+
+class FakeConsumer:
+    """
+    Returns each of `values` as a message, then None (as a balanced
+    consumer does on timeout), and records the number of messages
+    consumed at each commit.
+    """
+    def __init__(self, values):
+        self._values = list(values)
+        self.consumed = 0
+        self.commits = []
+        self.stopped = False
+
+    def consume(self):
+        if self.consumed >= len(self._values):
+            return None
+        self.consumed += 1
+        return FakeMessage(self._values[self.consumed - 1])
+
+    def commit_offsets(self):
+        self.commits.append(self.consumed)
+
+    def stop(self):
+        self.stopped = True
+
+
+class FakeTopic:
+    def __init__(self, producer=None, consumer=None):
+        self.producer = producer or FakeProducer()
+        self.consumer = consumer
+
+    def get_producer(self, partitioner=None, **kwargs):
+        self.producer.partitioner = partitioner
+        return self.producer
+
+    def get_balanced_consumer(self, **kwargs):
+        return self.consumer
+
+
+class FakeKafkaClient:
+    def __init__(self, topic):
+        self.topics = {'trawler': topic}
+
+
+def quiet_logger():
+    logger = logging.getLogger('test_trawler_kafka')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    return logger
+
+
+def fake_trawler_kafka(topic=None, **kwargs):
+    topic = topic or FakeTopic()
+    return TrawlerKafka(None, None, kafka_client=FakeKafkaClient(topic), logger=quiet_logger(), **kwargs)
+
+
+def tweet(tweet_id, user_id):
+    return {'id': tweet_id, 'text': u'tweet %d' % tweet_id, 'user': {'id': user_id}}
+
+
+class TestTrawlerKafka(unittest.TestCase):
+    def test_tweets_are_keyed_by_user(self):
+        trawler_kafka = fake_trawler_kafka()
+        trawler_kafka.send_individual_tweets([tweet(1, 10), tweet(2, 20), tweet(3, 10)])
+        producer = trawler_kafka.producer
+        self.assertEqual([m.partition_key for m in producer.messages], ['10', '20', '10'])
+        self.assertEqual(producer.messages[0].partition, producer.messages[2].partition)
+        self.assertEqual(json.loads(producer.messages[0].value), tweet(1, 10))
+
+    def test_records_without_a_user_are_keyed(self):
+        trawler_kafka = fake_trawler_kafka()
+        trawler_kafka.send_individual_tweets([{'id': 10, 'screen_name': 'jack'}, {'text': u'no user'},
+                                              {'text': u'no user'}])
+        producer = trawler_kafka.producer
+        # User objects are keyed by their ID, like their tweets
+        self.assertEqual(producer.messages[0].partition_key, '10')
+        self.assertEqual(len(set(m.partition_key for m in producer.messages)), 3)
+        self.assertEqual(trawler_kafka.messages_sent, 3)
+
+    def test_partition_key_overrides_user(self):
+        trawler_kafka = fake_trawler_kafka()
+        trawler_kafka.send_individual_tweets([tweet(1, 10)], partition_key='ids:5')
+        self.assertEqual(trawler_kafka.producer.messages[0].partition_key, 'ids:5')
+
+    def test_keys_can_be_turned_off(self):
+        trawler_kafka = fake_trawler_kafka(key_by_user=False)
+        trawler_kafka.send_individual_tweets([tweet(1, 10), tweet(2, 10), {'text': u'no user'}])
+        messages = trawler_kafka.producer.messages
+        self.assertEqual([m.partition_key for m in messages], [None, None, None])
+        self.assertEqual(len(set(m.partition for m in messages)), 3)
+
+    def test_sending_blocks_at_max_pending_messages(self):
+        trawler_kafka = fake_trawler_kafka(max_pending_messages=10)
+        trawler_kafka.send_individual_tweets([tweet(i, i) for i in range(100)])
+        producer = trawler_kafka.producer
+        self.assertEqual(len(producer.messages), 100)
+        self.assertTrue(producer.max_unacknowledged <= 10)
+        self.assertTrue(producer.blocking_waits > 0)
+        self.assertTrue(trawler_kafka.pending_messages < 10)
+
+    def test_flush_accounts_for_delivered_and_failed_messages(self):
+        producer = FakeProducer(fail=lambda message: json.loads(message.value)['id'] % 4 == 0)
+        trawler_kafka = fake_trawler_kafka(FakeTopic(producer))
+        trawler_kafka.send_individual_tweets([tweet(i, i) for i in range(40)])
+        trawler_kafka.flush()
+        self.assertEqual(trawler_kafka.messages_sent, 40)
+        self.assertEqual(trawler_kafka.messages_delivered, 30)
+        self.assertEqual(trawler_kafka.messages_failed, 10)
+        self.assertEqual(trawler_kafka.pending_messages, 0)
+
+    def test_close_flushes_and_stops_the_producer(self):
+        trawler_kafka = fake_trawler_kafka()
+        trawler_kafka.send_individual_tweets([tweet(1, 10)])
+        trawler_kafka.close()
+        self.assertEqual(trawler_kafka.pending_messages, 0)
+        self.assertTrue(trawler_kafka.producer.stopped)
+
+
+class IDNotInSetFilter:
+    def __init__(self, tweet_ids):
+        self._tweet_ids = set(tweet_ids)
+
+    def filter(self, json_tweet_string):
+        return json.loads(json_tweet_string)['id'] not in self._tweet_ids
+
+
+class TestTweetBatches(unittest.TestCase):
+    def consume_batches(self, values, batch_count, **kwargs):
+        consumer = FakeConsumer(values)
+        trawler_kafka = fake_trawler_kafka(FakeTopic(consumer=consumer))
+        tweet_batches = trawler_kafka.get_tweet_batches('group', **kwargs)
+        batches = [[tweet['id'] for tweet in next(tweet_batches)] for i in range(batch_count)]
+        tweet_batches.close()
+        return batches, consumer
+
+    def test_filtered_out_batches_are_committed(self):
+        values = [json.dumps(tweet(i, i)) for i in range(1, 7)]
+        batches, consumer = self.consume_batches(values, 2, batch_size=2, filters=[IDNotInSetFilter([3, 4])])
+        self.assertEqual(batches, [[1, 2], [5, 6]])
+        # The batch holding Tweets 3 and 4 was committed without being yielded
+        self.assertEqual(consumer.commits, [2, 4])
+        self.assertTrue(consumer.stopped)
+
+    def test_invalid_json_is_dropped(self):
+        values = [json.dumps(tweet(1, 1)), 'not json', json.dumps(tweet(2, 2))]
+        batches, consumer = self.consume_batches(values, 1, batch_size=3)
+        self.assertEqual(batches, [[1, 2]])
+
+    def test_workers_filter_and_decode(self):
+        values = [json.dumps(tweet(i, i)) for i in range(1, 101)]
+        batches, consumer = self.consume_batches(values, 2, batch_size=50, decode_workers=2,
+                                                 filters=[IDNotInSetFilter(range(1, 101, 2))])
+        self.assertEqual(batches, [range(2, 51, 2), range(52, 101, 2)])
+
+
+class FakeTrawlerKafka:
+    def __init__(self):
+        self.sent = []
+        self.flushes = 0
+        self.closes = 0
+
+    def send_individual_tweets(self, tweets, partition_key=None):
+        self.sent += [(tweet, partition_key) for tweet in tweets]
+
+    def flush(self):
+        self.flushes += 1
+
+    def close(self):
+        self.closes += 1
+
+
+class TestKafkaSink(unittest.TestCase):
+    def test_pages_are_routed_by_endpoint(self):
+        tweets_kafka = FakeTrawlerKafka()
+        ids_kafka = FakeTrawlerKafka()
+        sink = KafkaSink(tweets_kafka, topics={'followers/ids': ids_kafka})
+        sink.publish([tweet(1, 10), tweet(2, 10)], 'statuses/user_timeline', key=10)
+        sink.publish([1, 2, 3], 'followers/ids', key=10)
+        self.assertEqual(tweets_kafka.sent, [(tweet(1, 10), None), (tweet(2, 10), None)])
+        self.assertEqual(ids_kafka.sent, [({'endpoint': 'followers/ids', 'key': 10, 'ids': [1, 2, 3]}, '10')])
+
+    def test_pages_without_a_key_are_keyed(self):
+        trawler_kafka = fake_trawler_kafka()
+        sink = KafkaSink(trawler_kafka)
+        sink.publish([{'id': 10, 'screen_name': 'jack'}, {'id': 20, 'screen_name': 'biz'}], 'users/lookup')
+        sink.publish([1, 2, 3], 'statuses/retweeters/ids')
+        sink.publish([4, 5, 6], 'followers/ids', key=10)
+        self.assertEqual([m.partition_key for m in trawler_kafka.producer.messages],
+                         ['10', '20', 'statuses/retweeters/ids:1', '10'])
+        sink.close()
+        self.assertEqual(trawler_kafka.messages_delivered, 4)
+
+    def test_close_stops_every_producer_once(self):
+        tweets_kafka = FakeTrawlerKafka()
+        ids_kafka = FakeTrawlerKafka()
+        sink = KafkaSink(tweets_kafka, topics={'followers/ids': ids_kafka, 'friends/ids': ids_kafka,
+                                               'statuses/user_timeline': tweets_kafka})
+        sink.close()
+        self.assertEqual((tweets_kafka.closes, ids_kafka.closes), (1, 1))
+
+    def test_close_stops_real_producers(self):
+        trawler_kafka = fake_trawler_kafka()
+        sink = KafkaSink(trawler_kafka)
+        sink.publish([tweet(1, 10)], 'statuses/user_timeline', key=10)
+        sink.close()
+        self.assertEqual(trawler_kafka.messages_delivered, 1)
+        self.assertTrue(trawler_kafka.producer.stopped)
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""
+Tests for trawler_metrics.py, and the metrics recorded by
+RateLimitedTwitterEndpoint
+"""
+
+# Standard Library modules
+import contextlib
+import json
+import os
+import urllib2
+
+# Local modules
+from trawler_metrics import *
+from twitter_crawler import CrawlTwitterTimelines, RateLimitedTwitterEndpoint
+from mock_twitter_server import MockTwitterAPI, SyntheticTwitterData
+from test_twitter_crawler import MockTwitterTestCase
+
+
+class TestMetricsRegistry(MockTwitterTestCase):
+    def test_prometheus_text(self):
+        registry = MetricsRegistry(buckets=(0.1, 1.0))
+        metrics = Metrics([registry])
+        metrics.increment(REQUESTS, endpoint='users/lookup', status='200')
+        metrics.increment(REQUESTS, 2, endpoint='users/lookup', status='200')
+        metrics.observe(REQUEST_SECONDS, 0.5, endpoint='users/lookup')
+        metrics.observe(REQUEST_SECONDS, 5.0, endpoint='users/lookup')
+        lines = registry.prometheus_text().splitlines()
+        self.assertTrue('trawler_requests_total{endpoint="users/lookup",status="200"} 3' in lines)
+        self.assertTrue('trawler_request_seconds_bucket{endpoint="users/lookup",le="0.1"} 0' in lines)
+        self.assertTrue('trawler_request_seconds_bucket{endpoint="users/lookup",le="1.0"} 1' in lines)
+        self.assertTrue('trawler_request_seconds_bucket{endpoint="users/lookup",le="+Inf"} 2' in lines)
+        self.assertTrue('trawler_request_seconds_count{endpoint="users/lookup"} 2' in lines)
+
+    def test_prometheus_exporter(self):
+        registry = MetricsRegistry()
+        registry.increment(REQUESTS, 1, {'endpoint': 'users/lookup'})
+        exporter = PrometheusExporter(registry, port=0, host='localhost').start()
+        try:
+            body = urllib2.urlopen('http://localhost:%d/metrics' % exporter.port).read()
+        finally:
+            exporter.stop()
+        self.assertTrue('trawler_requests_total{endpoint="users/lookup"} 1' in body)
+
+    def test_statsd_format(self):
+        backend = StatsDBackend(prefix='trawler')
+        self.assertEqual(backend.format(REQUESTS, 1, 'c', {'endpoint': 'users/lookup', 'status': '200'}),
+                         'trawler.trawler_requests_total.users_lookup.200:1|c')
+        backend = StatsDBackend(prefix='trawler', tags=True)
+        self.assertEqual(backend.format(REQUESTS, 1, 'c', {'endpoint': 'users/lookup'}),
+                         'trawler.trawler_requests_total:1|c|#endpoint:users/lookup')
+
+    def test_json_lines(self):
+        json_filename = os.path.join(self.directory, 'metrics.json')
+        backend = JSONLinesBackend(json_filename)
+        Metrics([backend]).gauge(QUOTA_REMAINING, 14, endpoint='followers/ids')
+        backend.close()
+        event = json.loads(open(json_filename).readline())
+        self.assertEqual((event['metric'], event['value'], event['labels']),
+                         (QUOTA_REMAINING, 14, {'endpoint': 'followers/ids'}))
+
+
+class TestEndpointMetrics(MockTwitterTestCase):
+    def create_mock_api(self):
+        return MockTwitterAPI(SyntheticTwitterData(user_count=1000, clock=self.clock),
+                              error_rate=0.05, latency=0.5, clock=self.clock)
+
+    def test_timeline_metrics(self):
+        registry = MetricsRegistry()
+        spans = []
+
+        @contextlib.contextmanager
+        def span_hook(name, labels):
+            spans.append(name)
+            yield
+
+        metrics = Metrics([registry], [span_hook])
+        crawler = CrawlTwitterTimelines(self.twython, self.logger, metrics=metrics)
+        tweet_count = 0
+        for user_id in range(1, 20):
+            tweet_count += len(crawler.get_all_timeline_tweets_for_id(user_id))
+
+        endpoint = 'statuses/user_timeline'
+        self.assertEqual(registry.total(RECORDS, endpoint=endpoint), tweet_count)
+        self.assertEqual(registry.total(REQUESTS, endpoint=endpoint),
+                         self.mock_api.endpoint_counts[endpoint])
+        self.assertEqual(registry.total(REQUESTS, endpoint=endpoint, status='200'), len(spans))
+        self.assertEqual(registry.total(RETRIES, endpoint=endpoint, reason='server_error'),
+                         registry.total(REQUESTS, endpoint=endpoint) - len(spans))
+        self.assertTrue(registry.total(SLEEP_SECONDS, reason='backoff') > 0)
+        histogram = [metric for metric in registry.snapshot() if metric['metric'] == REQUEST_SECONDS][0]
+        self.assertAlmostEqual(histogram['sum'], 0.5 * histogram['count'])
+
+    def test_rate_limit_sleep(self):
+        registry = MetricsRegistry()
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'followers/ids', logger=self.logger,
+                                              metrics=Metrics([registry]))
+        for i in range(16):
+            endpoint.get_data(user_id=1)
+        self.assertTrue(registry.total(SLEEP_SECONDS, reason='rate_limit') >= 15 * 60 - 30)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+Tests for trawler_projection.py
+"""
+
+# Standard Library modules
+import json
+import unittest
+
+# Local modules
+from trawler_projection import *
+
+
+TWEET = json.dumps({
+    'created_at': 'Mon Aug 12 18:00:00 +0000 2018',
+    'id': 1027000000000000001,
+    'text': u'"Quoted" {braces} [brackets] \\ and \u00e9',
+    'entities': {'urls': [{'url': 'http://t.co/x', 'indices': [0, 13]}], 'hashtags': []},
+    'user': {'id': 12, 'screen_name': 'jack', 'entities': {'description': {'urls': []}}, 'verified': False},
+    'coordinates': None,
+    'retweet_count': -1.5e3,
+    'lang': 'en',
+})
+
+
+class TestTweetProjection(unittest.TestCase):
+    def assertProjects(self, json_string, paths, exists=()):
+        """
+        Asserts that projecting `json_string`, with and without
+        validation, gives the fields picked from the decoded string
+        """
+        expected = TweetProjection(paths, exists).pick(json.loads(json_string))
+        self.assertEqual(TweetProjection(paths, exists).project(json_string), expected)
+        self.assertEqual(TweetProjection(paths, exists, validate=True).project(json_string), expected)
+        return expected
+
+    def test_fields_are_projected(self):
+        fields = self.assertProjects(TWEET, ['id', 'text', 'user.id', 'lang', 'retweet_count', 'coordinates'])
+        self.assertEqual(fields, {'id': 1027000000000000001, 'text': u'"Quoted" {braces} [brackets] \\ and \u00e9',
+                                  'user.id': 12, 'lang': 'en', 'retweet_count': -1500.0, 'coordinates': None})
+
+    def test_nested_objects_are_projected_whole(self):
+        fields = self.assertProjects(TWEET, ['entities.urls', 'user.entities'])
+        self.assertEqual(fields['entities.urls'][0]['url'], 'http://t.co/x')
+        self.assertEqual(fields['user.entities'], {'description': {'urls': []}})
+
+    def test_missing_fields_are_left_out(self):
+        self.assertEqual(self.assertProjects(TWEET, ['id', 'full_text', 'user.name', 'lang.code']),
+                         {'id': 1027000000000000001})
+
+    def test_exists(self):
+        fields = self.assertProjects(TWEET, ['id'], exists=['retweeted_status', 'user.verified', 'entities.media'])
+        self.assertEqual(fields, {'id': 1027000000000000001, 'retweeted_status': False,
+                                  'user.verified': True, 'entities.media': False})
+
+    def test_whitespace_and_escaped_keys(self):
+        json_string = ' { "a\\u0062c" : 1 ,\n"list" : [ 1, {"id": 5} ] , "id" :\t2 } '
+        self.assertEqual(self.assertProjects(json_string, ['abc', 'id']), {'abc': 1, 'id': 2})
+
+    def test_scanning_stops_once_fields_are_found(self):
+        # The rest of the line is never read, so need not be valid
+        self.assertEqual(TweetProjection(['id']).project('{"id": 1, "text": '), {'id': 1})
+        self.assertRaises(ValueError, TweetProjection(['id'], validate=True).project, '{"id": 1, "text": ')
+
+    def test_invalid_lines_raise_value_error(self):
+        for json_string in ['', '[1, 2]', '{"text": "unterminated', '{"id" 1}', '{"list": [1, 2}', '{"id": nul}']:
+            self.assertRaises(ValueError, TweetProjection(['lang']).project, json_string)
+            self.assertRaises(ValueError, TweetProjection(['lang'], validate=True).project, json_string)
+
+    def test_exists_fields_can_contain_other_paths(self):
+        self.assertEqual(self.assertProjects(TWEET, ['user.id'], exists=['user', 'retweeted_status']),
+                         {'user.id': 12, 'user': True, 'retweeted_status': False})
+        self.assertEqual(self.assertProjects(TWEET, ['id', 'retweeted_status.id'], exists=['retweeted_status']),
+                         {'id': 1027000000000000001, 'retweeted_status': False})
+
+    def test_overlapping_paths_are_rejected(self):
+        self.assertRaises(ValueError, TweetProjection, ['user', 'user.id'])
+        self.assertRaises(ValueError, TweetProjection, ['user.id', 'user'])
+        self.assertRaises(ValueError, TweetProjection, ['user'], exists=['user'])
+        self.assertRaises(ValueError, TweetProjection, ['user'], exists=['user.id'])
+
+    def test_project_lines(self):
+        lines = [TWEET + '\n', '\n', json.dumps({'id': 2}) + '\n']
+        self.assertEqual(list(project_lines(lines, ['id'], exists=['user'])),
+                         [{'id': 1027000000000000001, 'user': True}, {'id': 2, 'user': False}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""
+Tests for trawler_rate_limits.py.  Crawlers in separate processes are
+stood in for by crawlers with separate EndpointRegistry instances
+sharing one store.
+"""
+
+# Standard Library modules
+import multiprocessing
+import os
+import threading
+import unittest
+
+# Local modules
+from twitter_crawler import EndpointRegistry, RateLimitWindow, UserLookup
+from trawler_rate_limits import *
+from mock_twitter_server import MockTwitterAPI, MockTwython, SyntheticTwitterData
+from test_twitter_crawler import MockTwitterTestCase
+
+
+def reserve_all(filename):
+    store = SQLiteRateLimitStore(filename)
+    window = store.window('token', 'users/lookup')
+    reserved = 0
+    while window.reserve() is not None:
+        reserved += 1
+    return reserved
+
+
+class TestSQLiteRateLimitStore(MockTwitterTestCase):
+    def create_mock_api(self):
+        return MockTwitterAPI(SyntheticTwitterData(user_count=1000, clock=self.clock),
+                              rate_limits={'users/lookup': 3}, clock=self.clock)
+
+    def test_reservations_are_atomic_across_processes(self):
+        filename = os.path.join(self.directory, 'rate_limits.db')
+        SQLiteRateLimitStore(filename).window('token', 'users/lookup').update(1000, self.clock.time() + 900)
+        pool = multiprocessing.Pool(4)
+        try:
+            reserved = pool.map(reserve_all, [filename] * 4)
+        finally:
+            pool.terminate()
+        self.assertEqual(sum(reserved), 1000)
+        self.assertEqual(SQLiteRateLimitStore(filename).window('token', 'users/lookup').state()[0], 0)
+
+    def test_reservations_are_atomic_across_threads(self):
+        window = SQLiteRateLimitStore(os.path.join(self.directory, 'rate_limits.db')).window('token', 'users/lookup')
+        window.update(500, self.clock.time() + 900)
+        reserved = []
+        def reserve():
+            while window.reserve() is not None:
+                reserved.append(1)
+        threads = [threading.Thread(target=reserve) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(reserved), 500)
+
+    def test_reservations_leave_calls_for_others(self):
+        window = SQLiteRateLimitStore(os.path.join(self.directory, 'rate_limits.db')).window('token', 'users/lookup')
+        window.update(3, self.clock.time() + 900)
+        self.assertEqual([window.reserve(keep=1), window.reserve(keep=1), window.reserve()], [2, 1, 0])
+
+    def test_stale_updates_do_not_restore_reserved_calls(self):
+        window = SQLiteRateLimitStore(os.path.join(self.directory, 'rate_limits.db')).window('token', 'users/lookup')
+        check_stale_updates(self, window)
+
+    def test_unknown_windows_have_no_state(self):
+        window = SQLiteRateLimitStore(os.path.join(self.directory, 'rate_limits.db')).window('token', 'users/lookup')
+        self.assertEqual(window.state(), (None, None))
+        self.assertEqual(window.reserve(), None)
+
+    def test_crawlers_sharing_a_store_split_the_quota(self):
+        store = SQLiteRateLimitStore(os.path.join(self.directory, 'rate_limits.db'))
+        first_crawler = UserLookup(self.twython, self.logger, registry=EndpointRegistry(store))
+        second_crawler = UserLookup(MockTwython(self.mock_api), self.logger, registry=EndpointRegistry(store))
+        # The second crawler found the window the first had looked up
+        self.assertEqual(self.mock_api.endpoint_counts['application/rate_limit_status'], 1)
+
+        start_time = self.clock.time()
+        first_crawler.lookup_users(range(1, 201))
+        second_crawler.lookup_users(range(201, 401))
+        self.assertEqual(self.mock_api.status_counts.get(429, 0), 0)
+        # Only 3 of the 4 calls fit in the first window
+        self.assertTrue(self.clock.time() - start_time >= 900)
+
+    def test_crawlers_with_separate_windows_collide(self):
+        first_crawler = UserLookup(self.twython, self.logger, registry=EndpointRegistry())
+        second_crawler = UserLookup(MockTwython(self.mock_api), self.logger, registry=EndpointRegistry())
+        first_crawler.lookup_users(range(1, 201))
+        second_crawler.lookup_users(range(201, 401))
+        self.assertTrue(self.mock_api.status_counts.get(429, 0) > 0)
+
+
+class FakeRedis:
+    """
+    The Redis commands RedisRateLimitWindow uses, with eval() running
+    the reservation and update scripts' logic in Python
+    """
+    def __init__(self):
+        self.hashes = {}
+        self.expiries = {}
+        self.scripts = set()
+
+    def hmget(self, key, fields):
+        return [self.hashes.get(key, {}).get(field) for field in fields]
+
+    def eval(self, script, key_count, key, *args):
+        self.scripts.add(script)
+        if script == RedisRateLimitWindow.UPDATE_SCRIPT:
+            return self._update(key, *args)
+        keep, = args
+        calls_remaining = self.hashes.get(key, {}).get('calls_remaining')
+        if calls_remaining is None or int(calls_remaining) <= keep:
+            return -1
+        self.hashes[key]['calls_remaining'] = str(int(calls_remaining) - 1)
+        return int(calls_remaining) - 1
+
+    def _update(self, key, calls_remaining, resets_at, expire_at):
+        if key in self.hashes:
+            if float(resets_at) < float(self.hashes[key]['resets_at']):
+                return 0
+            if float(resets_at) == float(self.hashes[key]['resets_at']):
+                calls_remaining = min(calls_remaining, int(self.hashes[key]['calls_remaining']))
+        self.hashes[key] = {'calls_remaining': str(calls_remaining), 'resets_at': str(resets_at)}
+        self.expiries[key] = expire_at
+        return 1
+
+
+class TestRedisRateLimitStore(unittest.TestCase):
+    def test_windows_are_stored_in_hashes(self):
+        redis = FakeRedis()
+        window = RedisRateLimitStore(redis).window('token', 'users/lookup')
+        self.assertEqual(window.state(), (None, None))
+        window.update(2, 1000.0)
+        self.assertEqual(redis.hashes['trawler:rate_limit:token:users/lookup'],
+                         {'calls_remaining': '2', 'resets_at': '1000.0'})
+        self.assertEqual(redis.expiries['trawler:rate_limit:token:users/lookup'], 4600)
+        self.assertEqual([window.reserve(), window.reserve(), window.reserve()], [1, 0, None])
+        self.assertEqual(window.state(), (0, 1000.0))
+        self.assertEqual(redis.scripts, set([RedisRateLimitWindow.RESERVE_SCRIPT, RedisRateLimitWindow.UPDATE_SCRIPT]))
+
+    def test_stale_updates_do_not_restore_reserved_calls(self):
+        window = RedisRateLimitStore(FakeRedis()).window('token', 'users/lookup')
+        check_stale_updates(self, window)
+
+
+class TestRateLimitWindow(unittest.TestCase):
+    def test_stale_updates_do_not_restore_reserved_calls(self):
+        check_stale_updates(self, RateLimitWindow())
+
+
+def check_stale_updates(test_case, window):
+    window.update(10, 1000.0)
+    window.reserve()
+    window.reserve()
+    # A status fetched before the reservations, in the same window
+    window.update(10, 1000.0)
+    test_case.assertEqual(window.state(), (8, 1000.0))
+    window.update(5, 1000.0)
+    test_case.assertEqual(window.state(), (5, 1000.0))
+    # A status from the previous window
+    window.update(180, 100.0)
+    test_case.assertEqual(window.state(), (5, 1000.0))
+    # The next window
+    window.update(180, 1900.0)
+    test_case.assertEqual(window.state(), (180, 1900.0))
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+Tests for trawler_schema.py, and for saving Tweets with a schema
+"""
+
+# Standard Library modules
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import ujson as json #much quicker
+except:
+    import json
+
+# Local modules
+from trawler_schema import *
+from twitter_crawler import (RotatingJSONWriter, compact_tweet_snapshots, load_tweets_from_json_file, load_user_table,
+                             save_tweets_to_json_file)
+
+
+def load_testdata(filename):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata', filename)) as json_file:
+        return [json.loads(line) for line in json_file if line.strip()]
+
+
+class TestTweetSchema(unittest.TestCase):
+    def test_fields_are_whitelisted(self):
+        tweet = {'id': 1, 'text': 'foo', 'source': 'web', 'geo': None,
+                 'entities': {'hashtags': [{'text': 'a', 'indices': [0, 2]}, {'text': 'b', 'indices': [3, 5]}],
+                              'urls': []},
+                 'user': {'id': 12, 'id_str': '12', 'screen_name': 'jack', 'profile_link_color': '0084B4'}}
+        users = {}
+        slim = TweetSchema(['id', 'text', 'geo', 'entities.hashtags.text']).slim_tweet(tweet, users)
+        self.assertEqual(slim, {'id': 1, 'text': 'foo', 'geo': None, 'entities': {'hashtags': [{'text': 'a'}, {'text': 'b'}]},
+                                'user': {'id': 12, 'id_str': '12', 'screen_name': 'jack'}})
+        self.assertEqual(users, {12: tweet['user']})
+        self.assertFalse('geo' in TweetSchema(['id', 'geo'], drop_null=True).slim_tweet(tweet, {}))
+
+    def test_users_are_kept_once(self):
+        tweets = load_testdata('shears.txt')
+        users = {}
+        slim_tweets = [SCHEMA_PROFILES['research-slim'].slim_tweet(tweet, users) for tweet in tweets]
+        user_ids = set(tweet['user']['id'] for tweet in tweets)
+        user_ids.update(tweet['retweeted_status']['user']['id'] for tweet in tweets if 'retweeted_status' in tweet)
+        self.assertEqual(sorted(users), sorted(user_ids))
+        self.assertFalse(any('profile_link_color' in user for user in users.values()))
+        # The slimmed Tweets are less than half the size
+        self.assertTrue(len(json.dumps(slim_tweets)) + len(json.dumps(users.values())) < len(json.dumps(tweets)) / 2)
+        for tweet, slim_tweet in zip(tweets, slim_tweets):
+            self.assertEqual(slim_tweet['text'], tweet['text'])
+            # Normalised before the retweeted Tweet was slimmed
+            self.assertEqual(slim_tweet['trawler']['is_retweet'], 'retweeted_status' in tweet)
+            self.assertEqual(expand_users(slim_tweet, users)['user']['screen_name'], tweet['user']['screen_name'])
+
+    def test_retweets_are_slimmed(self):
+        retweet = load_testdata('retweet_x1')[0]
+        users = {}
+        slim = SCHEMA_PROFILES['research-slim'].slim_tweet(retweet, users)
+        original_user_id = retweet['retweeted_status']['user']['id']
+        self.assertEqual(slim['retweeted_status']['id'], retweet['retweeted_status']['id'])
+        self.assertEqual(slim['retweeted_status']['user']['id'], original_user_id)
+        self.assertTrue(original_user_id in users)
+        self.assertFalse('profile_image_url' in expand_users(slim, users)['retweeted_status']['user'])
+
+    def test_get_tweet_schema(self):
+        self.assertEqual(get_tweet_schema(None), None)
+        self.assertEqual(get_tweet_schema('raw'), None)
+        self.assertTrue(get_tweet_schema('research-slim') is SCHEMA_PROFILES['research-slim'])
+        self.assertEqual(get_tweet_schema(['id', 'text']).tweet_fields, ('id', 'text'))
+        self.assertRaises(ValueError, get_tweet_schema, 'research-slimmer')
+
+    def test_user_table_filename(self):
+        self.assertEqual(user_table_filename('jack.tweets.gz'), 'jack.tweets.users.gz')
+        self.assertEqual(user_table_filename('search.00001.json.gz'), 'search.00001.users.json.gz')
+        self.assertEqual(user_table_filename('jack.tweets'), 'jack.tweets.users')
+
+
+class TestSavingWithSchema(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tweets = load_testdata('shears.txt') + load_testdata('retweet_x1')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_tweets_to_json_file(self):
+        json_filename = os.path.join(self.directory, 'shears.tweets.gz')
+        save_tweets_to_json_file(self.tweets, json_filename, schema='research-slim')
+        users = load_user_table(json_filename)
+        self.assertEqual(len(gzip.open(user_table_filename(json_filename)).read().splitlines()), len(users))
+        tweets = load_tweets_from_json_file(json_filename)
+        self.assertEqual([tweet['id'] for tweet in tweets], [tweet['id'] for tweet in self.tweets])
+        # Each user is saved once, as they were in their first Tweet in the file
+        self.assertEqual([tweet['user']['id'] for tweet in tweets], [tweet['user']['id'] for tweet in self.tweets])
+        self.assertTrue(all('followers_count' in tweet['user'] for tweet in tweets))
+
+    def test_raw_tweets_are_saved_as_they_are(self):
+        json_filename = os.path.join(self.directory, 'shears.tweets.gz')
+        save_tweets_to_json_file(self.tweets, json_filename, schema='raw')
+        self.assertEqual(load_tweets_from_json_file(json_filename), self.tweets)
+        self.assertFalse(os.path.exists(user_table_filename(json_filename)))
+
+    def test_each_file_has_its_own_user_table(self):
+        prefix = os.path.join(self.directory, 'shears')
+        writer = RotatingJSONWriter(prefix, max_tweets_per_file=20, schema='research-slim')
+        writer.write_tweets(self.tweets)
+        writer.close()
+        first_filename, second_filename = '%s.00000.json.gz' % prefix, '%s.00001.json.gz' % prefix
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(os.path.basename(filename) for filename in [
+                             first_filename, user_table_filename(first_filename),
+                             second_filename, user_table_filename(second_filename)]))
+        tweets = load_tweets_from_json_file(first_filename) + load_tweets_from_json_file(second_filename)
+        self.assertEqual([tweet['user']['id'] for tweet in tweets], [tweet['user']['id'] for tweet in self.tweets])
+        self.assertTrue(all('followers_count' in tweet['user'] for tweet in tweets))
+
+    def test_snapshots_are_compacted_with_their_user_tables(self):
+        directories = [os.path.join(self.directory, name) for name in ['snapshot0', 'snapshot1']]
+        tweets = sorted(self.tweets, key=lambda tweet: tweet['id'], reverse=True)
+        for directory, snapshot in zip(directories, [tweets[10:], tweets[:20]]):
+            os.mkdir(directory)
+            save_tweets_to_json_file(snapshot, os.path.join(directory, 'shears.tweets.gz'), schema='research-slim')
+        output_directory = os.path.join(self.directory, 'compacted')
+        self.assertEqual(compact_tweet_snapshots(directories, output_directory, processes=1),
+                         {'shears.tweets.gz': len(tweets)})
+        compacted_tweets = load_tweets_from_json_file(os.path.join(output_directory, 'shears.tweets.gz'))
+        self.assertEqual([tweet['id'] for tweet in compacted_tweets], [tweet['id'] for tweet in tweets])
+        self.assertTrue(all('followers_count' in tweet['user'] for tweet in compacted_tweets))
+
+
+if __name__ == '__main__':
+    unittest.main()
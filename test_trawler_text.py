@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+Tests for trawler_text.py
+"""
+
+# Standard Library modules
+import os
+import unittest
+
+try:
+    import ujson as json #much quicker
+except:
+    import json
+
+# Local modules
+from trawler_text import *
+from trawler_projection import TweetProjection
+
+
+def load_testdata(filename):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata', filename)) as json_file:
+        return [json.loads(line) for line in json_file if line.strip()]
+
+
+class TestNormaliseTweet(unittest.TestCase):
+    def test_text_is_taken_from_whichever_field_has_it(self):
+        self.assertEqual(normalise_tweet({'text': u'short'})['trawler']['text'], u'short')
+        self.assertEqual(normalise_tweet({'full_text': u'extended'})['trawler']['text'], u'extended')
+        streamed = {'text': u'truncated\u2026', 'truncated': True, 'extended_tweet': {'full_text': u'untruncated'}}
+        self.assertEqual(normalise_tweet(streamed)['trawler']['text'], u'untruncated')
+
+    def test_retweets_have_the_full_retweeted_text(self):
+        retweet = {'full_text': u'RT @jack: just setting up my tw\u2026',
+                   'retweeted_status': {'id': 20, 'full_text': u'just setting up my twttr', 'user': {'screen_name': 'jack'}},
+                   'entities': {'urls': [], 'hashtags': [], 'user_mentions': [{'screen_name': 'jack'}]}}
+        self.assertEqual(normalise_tweet(retweet)['trawler'], {
+            'text': u'RT @jack: just setting up my twttr', 'is_retweet': True, 'has_url': False,
+            'mention_count': 1, 'hashtag_count': 0})
+        self.assertTrue(normalise_tweet({'text': u'RT @jack: a manual retweet'})['trawler']['is_retweet'])
+        self.assertFalse(normalise_tweet({'text': u'ART @jack'})['trawler']['is_retweet'])
+
+    def test_flags_are_taken_from_entities(self):
+        tweet = {'text': u'#one #two @three http://t.co/x',
+                 'entities': {'urls': [], 'media': [{'type': 'photo'}], 'hashtags': [{'text': 'one'}],
+                              'user_mentions': []}}
+        flags = normalise_tweet(tweet)['trawler']
+        self.assertEqual((flags['has_url'], flags['hashtag_count'], flags['mention_count']), (True, 1, 0))
+        # Without entities, the flags are read from the text
+        flags = normalise_tweet({'text': u'#one #two @three email@example.com http://t.co/x'})['trawler']
+        self.assertEqual((flags['has_url'], flags['hashtag_count'], flags['mention_count']), (True, 2, 1))
+
+    def test_projected_tweets_are_normalised_the_same(self):
+        projection = TweetProjection(NORMALISE_PATHS)
+        for tweet in load_testdata('shears.txt') + load_testdata('retweet_x1'):
+            json_tweet_string = json.dumps(tweet)
+            fields = normalised_fields(projection.project(json_tweet_string))
+            normalised_tweet = normalise_tweet(tweet)
+            self.assertEqual(fields, normalised_tweet['trawler'])
+            # Once normalised, Tweets are not normalised again
+            self.assertEqual(normalised_fields(projection.project(json.dumps(normalised_tweet))), fields)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+"""
+Tests for trawler_work_queue.py.  Every test runs against both the
+SQLite and the directory queues.
+"""
+
+# Standard Library modules
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local modules
+import trawler_work_queue
+from trawler_work_queue import *
+from mock_twitter_server import VirtualClock
+
+
+def claim_all(url):
+    work_queue = open_work_queue(url)
+    claimed = []
+    job = work_queue.claim()
+    while job is not None:
+        claimed.append(job.item)
+        work_queue.ack(job)
+        job = work_queue.claim()
+    return claimed
+
+
+class WorkQueueTests:
+    """
+    Tests for the work queue returned by open_work_queue(self.url()),
+    run on a virtual clock
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = VirtualClock()
+        self._real_time = trawler_work_queue.time
+        trawler_work_queue.time = self.clock
+        self.logger = logging.getLogger('test_trawler_work_queue')
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+
+    def tearDown(self):
+        trawler_work_queue.time = self._real_time
+        shutil.rmtree(self.directory)
+
+    def url(self):
+        raise NotImplementedError
+
+    def work_queue(self, lease_seconds=600, max_attempts=3):
+        return open_work_queue(self.url(), lease_seconds, max_attempts)
+
+    def test_items_are_queued_once(self):
+        work_queue = self.work_queue()
+        self.assertEqual(work_queue.put([u'alice', u'bob', u'alice']), 2)
+        self.assertEqual(work_queue.put(iter([u'bob', u'carol'])), 1)
+        self.assertEqual(work_queue.counts(), {PENDING: 3, LEASED: 0, DONE: 0, FAILED: 0})
+
+    def test_counts_of_some_states(self):
+        work_queue = self.work_queue()
+        work_queue.put([u'alice', u'bob'])
+        work_queue.claim()
+        self.assertEqual(work_queue.counts((PENDING, LEASED)), {PENDING: 1, LEASED: 1})
+
+    def test_claimed_jobs_are_acknowledged(self):
+        work_queue = self.work_queue()
+        work_queue.put([u'alice', u'bob'])
+        first_job = work_queue.claim()
+        second_job = work_queue.claim()
+        self.assertEqual(sorted([first_job.item, second_job.item]), [u'alice', u'bob'])
+        self.assertEqual(work_queue.claim(), None)
+        self.assertEqual(work_queue.counts()[LEASED], 2)
+        self.assertTrue(work_queue.ack(first_job))
+        self.assertEqual(work_queue.counts(), {PENDING: 0, LEASED: 1, DONE: 1, FAILED: 0})
+
+    def test_failed_jobs_are_retried_until_max_attempts(self):
+        work_queue = self.work_queue(max_attempts=2)
+        work_queue.put([u'alice'])
+        job = work_queue.claim()
+        self.assertTrue(work_queue.fail(job, 'Not found'))
+        job = work_queue.claim()
+        self.assertEqual(job.attempts, 2)
+        self.assertTrue(work_queue.fail(job, 'Not found'))
+        self.assertEqual(work_queue.claim(), None)
+        self.assertEqual(work_queue.counts(), {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 1})
+
+    def test_expired_leases_are_claimed_again(self):
+        work_queue = self.work_queue(lease_seconds=600)
+        work_queue.put([u'alice'])
+        crashed_job = work_queue.claim()
+        self.clock.sleep(300)
+        self.assertEqual(work_queue.claim(), None)
+        self.clock.sleep(301)
+        job = work_queue.claim()
+        self.assertEqual((job.item, job.attempts), (u'alice', 2))
+        # The first worker's lease is gone
+        self.assertFalse(work_queue.ack(crashed_job))
+        self.assertFalse(work_queue.extend(crashed_job))
+        self.assertTrue(work_queue.ack(job))
+
+    def test_extended_leases_do_not_expire(self):
+        work_queue = self.work_queue(lease_seconds=600)
+        work_queue.put([u'alice'])
+        job = work_queue.claim()
+        self.clock.sleep(500)
+        self.assertTrue(work_queue.extend(job))
+        self.clock.sleep(500)
+        self.assertEqual(work_queue.claim(), None)
+        self.assertTrue(work_queue.ack(job))
+
+    def test_workers_in_separate_processes_claim_each_job_once(self):
+        work_queue = self.work_queue()
+        work_queue.put(unicode(user_id) for user_id in range(200))
+        pool = multiprocessing.Pool(4)
+        try:
+            claimed = pool.map(claim_all, [self.url()] * 4)
+        finally:
+            pool.terminate()
+        claimed = sum(claimed, [])
+        self.assertEqual(sorted(claimed, key=int), [unicode(user_id) for user_id in range(200)])
+        self.assertEqual(work_queue.counts()[DONE], 200)
+
+    def test_run_worker_retries_failing_crawls(self):
+        work_queue = self.work_queue(max_attempts=2)
+        work_queue.put([u'alice', u'bob', u'carol'])
+        crawled = []
+        def crawl(screen_name):
+            crawled.append(screen_name)
+            if screen_name == u'bob':
+                raise ValueError(screen_name)
+        self.assertEqual(run_worker(work_queue, crawl, self.logger), 2)
+        self.assertEqual(sorted(crawled), [u'alice', u'bob', u'bob', u'carol'])
+        self.assertEqual(work_queue.counts(), {PENDING: 0, LEASED: 0, DONE: 2, FAILED: 1})
+
+
+class TestSQLiteWorkQueue(WorkQueueTests, unittest.TestCase):
+    def url(self):
+        return 'sqlite:' + os.path.join(self.directory, 'queue.db')
+
+
+class TestDirectoryWorkQueue(WorkQueueTests, unittest.TestCase):
+    def url(self):
+        return 'dir:' + os.path.join(self.directory, 'queue')
+
+    def test_directories_are_not_listed_for_every_claim(self):
+        work_queue = self.work_queue()
+        work_queue.put(unicode(user_id) for user_id in range(100))
+        listed = []
+        real_listdir = os.listdir
+        def recording_listdir(path):
+            listed.append(os.path.basename(path))
+            return real_listdir(path)
+        trawler_work_queue.os.listdir = recording_listdir
+        try:
+            for i in range(100):
+                work_queue.ack(work_queue.claim())
+                self.clock.sleep(1)
+            self.assertEqual(work_queue.claim(), None)
+        finally:
+            trawler_work_queue.os.listdir = real_listdir
+        # pending/ is listed once, then again once it seems empty, and
+        # leased/ once every 60 seconds
+        self.assertEqual(listed.count(PENDING), 2)
+        self.assertEqual(listed.count(LEASED), 2)
+
+
+class TestOpenWorkQueue(unittest.TestCase):
+    def test_unknown_urls_are_rejected(self):
+        self.assertRaises(ValueError, open_work_queue, 'queue.db')
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,1150 @@
+#!/usr/bin/env python
+
+"""
+Tests for the crawlers in twitter_crawler.py, run against the mock
+Twitter API in mock_twitter_server.py with a virtual clock.
+"""
+
+# Standard Library modules
+import datetime
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+# Local modules
+import trawler_metrics
+import twitter_crawler
+from twitter_crawler import *
+from mock_twitter_server import (TIMELINE_ID_BASE, MockTwitterAPI, MockTwython, ScaledClock, SyntheticTwitterData,
+                                 VirtualClock, error_body, format_twitter_time)
+
+
+class MockTwitterTestCase(unittest.TestCase):
+    """
+    Points twitter_crawler at a fresh mock API whose clock only moves
+    when the crawlers sleep.
+    """
+    def setUp(self):
+        self.clock = self.create_clock()
+        self._real_time = twitter_crawler.time
+        twitter_crawler.time = self.clock
+        self.mock_api = self.create_mock_api()
+        self.twython = MockTwython(self.mock_api)
+        self.logger = logging.getLogger('test_twitter_crawler')
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        twitter_crawler.time = self._real_time
+        shutil.rmtree(self.directory)
+
+    def create_clock(self):
+        return VirtualClock()
+
+    def create_mock_api(self):
+        return MockTwitterAPI(SyntheticTwitterData(user_count=1000, list_count=100, clock=self.clock),
+                              clock=self.clock)
+
+    def record_requests(self, endpoint):
+        """
+        Returns a list that the parameters of every request to
+        `endpoint` are appended to.
+        """
+        requests = []
+        handle = self.mock_api.handle
+        def recording_handle(request_endpoint, params, token='default'):
+            if request_endpoint == endpoint:
+                requests.append(dict(params))
+            return handle(request_endpoint, params, token)
+        self.mock_api.handle = recording_handle
+        return requests
+
+    def fail_requests(self, endpoint, count, status=503):
+        """
+        Makes the next `count` requests to `endpoint` fail with a 503
+        (or a 429, or a 401 for a revoked bearer token, if `status` is
+        429 or 401), and returns a list that the parameters of each
+        failed request are appended to.
+        """
+        failed_requests = []
+        handle = self.mock_api.handle
+        def failing_handle(request_endpoint, params, token='default'):
+            if request_endpoint == endpoint and len(failed_requests) < count:
+                failed_requests.append(dict(params))
+                if status == 429:
+                    return 429, {}, error_body(88, 'Rate limit exceeded')
+                if status == 401:
+                    return 401, {}, error_body(89, 'Invalid or expired token')
+                return 503, {}, error_body(130, 'Over capacity')
+            return handle(request_endpoint, params, token)
+        self.mock_api.handle = failing_handle
+        return failed_requests
+
+
+class TestCrawlTwitterTimelines(MockTwitterTestCase):
+    def test_all_timeline_tweets_for_id(self):
+        crawler = CrawlTwitterTimelines(self.twython, self.logger)
+        for user_id in [1, 2, 3]:
+            tweets = crawler.get_all_timeline_tweets_for_id(user_id)
+            expected_tweets = self.mock_api.data.timeline(user_id, count=3200)
+            self.assertEqual([t['id'] for t in tweets], [t['id'] for t in expected_tweets])
+
+    def test_every_page_is_fetched_with_full_text(self):
+        crawler = CrawlTwitterTimelines(self.twython, self.logger)
+        for tweets in [crawler.get_all_timeline_tweets_for_id(1),
+                       crawler.get_all_timeline_tweets_for_id_since(1, TIMELINE_ID_BASE),
+                       crawler.get_all_timeline_tweets_for_screen_name('user1')]:
+            self.assertTrue(tweets)
+            self.assertTrue(all('full_text' in tweet and 'text' not in tweet for tweet in tweets))
+
+    def test_missing_and_protected_users(self):
+        crawler = CrawlTwitterTimelines(self.twython, self.logger)
+        self.assertEqual(crawler.get_all_timeline_tweets_for_id(97), [])
+        self.assertEqual(crawler.get_all_timeline_tweets_for_screen_name('user53'), [])
+
+    def test_sink_receives_every_page(self):
+        sink = InMemorySink()
+        crawler = get_timeline_crawler(self.twython, self.logger, sink=sink)
+        tweets = crawler.get_all_timeline_tweets_for_id(1)
+        self.assertEqual(sink.records('statuses/user_timeline'), tweets)
+        self.assertEqual(set(key for endpoint, key, records in sink.pages), set([1]))
+
+
+class TestTimelinePlanner(MockTwitterTestCase):
+    def profiles(self):
+        return [{'id': 1, 'statuses_count': 450, 'protected': False},
+                {'id': 2, 'statuses_count': 50, 'protected': False},
+                {'id': 3, 'statuses_count': 10000, 'protected': False},
+                {'id': 4, 'statuses_count': 900, 'protected': True},
+                {'id': 5, 'statuses_count': 0, 'protected': False},
+                {'id': 6, 'statuses_count': 150, 'protected': False}]
+
+    def test_calls_are_estimated_from_statuses_count(self):
+        planner = TimelinePlanner(self.profiles(), logger=self.logger)
+        self.assertEqual([planner.estimated_calls(user_id) for user_id in [1, 2, 3, 6, 7]], [3, 1, 17, 2, None])
+
+    def test_plans_follow_the_goal(self):
+        planner = TimelinePlanner(self.profiles(), logger=self.logger)
+        self.assertEqual(planner.plan([1, 2, 3, 4, 5, 6, 7]), [2, 6, 1, 3, 7])
+        self.assertEqual(planner.skipped, {4: 'protected', 5: 'empty'})
+        planner = TimelinePlanner(self.profiles(), goal='tweets_per_call', logger=self.logger)
+        self.assertEqual(planner.plan([1, 2, 3, 4, 5, 6, 7]), [3, 1, 6, 2, 7])
+        self.assertRaises(ValueError, TimelinePlanner, goal='most_followers')
+
+    def test_inactive_users_are_skipped(self):
+        profiles = self.profiles()
+        profiles[0]['status'] = {'created_at': format_twitter_time(self.clock.time() - 90 * 86400)}
+        profiles[1]['status'] = {'created_at': format_twitter_time(self.clock.time() - 86400)}
+        planner = TimelinePlanner(profiles, inactive_days=30, logger=self.logger)
+        self.assertEqual(planner.plan([1, 2, 3]), [2, 3])
+        self.assertEqual(planner.skipped, {1: 'inactive'})
+
+    def test_batches_fit_in_a_window(self):
+        planner = TimelinePlanner(self.profiles(), logger=self.logger)
+        self.assertEqual(planner.batches([2, 6, 1, 3], 4), [[2, 6], [1], [3]])
+
+    def test_uncached_profiles_are_looked_up_and_stored(self):
+        self.mock_api.data._deleted_tweet_rate = 0
+        profile_store = ProfileStore(os.path.join(self.directory, 'profiles.json.gz'))
+        planner = TimelinePlanner(user_lookup=UserLookup(self.twython, self.logger), profile_store=profile_store,
+                                  logger=self.logger)
+        user_ids = planner.plan(range(90, 110))
+        # User 97 does not exist, user 106 is protected
+        self.assertEqual(planner.skipped.get(97), 'missing')
+        self.assertEqual(planner.skipped.get(106), 'protected')
+        self.assertEqual(len(profile_store), 19)
+        self.assertEqual(sorted(user['id'] for user in profile_store.users()), [user_id for user_id in range(90, 110)
+                                                                               if user_id != 97])
+        # The estimates hold for the synthetic timelines
+        crawler = CrawlTwitterTimelines(self.twython, self.logger)
+        for user_id in user_ids:
+            crawler.get_all_timeline_tweets_for_id(user_id)
+        self.assertEqual(self.mock_api.endpoint_counts['statuses/user_timeline'],
+                         sum(planner.estimated_calls(user_id) for user_id in user_ids))
+        profile_store.close()
+
+
+class TestRateLimitedTwitterEndpoint(MockTwitterTestCase):
+    def create_mock_api(self):
+        return MockTwitterAPI(SyntheticTwitterData(user_count=1000, clock=self.clock),
+                              error_rate=0.05, empty_response_rate=0.05, clock=self.clock)
+
+    def test_recovers_from_server_errors(self):
+        crawler = CrawlTwitterTimelines(self.twython, self.logger)
+        for user_id in range(1, 50):
+            tweets = crawler.get_most_recent_tweets_by_id(user_id)
+            self.assertEqual(len(tweets), len(self.mock_api.data.timeline(user_id, count=200)))
+        self.assertTrue(self.mock_api.status_counts.get(502, 0) + self.mock_api.status_counts.get(503, 0) +
+                        self.mock_api.status_counts.get(504, 0) > 0)
+        self.assertTrue(self.clock.seconds_slept > 0)
+
+    def test_waits_for_next_window(self):
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'followers/ids', logger=self.logger)
+        start_time = self.clock.time()
+        for i in range(16):
+            endpoint.get_data(user_id=1)
+        self.assertTrue(self.clock.time() - start_time >= 15 * 60)
+
+    def test_sleeps_without_holding_the_window_lock(self):
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'followers/ids', logger=self.logger)
+        locked_during_sleep = []
+        sleep = self.clock.sleep
+        def probing_sleep(seconds):
+            probe = threading.Thread(target=probe_lock)
+            probe.start()
+            probe.join()
+            sleep(seconds)
+        def probe_lock():
+            # Whether another thread can take the lock meanwhile
+            locked_during_sleep.append(endpoint._window.lock.acquire(False))
+            if locked_during_sleep[-1]:
+                endpoint._window.lock.release()
+        self.clock.sleep = probing_sleep
+        for i in range(16):
+            endpoint.get_data(user_id=1)
+        self.assertTrue(locked_during_sleep)
+        self.assertTrue(all(locked_during_sleep))
+
+
+class TestRetryPolicy(MockTwitterTestCase):
+    def test_backoff_is_capped(self):
+        policy = RetryPolicy(initial_backoff=60, max_backoff=900, jitter=False)
+        self.assertEqual([policy.backoff(retry) for retry in range(1, 7)], [60, 120, 240, 480, 900, 900])
+        self.assertEqual(policy.backoff(1000), 900)
+
+    def test_backoff_has_full_jitter(self):
+        policy = RetryPolicy(initial_backoff=60, max_backoff=900, seed=1)
+        backoffs = [policy.backoff(3) for i in range(100)]
+        self.assertTrue(all(0 <= backoff <= 240 for backoff in backoffs))
+        self.assertTrue(min(backoffs) < 60 and max(backoffs) > 180)
+
+    def test_gives_up_after_max_attempts(self):
+        failed_requests = self.fail_requests('followers/ids', 10)
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'followers/ids', logger=self.logger,
+                                              retry_policy=RetryPolicy(max_attempts=3, jitter=False))
+        try:
+            endpoint.get_data(user_id=1)
+            self.fail('No TwythonError raised')
+        except TwythonError as e:
+            self.assertEqual(e.error_code, 503)
+        self.assertEqual(len(failed_requests), 3)
+        # Slept before the second and third attempts only
+        self.assertEqual(self.clock.seconds_slept, 60 + 120)
+
+    def test_rate_limits_are_not_attempts(self):
+        failed_requests = self.fail_requests('followers/ids', 5, status=429)
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'followers/ids', logger=self.logger,
+                                              retry_policy=RetryPolicy(max_attempts=3))
+        start_time = self.clock.time()
+        self.assertEqual(endpoint.get_data(user_id=1)['ids'], self.mock_api.data.follower_ids(1)[:5000])
+        self.assertEqual(len(failed_requests), 5)
+        # Each 429 waited for the rate limit window to reset
+        self.assertTrue(self.clock.time() - start_time >= 5 * 15 * 60)
+
+    def test_deferred_rate_limits_retry_when_the_window_resets(self):
+        self.fail_requests('followers/ids', 1, status=429)
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'followers/ids', logger=self.logger,
+                                              retry_policy=RetryPolicy(defer=True))
+        resets_at = endpoint._window.state()[1]
+        try:
+            endpoint.get_data(user_id=1)
+            self.fail('No RetryLater raised')
+        except RetryLater as e:
+            self.assertEqual((e.reason, e.retry_at), ('rate_limit', resets_at + 15))
+        self.assertEqual(endpoint.calls_remaining(), 0)
+
+    def test_recovers_within_max_attempts(self):
+        self.fail_requests('followers/ids', 2)
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'followers/ids', logger=self.logger,
+                                              retry_policy=RetryPolicy(max_attempts=3))
+        self.assertEqual(endpoint.get_data(user_id=1)['ids'], self.mock_api.data.follower_ids(1)[:5000])
+
+    def test_deferred_retries_raise_retry_later(self):
+        self.fail_requests('followers/ids', 1)
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'followers/ids', logger=self.logger,
+                                              retry_policy=RetryPolicy(jitter=False, defer=True))
+        start_time = self.clock.time()
+        try:
+            endpoint.get_data(user_id=1)
+            self.fail('No RetryLater raised')
+        except RetryLater as e:
+            self.assertEqual(e.retry_at, start_time + 60)
+            self.assertEqual(e.cause.error_code, 503)
+        self.assertEqual(self.clock.seconds_slept, 0)
+        self.assertTrue(endpoint.get_data(user_id=1)['ids'])
+
+
+class TestCircuitBreaker(MockTwitterTestCase):
+    def test_opens_after_failures_in_a_row(self):
+        failed_requests = self.fail_requests('followers/ids', 4)
+        circuit_breaker = CircuitBreaker(failure_threshold=3, reset_seconds=300)
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'followers/ids', logger=self.logger,
+                                              retry_policy=RetryPolicy(jitter=False, defer=True),
+                                              circuit_breaker=circuit_breaker)
+        for i in range(3):
+            self.assertRaises(RetryLater, endpoint.get_data, user_id=1)
+        self.assertEqual(len(failed_requests), 3)
+        self.assertTrue(circuit_breaker.is_open())
+
+        # Requests fail fast while the breaker is open
+        self.assertRaises(CircuitOpenError, endpoint.get_data, user_id=1)
+        self.assertEqual(len(failed_requests), 3)
+
+        # After reset_seconds one request is let through, and a failure
+        # opens the breaker again at once
+        self.clock.sleep(300)
+        self.assertRaises(RetryLater, endpoint.get_data, user_id=1)
+        self.assertEqual(len(failed_requests), 4)
+        self.assertRaises(CircuitOpenError, endpoint.get_data, user_id=1)
+
+        # A success closes it
+        self.clock.sleep(300)
+        self.assertEqual(endpoint.get_data(user_id=1)['ids'], self.mock_api.data.follower_ids(1)[:5000])
+        self.assertFalse(circuit_breaker.is_open())
+
+    def test_blocking_requests_wait_for_the_breaker(self):
+        failed_requests = self.fail_requests('followers/ids', 3)
+        circuit_breaker = CircuitBreaker(failure_threshold=3, reset_seconds=300)
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'followers/ids', logger=self.logger,
+                                              retry_policy=RetryPolicy(jitter=False, initial_backoff=10),
+                                              circuit_breaker=circuit_breaker)
+        start_time = self.clock.time()
+        self.assertEqual(endpoint.get_data(user_id=1)['ids'], self.mock_api.data.follower_ids(1)[:5000])
+        self.assertEqual(len(failed_requests), 3)
+        # Opened by the third failure, after 10 + 20 seconds of backoff
+        self.assertTrue(self.clock.time() - start_time >= 30 + 300)
+        self.assertFalse(circuit_breaker.is_open())
+
+    def test_shared_by_every_token(self):
+        registry = EndpointRegistry()
+        first_endpoint = registry.get_endpoint(self.twython, 'followers/ids', self.logger)
+        second_endpoint = registry.get_endpoint(MockTwython(self.mock_api, 'other'), 'followers/ids', self.logger)
+        self.assertTrue(first_endpoint._circuit_breaker is second_endpoint._circuit_breaker)
+
+
+class CountingTwython(Twython):
+    """
+    Twython that hands out a made-up bearer token instead of asking
+    Twitter for one
+    """
+    tokens_obtained = 0
+
+    def obtain_access_token(self):
+        CountingTwython.tokens_obtained += 1
+        return 'token-%s-%d' % (self.app_key, CountingTwython.tokens_obtained)
+
+
+class TestConnectionManager(MockTwitterTestCase):
+    def setUp(self):
+        MockTwitterTestCase.setUp(self)
+        CountingTwython.tokens_obtained = 0
+
+    def connection_manager(self, **kwargs):
+        return ConnectionManager(os.path.join(self.directory, 'tokens'), twython_class=CountingTwython, **kwargs)
+
+    def test_tokens_are_cached_per_consumer_key(self):
+        connection_manager = self.connection_manager()
+        first = connection_manager.get_connection('key1', 'secret1')
+        second = connection_manager.get_connection('key1', 'secret1')
+        other = connection_manager.get_connection('key2', 'secret2')
+        self.assertEqual(CountingTwython.tokens_obtained, 2)
+        self.assertEqual(first.access_token, second.access_token)
+        self.assertNotEqual(first.access_token, other.access_token)
+
+    def test_tokens_are_cached_on_disk(self):
+        token = self.connection_manager().access_token('key1', 'secret1')
+        # As if in a later process
+        self.assertEqual(self.connection_manager().access_token('key1', 'secret1'), token)
+        self.assertEqual(CountingTwython.tokens_obtained, 1)
+        token_filenames = os.listdir(os.path.join(self.directory, 'tokens'))
+        self.assertEqual(len(token_filenames), 1)
+        self.assertEqual(os.stat(os.path.join(self.directory, 'tokens', token_filenames[0])).st_mode & 0777, 0600)
+
+    def test_invalidated_tokens_are_obtained_again(self):
+        connection_manager = self.connection_manager()
+        token = connection_manager.access_token('key1', 'secret1')
+        connection_manager.invalidate('key1')
+        self.assertNotEqual(self.connection_manager().access_token('key1', 'secret1'), token)
+        self.assertEqual(CountingTwython.tokens_obtained, 2)
+
+    def test_rejected_tokens_are_obtained_again(self):
+        connection_manager = self.connection_manager()
+        token = connection_manager.get_connection('key1', 'secret1').access_token
+        # The mock API accepts any token, so stand a MockTwython in for
+        # the connection the manager handed out
+        self.twython.app_key = 'key1'
+        self.twython.connection_manager = connection_manager
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'statuses/user_timeline', self.logger)
+        self.fail_requests('statuses/user_timeline', 1, status=401)
+        with self.assertRaises(TwythonError) as raised:
+            endpoint.get_data(user_id=1)
+        self.assertTrue(is_invalid_token_error(raised.exception))
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'tokens')), [])
+        # As if in a later process, too
+        for manager in [connection_manager, self.connection_manager()]:
+            self.assertNotEqual(manager.get_connection('key1', 'secret1').access_token, token)
+        self.assertEqual(CountingTwython.tokens_obtained, 2)
+
+    def test_protected_timelines_keep_the_token(self):
+        connection_manager = self.connection_manager()
+        connection_manager.get_connection('key1', 'secret1')
+        self.twython.app_key = 'key1'
+        self.twython.connection_manager = connection_manager
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'statuses/user_timeline', self.logger)
+        with self.assertRaises(TwythonError) as raised:
+            endpoint.get_data(user_id=53)
+        self.assertEqual(raised.exception.error_code, 401)
+        connection_manager.get_connection('key1', 'secret1')
+        self.assertEqual(CountingTwython.tokens_obtained, 1)
+
+    def test_connections_share_one_pool(self):
+        connection_manager = self.connection_manager(pool_size=25)
+        first = connection_manager.get_connection('key1', 'secret1')
+        other = connection_manager.get_connection('key2', 'secret2')
+        adapter = first.client.get_adapter('https://api.twitter.com/1.1/followers/ids.json')
+        self.assertTrue(other.client.get_adapter('https://api.twitter.com/1.1/followers/ids.json') is adapter)
+        self.assertEqual(adapter.poolmanager.connection_pool_kw['maxsize'], 25)
+        connection_manager.resize(50)
+        self.assertEqual(adapter.poolmanager.connection_pool_kw['maxsize'], 50)
+
+
+class TestFindFollowers(MockTwitterTestCase):
+    def test_follower_ids_follow_cursors(self):
+        self.mock_api.data.follower_ids = lambda user_id: range(1, 12001)
+        crawler = FindFollowers(self.twython, self.logger)
+        self.assertEqual(crawler.get_follower_ids_for_id(1, count=20000), range(1, 12001))
+        self.assertEqual(len(crawler.get_follower_ids_for_id(1)), 5000)
+
+    def test_follower_ids_for_screen_name_follow_cursors(self):
+        self.mock_api.data.follower_ids = lambda user_id: range(1, 7001)
+        crawler = FindFollowers(self.twython, self.logger)
+        self.assertEqual(crawler.get_follower_ids_for_screen_name('user1', count=20000), range(1, 7001))
+
+
+class TestFindFollowees(MockTwitterTestCase):
+    def test_followee_ids_follow_cursors(self):
+        self.mock_api.data.friend_ids = lambda user_id: range(1, 7001)
+        crawler = FindFollowees(self.twython, self.logger)
+        self.assertEqual(crawler.get_followee_ids_for_id(1, count=20000), range(1, 7001))
+        self.assertEqual(crawler.get_followee_ids_for_screen_name('user1', count=20000), range(1, 7001))
+
+
+class TestTweetLookup(MockTwitterTestCase):
+    def tweet_ids(self):
+        """
+        Returns the IDs of some Tweets that exist, and of some that are
+        missing: from a user that does not exist, from a protected user,
+        and one that was never a Tweet
+        """
+        found_ids = [tweet['id'] for user_id in range(1, 6) for tweet in self.mock_api.data.timeline(user_id, count=60)]
+        return found_ids, [TIMELINE_ID_BASE + 97, TIMELINE_ID_BASE + 53, 12345]
+
+    def test_lookups_pack_100_ids_per_call(self):
+        found_ids, missing_ids = self.tweet_ids()
+        requests = self.record_requests('statuses/lookup')
+        tweets = TweetLookup(self.twython, self.logger).lookup_tweets(found_ids + missing_ids)
+        self.assertEqual(sorted(tweet['id'] for tweet in tweets), sorted(found_ids))
+        self.assertTrue(all('full_text' in tweet for tweet in tweets))
+        self.assertEqual([len(request['id'].split(',')) for request in requests],
+                         [100] * (len(requests) - 1) + [(len(found_ids) + 3) % 100])
+
+    def test_hydrated_tweets_are_written_as_they_arrive(self):
+        found_ids, missing_ids = self.tweet_ids()
+        scheduler = CrawlScheduler(self.twython, self.logger, workers_per_token=4)
+        writer = RotatingJSONWriter(os.path.join(self.directory, 'hydrated'), gzip_out=False)
+        missing = CompactIDSet()
+        tweet_count = hydrate_tweets(scheduler, iter(missing_ids + found_ids), writer, missing, max_pending=2)
+        writer.close()
+        scheduler.close()
+        lines = open(os.path.join(self.directory, 'hydrated.00000.json')).read().splitlines()
+        self.assertEqual(tweet_count, len(found_ids))
+        self.assertEqual(sorted(json.loads(line)['id'] for line in lines), sorted(found_ids))
+        self.assertEqual(list(missing), sorted(missing_ids))
+
+
+class TestCompactIDSet(MockTwitterTestCase):
+    def test_ids_are_kept_sorted_and_unique(self):
+        ids = CompactIDSet([TIMELINE_ID_BASE + 3, 7, TIMELINE_ID_BASE + 3])
+        ids.add(5)
+        self.assertEqual(list(ids), [5, 7, TIMELINE_ID_BASE + 3])
+        self.assertEqual(len(ids), 3)
+        self.assertTrue(TIMELINE_ID_BASE + 3 in ids)
+        self.assertFalse(6 in ids)
+        ids.add(6)
+        self.assertTrue(6 in ids)
+
+    def test_saved_ids_can_be_read_back(self):
+        filename = os.path.join(self.directory, 'missing.txt')
+        CompactIDSet([TIMELINE_ID_BASE + 3, 7]).save(filename)
+        self.assertEqual(get_ids_from_file(filename), [7, TIMELINE_ID_BASE + 3])
+
+
+class TestSaveTweetsToJSONFile(MockTwitterTestCase):
+    def test_gzip_file_is_complete(self):
+        tweets = self.mock_api.data.timeline(1, count=200)
+        json_filename = os.path.join(self.directory, 'tweets.json.gz')
+        save_tweets_to_json_file(tweets, json_filename)
+        lines = gzip.open(json_filename).read().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [tweet['id'] for tweet in tweets])
+
+
+class TestMergeTweetFiles(MockTwitterTestCase):
+    def save_snapshots(self, user_id, snapshots):
+        """
+        Saves slices (first, last) of `user_id`'s timeline, newest first,
+        to a directory per snapshot, and returns the directories
+        """
+        tweets = self.mock_api.data.timeline(user_id, count=200)
+        directories = []
+        for snapshot_number, (first, last) in enumerate(snapshots):
+            directory = os.path.join(self.directory, 'snapshot%d' % snapshot_number)
+            if not os.path.exists(directory):
+                os.mkdir(directory)
+            save_tweets_to_json_file(tweets[first:last], os.path.join(directory, 'user%d.tweets' % user_id),
+                                     gzip_out=snapshot_number % 2 == 0)
+            directories.append(directory)
+        return tweets, directories
+
+    def read_tweet_ids(self, json_filename):
+        return [json.loads(line)['id'] for line in open_json_file(json_filename)]
+
+    def test_overlapping_snapshots_are_merged_once(self):
+        tweets, directories = self.save_snapshots(1, [(100, 200), (50, 120), (0, 60)])
+        output_filename = os.path.join(self.directory, 'user1.tweets')
+        filenames = [os.path.join(directory, 'user1.tweets') for directory in directories]
+        self.assertEqual(merge_tweet_files(filenames, output_filename), len(tweets))
+        self.assertEqual(self.read_tweet_ids(output_filename), [tweet['id'] for tweet in tweets])
+        self.assertEqual(open(output_filename, 'rb').read(2), '\x1f\x8b')
+
+    def test_unsorted_files_are_rejected(self):
+        tweets = self.mock_api.data.timeline(1, count=20)
+        json_filename = os.path.join(self.directory, 'user1.tweets')
+        save_tweets_to_json_file(list(reversed(tweets)), json_filename)
+        output_filename = os.path.join(self.directory, 'merged.tweets')
+        self.assertRaises(ValueError, merge_tweet_files, [json_filename], output_filename)
+        self.assertEqual(os.listdir(self.directory), ['user1.tweets'])
+
+    def test_archives_are_compacted_in_parallel(self):
+        first_tweets, directories = self.save_snapshots(1, [(100, 200), (0, 120)])
+        second_tweets, second_directories = self.save_snapshots(2, [(0, 200)])
+        output_directory = os.path.join(self.directory, 'compacted')
+        tweet_counts = compact_tweet_snapshots(directories, output_directory, processes=2)
+        self.assertEqual(tweet_counts, {'user1.tweets': len(first_tweets), 'user2.tweets': len(second_tweets)})
+        self.assertEqual(self.read_tweet_ids(os.path.join(output_directory, 'user2.tweets')),
+                         [tweet['id'] for tweet in second_tweets])
+
+
+class TestEndpointRegistry(MockTwitterTestCase):
+    def test_crawlers_share_rate_limit_windows(self):
+        registry = EndpointRegistry()
+        follower_metrics = trawler_metrics.MetricsRegistry()
+        lookup_metrics = trawler_metrics.MetricsRegistry()
+        follower_crawler = FindFollowers(self.twython, self.logger, metrics=trawler_metrics.Metrics([follower_metrics]),
+                                         registry=registry)
+        lookup_crawler = UserLookup(self.twython, self.logger, metrics=trawler_metrics.Metrics([lookup_metrics]),
+                                    registry=registry)
+        other_token_crawler = UserLookup(MockTwython(self.mock_api, token='other'), self.logger, registry=registry)
+        self.assertEqual(self.mock_api.endpoint_counts['application/rate_limit_status'], 3)
+
+        lookup_crawler.lookup_users(range(1, 201))
+        follower_crawler._user_lookup_endpoint.get_data(user_id='1,2,3')
+        self.assertEqual(follower_crawler._user_lookup_endpoint.calls_remaining(), 300 - 3)
+        self.assertEqual(lookup_crawler._user_lookup_endpoint.calls_remaining(), 300 - 3)
+        self.assertEqual(other_token_crawler._user_lookup_endpoint.calls_remaining(), 300)
+        # Each crawler still records its own requests
+        self.assertEqual(lookup_metrics.total(trawler_metrics.REQUESTS, endpoint='users/lookup'), 2)
+        self.assertEqual(follower_metrics.total(trawler_metrics.REQUESTS, endpoint='users/lookup'), 1)
+
+    def test_crawlers_without_a_registry_have_their_own_windows(self):
+        follower_crawler = FindFollowers(self.twython, self.logger)
+        lookup_crawler = UserLookup(self.twython, self.logger)
+        lookup_crawler.lookup_users(range(1, 101))
+        self.assertEqual(follower_crawler._user_lookup_endpoint.calls_remaining(), 300)
+
+
+class TestCrawlScheduler(MockTwitterTestCase):
+    """
+    Runs on a ScaledClock, so that workers waiting on different rate
+    limits really do wait at the same time, and with small rate limits
+    so that every endpoint needs two windows.
+    """
+    RATE_LIMITS = {'followers/ids': 4, 'statuses/user_timeline': 9, 'users/lookup': 2}
+
+    def create_clock(self):
+        return ScaledClock(speedup=1000)
+
+    def create_mock_api(self):
+        data = SyntheticTwitterData(user_count=1000, clock=self.clock)
+        data.follower_ids = lambda user_id: range(1, 101)
+        # Two timeline pages per user
+        data.statuses_count = lambda user_id: 300
+        return MockTwitterAPI(data, rate_limits=self.RATE_LIMITS, clock=self.clock)
+
+    def crawl_sequentially(self, follower_user_ids, timeline_user_ids, lookup_user_ids):
+        follower_crawler = FindFollowers(self.twython, self.logger)
+        timeline_crawler = CrawlTwitterTimelines(self.twython, self.logger)
+        lookup_crawler = UserLookup(self.twython, self.logger)
+        return ([follower_crawler.get_follower_ids_for_id(user_id) for user_id in follower_user_ids],
+                [timeline_crawler.get_all_timeline_tweets_for_id(user_id) for user_id in timeline_user_ids],
+                lookup_crawler.lookup_users(lookup_user_ids))
+
+    def crawl_with_scheduler(self, follower_user_ids, timeline_user_ids, lookup_user_ids):
+        scheduler = CrawlScheduler(self.twython, self.logger)
+        follower_tasks = [scheduler.get_follower_ids_for_id(user_id) for user_id in follower_user_ids]
+        timeline_tasks = [scheduler.get_all_timeline_tweets_for_id(user_id) for user_id in timeline_user_ids]
+        lookup_tasks = scheduler.lookup_users(lookup_user_ids)
+        results = ([task.result() for task in follower_tasks],
+                   [task.result() for task in timeline_tasks],
+                   sum([task.result() for task in lookup_tasks], []))
+        scheduler.close()
+        return results
+
+    def time_mixed_job(self, crawl):
+        """
+        Returns the IDs crawled by `crawl` and the (scaled) seconds it took
+        """
+        start_time = self.clock.time()
+        followers, timelines, users = crawl([1, 2, 3, 4, 5, 6, 7, 8], [1, 2, 3, 4, 5, 6], range(1, 401))
+        seconds = self.clock.time() - start_time
+        return (followers, [[tweet['id'] for tweet in tweets] for tweets in timelines],
+                [user['id'] for user in users]), seconds
+
+    def test_endpoints_wait_for_their_windows_at_the_same_time(self):
+        sequential_results, sequential_seconds = self.time_mixed_job(self.crawl_sequentially)
+        self.mock_api = self.create_mock_api()
+        self.twython = MockTwython(self.mock_api)
+        scheduled_results, scheduled_seconds = self.time_mixed_job(self.crawl_with_scheduler)
+
+        self.assertEqual(scheduled_results, sequential_results)
+        for endpoint, rate_limit in self.RATE_LIMITS.items():
+            # Every endpoint needed a second window
+            self.assertTrue(rate_limit < self.mock_api.endpoint_counts[endpoint] <= 2 * rate_limit, endpoint)
+        # Run one after another, the three endpoints each wait out a
+        # window; scheduled, they wait for theirs together
+        self.assertTrue(sequential_seconds > 3 * 15 * 60, sequential_seconds)
+        self.assertTrue(scheduled_seconds < 2 * 15 * 60, scheduled_seconds)
+
+    def test_tasks_spread_across_tokens(self):
+        twythons = [MockTwython(self.mock_api, token) for token in ['a', 'b', 'c']]
+        start_time = self.clock.time()
+        scheduler = CrawlScheduler(twythons, self.logger)
+        tasks = [scheduler.get_follower_ids_for_id(user_id) for user_id in range(1, 13)]
+        for task in tasks:
+            self.assertEqual(task.result(), range(1, 101))
+        scheduler.close()
+        # 12 calls need three windows on one token, but fit in a single
+        # window across three
+        self.assertTrue(self.clock.time() - start_time < 15 * 60)
+
+    def test_deferred_tasks_do_not_hold_workers(self):
+        self.fail_requests('users/lookup', 1)
+        registry = EndpointRegistry(retry_policy=RetryPolicy(jitter=False, defer=True))
+        scheduler = CrawlScheduler(self.twython, self.logger, registry=registry)
+        finished = []
+        def lookup(twython, user_ids):
+            users = UserLookup(twython, self.logger, registry=registry).lookup_users(user_ids)
+            finished.append(user_ids[0])
+            return users
+        tasks = [scheduler.submit('users/lookup', lookup, range(first_id, first_id + 100))
+                 for first_id in (1, 101, 201)]
+        scheduler.join()
+        expected_users = UserLookup(self.twython, self.logger).lookup_users(range(1, 301))
+        self.assertEqual([user['id'] for task in tasks for user in task.result()],
+                         [user['id'] for user in expected_users])
+        # The first task was put back while the others ran
+        self.assertEqual(finished, [101, 201, 1])
+        self.assertEqual(tasks[0].deferrals, 1)
+        scheduler.close()
+
+    def test_deferred_tasks_fail_after_max_attempts(self):
+        self.fail_requests('users/lookup', 100)
+        registry = EndpointRegistry(retry_policy=RetryPolicy(initial_backoff=1, max_attempts=3, defer=True))
+        scheduler = CrawlScheduler(self.twython, self.logger, registry=registry)
+        task = scheduler.lookup_users(range(1, 101))[0]
+        try:
+            task.result()
+            self.fail('No TwythonError raised')
+        except TwythonError as e:
+            self.assertEqual(e.error_code, 503)
+        self.assertEqual(task.deferrals, 3)
+        scheduler.close()
+
+    def test_deferred_rate_limits_are_not_attempts(self):
+        self.fail_requests('users/lookup', 4, status=429)
+        registry = EndpointRegistry(retry_policy=RetryPolicy(max_attempts=3, defer=True))
+        scheduler = CrawlScheduler(self.twython, self.logger, registry=registry)
+        task = scheduler.lookup_users(range(1, 101))[0]
+        self.assertEqual([user['id'] for user in task.result()],
+                         [user['id'] for user in UserLookup(self.twython, self.logger).lookup_users(range(1, 101))])
+        self.assertEqual((task.deferrals, task.attempts), (4, 0))
+        scheduler.close()
+
+    def test_task_exceptions_are_raised_by_result(self):
+        scheduler = CrawlScheduler(self.twython, self.logger)
+        def fail(twython):
+            raise ValueError('failed')
+        task = scheduler.submit('users/lookup', fail)
+        self.assertRaises(ValueError, task.result)
+        scheduler.close()
+
+
+class TestPriorityClasses(MockTwitterTestCase):
+    """
+    Runs on a ScaledClock, with a single worker per endpoint, which
+    tests hold with a blocking task while they queue others
+    """
+    def create_clock(self):
+        return ScaledClock(speedup=1000)
+
+    def create_mock_api(self):
+        data = SyntheticTwitterData(user_count=2000, clock=self.clock)
+        return MockTwitterAPI(data, rate_limits={'users/lookup': 10}, clock=self.clock)
+
+    def hold_worker(self, scheduler):
+        """
+        Returns an Event that releases a task holding the users/lookup
+        worker, once the worker has started it
+        """
+        started = threading.Event()
+        release = threading.Event()
+        def block(twython):
+            started.set()
+            release.wait()
+        scheduler.submit('users/lookup', block)
+        started.wait()
+        return release
+
+    def test_tasks_run_by_priority_then_deadline(self):
+        scheduler = CrawlScheduler(self.twython, self.logger)
+        release = self.hold_worker(scheduler)
+        started = []
+        def record(twython, name):
+            started.append(name)
+        now = self.clock.time()
+        scheduler.submit('users/lookup', record, 'batch')
+        scheduler.submit('users/lookup', record, 'batch due later', deadline=now + 300)
+        scheduler.submit('users/lookup', record, 'batch due sooner', deadline=now + 100)
+        scheduler.submit('users/lookup', record, 'interactive', priority='interactive')
+        release.set()
+        scheduler.join()
+        scheduler.close()
+        self.assertEqual(started, ['interactive', 'batch due sooner', 'batch due later', 'batch'])
+
+    def test_unknown_priority_classes_are_rejected(self):
+        scheduler = CrawlScheduler(self.twython, self.logger)
+        self.assertRaises(ValueError, scheduler.lookup_users, range(1, 101), priority='urgent')
+        scheduler.close()
+        self.assertRaises(ValueError, CrawlScheduler, self.twython, self.logger, default_priority='urgent')
+
+    def test_reserved_shares_are_left_for_their_class(self):
+        priority_classes = [PriorityClass('interactive', 0, {'users/lookup': 0.2}), PriorityClass('batch', 1)]
+        registry = EndpointRegistry()
+        scheduler = CrawlScheduler(self.twython, self.logger, registry=registry, priority_classes=priority_classes)
+        start_time = self.clock.time()
+        finished = []
+        def lookup(twython, name, user_ids):
+            UserLookup(twython, self.logger, registry=registry).lookup_users(user_ids)
+            finished.append((name, self.clock.time() - start_time))
+        batch_tasks = [scheduler.submit('users/lookup', lookup, 'batch', range(first_id, first_id + 100))
+                       for first_id in range(1, 1001, 100)]
+        batch_tasks[7].result()
+        for first_id in (1001, 1101):
+            scheduler.submit('users/lookup', lookup, 'interactive', range(first_id, first_id + 100),
+                             priority='interactive')
+        scheduler.join()
+        scheduler.close()
+        # Batch tasks used 8 of the 10 calls in the first window, leaving
+        # the last 2 for interactive tasks queued after them
+        self.assertEqual([name for name, seconds in finished], ['batch'] * 8 + ['interactive'] * 2 + ['batch'] * 2)
+        self.assertTrue(all(seconds < 15 * 60 for name, seconds in finished[:10]), finished)
+        self.assertTrue(all(seconds >= 15 * 60 for name, seconds in finished[10:]), finished)
+
+    def test_workers_wait_for_the_window_after_the_unreserved_share(self):
+        priority_classes = [PriorityClass('interactive', 0, {'users/lookup': 0.2}), PriorityClass('batch', 1)]
+        registry = EndpointRegistry()
+        scheduler = CrawlScheduler(self.twython, self.logger, registry=registry, priority_classes=priority_classes)
+        handed_back = []
+        put = scheduler._put
+        def recording_put(queue, task, wake_workers=True):
+            if not wake_workers:
+                handed_back.append(task)
+            put(queue, task, wake_workers)
+        scheduler._put = recording_put
+        def lookup(twython, user_ids):
+            return UserLookup(twython, self.logger, registry=registry).lookup_users(user_ids)
+        tasks = [scheduler.submit('users/lookup', lookup, range(first_id, first_id + 100))
+                 for first_id in range(1, 1001, 100)]
+        self.assertTrue(all(task.result() for task in tasks))
+        scheduler.close()
+        # Once the 8 unreserved calls are used, the 9th task is handed
+        # back once, rather than every second until the window resets
+        self.assertEqual(handed_back, [tasks[8]])
+
+    def test_queueing_delay_is_recorded_per_class(self):
+        registry = trawler_metrics.MetricsRegistry()
+        scheduler = CrawlScheduler(self.twython, self.logger, metrics=trawler_metrics.Metrics([registry]))
+        release = self.hold_worker(scheduler)
+        def wait(twython):
+            pass
+        scheduler.submit('users/lookup', wait, priority='interactive')
+        scheduler.submit('users/lookup', wait, deadline=self.clock.time() - 1)
+        self.clock.sleep(60)
+        release.set()
+        scheduler.join()
+        scheduler.close()
+        histograms = dict((dict(labels)['priority'], histogram)
+                          for (name, labels), histogram in registry.histograms.items()
+                          if name == trawler_metrics.QUEUE_SECONDS)
+        self.assertEqual(histograms['interactive'].count, 1)
+        self.assertTrue(histograms['interactive'].sum >= 60)
+        # The holding task, and the one that waited behind it
+        self.assertEqual(histograms['batch'].count, 2)
+        self.assertEqual(registry.total(trawler_metrics.DEADLINES_MISSED, priority='batch'), 1)
+        self.assertEqual(registry.total(trawler_metrics.DEADLINES_MISSED, priority='interactive'), 0)
+
+
+class TestAsyncCrawls(MockTwitterTestCase):
+    """
+    Runs on a ScaledClock, with every request taking 5 seconds
+    """
+    def create_clock(self):
+        return ScaledClock(speedup=1000)
+
+    def create_mock_api(self):
+        data = SyntheticTwitterData(user_count=1000, clock=self.clock)
+        data.follower_ids = lambda user_id: range(user_id, user_id + 100)
+        return MockTwitterAPI(data, latency=5, clock=self.clock)
+
+    def test_workers_keep_requests_in_flight(self):
+        scheduler = CrawlScheduler(self.twython, self.logger, workers_per_token=10)
+        start_time = self.clock.time()
+        tasks = [scheduler.get_follower_ids_for_id(user_id) for user_id in range(1, 15)]
+        follower_ids = [task.result() for task in tasks]
+        seconds = self.clock.time() - start_time
+        scheduler.close()
+        self.assertEqual(follower_ids, [range(user_id, user_id + 100) for user_id in range(1, 15)])
+        # 14 requests of 5 seconds each, ten at a time, rather than 70
+        # seconds one after another
+        self.assertTrue(seconds < 40, seconds)
+
+    def test_as_completed_yields_tasks_as_they_finish(self):
+        scheduler = CrawlScheduler(self.twython, self.logger, workers_per_token=3)
+        def crawl(twython, seconds):
+            self.clock.sleep(seconds)
+            return seconds
+        tasks = [scheduler.submit('users/lookup', crawl, seconds) for seconds in (300, 100, 200)]
+        self.assertEqual([task.result() for task in as_completed(tasks)], [100, 200, 300])
+        scheduler.close()
+
+    def test_done_callbacks(self):
+        scheduler = CrawlScheduler(self.twython, self.logger)
+        finished = []
+        task = scheduler.get_follower_ids_for_screen_name('user1')
+        task.add_done_callback(finished.append)
+        scheduler.join()
+        task.add_done_callback(finished.append)
+        self.assertEqual(finished, [task, task])
+        self.assertEqual(task.result(), range(1, 101))
+        scheduler.close()
+
+
+class TestListMembership(MockTwitterTestCase):
+    def test_memberships_follow_cursors(self):
+        self.mock_api.data.list_membership_ids = lambda user_id: range(1, 2501)
+        crawler = ListMembership(self.twython, self.logger)
+        lists = crawler.get_list_memberships_for_screen_name('user1', count=5000)
+        self.assertEqual([l['id'] for l in lists], range(1, 2501))
+
+    def test_crawl_list_members_writes_each_user_once(self):
+        crawler = ListMembership(self.twython, self.logger)
+        profile_store = ProfileStore(os.path.join(self.directory, 'users.json.gz'))
+        member_ids = set()
+        for list_id, page_member_ids in crawler.crawl_list_members([1, 2, 3, 1], profile_store):
+            member_ids.update(page_member_ids)
+        profile_store.close()
+        self.assertEqual(len(ProfileStore(os.path.join(self.directory, 'users.json.gz'))), len(member_ids))
+
+    def test_crawl_list_members_resumes_from_checkpoint(self):
+        crawler = ListMembership(self.twython, self.logger)
+        checkpoint_filename = os.path.join(self.directory, 'checkpoint')
+        profile_store = ProfileStore(os.path.join(self.directory, 'users.json.gz'))
+        checkpoint = CursorCheckpoint(checkpoint_filename)
+        first_run = [list_id for list_id, member_ids in crawler.crawl_list_members([1, 2, 3], profile_store, checkpoint)]
+        checkpoint.close()
+        checkpoint = CursorCheckpoint(checkpoint_filename)
+        second_run = [list_id for list_id, member_ids in crawler.crawl_list_members([1, 2, 3], profile_store, checkpoint)]
+        self.assertTrue(first_run)
+        self.assertEqual(second_run, [])
+
+    def test_interrupted_crawl_list_memberships_resumes_at_next_page(self):
+        self.mock_api.data.list_membership_ids = lambda user_id: range(1, 2501)
+        crawler = ListMembership(self.twython, self.logger)
+        checkpoint_filename = os.path.join(self.directory, 'checkpoint')
+        checkpoint = CursorCheckpoint(checkpoint_filename)
+        list_ids = []
+        try:
+            for screen_name, lists in crawler.crawl_list_memberships(['user1'], checkpoint):
+                if list_ids:
+                    # Interrupted while handling the second page
+                    raise KeyboardInterrupt()
+                list_ids += [l['id'] for l in lists]
+        except KeyboardInterrupt:
+            pass
+        checkpoint.close()
+
+        requests = self.record_requests('lists/memberships')
+        checkpoint = CursorCheckpoint(checkpoint_filename)
+        for screen_name, lists in crawler.crawl_list_memberships(['user1'], checkpoint):
+            list_ids += [l['id'] for l in lists]
+        self.assertEqual([int(params['cursor']) for params in requests], [1000, 2000])
+        self.assertEqual(list_ids, range(1, 2501))
+
+    def test_interrupted_crawl_list_members_resumes_at_next_page(self):
+        self.mock_api.data.list_member_ids = lambda list_id: [i % 1000 + 1 for i in range(12000)]
+        crawler = ListMembership(self.twython, self.logger)
+        checkpoint_filename = os.path.join(self.directory, 'checkpoint')
+        profile_store = ProfileStore(os.path.join(self.directory, 'users.json.gz'))
+        checkpoint = CursorCheckpoint(checkpoint_filename)
+        pages = 0
+        try:
+            for list_id, member_ids in crawler.crawl_list_members([1, 2], profile_store, checkpoint):
+                if pages == 1:
+                    raise KeyboardInterrupt()
+                pages += 1
+        except KeyboardInterrupt:
+            pass
+        checkpoint.close()
+
+        requests = self.record_requests('lists/members')
+        checkpoint = CursorCheckpoint(checkpoint_filename)
+        for list_id, member_ids in crawler.crawl_list_members([1, 2], profile_store, checkpoint):
+            pass
+        self.assertEqual([(int(params['list_id']), int(params['cursor'])) for params in requests],
+                         [(1, 5000), (1, 10000), (2, -1), (2, 5000), (2, 10000)])
+
+
+class TestCursorCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_repeated_updates_are_compacted(self):
+        checkpoint_filename = os.path.join(self.directory, 'checkpoint')
+        checkpoint = CursorCheckpoint(checkpoint_filename, compact_lines=10)
+        for i in range(100):
+            checkpoint.set('since:%d' % (i % 3), i)
+        self.assertTrue(len(open(checkpoint_filename).readlines()) <= 10)
+        checkpoint.close()
+        checkpoint = CursorCheckpoint(checkpoint_filename)
+        self.assertEqual([checkpoint.get('since:%d' % key) for key in range(3)], [99, 97, 98])
+
+
+class TestSearchHarvester(MockTwitterTestCase):
+    def test_harvest_interleaves_terms_and_resumes(self):
+        search_crawler = SearchTwitterTimelines(self.twython, self.logger)
+        checkpoint = CursorCheckpoint(os.path.join(self.directory, 'checkpoint'))
+        harvester = SearchHarvester(search_crawler, self.directory, checkpoint,
+                                    max_tweets_per_file=300, logger=self.logger)
+        tweet_counts = harvester.harvest(['foo', 'bar baz'])
+        self.assertEqual(tweet_counts['foo'], 1000)
+        self.assertEqual(tweet_counts['bar baz'], 1000)
+        self.assertTrue(os.path.exists(os.path.join(self.directory,
+                                                    search_term_filename('bar baz') + '.00003.json.gz')))
+        self.assertEqual(harvester.harvest(['foo', 'bar baz']), {'foo': 0, 'bar baz': 0})
+
+    def test_finished_harvest_fetches_newer_tweets(self):
+        search_crawler = SearchTwitterTimelines(self.twython, self.logger)
+        checkpoint_filename = os.path.join(self.directory, 'checkpoint')
+        harvester = SearchHarvester(search_crawler, self.directory, CursorCheckpoint(checkpoint_filename),
+                                    logger=self.logger)
+        self.assertEqual(harvester.harvest(['foo']), {'foo': 1000})
+        newest_id = max(json.loads(line)['id'] for line in
+                        gzip.open(os.path.join(self.directory, search_term_filename('foo') + '.00000.json.gz')))
+
+        self.clock.sleep(3600)
+        requests = self.record_requests('search/tweets')
+        harvester = SearchHarvester(search_crawler, self.directory, CursorCheckpoint(checkpoint_filename),
+                                    logger=self.logger)
+        new_tweet_count = harvester.harvest(['foo'])['foo']
+        self.assertTrue(new_tweet_count > 0)
+        self.assertEqual(int(requests[0]['since_id']), newest_id)
+        new_ids = [json.loads(line)['id'] for line in
+                   gzip.open(os.path.join(self.directory, search_term_filename('foo') + '.00001.json.gz'))]
+        self.assertEqual(len(new_ids), new_tweet_count)
+        self.assertTrue(min(new_ids) > newest_id)
+
+    def test_terms_differing_in_punctuation_get_separate_files(self):
+        search_crawler = SearchTwitterTimelines(self.twython, self.logger)
+        harvester = SearchHarvester(search_crawler, self.directory, logger=self.logger)
+        tweet_counts = harvester.harvest(['#python', 'python', '@python', 'python'])
+        self.assertEqual(len(set(search_term_filename(term) for term in tweet_counts)), 3)
+        for term, tweet_count in tweet_counts.items():
+            self.assertEqual(tweet_count, 1000)
+            json_filename = os.path.join(self.directory, search_term_filename(term) + '.00000.json.gz')
+            self.assertEqual(len(gzip.open(json_filename).read().splitlines()), 1000)
+
+    def test_search_term_filenames_rejects_shared_filenames(self):
+        self.assertEqual(len(search_term_filenames(['Python', 'python', 'python'])), 2)
+        real_search_term_filename = twitter_crawler.search_term_filename
+        twitter_crawler.search_term_filename = lambda term: term.lower()
+        try:
+            self.assertRaises(ValueError, search_term_filenames, ['Python', 'python'])
+        finally:
+            twitter_crawler.search_term_filename = real_search_term_filename
+
+    def test_interrupted_harvest_resumes_before_oldest_tweet_written(self):
+        search_crawler = SearchTwitterTimelines(self.twython, self.logger)
+        checkpoint_filename = os.path.join(self.directory, 'checkpoint')
+        checkpoint = CursorCheckpoint(checkpoint_filename)
+        harvester = SearchHarvester(search_crawler, self.directory, checkpoint, logger=self.logger)
+        requests = self.record_requests('search/tweets')
+        def interrupting_write_tweets(writer, tweets):
+            if len(requests) > 3:
+                raise KeyboardInterrupt()
+            real_write_tweets(writer, tweets)
+        real_write_tweets = RotatingJSONWriter.write_tweets
+        RotatingJSONWriter.write_tweets = interrupting_write_tweets
+        try:
+            self.assertRaises(KeyboardInterrupt, harvester.harvest, ['foo'])
+        finally:
+            RotatingJSONWriter.write_tweets = real_write_tweets
+        checkpoint.close()
+
+        def written_ids():
+            ids = []
+            for filename in sorted(os.listdir(self.directory)):
+                if filename.endswith('.json.gz'):
+                    ids += [json.loads(line)['id'] for line in gzip.open(os.path.join(self.directory, filename))]
+            return ids
+        oldest_id = min(written_ids())
+        del requests[:]
+        harvester = SearchHarvester(search_crawler, self.directory, CursorCheckpoint(checkpoint_filename),
+                                    logger=self.logger)
+        harvester.harvest(['foo'])
+        self.assertEqual(int(requests[0]['max_id']), oldest_id - 1)
+        ids = written_ids()
+        self.assertEqual(len(ids), 1000)
+        self.assertEqual(len(set(ids)), 1000)
+
+
+class TestSearchQueries(unittest.TestCase):
+    def test_search_query_for_terms(self):
+        self.assertEqual(search_query_for_terms(['foo']), 'foo')
+        self.assertEqual(search_query_for_terms(['foo', 'bar baz', '#qux']), 'foo OR (bar baz) OR #qux')
+
+    def test_search_term_is_batchable(self):
+        for term in ['python', '#python', '@nasa', 'bar baz']:
+            self.assertTrue(search_term_is_batchable(term), term)
+        for term in ['python -snake', 'from:nasa', '"exact phrase"', 'cats OR dogs', '(a b)']:
+            self.assertFalse(search_term_is_batchable(term), term)
+
+    def test_tweet_matches_search_term(self):
+        tweet = {'full_text': u'Reading about Monty https://t.co/abc',
+                 'user': {'screen_name': 'guido'},
+                 'entities': {'hashtags': [{'text': 'Python'}],
+                              'user_mentions': [{'screen_name': 'nasa'}],
+                              'urls': [{'url': 'https://t.co/abc', 'expanded_url': 'https://example.com/snakes'}]},
+                 'quoted_status': {'text': u'Flying circus', 'user': {'screen_name': 'bbc'}}}
+        for term in ['monty', '#python', '@nasa', 'snakes', 'guido', 'flying circus', 'bbc python']:
+            self.assertTrue(tweet_matches_search_term(tweet, term), term)
+        for term in ['java', 'monty java']:
+            self.assertFalse(tweet_matches_search_term(tweet, term), term)
+
+    def test_extended_tweet_text_is_matched(self):
+        tweet = {'text': u'Truncated...', 'extended_tweet': {'full_text': u'Truncated text about pandas',
+                                                             'entities': {}}}
+        self.assertTrue(tweet_matches_search_term(tweet, 'pandas'))
+
+
+class TestSyntheticSearch(MockTwitterTestCase):
+    def created_at(self, tweet):
+        return datetime.datetime.strptime(tweet['created_at'], '%a %b %d %H:%M:%S +0000 %Y')
+
+    def test_search_ids_are_ordered_by_time_across_terms(self):
+        tweets = self.mock_api.data.search('foo OR bar baz OR qux', count=100)
+        ids = [tweet['id'] for tweet in tweets]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        times = [self.created_at(tweet) for tweet in tweets]
+        self.assertEqual(times, sorted(times, reverse=True))
+
+    def test_or_query_since_id_loses_nothing(self):
+        data = self.mock_api.data
+        since_tweet = data.search('foo OR bar', count=100)[0]
+        self.clock.sleep(20)
+        new_tweets = data.search('foo OR bar', count=100, since_id=since_tweet['id'])
+        # Every Tweet for either term created after the since_id Tweet
+        later_ids = set(tweet['id'] for term in ['foo', 'bar'] for tweet in data.search(term, count=100)
+                        if self.created_at(tweet) > self.created_at(since_tweet))
+        self.assertTrue(later_ids)
+        self.assertTrue(later_ids <= set(tweet['id'] for tweet in new_tweets))
+        self.assertTrue(all(self.created_at(tweet) >= self.created_at(since_tweet) for tweet in new_tweets))
+
+class TestSearchMonitor(MockTwitterTestCase):
+    def create_monitor(self, terms, output, **kwargs):
+        search_crawler = SearchTwitterTimelines(self.twython, self.logger)
+        return SearchMonitor(search_crawler, terms, output, logger=self.logger, **kwargs)
+
+    def test_only_plain_terms_are_batched(self):
+        monitor = self.create_monitor(['foo', 'bar', 'python -snake', 'from:nasa', '"a phrase"'],
+                                      lambda term, tweets: None)
+        monitor.poll_once()
+        self.clock.sleep(15 * 60)
+        requests = self.record_requests('search/tweets')
+        monitor.poll_once()
+        self.assertEqual(set(params['q'] for params in requests),
+                         set(['bar OR foo', 'python -snake', 'from:nasa', '"a phrase"']))
+        self.assertTrue(all(params['tweet_mode'] == 'extended' for params in requests))
+
+    def test_new_terms_are_polled_on_their_own(self):
+        emitted = {}
+        def output(term, tweets):
+            emitted.setdefault(term, []).extend(tweet['id'] for tweet in tweets)
+        monitor = self.create_monitor(['foo'], output)
+        monitor.poll_once()
+        self.clock.sleep(15 * 60)
+        requests = self.record_requests('search/tweets')
+        monitor.add_term('bar')
+        monitor.poll_once()
+        # 'foo' is still low volume, but is not batched with the new term
+        self.assertEqual(set(params['q'] for params in requests), set(['bar', 'foo']))
+        # Every Tweet for 'foo' since its first poll was emitted
+        since_first_poll = self.mock_api.data.search('foo', count=10000, since_id=min(emitted['foo']) - 1)
+        self.assertEqual(sorted(emitted['foo']), sorted(tweet['id'] for tweet in since_first_poll))
+
+    def test_single_term_results_are_not_filtered(self):
+        real_search = self.mock_api.data.search
+        def search_without_terms_in_text(query, **kwargs):
+            tweets = real_search(query, **kwargs)
+            for tweet in tweets:
+                tweet['text'] = u'Matched on a URL'
+            return tweets
+        self.mock_api.data.search = search_without_terms_in_text
+        emitted = {}
+        def output(term, tweets):
+            emitted[term] = emitted.get(term, 0) + len(tweets)
+        monitor = self.create_monitor(['python -snake', 'from:nasa'], output)
+        self.assertEqual(monitor.poll_once(), 200)
+        self.assertEqual(emitted, {'python -snake': 100, 'from:nasa': 100})
+
+    def test_batched_results_are_demultiplexed(self):
+        emitted = {}
+        def output(term, tweets):
+            emitted.setdefault(term, []).extend(tweets)
+        monitor = self.create_monitor(['foo', 'bar'], output)
+        monitor.poll_once()
+        self.clock.sleep(15 * 60)
+        monitor.poll_once()
+        self.assertTrue(emitted['foo'] and emitted['bar'])
+        for term, tweets in emitted.items():
+            self.assertTrue(all(tweet['full_text'].endswith(' ' + term) for tweet in tweets))
+            self.assertEqual(len(set(tweet['id'] for tweet in tweets)), len(tweets))
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
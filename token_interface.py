@@ -2,6 +2,8 @@
 Interfacing with oAuth token files and token database
 """
 
+import yaml
+
 def get_tokens_from_file( token_file ):
     # Set up API access
     if token_file.endswith('yaml'):
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+
+"""
+Micro-benchmarks for FilteredTweetReader and the TweetFilter classes
+in tweet_filter.py, run over synthetic corpora built from the Tweets
+in testdata/.
+
+For each filter (and each chain of filters) the benchmark reports
+Tweets per second, and splits the time spent into reading the file,
+parsing the JSON and evaluating the filter's predicate.  It also
+tracks how memory grows with the number of entries held by
+TweetFilterIDSet and TweetFilterOneTweetPerScreenName.
+
+  ./benchmark_tweet_filter.py --lines 2000000 --retweet-ratio 0.3
+  ./benchmark_tweet_filter.py --output before.json
+  ./benchmark_tweet_filter.py --baseline before.json
+"""
+
+# Standard Library modules
+import argparse
+import codecs
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import tempfile
+import time
+
+# Local modules
+from tweet_filter import *
+
+
+TESTDATA_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'testdata')
+DEFAULT_TEMPLATE_FILENAMES = [os.path.join(TESTDATA_DIRECTORY, 'shears.txt'),
+                              os.path.join(TESTDATA_DIRECTORY, 'retweet_x1')]
+
+# Text for Tweets that should not pass TweetFilterReliablyEnglish
+NON_ENGLISH_TEXTS = [
+    u"Muchas de las victimas fueron mostrados con vendajes aplicados a toda prisa",
+    u"Adakah yang cantik masih bangun? Aku belum tidur sama sekali malam ini",
+    u"Ik heb vandaag mijn nieuwe schaar gekregen en ik ben er heel blij mee",
+    u"Je ne trouve plus mes ciseaux, quelqu'un les a vus dans le salon ce matin?",
+    u"Ich habe heute meine Schere im Friseursalon vergessen, so ein Mist",
+]
+
+FIRST_TWEET_ID = 400000000000000000
+
+
+class SyntheticTweetCorpus:
+    """
+    Generates an unlimited stream of JSON Tweets, one per line, from
+    template Tweets, with the given fraction of retweets, Tweets
+    containing URLs, non-English Tweets and exact duplicates of
+    earlier Tweets.  Screen names are drawn from `screen_name_count`
+    users, and the same `seed` always produces the same corpus.
+    """
+    def __init__(self, retweet_ratio=0.2, url_ratio=0.2, non_english_ratio=0.1, duplicate_ratio=0.05,
+                 screen_name_count=10000, seed=0, template_filenames=None):
+        self.retweet_ratio = retweet_ratio
+        self.url_ratio = url_ratio
+        self.non_english_ratio = non_english_ratio
+        self.duplicate_ratio = duplicate_ratio
+        self.screen_name_count = screen_name_count
+        self._seed = seed
+
+        # Templates are kept as JSON strings, and decoded into a fresh
+        # copy for each synthetic Tweet
+        self._tweet_templates = []
+        self._retweet_templates = []
+        for template_filename in template_filenames or DEFAULT_TEMPLATE_FILENAMES:
+            for line in codecs.open(template_filename, 'r', 'utf-8'):
+                if line.strip():
+                    if 'retweeted_status' in json.loads(line):
+                        self._retweet_templates.append(line.strip())
+                    else:
+                        self._tweet_templates.append(line.strip())
+
+    def json_lines(self, count):
+        """
+        Yields `count` JSON Tweet strings.  Tweet `i` (unless it is a
+        duplicate) has ID FIRST_TWEET_ID + i.
+        """
+        rng = random.Random(self._seed)
+        recent_lines = []
+        for i in xrange(count):
+            if recent_lines and rng.random() < self.duplicate_ratio:
+                yield rng.choice(recent_lines)
+                continue
+
+            json_tweet_string = json.dumps(self._tweet(rng, FIRST_TWEET_ID + i))
+            # Duplicates are drawn from a window of recent Tweets, as
+            # they are when a crawl is restarted
+            if len(recent_lines) < 1000:
+                recent_lines.append(json_tweet_string)
+            else:
+                recent_lines[rng.randrange(1000)] = json_tweet_string
+            yield json_tweet_string
+
+    def write(self, filename, count):
+        out = codecs.open(filename, 'w', 'utf-8')
+        for json_tweet_string in self.json_lines(count):
+            out.write(u"%s\n" % json_tweet_string)
+        out.close()
+
+    def _tweet(self, rng, tweet_id):
+        tweet = json.loads(rng.choice(self._tweet_templates))
+
+        if rng.random() < self.non_english_ratio:
+            text = rng.choice(NON_ENGLISH_TEXTS)
+            tweet['lang'] = 'und'
+        else:
+            text = re.sub(r'\s*https?://\S+', '', tweet['text'])
+        tweet.get('entities', {}).pop('media', None)
+        tweet.setdefault('entities', {})['urls'] = []
+        if rng.random() < self.url_ratio:
+            url = u"http://t.co/%010x" % rng.getrandbits(40)
+            tweet['entities']['urls'] = [{'url': url, 'expanded_url': url}]
+            text = u"%s %s" % (text, url)
+
+        user_number = rng.randint(1, self.screen_name_count)
+        tweet['user']['id'] = user_number
+        tweet['user']['id_str'] = str(user_number)
+        tweet['user']['screen_name'] = 'user%d' % user_number
+
+        if self._retweet_templates and rng.random() < self.retweet_ratio:
+            retweet = json.loads(rng.choice(self._retweet_templates))
+            retweeted_status = retweet['retweeted_status']
+            retweeted_status['text'] = text
+            tweet['retweeted_status'] = retweeted_status
+            text = u"RT @%s: %s" % (retweeted_status['user']['screen_name'], text)
+
+        tweet['id'] = tweet_id
+        tweet['id_str'] = str(tweet_id)
+        tweet['text'] = text
+        return tweet
+
+
+def get_null_logger():
+    # TweetFilter adds a console handler to the root logger when it is
+    # not given a logger, once per filter
+    logger = logging.getLogger('benchmark_tweet_filter')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    return logger
+
+
+def id_set_filter(filter_class, line_count):
+    """
+    Returns a `filter_class` (a TweetFilterIDSet subclass) holding
+    every other Tweet ID in a corpus of `line_count` Tweets
+    """
+    def create_filter(logger):
+        id_filter = filter_class(logger)
+        id_filter.add_tweet_ids(xrange(FIRST_TWEET_ID, FIRST_TWEET_ID + line_count, 2))
+        return id_filter
+    return create_filter
+
+
+def get_filters(line_count):
+    """
+    Returns a list of (name, function) pairs, where the function takes
+    a logger and returns a freshly created filter
+    """
+    return [
+        ('TweetFilterValidJSON', TweetFilterValidJSON),
+        ('TweetFilterNotARetweet', TweetFilterNotARetweet),
+        ('TweetFilterNoURLs', TweetFilterNoURLs),
+        ('TweetFilterReliablyEnglish', TweetFilterReliablyEnglish),
+        ('TweetFilterOneTweetPerScreenName', TweetFilterOneTweetPerScreenName),
+        ('TweetFilterFieldMatchesRegEx', lambda logger: TweetFilterFieldMatchesRegEx(
+            'text', r'\bmy %s(s|es)?\b' % 'shears', logger)),
+        ('TweetFilterTweetIDInSet', id_set_filter(TweetFilterTweetIDInSet, line_count)),
+        ('TweetFilterTweetIDNotInSet', id_set_filter(TweetFilterTweetIDNotInSet, line_count)),
+    ]
+
+
+# Each chain is run through a FilteredTweetReader, which always starts
+# with a TweetFilterValidJSON
+CHAINS = [
+    ('reader_only', []),
+    ('not_a_retweet+no_urls', ['TweetFilterNotARetweet', 'TweetFilterNoURLs']),
+    ('english_originals', ['TweetFilterNotARetweet', 'TweetFilterNoURLs', 'TweetFilterReliablyEnglish']),
+    ('one_per_user', ['TweetFilterNotARetweet', 'TweetFilterReliablyEnglish',
+                      'TweetFilterOneTweetPerScreenName']),
+    ('new_ids', ['TweetFilterTweetIDNotInSet', 'TweetFilterNotARetweet']),
+]
+
+
+def time_lines(corpus_filename, function=None):
+    """
+    Returns the processor time taken to read every line of the corpus
+    and, if given, call `function` on it, along with the number of
+    lines for which `function` returned True.
+    """
+    passed = 0
+    corpus_file = codecs.open(corpus_filename, 'r', 'utf-8')
+    start_time = time.clock()
+    if function is None:
+        for json_tweet_string in corpus_file:
+            pass
+    else:
+        for json_tweet_string in corpus_file:
+            if function(json_tweet_string):
+                passed += 1
+    elapsed = time.clock() - start_time
+    corpus_file.close()
+    return elapsed, passed
+
+
+def benchmark_filters(corpus_filename, line_count, filter_names=None):
+    """
+    Times each filter on its own over the corpus.  The time to read the
+    corpus, and to parse each line with json.loads(), is measured once
+    and subtracted, leaving the time spent in each filter's predicate.
+    """
+    logger = get_null_logger()
+    read_seconds, passed = time_lines(corpus_filename)
+    parse_seconds, passed = time_lines(corpus_filename, json.loads)
+    parse_seconds -= read_seconds
+
+    results = {'read': {'seconds': read_seconds, 'tweets_per_second': line_count / max(read_seconds, 1e-9)},
+               'json.loads': {'seconds': parse_seconds, 'tweets_per_second': line_count / max(parse_seconds, 1e-9)}}
+    for name, create_filter in get_filters(line_count):
+        if filter_names and name not in filter_names:
+            continue
+        tweet_filter = create_filter(logger)
+        filter_seconds, passed = time_lines(corpus_filename, tweet_filter.filter)
+        filter_seconds -= read_seconds
+        results[name] = {
+            'seconds': filter_seconds,
+            'tweets_per_second': line_count / max(filter_seconds, 1e-9),
+            'parse_seconds': parse_seconds,
+            'predicate_seconds': filter_seconds - parse_seconds,
+            'pass_rate': float(passed) / line_count,
+        }
+    return results
+
+
+def benchmark_chains(corpus_filename, line_count):
+    """
+    Times a FilteredTweetReader over the corpus for each chain in
+    CHAINS
+    """
+    logger = get_null_logger()
+    filters = dict(get_filters(line_count))
+    results = {}
+    for chain_name, filter_names in CHAINS:
+        reader = FilteredTweetReader([filters[name](logger) for name in filter_names], logger)
+        reader.open(corpus_filename)
+        passed = 0
+        start_time = time.clock()
+        for json_tweet_string in reader:
+            passed += 1
+        seconds = time.clock() - start_time
+        reader.close()
+        results[chain_name] = {'seconds': seconds,
+                               'tweets_per_second': line_count / max(seconds, 1e-9),
+                               'pass_rate': float(passed) / line_count}
+    return results
+
+
+def measure_memory_growth(filter_name, entry_count, samples=10):
+    """
+    Adds `entry_count` distinct entries to a fresh filter, and returns
+    a list of (entries, peak RSS in kilobytes) pairs sampled along the
+    way.  Intended to be run in its own process.
+    """
+    logger = get_null_logger()
+    step = max(entry_count // samples, 1)
+    growth = [(0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)]
+    if filter_name == 'TweetFilterIDSet':
+        id_filter = TweetFilterTweetIDNotInSet(logger)
+        for start in xrange(0, entry_count, step):
+            id_filter.add_tweet_ids(xrange(FIRST_TWEET_ID + start, FIRST_TWEET_ID + min(start + step, entry_count)))
+            growth.append((min(start + step, entry_count), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    elif filter_name == 'TweetFilterOneTweetPerScreenName':
+        screen_name_filter = TweetFilterOneTweetPerScreenName(logger)
+        for start in xrange(0, entry_count, step):
+            for i in xrange(start, min(start + step, entry_count)):
+                screen_name_filter.filter('{"id": %d, "id_str": "%d", "user": {"screen_name": "user%d"}}' % (i, i, i))
+            growth.append((min(start + step, entry_count), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    else:
+        raise ValueError("No memory benchmark for '%s'" % filter_name)
+    return growth
+
+
+def _measure_memory_growth_in_pool(args):
+    return measure_memory_growth(*args)
+
+
+def benchmark_memory(entry_count):
+    """
+    Runs measure_memory_growth() for each filter that holds state, each
+    in a fresh process so that peak RSS starts from the same place
+    """
+    results = {}
+    for filter_name in ['TweetFilterIDSet', 'TweetFilterOneTweetPerScreenName']:
+        pool = multiprocessing.Pool(1)
+        try:
+            growth = pool.apply(_measure_memory_growth_in_pool, [(filter_name, entry_count)])
+        finally:
+            pool.terminate()
+        results[filter_name] = {
+            'entries': entry_count,
+            'growth': growth,
+            'bytes_per_entry': 1024.0 * (growth[-1][1] - growth[0][1]) / max(entry_count, 1),
+        }
+    return results
+
+
+def format_results(results, baseline=None):
+    def speedup(section, name, metric='tweets_per_second'):
+        if baseline and name in baseline.get(section, {}):
+            return '%9.2fx' % (results[section][name][metric] / max(baseline[section][name][metric], 1e-9))
+        return ''
+
+    lines = ['%-34s %14s %12s %12s %10s' % ('filter', 'tweets/s', 'parse s', 'predicate s', 'pass')]
+    for name in ['read', 'json.loads']:
+        result = results['filters'][name]
+        lines.append('%-34s %14.0f %12s %12s %10s%s' % (name, result['tweets_per_second'], '', '', '',
+                                                      speedup('filters', name)))
+    for name, result in sorted(results['filters'].items()):
+        if name in ['read', 'json.loads']:
+            continue
+        lines.append('%-34s %14.0f %12.3f %12.3f %10.3f%s' % (name, result['tweets_per_second'],
+                                                            result['parse_seconds'], result['predicate_seconds'],
+                                                            result['pass_rate'], speedup('filters', name)))
+    lines.append('')
+    lines.append('%-34s %14s %12s %10s' % ('chain', 'tweets/s', 'seconds', 'pass'))
+    for name, filter_names in CHAINS:
+        if name in results.get('chains', {}):
+            result = results['chains'][name]
+            lines.append('%-34s %14.0f %12.3f %10.3f%s' % (name, result['tweets_per_second'], result['seconds'],
+                                                         result['pass_rate'], speedup('chains', name)))
+    if results.get('memory'):
+        lines.append('')
+        lines.append('%-34s %14s %12s' % ('memory', 'entries', 'bytes/entry'))
+        for name, result in sorted(results['memory'].items()):
+            lines.append('%-34s %14d %12.1f' % (name, result['entries'], result['bytes_per_entry']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FilteredTweetReader and the TweetFilters.")
+    parser.add_argument('--lines', dest='line_count', type=int, default=100000,
+                        help='Number of Tweets in the synthetic corpus.')
+    parser.add_argument('--corpus', dest='corpus_filename',
+                        help='Write the corpus to (or, if it exists, read it from) this file.')
+    parser.add_argument('--retweet-ratio', dest='retweet_ratio', type=float, default=0.2)
+    parser.add_argument('--url-ratio', dest='url_ratio', type=float, default=0.2)
+    parser.add_argument('--non-english-ratio', dest='non_english_ratio', type=float, default=0.1)
+    parser.add_argument('--duplicate-ratio', dest='duplicate_ratio', type=float, default=0.05)
+    parser.add_argument('--screen-names', dest='screen_name_count', type=int, default=10000,
+                        help='Number of distinct users the corpus Tweets are drawn from.')
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    parser.add_argument('--filter', dest='filter_names', action='append',
+                        help='Only benchmark this filter (may be repeated).')
+    parser.add_argument('--no-chains', dest='chains', action='store_false', default=True)
+    parser.add_argument('--memory-entries', dest='memory_entries', type=int, default=1000000,
+                        help='Entries added when measuring memory growth (0 to skip).')
+    parser.add_argument('--output', dest='output', help='Save the results to this JSON file.')
+    parser.add_argument('--baseline', dest='baseline', help='Show speedups relative to this JSON file.')
+    args = parser.parse_args()
+
+    temporary_directory = None
+    corpus_filename = args.corpus_filename
+    if corpus_filename is None:
+        temporary_directory = tempfile.mkdtemp()
+        corpus_filename = os.path.join(temporary_directory, 'corpus.json')
+    try:
+        if os.path.exists(corpus_filename):
+            line_count = sum(1 for line in open(corpus_filename))
+        else:
+            corpus = SyntheticTweetCorpus(args.retweet_ratio, args.url_ratio, args.non_english_ratio,
+                                          args.duplicate_ratio, args.screen_name_count, args.seed)
+            corpus.write(corpus_filename, args.line_count)
+            line_count = args.line_count
+
+        results = {'lines': line_count,
+                   'filters': benchmark_filters(corpus_filename, line_count, args.filter_names)}
+        if args.chains:
+            results['chains'] = benchmark_chains(corpus_filename, line_count)
+        if args.memory_entries:
+            results['memory'] = benchmark_memory(args.memory_entries)
+    finally:
+        if temporary_directory:
+            shutil.rmtree(temporary_directory)
+
+    baseline = None
+    if args.baseline:
+        baseline = json.load(open(args.baseline))
+    print format_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
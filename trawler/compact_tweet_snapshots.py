@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+"""
+This script merges the timeline snapshots written by successive runs
+of save_recent_tweets_to_json.py into one file per user.
+
+The script takes as input the path where the merged files will be
+stored, followed by the paths of the snapshot directories.  The
+'[username].tweets' files with the same name in each snapshot
+directory are merged into one gzipped '[username].tweets' file in the
+output path, holding each Tweet once, newest first.  The merged
+directory can be given as the old_tweet_path of the next run of
+save_recent_tweets_to_json.py.
+"""
+
+# Standard Library modules
+import argparse
+import codecs
+import sys
+
+# Local modules
+from twitter_crawler import compact_tweet_snapshots, get_console_info_logger
+
+
+def main():
+    # Make stdout output UTF-8, preventing "'ascii' codec can't encode" errors
+    sys.stdout = codecs.getwriter('utf8')(sys.stdout)
+
+    parser = argparse.ArgumentParser(description="Merge timeline snapshots into one file per user")
+    parser.add_argument('output_tweet_path')
+    parser.add_argument('snapshot_tweet_paths', nargs='+')
+    parser.add_argument('--processes', type=int, default=None,
+                        help="Number of files to merge at once (default: one per CPU)")
+    args = parser.parse_args()
+
+    logger = get_console_info_logger()
+
+    tweet_counts = compact_tweet_snapshots(args.snapshot_tweet_paths, args.output_tweet_path,
+                                           args.processes, logger)
+    logger.info("Merged %d Tweets into %d files" % (sum(tweet_counts.values()), len(tweet_counts)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""
+This script downloads the Tweets for a list of Tweet IDs, e.g. from a
+shared dataset, using the statuses/lookup API.
+
+The script takes as input a text file which lists one Tweet ID per
+line of the file.  The Tweets are written to the files
+'[output_prefix].00000.json.gz', '[output_prefix].00001.json.gz', ...,
+one JSON object per line, and the IDs of Tweets that have been deleted
+or are no longer public are written to '[output_prefix].missing.txt'.
+
+Lookups of 100 IDs each are run several at a time, sharing the API
+key's rate limit.
+
+Your Twitter OAuth credentials should be stored in the file
+twitter_oauth_settings.py.
+"""
+
+# Standard Library modules
+import argparse
+import codecs
+import sys
+
+# Local modules
+from twitter_crawler import (CompactIDSet, CrawlScheduler, RotatingJSONWriter, get_connection,
+                             get_console_info_logger, hydrate_tweets, iter_ids_from_file)
+try:
+    from twitter_oauth_settings import access_token, access_token_secret, consumer_key, consumer_secret
+except ImportError:
+    print "You must create a 'twitter_oauth_settings.py' file with your Twitter API credentials."
+    print "Please copy over the sample configuration file:"
+    print "  cp twitter_oauth_settings.sample.py twitter_oauth_settings.py"
+    print "and add your API credentials to the file."
+    sys.exit()
+
+
+def main():
+    # Make stdout output UTF-8, preventing "'ascii' codec can't encode" errors
+    sys.stdout = codecs.getwriter('utf8')(sys.stdout)
+
+    parser = argparse.ArgumentParser(description="Download the Tweets for a file of Tweet IDs")
+    parser.add_argument('id_file')
+    parser.add_argument('output_prefix')
+    parser.add_argument('--tweets-per-file', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=4,
+                        help="Number of lookups to keep in flight at once")
+    parser.add_argument('--schema', default='raw',
+                        help="'raw' or 'research-slim', which saves each file's users to a separate user table")
+    args = parser.parse_args()
+
+    logger = get_console_info_logger()
+
+    twython = get_connection(consumer_key, consumer_secret)
+
+    scheduler = CrawlScheduler(twython, logger, workers_per_token=args.workers)
+    writer = RotatingJSONWriter(args.output_prefix, args.tweets_per_file, schema=args.schema)
+    missing_ids = CompactIDSet()
+    try:
+        tweet_count = hydrate_tweets(scheduler, iter_ids_from_file(args.id_file), writer, missing_ids)
+    finally:
+        writer.close()
+        scheduler.close()
+        missing_ids.save('%s.missing.txt' % args.output_prefix)
+    logger.info("Downloaded %d Tweets, %d Tweets are missing" % (tweet_count, len(missing_ids)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""
+This script indexes gzipped Tweet files (e.g. '[username].tweets' or
+'[user_id].tweets.gz' files) in a SQLite database, so that Tweets can
+be fetched by ID, and users' Tweets by time, with ArchiveIndex.
+
+The script takes as input the path of the index database, followed by
+the Tweet files to index.  With --rewrite, each file is first rewritten
+in blocks of --lines-per-block Tweets, so that a lookup only
+decompresses the block holding the Tweet rather than the whole file.
+"""
+
+# Standard Library modules
+import argparse
+import codecs
+import sys
+
+# Local modules
+from twitter_crawler import get_console_info_logger
+from trawler_archive import ArchiveIndex, rewrite_in_blocks
+
+
+def main():
+    # Make stdout output UTF-8, preventing "'ascii' codec can't encode" errors
+    sys.stdout = codecs.getwriter('utf8')(sys.stdout)
+
+    parser = argparse.ArgumentParser(description="Index Tweet files for lookups by Tweet ID and by user")
+    parser.add_argument('index_db')
+    parser.add_argument('tweet_files', nargs='+')
+    parser.add_argument('--rewrite', action='store_true',
+                        help="Rewrite each file in separately compressed blocks before indexing it")
+    parser.add_argument('--lines-per-block', type=int, default=1000)
+    args = parser.parse_args()
+
+    logger = get_console_info_logger()
+
+    index = ArchiveIndex(args.index_db)
+    for tweet_filename in args.tweet_files:
+        if args.rewrite:
+            rewrite_in_blocks(tweet_filename, lines_per_block=args.lines_per_block)
+        tweet_count = index.index_file(tweet_filename)
+        logger.info("Indexed %d Tweets in '%s'" % (tweet_count, tweet_filename))
+    index.close()
+
+if __name__ == "__main__":
+    main()
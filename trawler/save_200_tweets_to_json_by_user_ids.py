@@ -1,12 +1,13 @@
 #!/usr/bin/env python
 
 """
-This script downloads all available Tweets for a given list of
-usernames.
+This script downloads the 200 most recent Tweets for a given list of
+Twitter user IDs.  (To download Tweets by their own IDs, use
+hydrate_tweets.py.)
 
-The script takes as input a text file which lists one Twitter username
-per line of the file.  The script creates a [username].tweets file for
-each username specified in the directory.
+The script takes as input a text file which lists one Twitter user ID
+per line of the file.  The script creates a testdata/[user_id].json
+file for each user ID specified.
 
 Your Twitter OAuth credentials should be stored in the file
 twitter_oauth_settings.py.
@@ -62,9 +63,9 @@ def main():
             except TwythonError as e:
                 print "TwythonError: %s" % e
                 if e.error_code == 404:
-                    logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % screen_name)
+                    logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % user_id)
                 elif e.error_code == 401:
-                    logger.warn("HTTP 401 error - Most likely, Twitter user '%s' no longer publicly accessible" % screen_name)
+                    logger.warn("HTTP 401 error - Most likely, Twitter user '%s' no longer publicly accessible" % user_id)
                 else:
                     # Unhandled exception
                     raise e
@@ -30,7 +30,7 @@ from twython import Twython, TwythonError
 
 # Local modules
 from twitter_crawler import (CrawlTwitterTimelines, RateLimitedTwitterEndpoint,
-                             get_console_info_logger, get_screen_names_from_file, save_tweets_to_json_file)
+                             get_connection, get_console_info_logger, get_screen_names_from_file, save_tweets_to_json_file)
 try:
     from twitter_oauth_settings import access_token, access_token_secret, consumer_key, consumer_secret
 except ImportError:
@@ -53,8 +53,7 @@ def main():
 
     logger = get_console_info_logger()
 
-    ACCESS_TOKEN = Twython(consumer_key, consumer_secret, oauth_version=2).obtain_access_token()
-    twython = Twython(consumer_key, access_token=ACCESS_TOKEN)
+    twython = get_connection(consumer_key, consumer_secret)
 
     crawler = CrawlTwitterTimelines(twython, logger)
 
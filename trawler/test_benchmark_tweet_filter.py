@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+"""
+Tests for the synthetic corpora in benchmark_tweet_filter.py
+"""
+
+# Standard Library modules
+import json
+import unittest
+
+# Local modules
+from benchmark_tweet_filter import *
+
+
+class TestSyntheticTweetCorpus(unittest.TestCase):
+    def test_ratios(self):
+        corpus = SyntheticTweetCorpus(retweet_ratio=0.3, url_ratio=0.5, non_english_ratio=0.0,
+                                      duplicate_ratio=0.1, screen_name_count=50)
+        json_tweet_strings = list(corpus.json_lines(4000))
+        tweets = [json.loads(json_tweet_string) for json_tweet_string in json_tweet_strings]
+
+        self.assertTrue(all(TweetFilterValidJSON().filter(s) for s in json_tweet_strings))
+        duplicate_ratio = 1 - len(set(tweet['id'] for tweet in tweets)) / 4000.0
+        self.assertAlmostEqual(duplicate_ratio, 0.1, delta=0.02)
+        retweet_ratio = sum(1 for tweet in tweets if 'retweeted_status' in tweet) / 4000.0
+        self.assertAlmostEqual(retweet_ratio, 0.3, delta=0.03)
+        url_ratio = sum(1 for tweet in tweets if 'http://' in tweet['text']) / 4000.0
+        self.assertAlmostEqual(url_ratio, 0.5, delta=0.03)
+        self.assertEqual(len(set(tweet['user']['screen_name'] for tweet in tweets)), 50)
+
+    def test_same_seed_same_corpus(self):
+        self.assertEqual(list(SyntheticTweetCorpus(seed=1).json_lines(100)),
+                         list(SyntheticTweetCorpus(seed=1).json_lines(100)))
+
+
+if __name__ == '__main__':
+    unittest.main()
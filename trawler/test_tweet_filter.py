@@ -4,6 +4,8 @@
 """
 
 # Standard Library modules
+import json
+import re
 import unittest
 
 # Local modules
@@ -19,6 +21,14 @@ class TestFilterValidJSON(unittest.TestCase):
         self.assertTrue(tweet_json_filter.filter(json_tweet))
         self.assertFalse(tweet_json_filter.filter(json_tweet_no_screen_name))
 
+    def test_extended_tweets_are_valid(self):
+        json_tweet = '{"id": 1, "id_str": "1", "full_text":"foo", "user": {"screen_name": "charman"}}'
+        json_tweet_no_text = '{"id": 1, "id_str": "1", "user": {"screen_name": "charman"}}'
+        tweet_json_filter = TweetFilterValidJSON()
+
+        self.assertTrue(tweet_json_filter.filter(json_tweet))
+        self.assertFalse(tweet_json_filter.filter(json_tweet_no_text))
+
 
 class TestFilterNoURLs(unittest.TestCase):
     def test_url_filtering(self):
@@ -31,6 +41,15 @@ class TestFilterNoURLs(unittest.TestCase):
         self.assertFalse(tweet_no_url_filter.filter(json_tweet_https))
         self.assertTrue(tweet_no_url_filter.filter(json_tweet_clean))
 
+    def test_url_entities_and_precomputed_flags(self):
+        json_tweet_url_entity = '{"id": 1, "id_str": "1", "full_text":"see pic.twitter.com/x", "entities": {"urls": [], "media": [{"type": "photo"}]}}'
+        json_tweet_normalised = '{"id": 2, "id_str": "2", "text":"http://twitter.com", "trawler": {"text": "http://twitter.com", "is_retweet": false, "has_url": false, "mention_count": 0, "hashtag_count": 0}}'
+        tweet_no_url_filter = TweetFilterNoURLs()
+
+        self.assertFalse(tweet_no_url_filter.filter(json_tweet_url_entity))
+        # The precomputed flag is used rather than the text
+        self.assertTrue(tweet_no_url_filter.filter(json_tweet_normalised))
+
 
 class TestFilterOneTweetPerScreenName(unittest.TestCase):
     def test_screen_name_filtering(self):
@@ -136,6 +155,18 @@ class TestFilterTweetIDNotInSet(unittest.TestCase):
 
 
 
+class TestFilterNotARetweet(unittest.TestCase):
+    def test_retweet_filtering(self):
+        json_tweet_retweet = '{"id": 1, "id_str": "1", "full_text":"RT @jack: foo", "retweeted_status": {"id": 2, "full_text": "foo", "user": {"screen_name": "jack"}}}'
+        json_tweet_manual_retweet = '{"id": 3, "id_str": "3", "text":"RT @jack: foo"}'
+        json_tweet_original = '{"id": 4, "id_str": "4", "extended_tweet": {"full_text": "foo"}, "text": "foo"}'
+        not_a_retweet_filter = TweetFilterNotARetweet()
+
+        self.assertFalse(not_a_retweet_filter.filter(json_tweet_retweet))
+        self.assertFalse(not_a_retweet_filter.filter(json_tweet_manual_retweet))
+        self.assertTrue(not_a_retweet_filter.filter(json_tweet_original))
+
+
 class TestFilteredTweetReader(unittest.TestCase):
     def test_add_filter_when_reader_crated(self):
         filtered_reader = FilteredTweetReader([TweetFilterNotARetweet()])
@@ -202,6 +233,94 @@ class TestFilteredTweetReader(unittest.TestCase):
         self.assertEqual(total_tweets_passed_through_filters(filtered_reader), 0)
         filtered_reader.close()
 
+    def test_reader_returns_projected_fields(self):
+        filtered_reader = FilteredTweetReader([TweetFilterNotARetweet()], paths=['id', 'user.screen_name', 'created_at'])
+        filtered_reader.open("testdata/shears.txt")
+        fields = list(filtered_reader)
+        filtered_reader.close()
+
+        filtered_reader = FilteredTweetReader([TweetFilterNotARetweet()])
+        filtered_reader.open("testdata/shears.txt")
+        tweets = [json.loads(json_tweet_string) for json_tweet_string in filtered_reader]
+        filtered_reader.close()
+        self.assertEqual(fields, [{'id': tweet['id'], 'user.screen_name': tweet['user']['screen_name'],
+                                   'created_at': tweet['created_at']} for tweet in tweets])
+
+    def test_filters_given_the_json_tweet_string(self):
+        # Filters that override filter() rather than filter_fields() still work
+        filtered_reader = FilteredTweetReader([TweetFilterRegExOnJSON(r'"possibly_sensitive":false'), TweetFilterNotARetweet()])
+        filtered_reader.open("testdata/shears.txt")
+        json_tweet_strings = list(filtered_reader)
+        filtered_reader.close()
+        self.assertTrue(json_tweet_strings)
+        for json_tweet_string in json_tweet_strings:
+            self.assertFalse(json.loads(json_tweet_string)['possibly_sensitive'])
+            self.assertFalse('retweeted_status' in json.loads(json_tweet_string))
+
+    def test_limit_stops_across_files(self):
+        filtered_reader = FilteredTweetReader([TweetFilterNotARetweet()], limit=40)
+        filtered_reader.open("testdata/shears.txt", "testdata/retweet_x1", "testdata/shears.txt", "testdata/shears.txt")
+        self.assertEqual(total_tweets_passed_through_filters(filtered_reader), 40)
+        filtered_reader.close()
+
+    def test_sampling_is_deterministic(self):
+        filtered_reader = FilteredTweetReader(paths=['id'], sample_rate=0.5)
+        filtered_reader.open("testdata/shears.txt")
+        sampled_ids = [fields['id'] for fields in filtered_reader]
+        filtered_reader.close()
+        self.assertTrue(8 < len(sampled_ids) < 24)
+
+        filtered_reader = FilteredTweetReader(paths=['id'])
+        filtered_reader.open("testdata/shears.txt")
+        tweet_ids = [fields['id'] for fields in filtered_reader]
+        filtered_reader.close()
+        self.assertEqual(sampled_ids, [tweet_id for tweet_id in tweet_ids if tweet_sample_key(tweet_id) < 0.5])
+        self.assertNotEqual(sampled_ids, [tweet_id for tweet_id in tweet_ids if tweet_sample_key(tweet_id, 1) < 0.5])
+
+    def test_tweets_not_sampled_are_not_filtered(self):
+        filtered_reader = FilteredTweetReader([TweetFilterAlwaysRaiseException()], sample_rate=0.0)
+        filtered_reader.open("testdata/shears.txt")
+        self.assertEqual(total_tweets_passed_through_filters(filtered_reader), 0)
+        filtered_reader.close()
+
+    def test_reservoir_sample(self):
+        filtered_reader = create_not_a_retweet_reader()
+        filtered_reader.open("testdata/shears.txt")
+        tweet_ids = [fields['id'] for fields in filtered_reader]
+        filtered_reader.close()
+
+        filtered_reader = create_not_a_retweet_reader()
+        filtered_reader.open("testdata/shears.txt")
+        sample = filtered_reader.reservoir_sample(5)
+        filtered_reader.close()
+        self.assertEqual([fields['id'] for fields in sample],
+                         [tweet_id for tweet_id in tweet_ids if tweet_id in sorted(tweet_ids, key=tweet_sample_key)[:5]])
+
+
+class TestFilterFiles(unittest.TestCase):
+    tweet_filenames = ["testdata/shears.txt", "testdata/retweet_x1", "testdata/shears.txt"]
+
+    def test_filter_files_matches_a_single_reader(self):
+        for limit in [None, 45]:
+            filtered_reader = create_not_a_retweet_reader()
+            filtered_reader._limit = limit
+            filtered_reader.open(*self.tweet_filenames)
+            tweets = list(filtered_reader)
+            filtered_reader.close()
+            self.assertEqual(list(filter_files(self.tweet_filenames, create_not_a_retweet_reader, processes=2, limit=limit)),
+                             tweets)
+
+    def test_reservoir_sample_files_matches_a_single_reader(self):
+        filtered_reader = create_not_a_retweet_reader()
+        filtered_reader.open(*self.tweet_filenames)
+        sample = filtered_reader.reservoir_sample(7)
+        filtered_reader.close()
+        self.assertEqual(reservoir_sample_files(self.tweet_filenames, create_not_a_retweet_reader, 7, processes=2), sample)
+
+
+def create_not_a_retweet_reader():
+    return FilteredTweetReader([TweetFilterNotARetweet()], paths=['id', 'created_at'])
+
 
 def total_tweets_passed_through_filters(filtered_reader):
     tweets = []
@@ -220,6 +339,15 @@ class TweetFilterAlwaysReject(TweetFilter):
         return False
 
 
+class TweetFilterRegExOnJSON(TweetFilter):
+    def __init__(self, regex):
+        self._regex = regex
+        TweetFilter.__init__(self)
+
+    def filter(self, json_tweet_string):
+        return re.search(self._regex, json_tweet_string) is not None
+
+
 
 if __name__ == '__main__':
     unittest.main(buffer=True)
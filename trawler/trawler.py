@@ -19,8 +19,10 @@ from twython import Twython, TwythonError
 
 # Local modules
 from twitter_crawler import (get_connection, save_tweets_to_json_file,
-                             get_screen_names_from_file, get_timeline_crawler,
-                             get_console_info_logger)
+                             get_screen_names_from_file, iter_screen_names_from_file, get_timeline_crawler,
+                             get_console_info_logger, EndpointRegistry)
+from trawler_metrics import JSONLinesBackend, Metrics, MetricsRegistry, PrometheusExporter
+from trawler_work_queue import open_work_queue, run_worker
 
 def main():
     # Make stdout output UTF-8, preventing "'ascii' codec can't encode" errors
@@ -34,6 +36,26 @@ def main():
                     help='A configuration file with Twitter API access tokens. See example_token_file.yaml or twitter_oauth_settings.sample.py')
     parser.add_argument('--output', dest='output', default='./',
                     help='Where to output the resulting data.')
+    parser.add_argument('--kafka', dest='kafka', default=None,
+                    help='Also publish each page of Tweets to the Kafka broker at HOST:PORT as soon as it arrives.')
+    parser.add_argument('--kafka-topic', dest='kafka_topic', default='trawler',
+                    help='The Kafka topic to publish to.')
+    parser.add_argument('--metrics-file', dest='metrics_file', default=None,
+                    help='Append per-endpoint metrics to this file as JSON lines.')
+    parser.add_argument('--prometheus-port', dest='prometheus_port', type=int, default=None,
+                    help='Serve per-endpoint metrics for Prometheus at http://localhost:PORT/metrics.')
+    parser.add_argument('--rate-limit-db', dest='rate_limit_db', default=None,
+                    help='Share rate limits with other trawler processes on this host through this SQLite file.')
+    parser.add_argument('--rate-limit-redis', dest='rate_limit_redis', default=None,
+                    help='Share rate limits with other trawler processes through the Redis server at HOST:PORT.')
+    parser.add_argument('--queue', dest='queue', default=None,
+                    help='Crawl the screen names in this work queue (sqlite:PATH, dir:PATH or redis://HOST:PORT/NAME) '
+                         'instead of --input, sharing them with any other workers using the queue.')
+    parser.add_argument('--enqueue', dest='enqueue', action='store_true',
+                    help='Add the screen names in --input to --queue, then exit.')
+    parser.add_argument('--schema', dest='schema', default='raw',
+                    help="Save Tweets with this schema: 'raw' (as returned by the API) or 'research-slim', which "
+                         "keeps the commonly used fields and saves each file's users once, in a separate file.")
     args = parser.parse_args()
 
     # Set up loggers and output directory
@@ -47,6 +69,13 @@ def main():
         exit(0)
     logger.info("Created directory: %s" % output_directory)
 
+    if args.queue:
+        work_queue = open_work_queue(args.queue)
+        if args.enqueue:
+            added = work_queue.put(iter_screen_names_from_file(args.screen_name_file))
+            logger.info("Added %d screen names to '%s': %s" % (added, args.queue, work_queue.counts()))
+            return
+
     # Set up API access
     if args.token_file.endswith('yaml'):
         #YAML file
@@ -61,22 +90,55 @@ def main():
         raise "Unrecognized token file type -- please use a .yaml or .py file following the examples"
             
     twython = get_connection( tokens['consumer_key'], tokens['consumer_secret'])
-    crawler = get_timeline_crawler( twython, logger=logger)
-
-    # Gather unique screen names
-    screen_names = get_screen_names_from_file(args.screen_name_file)
+    sink = None
+    if args.kafka:
+        from trawler_kafka import KafkaSink, TrawlerKafka
+        kafka_host, kafka_port = args.kafka.split(':')
+        sink = KafkaSink(TrawlerKafka(kafka_host, kafka_port, topic=args.kafka_topic, logger=logger))
+    metrics = Metrics()
+    if args.metrics_file:
+        metrics.add_backend(JSONLinesBackend(args.metrics_file))
+    if args.prometheus_port:
+        registry = MetricsRegistry()
+        metrics.add_backend(registry)
+        PrometheusExporter(registry, args.prometheus_port).start()
+    rate_limit_store = None
+    if args.rate_limit_db:
+        from trawler_rate_limits import SQLiteRateLimitStore
+        rate_limit_store = SQLiteRateLimitStore(args.rate_limit_db)
+    elif args.rate_limit_redis:
+        import redis
+        from trawler_rate_limits import RedisRateLimitStore
+        redis_host, redis_port = args.rate_limit_redis.split(':')
+        rate_limit_store = RedisRateLimitStore(redis.StrictRedis(redis_host, int(redis_port)))
+    crawler = get_timeline_crawler( twython, logger=logger, sink=sink, metrics=metrics,
+                                    registry=EndpointRegistry(rate_limit_store))
 
-    # Gather tweets for each of the unique screen names
-    # NB: in production, one should use `id` as an identifier (which does not change)
-    # rather than the `screen_name`, which can be changed at the users's whim.
-    for screen_name in screen_names:
+    def crawl_screen_name(screen_name):
         tweet_filename = output_directory + screen_name + ".tweets.gz" 
         if os.path.exists(tweet_filename):
             logger.info("File '%s' already exists - will not attempt to download Tweets for '%s'" % (tweet_filename, screen_name))
         else:
             tweets = crawler.get_all_timeline_tweets_for_screen_name( screen_name )
             #Write them out as one-JSON-object-per-line in a gzipped file
-            save_tweets_to_json_file(tweets, tweet_filename)
+            save_tweets_to_json_file(tweets, tweet_filename, schema=args.schema)
+
+    if args.queue:
+        # Every worker pulls screen names from the queue until none are left
+        run_worker(work_queue, crawl_screen_name, logger)
+    else:
+        # Gather unique screen names
+        screen_names = get_screen_names_from_file(args.screen_name_file)
+
+        # Gather tweets for each of the unique screen names
+        # NB: in production, one should use `id` as an identifier (which does not change)
+        # rather than the `screen_name`, which can be changed at the users's whim.
+        for screen_name in screen_names:
+            crawl_screen_name(screen_name)
+
+    if sink:
+        sink.close()
+    metrics.close()
 
 
 if __name__ == "__main__":
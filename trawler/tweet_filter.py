@@ -2,14 +2,22 @@
 """
 
 import codecs
-import json
+import hashlib
+import heapq
+import itertools
 import logging
+import multiprocessing
 import re
+import struct
 
 # Chromium Compact Language Detector
 #   https://pypi.python.org/pypi/chromium_compact_language_detector/ 
 import cld
 
+# Local modules
+from trawler_projection import TweetProjection
+from trawler_text import NORMALISE_PATHS, normalised_fields
+
 
 class FilteredTweetReader:
     """
@@ -22,46 +30,237 @@ class FilteredTweetReader:
       filtered_reader.open('tweet_filename')
       for json_tweet_string in filtered_reader:
           do_something(json_tweet_string)
+
+    Each line is decoded once, into just the fields the filters use,
+    rather than once by each filter.  With `paths` (dotted paths, e.g.
+    'user.id'), the reader returns a dictionary of those fields of each
+    Tweet instead of its JSON string.
+
+    open() takes one or more files, which are read one after another.
+    Reading stops once `limit` Tweets have passed the filters.  With
+    `sample_rate`, only that fraction of Tweets, chosen by a hash of
+    their IDs (and `sample_seed`), are passed to the filters at all, so
+    the same Tweets are sampled every time, and Tweets that are not
+    sampled cost only a scan for their ID.
     """
     def __del__(self):
         if self._tweet_file:
             self._tweet_file.close()
 
-    def __init__(self, filters=[], logger=None):
+    def __init__(self, filters=[], logger=None, paths=None, limit=None, sample_rate=None, sample_seed=0):
         # First filter is always a TweetFilterValidJSON instance
         self._filters = [TweetFilterValidJSON(logger)] + filters
+        self._paths = paths
+        self._limit = limit
+        self._sample_rate = sample_rate
+        self._sample_seed = sample_seed
+        self._projection = None
+        self._id_projection = TweetProjection(['id'])
         self._tweet_file = None
+        self._tweet_filenames = []
+        self._tweets_passed = 0
 
     def __iter__(self):
         return self
 
     def add_filter(self, filter):
         self._filters.append(filter)
+        self._projection = None
 
-    def open(self, tweet_filename):
-        self._tweet_file = codecs.open(tweet_filename, 'r', 'utf-8')
+    def open(self, *tweet_filenames):
+        self._tweet_filenames = list(tweet_filenames)
+        self._tweets_passed = 0
+        self._open_next_file()
 
     def close(self):
         self._tweet_file.close()
 
     def next(self):
-         while 1:
-             # _tweet_file.__next__() will throw a StopIteration if EOF reached
-             json_tweet_string = self._tweet_file.next()
+        return self._next_passed()[1]
+
+    def reservoir_sample(self, size):
+        """
+        Reads every remaining Tweet, and returns `size` of those that
+        pass the filters, chosen uniformly at random but reproducibly:
+        the Tweets whose IDs hash lowest with `sample_seed`.  They are
+        returned in the order read.
+        """
+        return [tweet for key, index, tweet in self._reservoir(size)]
+
+    def _reservoir(self, size):
+        """
+        Returns the (sample key, index, Tweet) of reservoir_sample()'s
+        Tweets
+        """
+        # A heap of the lowest keys so far, the highest (and, of equal
+        # keys, the last read) first
+        heap = []
+        for index, (tweet_id, tweet) in enumerate(iter(self._next_passed, None)):
+            entry = (-tweet_sample_key(tweet_id, self._sample_seed), -index, tweet)
+            if len(heap) < size:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+        return sorted(((-negative_key, -negative_index, tweet) for negative_key, negative_index, tweet in heap),
+                      key=lambda sample: sample[1])
+
+    def _next_passed(self):
+        """
+        Returns the (Tweet ID, Tweet) of the next Tweet to pass the
+        filters, raising StopIteration once there are none left or
+        `limit` have passed
+        """
+        while 1:
+            if self._limit is not None and self._tweets_passed >= self._limit:
+                raise StopIteration
+            json_tweet_string = self._next_line()
+
+            if self._sample_rate is not None:
+                try:
+                    tweet_id = self._id_projection.project(json_tweet_string).get('id')
+                except ValueError:
+                    # Rejected by TweetFilterValidJSON
+                    continue
+                if tweet_id is None or tweet_sample_key(tweet_id, self._sample_seed) >= self._sample_rate:
+                    continue
+
+            try:
+                fields = self._get_projection().project(json_tweet_string)
+            except ValueError:
+                # Rejected by TweetFilterValidJSON
+                continue
+
+            # Filters will stop being applied after the first filter fails
+            for filter in self._filters:
+                if filter.paths is None:
+                    passed = filter.filter(json_tweet_string)
+                else:
+                    passed = filter.filter_fields(fields)
+                if not passed:
+                    break
+            # The else clause runs when no break occurs before the 'for' loop completes
+            else:
+                self._tweets_passed += 1
+                if self._paths is None:
+                    return fields['id'], json_tweet_string
+                return fields['id'], dict((path, fields[path]) for path in self._paths if path in fields)
+
+    def _next_line(self):
+        while 1:
+            try:
+                return self._tweet_file.next()
+            except StopIteration:
+                if not self._tweet_filenames:
+                    raise
+                self._open_next_file()
+
+    def _open_next_file(self):
+        if self._tweet_file:
+            self._tweet_file.close()
+        self._tweet_file = codecs.open(self._tweet_filenames.pop(0), 'r', 'utf-8')
 
-             # Filters will stop being applied after the first filter fails
-             for filter in self._filters:
-                 if not filter.filter(json_tweet_string):
-                     break
-             # The else clause runs when no break occurs before the 'for' loop completes
-             else:
-                 return json_tweet_string
+    def _get_projection(self):
+        """
+        Returns a TweetProjection onto the fields used by every filter
+        """
+        if self._projection is None:
+            paths = set(self._paths or [])
+            exists = set()
+            for filter in self._filters:
+                if filter.paths is not None:
+                    paths.update(filter.paths)
+                    exists.update(filter.exists)
+            self._projection = TweetProjection(sorted(paths), sorted(exists - paths),
+                                               validate=any(filter.validate for filter in self._filters))
+        return self._projection
+
+
+def tweet_sample_key(tweet_id, seed=0):
+    """
+    Returns a number from 0 up to 1, the same for the same `tweet_id`
+    and `seed`, but otherwise as if chosen at random
+    """
+    digest = hashlib.md5('%s:%d' % (seed, int(tweet_id))).digest()
+    return struct.unpack('>Q', digest[:8])[0] / 18446744073709551616.0
+
+
+def filter_files(tweet_filenames, create_reader, processes=None, limit=None):
+    """
+    Yields the Tweets in `tweet_filenames` that pass the filters of a
+    FilteredTweetReader returned by `create_reader()` (a function that
+    can be pickled, e.g. one defined at module level), reading the files
+    on a pool of `processes` processes, one reader per file.
+
+    Tweets are yielded in the order a single reader would yield them,
+    stopping once `limit` have been yielded.  Each process has its own
+    reader, so filters that remember what they have seen (e.g.
+    TweetFilterOneTweetPerScreenName) only do so within a file.
+    """
+    pool = multiprocessing.Pool(processes)
+    try:
+        tweet_count = 0
+        jobs = [(create_reader, tweet_filename, limit, None) for tweet_filename in tweet_filenames]
+        for tweets in pool.imap(_filter_file, jobs):
+            for tweet in tweets:
+                if limit is not None and tweet_count >= limit:
+                    return
+                tweet_count += 1
+                yield tweet
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def reservoir_sample_files(tweet_filenames, create_reader, size, processes=None):
+    """
+    Returns the same Tweets as reservoir_sample() would for a single
+    reader over `tweet_filenames`, reading the files in parallel as
+    filter_files() does
+    """
+    pool = multiprocessing.Pool(processes)
+    try:
+        jobs = [(create_reader, tweet_filename, None, size) for tweet_filename in tweet_filenames]
+        samples = []
+        for file_number, reservoir in enumerate(pool.imap(_filter_file, jobs)):
+            samples.extend((key, file_number, index, tweet) for key, index, tweet in reservoir)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return [tweet for key, file_number, index, tweet in
+            sorted(heapq.nsmallest(size, samples), key=lambda sample: sample[1:3])]
+
+
+def _filter_file(args):
+    """
+    Returns the Tweets (up to `limit`) in a file that pass the filters,
+    or the (sample key, index, Tweet) of its reservoir of `size` Tweets
+    """
+    create_reader, tweet_filename, limit, size = args
+    reader = create_reader()
+    reader.open(tweet_filename)
+    try:
+        if size is not None:
+            return reader._reservoir(size)
+        return list(itertools.islice(reader, limit))
+    finally:
+        reader.close()
 
 
 class TweetFilter:
     """
-    Base class for other TweetFilters
+    Base class for other TweetFilters.
+
+    Subclasses either override filter(), which is passed the JSON Tweet
+    string, or set `paths` (and `exists`) to the dotted paths of the
+    fields they use, and override filter_fields(), which is passed a
+    dictionary of those fields as returned by TweetProjection.project().
     """
+    paths = None
+    exists = ()
+    # Whether the whole Tweet must be decoded to check that it is valid JSON
+    validate = False
     def __init__(self, logger=None):
         if logger is None:
             # Log INFO and above to stderr
@@ -74,6 +273,13 @@ class TweetFilter:
             self._logger = logger
 
     def filter(self, json_tweet_string):
+        if self.paths is None:
+            raise NotImplementedError
+        if getattr(self, '_projection', None) is None:
+            self._projection = TweetProjection(self.paths, self.exists, validate=self.validate)
+        return self.filter_fields(self._projection.project(json_tweet_string))
+
+    def filter_fields(self, fields):
         raise NotImplementedError
 
 
@@ -81,10 +287,11 @@ class TweetFilterReliablyEnglish(TweetFilter):
     """
     Returns true IFF Chromium Compact Language Detector claims that Tweet is English.
     """
-    def filter(self, json_tweet_string):
-        tweet = json.loads(json_tweet_string)
+    paths = NORMALISE_PATHS
+
+    def filter_fields(self, fields):
         # CLD expects a bytestring encoded as UTF-8, and not a unicode string
-        tweet_text = codecs.encode(tweet['text'], 'utf-8')
+        tweet_text = codecs.encode(normalised_fields(fields)['text'], 'utf-8')
         # Per the CLD docs, "isReliable is True if the top language is much better than 2nd best language."
         topLanguageName, topLanguageCode, isReliable, textBytesFound, details = cld.detect(tweet_text)
         if topLanguageName == "ENGLISH" and isReliable:
@@ -94,22 +301,21 @@ class TweetFilterReliablyEnglish(TweetFilter):
 
 
 class TweetFilterNoURLs(TweetFilter):
-    def filter(self, json_tweet_string):
-        tweet = json.loads(json_tweet_string)
-        if re.search(r'https?://', tweet['text']):
-            return False
-        else:
-            return True
+    paths = NORMALISE_PATHS
+
+    def filter_fields(self, fields):
+        return not normalised_fields(fields)['has_url']
 
 
 class TweetFilterOneTweetPerScreenName(TweetFilter):
+    paths = ('user.screen_name',)
+
     def __init__(self, logger=None):
         self._screen_name_set = set()
         TweetFilter.__init__(self, logger=logger)
 
-    def filter(self, json_tweet_string):
-        tweet = json.loads(json_tweet_string)
-        screen_name = tweet['user']['screen_name']
+    def filter_fields(self, fields):
+        screen_name = fields['user.screen_name']
         if not screen_name in self._screen_name_set:
             self._screen_name_set.add(screen_name)
             return True
@@ -121,15 +327,14 @@ class TweetFilterFieldMatchesRegEx(TweetFilter):
     def __init__(self, tweet_field, regex, logger=None):
         self._regex = regex
         self._tweet_field = tweet_field
+        self.paths = (tweet_field,)
         TweetFilter.__init__(self, logger=logger)
 
-    def filter(self, json_tweet_string):
+    def filter_fields(self, fields):
         """
-        Returns True if the Tweet field for the json_tweet_string
-        matches the regex
+        Returns True if the Tweet field matches the regex
         """
-        tweet = json.loads(json_tweet_string)
-        if re.search(self._regex, tweet[self._tweet_field]):
+        if re.search(self._regex, fields[self._tweet_field]):
             return True
         else:
             return False
@@ -139,13 +344,15 @@ class TweetFilterIDSet(TweetFilter):
     """
     Base class for TweetFilterIDInSet and TweetFilterIDNotInSet
     """
+    paths = ('id', 'id_str')
+
     def __init__(self, logger=None):
         self._tweet_id_set = set()
+        self._id_projection = TweetProjection(['id'])
         TweetFilter.__init__(self, logger=logger)
 
     def add_tweet(self, json_tweet_string):
-        tweet = json.loads(json_tweet_string)
-        self._tweet_id_set.add(tweet['id'])
+        self._tweet_id_set.add(self._id_projection.project(json_tweet_string)['id'])
 
     def add_tweets(self, json_tweet_string_list):
         for json_tweet_string in json_tweet_string_list:
@@ -157,64 +364,56 @@ class TweetFilterIDSet(TweetFilter):
     def add_tweet_ids(self, tweet_ids):
         self._tweet_id_set.update(tweet_ids)
 
-    def filter(self, json_tweet_string):
+    def filter_fields(self, fields):
         raise NotImplementedError
 
 
 class TweetFilterTweetIDInSet(TweetFilterIDSet):
-    def filter(self, json_tweet_string):
+    def filter_fields(self, fields):
         """
         Returns True if the Tweet's ID is in the existing set
         """
-        tweet = json.loads(json_tweet_string)
-        return (tweet['id'] in self._tweet_id_set) or (tweet['id_str'] in self._tweet_id_set)
+        return (fields['id'] in self._tweet_id_set) or (fields['id_str'] in self._tweet_id_set)
 
 
 class TweetFilterTweetIDNotInSet(TweetFilterIDSet):
-    def filter(self, json_tweet_string):
+    def filter_fields(self, fields):
         """
         Returns True if the Tweet's ID is not in the existing set
         """
-        tweet = json.loads(json_tweet_string)
-        return (tweet['id'] not in self._tweet_id_set) and (tweet['id_str'] not in self._tweet_id_set)
+        return (fields['id'] not in self._tweet_id_set) and (fields['id_str'] not in self._tweet_id_set)
 
 
 class TweetFilterNotARetweet(TweetFilter):
-    def filter(self, json_tweet_string):
+    paths = NORMALISE_PATHS
+
+    def filter_fields(self, fields):
         """
-        Returns True if json_tweet_string is not a retweet
+        Returns True if the Tweet is not a retweet, either one that the
+        Twitter API considers to be a retweet, or one that starts with
+        'RT', even if not "officially" a retweet
         """
-        tweet = json.loads(json_tweet_string)
+        return not normalised_fields(fields)['is_retweet']
 
-        if 'retweeted_status' in tweet:
-            # Reject Tweets that the Twitter API considers to be retweets
-            return False
-        elif re.match(r'\s*RT\b', tweet['text']):
-            # Reject Tweets that start with 'RT', even if not "officially" a retweet
-            return False
-        else:
-            return True
-        
 
 class TweetFilterValidJSON(TweetFilter):
+    paths = ('id', 'id_str', 'text', 'full_text', 'user.screen_name')
+    validate = True
+
     def filter(self, json_tweet_string):
         """
         Returns True if json_tweet_string is a parsable JSON Tweet object
         """
         try:
-            tweet = json.loads(json_tweet_string)
+            return TweetFilter.filter(self, json_tweet_string)
         except ValueError:
 #            self._logger.warning("JSON Tweet object could not be parsed")
             return False
-        else:
-            if type(tweet) is dict:
-                for tweet_field in ['id', 'id_str', 'text', 'user']:
-                    if tweet_field not in tweet:
-#                        self._logger.warning("JSON Tweet object did not have a '%s' field" % tweet_field)
-                        return False
-                if 'screen_name' not in tweet['user']:
-                    return False
-                return True
-            else:
-#                self._logger.warning("JSON Tweet object evalauted to a %s instead of a dict" % type(tweet))
+
+    def filter_fields(self, fields):
+        for tweet_field in ['id', 'id_str', 'user.screen_name']:
+            if tweet_field not in fields:
+#                self._logger.warning("JSON Tweet object did not have a '%s' field" % tweet_field)
                 return False
+        # Tweets fetched with tweet_mode='extended' have 'full_text' instead of 'text'
+        return 'text' in fields or 'full_text' in fields
@@ -40,7 +40,7 @@ class TweetFilterTimelineDownloadable(TweetFilter):
 
         try:
             self._logger.info("Retrieving Tweets for user '%s'" % screen_name)
-            tweets = self._crawler.get_data(screen_name=screen_name, count=200)
+            tweets = self._crawler.get_data(screen_name=screen_name, count=200, tweet_mode='extended')
         except TwythonError as e:
             print "TwythonError: %s" % e
             if e.error_code == 404:
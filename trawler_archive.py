@@ -0,0 +1,243 @@
+"""
+A secondary index over an archive of Tweet files, for fetching a Tweet
+by ID, or a user's Tweets between two times, without decompressing and
+parsing whole files.
+
+  index = ArchiveIndex('archive.db')
+  for filename in glob.glob('tweets/*.tweets.gz'):
+      index.index_file(filename)
+  tweet = index.get_tweet(1234567890)
+  tweets = index.user_tweets(12, since=start_time, until=end_time)
+
+The index is a SQLite database holding, for each Tweet ID, the file,
+the offset of the compressed block and the line within the block that
+hold the Tweet, and for each user the range of their Tweet IDs and
+times.  Blocks are the members of a multi-member gzip file, which any
+gzip reader reads as one stream, but which can each be decompressed on
+their own from their offset.  BlockGzipWriter writes such files, and
+rewrite_in_blocks() converts existing ones; files gzipped as a single
+member can still be indexed, but are one block long.
+"""
+
+# Standard Library modules
+import os
+import sqlite3
+import zlib
+
+try:
+    import ujson as json #much quicker
+except:
+    import json
+
+# Local modules
+from trawler_projection import TweetProjection
+from twitter_crawler import open_json_file, parse_twitter_time
+
+
+# zlib's window bits for reading and writing gzip headers and trailers
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class BlockGzipWriter:
+    """
+    Writes lines to `filename` as a gzip file with a new member every
+    `lines_per_block` lines, so that each block can be decompressed on
+    its own.  write_line() returns the (block offset, line in block) the
+    line was written at.
+    """
+    def __init__(self, filename, lines_per_block=1000, compresslevel=9):
+        self._file = open(filename, 'wb')
+        self._lines_per_block = lines_per_block
+        self._compresslevel = compresslevel
+        self._lines = []
+        self._block_offset = 0
+
+    def write_line(self, line):
+        if not line.endswith('\n'):
+            line += '\n'
+        self._lines.append(line)
+        position = (self._block_offset, len(self._lines) - 1)
+        if len(self._lines) >= self._lines_per_block:
+            self._write_block()
+        return position
+
+    def write_tweets(self, tweets):
+        for tweet in tweets:
+            self.write_line(unicode("%s\n" % json.dumps(tweet)).encode('utf-8'))
+
+    def close(self):
+        self._write_block()
+        self._file.close()
+
+    def _write_block(self):
+        if self._lines:
+            compressor = zlib.compressobj(self._compresslevel, zlib.DEFLATED, GZIP_WBITS)
+            self._file.write(compressor.compress(''.join(self._lines)) + compressor.flush())
+            self._block_offset = self._file.tell()
+            self._lines = []
+
+
+def iter_gzip_blocks(filename, chunk_size=65536):
+    """
+    Yields the (offset, decompressed data) of each member of gzip file
+    `filename`
+    """
+    with open(filename, 'rb') as gzip_file:
+        offset = 0
+        data = gzip_file.read(chunk_size)
+        while data:
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+            parts = []
+            consumed = 0
+            while data:
+                parts.append(decompressor.decompress(data))
+                if decompressor.unused_data:
+                    # The start of the next member
+                    consumed += len(data) - len(decompressor.unused_data)
+                    data = decompressor.unused_data
+                    break
+                consumed += len(data)
+                data = gzip_file.read(chunk_size)
+            parts.append(decompressor.flush())
+            yield offset, ''.join(parts)
+            offset += consumed
+
+
+def read_gzip_block(filename, offset, chunk_size=65536):
+    """
+    Returns the decompressed data of the gzip member at `offset`
+    """
+    with open(filename, 'rb') as gzip_file:
+        gzip_file.seek(offset)
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+        parts = []
+        data = gzip_file.read(chunk_size)
+        while data and not decompressor.unused_data:
+            parts.append(decompressor.decompress(data))
+            data = gzip_file.read(chunk_size)
+        parts.append(decompressor.flush())
+        return ''.join(parts)
+
+
+def rewrite_in_blocks(json_filename, output_filename=None, lines_per_block=1000):
+    """
+    Rewrites a file of Tweets (gzipped or not) as a BlockGzipWriter file
+    named `output_filename`, by default replacing `json_filename`
+    """
+    output_filename = output_filename or json_filename
+    temporary_filename = output_filename + '.tmp'
+    writer = BlockGzipWriter(temporary_filename, lines_per_block)
+    json_file = open_json_file(json_filename)
+    try:
+        for line in json_file:
+            if line.strip():
+                writer.write_line(line)
+    finally:
+        json_file.close()
+        writer.close()
+    os.rename(temporary_filename, output_filename)
+
+
+class ArchiveIndex:
+    """
+    Indexes gzipped Tweet files in the SQLite database `filename`, which
+    is created if necessary.
+    """
+    def __init__(self, filename, timeout=30.0):
+        self._connection = sqlite3.connect(filename, timeout=timeout)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS files (file_id INTEGER PRIMARY KEY, filename TEXT UNIQUE);
+            CREATE TABLE IF NOT EXISTS tweets (tweet_id INTEGER PRIMARY KEY, file_id INTEGER,
+                                               block_offset INTEGER, line INTEGER,
+                                               user_id INTEGER, created_at REAL);
+            CREATE INDEX IF NOT EXISTS tweets_by_user ON tweets (user_id, created_at);
+            CREATE INDEX IF NOT EXISTS tweets_by_file ON tweets (file_id);
+            CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, tweet_count INTEGER,
+                                              min_tweet_id INTEGER, max_tweet_id INTEGER,
+                                              first_created_at REAL, last_created_at REAL);
+        """)
+
+    def index_file(self, json_filename):
+        """
+        Adds the Tweets in gzip file `json_filename` to the index, in
+        place of any indexed from it before, and returns their number
+        """
+        json_filename = os.path.abspath(json_filename)
+        with self._connection:
+            self._connection.execute('INSERT OR IGNORE INTO files (filename) VALUES (?)', (json_filename,))
+            file_id = self._connection.execute('SELECT file_id FROM files WHERE filename = ?',
+                                               (json_filename,)).fetchone()[0]
+            user_ids = set(row[0] for row in self._connection.execute(
+                'SELECT DISTINCT user_id FROM tweets WHERE file_id = ?', (file_id,)))
+            self._connection.execute('DELETE FROM tweets WHERE file_id = ?', (file_id,))
+            tweet_count = 0
+            projection = TweetProjection(['created_at', 'id', 'user.id'])
+            for block_offset, data in iter_gzip_blocks(json_filename):
+                rows = []
+                for line_number, line in enumerate(data.splitlines()):
+                    if line.strip():
+                        fields = projection.project(line)
+                        rows.append((fields['id'], file_id, block_offset, line_number, fields['user.id'],
+                                     parse_twitter_time(fields['created_at'])))
+                        user_ids.add(fields['user.id'])
+                self._connection.executemany('INSERT OR REPLACE INTO tweets VALUES (?, ?, ?, ?, ?, ?)', rows)
+                tweet_count += len(rows)
+            self._update_users(user_ids)
+        return tweet_count
+
+    def get_tweet(self, tweet_id):
+        """
+        Returns the Tweet with ID `tweet_id`, or None if it is not in
+        the index
+        """
+        row = self._connection.execute('SELECT filename, block_offset, line FROM tweets '
+                                       'JOIN files USING (file_id) WHERE tweet_id = ?', (tweet_id,)).fetchone()
+        if row is None:
+            return None
+        filename, block_offset, line = row
+        return json.loads(read_gzip_block(filename, block_offset).splitlines()[line])
+
+    def user_tweets(self, user_id, since=None, until=None):
+        """
+        Returns `user_id`'s indexed Tweets created from Unix time `since`
+        up to (but not including) `until`, newest first
+        """
+        query = 'SELECT filename, block_offset, line FROM tweets JOIN files USING (file_id) WHERE user_id = ?'
+        parameters = [user_id]
+        if since is not None:
+            query += ' AND created_at >= ?'
+            parameters.append(since)
+        if until is not None:
+            query += ' AND created_at < ?'
+            parameters.append(until)
+        query += ' ORDER BY created_at DESC, tweet_id DESC'
+        # Each block is decompressed once, however many Tweets it holds
+        blocks = {}
+        tweets = []
+        for filename, block_offset, line in self._connection.execute(query, parameters).fetchall():
+            if (filename, block_offset) not in blocks:
+                blocks[(filename, block_offset)] = read_gzip_block(filename, block_offset).splitlines()
+            tweets.append(json.loads(blocks[(filename, block_offset)][line]))
+        return tweets
+
+    def user_ranges(self, user_id):
+        """
+        Returns a dictionary of the number, the lowest and highest IDs,
+        and the first and last times of `user_id`'s indexed Tweets, or
+        None if the user has none
+        """
+        row = self._connection.execute('SELECT tweet_count, min_tweet_id, max_tweet_id, first_created_at, '
+                                       'last_created_at FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(['tweet_count', 'min_tweet_id', 'max_tweet_id', 'first_created_at', 'last_created_at'], row))
+
+    def close(self):
+        self._connection.close()
+
+    def _update_users(self, user_ids):
+        for user_id in user_ids:
+            self._connection.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+            self._connection.execute('INSERT INTO users SELECT user_id, COUNT(*), MIN(tweet_id), MAX(tweet_id), '
+                                     'MIN(created_at), MAX(created_at) FROM tweets WHERE user_id = ? '
+                                     'GROUP BY user_id', (user_id,))
@@ -2,7 +2,16 @@
 For generic interaction with a kafka stream.
 """
 
+import logging
+import multiprocessing
+import Queue
+
 from pykafka import KafkaClient
+from pykafka.common import CompressionType
+from pykafka.partitioners import RandomPartitioner, hashing_partitioner
+
+# Local modules
+from twitter_crawler import CrawlSink
 
 
 try:
@@ -10,34 +19,80 @@ try:
 except:
     import json
 
+
+COMPRESSION_TYPES = {None: CompressionType.NONE,
+                     'none': CompressionType.NONE,
+                     'gzip': CompressionType.GZIP,
+                     'snappy': CompressionType.SNAPPY,
+                     'lz4': CompressionType.LZ4}
+
+
 class TrawlerKafka:
-    def __init__(self, host, port, topic='trawler'):
+    def __init__(self, host, port, topic='trawler', linger_ms=500, batch_size=1000,
+                 compression='gzip', max_pending_messages=20000, key_by_user=True,
+                 logger=None, kafka_client=None):
         """
         Connect to a running Kafka instance on `host` and
         `port`, and return closures around this to easily
         push tweets to it.
+
+        Tweets are produced asynchronously: the producer collects up to
+        `batch_size` messages, or waits at most `linger_ms`, before
+        sending a `compression` ('gzip', 'snappy', 'lz4' or None)
+        compressed batch to the broker.  When `key_by_user` is set each
+        tweet is keyed by its user ID, so all of a user's tweets land on
+        the same partition.  Other records are keyed by their own ID
+        (so user objects land with their user's tweets) or, without
+        one, spread across the partitions in turn.  Otherwise messages
+        are spread across the partitions in turn.
+
+        Delivery reports are tracked in `messages_delivered` and
+        `messages_failed`.  Once `max_pending_messages` tweets are
+        waiting for the broker to acknowledge them, sending blocks until
+        some are acknowledged, so a slow broker pauses the crawler that
+        is feeding it instead of letting memory grow without bound.
+
+        An already connected `kafka_client` (a pykafka.KafkaClient, or
+        anything with the same `topics` interface) may be passed in
+        instead of connecting to `host` and `port`.
         """
+        if logger is None:
+            self._logger = logging.getLogger(__name__)
+        else:
+            self._logger = logger
 
-        kafka_client = KafkaClient(hosts="%s:%s" % (host,port))
+        if kafka_client is None:
+            kafka_client = KafkaClient(hosts="%s:%s" % (host,port))
         topic = kafka_client.topics[topic]
-        producer = topic.get_producer()
+        producer = topic.get_producer(linger_ms=linger_ms,
+                                      min_queued_messages=batch_size,
+                                      max_queued_messages=max(max_pending_messages, batch_size),
+                                      block_on_queue_full=True,
+                                      compression=COMPRESSION_TYPES[compression],
+                                      partitioner=hashing_partitioner if key_by_user else RandomPartitioner(),
+                                      delivery_reports=True)
         self.client = kafka_client
         self.topic = topic
         self.producer = producer
-        """self.consumer = topic.get_simple_consumer(consumer_group='mygroup',
-                                                  #auto_offset_reset=OffsetType.EARLIEST,
-                                                  reset_offset_on_start=False)
-                                                  """
-        #self.consumer.start()
-        #self.consumer.
-        self.consumer = topic.get_simple_consumer()
-        
-    def send_individual_tweets( self, tweets):
+        self.consumer = None
+        self._key_by_user = key_by_user
+        self._max_pending_messages = max_pending_messages
+        self.messages_sent = 0
+        self.messages_delivered = 0
+        self.messages_failed = 0
+
+    def send_individual_tweets( self, tweets, partition_key=None):
         """
         Send each tweet in `tweets` as an individual Kafka message. 
+        `partition_key` overrides the per-user key for every message.
         """
         for tweet in tweets:
-            self.producer.produce([json.dumps(tweet)])
+            if self.pending_messages >= self._max_pending_messages:
+                self._collect_delivery_reports()
+            self.producer.produce(encode_message(tweet),
+                                  partition_key=partition_key or self._partition_key(tweet))
+            self.messages_sent += 1
+        self._collect_delivery_reports()
 
     def send_individual_tweet( self, tweet):
         """
@@ -48,20 +103,238 @@ class TrawlerKafka:
 
     def send_bulk_tweets( self, tweets):
         """
-        Send `tweets` in bulk as a single kafka message.
+        Send `tweets` in bulk.
+
+        Each tweet is still its own message -- a single message holding
+        the whole list could exceed the broker's maximum message size --
+        but the producer batches and compresses them together.
+        """
+        self.send_individual_tweets(tweets)
+
+    @property
+    def pending_messages(self):
+        """
+        Number of messages sent that the broker has not yet acknowledged.
+        """
+        return self.messages_sent - self.messages_delivered - self.messages_failed
+
+    def flush(self):
+        """
+        Block until the broker has acknowledged (or rejected) every
+        message sent so far.
+        """
+        while self.pending_messages > 0:
+            self._collect_delivery_report(block=True)
+
+    def close(self):
+        """
+        Flush outstanding messages and stop the producer.
         """
-        self.producer.produce(json.dumps(tweets))
+        self.flush()
+        self.producer.stop()
+
+    def _partition_key(self, tweet):
+        if not self._key_by_user:
+            # Ignored by the RandomPartitioner
+            return None
+        if isinstance(tweet, dict):
+            if isinstance(tweet.get('user'), dict) and 'id' in tweet['user']:
+                return str(tweet['user']['id'])
+            if 'id' in tweet:
+                return str(tweet['id'])
+        # The hashing partitioner rejects None, so records with no ID are
+        # keyed by their number instead
+        return str(self.messages_sent)
+
+    def _collect_delivery_reports(self):
+        # Delivery reports are queued per producing thread, so they are
+        # always drained here, on the thread that sent the messages
+        while self._collect_delivery_report(block=False):
+            pass
+        while self.pending_messages >= self._max_pending_messages:
+            self._collect_delivery_report(block=True)
+
+    def _collect_delivery_report(self, block):
+        try:
+            message, exception = self.producer.get_delivery_report(block=block, timeout=1)
+        except Queue.Empty:
+            return False
+        if exception is None:
+            self.messages_delivered += 1
+        else:
+            self.messages_failed += 1
+            self._logger.error("Kafka message with key '%s' was not delivered: %s" % (message.partition_key, exception))
+        return True
 
     def get_tweets(self):
         """
         Get and reconstitute tweets from a kafka queue
         """
+        if self.consumer is None:
+            self.consumer = self.topic.get_simple_consumer()
         for message in self.consumer:
             if message is not None:
                 tweet = json.loads(message.value)
                 yield tweet
 
-        
+    def get_tweet_batches(self, consumer_group, batch_size=1000, batch_timeout_ms=1000,
+                          decode_workers=None, filters=None, zookeeper_connect=None):
+        """
+        Yield lists of up to `batch_size` tweets read as a member of
+        `consumer_group`.
+
+        Partitions of the topic are shared out between every process
+        reading with the same `consumer_group`, and rebalanced as
+        processes come and go.  The group's offsets are committed each
+        time the next batch is requested, i.e. once the previous batch
+        has been handled, so a restarted process resumes after the last
+        batch it finished rather than reprocessing the topic.
+
+        Each message is passed through `filters` (TweetFilter instances,
+        applied in order as in a FilteredTweetReader) and, if it passes,
+        its JSON is decoded.  Both steps run on a pool of
+        `decode_workers` processes (or in this process, if None), each
+        worker handling a share of the batch.  Each worker has its own
+        copy of the filters, so filters that remember what they have
+        seen (e.g. TweetFilterOneTweetPerScreenName) only do so within a
+        worker.  Messages that are not valid JSON are dropped.  A
+        partial batch is yielded when no message arrives for
+        `batch_timeout_ms`, and offsets are committed even when every
+        message in a batch was filtered out.
+
+        The group is coordinated by Kafka itself unless a ZooKeeper
+        `zookeeper_connect` string is given.
+        """
+        consumer = self.topic.get_balanced_consumer(consumer_group=consumer_group,
+                                                    managed=zookeeper_connect is None,
+                                                    zookeeper_connect=zookeeper_connect,
+                                                    auto_commit_enable=False,
+                                                    consumer_timeout_ms=batch_timeout_ms)
+        pool = None
+        if decode_workers:
+            pool = multiprocessing.Pool(decode_workers, _set_worker_filters, (filters,))
+        try:
+            while 1:
+                json_tweet_strings = []
+                while len(json_tweet_strings) < batch_size:
+                    message = consumer.consume()
+                    if message is None:
+                        break
+                    json_tweet_strings.append(message.value)
+
+                if not json_tweet_strings:
+                    continue
+                if pool:
+                    tweets = pool.map(_filter_and_decode_in_worker, json_tweet_strings,
+                                      chunksize=max(len(json_tweet_strings) // (4 * decode_workers), 1))
+                else:
+                    tweets = [filter_and_decode_message(json_tweet_string, filters)
+                              for json_tweet_string in json_tweet_strings]
+                tweets = [tweet for tweet in tweets if tweet is not None]
+                if tweets:
+                    yield tweets
+                consumer.commit_offsets()
+        finally:
+            if pool:
+                pool.terminate()
+            consumer.stop()
+
+
+
+class KafkaSink(CrawlSink):
+    """
+    CrawlSink that sends each page fetched by a crawler to Kafka as soon
+    as it arrives.
+
+    Tweets and user objects are sent as individual messages through
+    `trawler_kafka` (a TrawlerKafka instance), keyed as it keys them;
+    pages of user IDs (e.g. from 'followers/ids') are sent as a single
+    {"endpoint": ..., "key": ..., "ids": [...]} message keyed by the
+    user they were crawled for, or by the endpoint and first ID of the
+    page for IDs not crawled for a user.  `topics` may map endpoint names to
+    other TrawlerKafka instances, to keep e.g. Tweets and follower IDs
+    on separate topics.
+
+    Sending blocks while the broker is behind, which pauses the crawler.
+    """
+    def __init__(self, trawler_kafka, topics=None):
+        self._trawler_kafka = trawler_kafka
+        self._topics = topics or {}
+
+    def publish(self, records, endpoint, key=None):
+        trawler_kafka = self._topics.get(endpoint, self._trawler_kafka)
+        if records and isinstance(records[0], dict):
+            trawler_kafka.send_individual_tweets(records)
+        else:
+            if key is not None:
+                partition_key = str(key)
+            else:
+                partition_key = '%s:%s' % (endpoint, records[0] if records else '')
+            trawler_kafka.send_individual_tweets([{'endpoint': endpoint, 'key': key, 'ids': records}],
+                                                 partition_key=partition_key)
+
+    def flush(self):
+        for trawler_kafka in self._trawler_kafkas():
+            trawler_kafka.flush()
+
+    def close(self):
+        """
+        Flushes and stops the producer of every TrawlerKafka.
+        """
+        for trawler_kafka in self._trawler_kafkas():
+            trawler_kafka.close()
+
+    def _trawler_kafkas(self):
+        trawler_kafkas = [self._trawler_kafka]
+        for trawler_kafka in self._topics.values():
+            if trawler_kafka not in trawler_kafkas:
+                trawler_kafkas.append(trawler_kafka)
+        return trawler_kafkas
+
+
+def decode_message(json_tweet_string):
+    """
+    Reconstitute a tweet from a Kafka message, or None if the message
+    is not valid JSON.
+    """
+    try:
+        return json.loads(json_tweet_string)
+    except ValueError:
+        return None
+
+
+def filter_and_decode_message(json_tweet_string, filters=None):
+    """
+    Reconstitute a tweet from a Kafka message if it passes every one of
+    `filters`, otherwise (or if the message is not valid JSON) None.
+    """
+    for filter in filters or []:
+        if not filter.filter(json_tweet_string):
+            return None
+    return decode_message(json_tweet_string)
+
+
+# The filters used by each get_tweet_batches() pool worker process
+_worker_filters = None
+
+def _set_worker_filters(filters):
+    global _worker_filters
+    _worker_filters = filters
+
+def _filter_and_decode_in_worker(json_tweet_string):
+    return filter_and_decode_message(json_tweet_string, _worker_filters)
+
+
+def encode_message(tweet):
+    """
+    Serialize `tweet` to the UTF-8 encoded JSON bytes Kafka expects.
+    """
+    message = json.dumps(tweet)
+    if isinstance(message, unicode):
+        message = message.encode('utf-8')
+    return message
+
+
 if __name__ == '__main__':
     """
     Run standalone to test
@@ -72,6 +345,7 @@ if __name__ == '__main__':
     tweets = [{'text':'tweet tweet','timestamp':dt.datetime.now().isoformat()},{'text':'tweety tweet tweet'},{'text':'tweety tweet tweety tweet'}]
     for i in range(10):
         trawler_kafka.send_individual_tweets(tweets)
+    trawler_kafka.flush()
 
     print "------------------------"
 
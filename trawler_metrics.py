@@ -0,0 +1,364 @@
+"""
+Structured metrics for crawls: counters, gauges and histograms with
+labels (e.g. endpoint and token), fanned out to pluggable backends.
+
+  metrics = Metrics([MetricsRegistry(), StatsDBackend('localhost', 8125)])
+  crawler = get_timeline_crawler(twython, metrics=metrics)
+
+Backends:
+  MetricsRegistry -- aggregates in memory; can be served in the
+                     Prometheus text format by PrometheusExporter
+  StatsDBackend   -- sends each event over UDP as it happens
+  JSONLinesBackend -- appends each event to a file as a JSON object
+
+Span hooks are callables taking (name, labels) and returning a context
+manager, which is entered around each request, e.g. to start an
+OpenTracing span.
+"""
+
+# Standard Library modules
+import BaseHTTPServer
+import bisect
+import hashlib
+import re
+import socket
+import threading
+import time
+
+try:
+    import ujson as json #much quicker
+except:
+    import json
+
+
+# Upper bounds (in seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Metrics recorded by RateLimitedTwitterEndpoint, all labelled with
+# 'endpoint' and 'token'
+REQUESTS = 'trawler_requests_total'                 # label 'status': HTTP status, or 'error' if none
+REQUEST_SECONDS = 'trawler_request_seconds'         # histogram
+RECORDS = 'trawler_records_total'                   # Tweets, IDs, users or lists returned
+RATE_LIMIT_ERRORS = 'trawler_rate_limit_errors_total'
+RETRIES = 'trawler_retries_total'                   # label 'reason': 'rate_limit', 'server_error' or 'empty_response'
+SLEEP_SECONDS = 'trawler_sleep_seconds_total'       # label 'reason': 'rate_limit', 'backoff' or 'circuit_open'
+QUOTA_REMAINING = 'trawler_quota_remaining'         # gauge
+CIRCUIT_BREAKER_TRIPS = 'trawler_circuit_breaker_trips_total'
+
+# Metrics recorded by twitter_crawler.CrawlScheduler, labelled with
+# 'endpoint' and 'priority' (the task's priority class)
+QUEUE_SECONDS = 'trawler_queue_seconds'             # histogram: time from submit to start
+DEADLINES_MISSED = 'trawler_deadlines_missed_total' # tasks started after their deadline
+
+
+def token_label(twython):
+    """
+    Returns a short, stable label for the API key a Twython instance
+    uses, without exposing the key itself.
+    """
+    app_key = getattr(twython, 'app_key', None) or ''
+    return hashlib.sha1(app_key.encode('utf-8')).hexdigest()[:8]
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class MetricsBackend:
+    """
+    Base class for metrics backends.  `labels` is a dictionary of
+    label names to values.
+    """
+    def increment(self, name, value, labels):
+        raise NotImplementedError
+
+    def gauge(self, name, value, labels):
+        raise NotImplementedError
+
+    def observe(self, name, value, labels):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # The last count is for observations above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry(MetricsBackend):
+    """
+    Keeps running totals of every counter, the latest value of every
+    gauge and a histogram of every observed metric, per set of labels.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def increment(self, name, value, labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, labels):
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self._buckets)
+            self.histograms[key].observe(value)
+
+    def total(self, name, **labels):
+        """
+        Returns the sum of counter `name` over every set of labels that
+        includes `labels`, e.g. total(REQUESTS, endpoint='users/lookup')
+        """
+        with self._lock:
+            return sum(value for (counter_name, label_key), value in self.counters.items()
+                       if counter_name == name and set(labels.items()) <= set(label_key))
+
+    def snapshot(self):
+        """
+        Returns every metric as a list of dictionaries
+        """
+        with self._lock:
+            metrics = []
+            for (name, label_key), value in sorted(self.counters.items()):
+                metrics.append({'metric': name, 'type': 'counter', 'labels': dict(label_key), 'value': value})
+            for (name, label_key), value in sorted(self.gauges.items()):
+                metrics.append({'metric': name, 'type': 'gauge', 'labels': dict(label_key), 'value': value})
+            for (name, label_key), histogram in sorted(self.histograms.items()):
+                metrics.append({'metric': name, 'type': 'histogram', 'labels': dict(label_key),
+                                'buckets': list(histogram.buckets), 'counts': list(histogram.counts),
+                                'sum': histogram.sum, 'count': histogram.count})
+            return metrics
+
+    def prometheus_text(self):
+        """
+        Returns every metric in the Prometheus text exposition format
+        """
+        lines = []
+        typed = set()
+        for metric in self.snapshot():
+            name = metric['metric']
+            if name not in typed:
+                lines.append('# TYPE %s %s' % (name, metric['type']))
+                typed.add(name)
+            if metric['type'] == 'histogram':
+                cumulative = 0
+                for bucket, count in zip(list(metric['buckets']) + ['+Inf'], metric['counts']):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (name, _prometheus_labels(metric['labels'], le=bucket), cumulative))
+                lines.append('%s_sum%s %s' % (name, _prometheus_labels(metric['labels']), repr(metric['sum'])))
+                lines.append('%s_count%s %d' % (name, _prometheus_labels(metric['labels']), metric['count']))
+            else:
+                lines.append('%s%s %s' % (name, _prometheus_labels(metric['labels']), repr(metric['value'])))
+        return '\n'.join(lines) + '\n'
+
+
+def _prometheus_labels(labels, **extra_labels):
+    labels = dict(labels, **extra_labels)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in sorted(labels.items()))
+
+
+class PrometheusRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.prometheus_text()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PrometheusExporter(BaseHTTPServer.HTTPServer):
+    """
+    Serves a MetricsRegistry at http://host:port/metrics from a
+    background thread.
+    """
+    def __init__(self, registry, port=9410, host=''):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), PrometheusRequestHandler)
+        self.registry = registry
+        self.port = self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StatsDBackend(MetricsBackend):
+    """
+    Sends each event to a StatsD daemon over UDP.  Labels are sent as
+    DogStatsD tags if `tags` is True, and otherwise appended to the
+    metric name, e.g. 'trawler.trawler_requests_total.statuses_user_timeline.200'
+    """
+    def __init__(self, host='localhost', port=8125, prefix='trawler', tags=False):
+        self._address = (host, port)
+        self._prefix = prefix
+        self._tags = tags
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def increment(self, name, value, labels):
+        self._send(name, value, 'c', labels)
+
+    def gauge(self, name, value, labels):
+        self._send(name, value, 'g', labels)
+
+    def observe(self, name, value, labels):
+        # StatsD timers are in milliseconds
+        self._send(name, value * 1000.0, 'ms', labels)
+
+    def close(self):
+        self._socket.close()
+
+    def format(self, name, value, metric_type, labels):
+        if self._prefix:
+            name = '%s.%s' % (self._prefix, name)
+        if self._tags:
+            tags = ','.join('%s:%s' % (label, label_value) for label, label_value in sorted(labels.items()))
+            return '%s:%s|%s%s' % (name, value, metric_type, '|#' + tags if tags else '')
+        for label, label_value in sorted(labels.items()):
+            name += '.' + re.sub(r'[^A-Za-z0-9_-]', '_', str(label_value))
+        return '%s:%s|%s' % (name, value, metric_type)
+
+    def _send(self, name, value, metric_type, labels):
+        try:
+            self._socket.sendto(self.format(name, value, metric_type, labels), self._address)
+        except socket.error:
+            # Metrics must never stop a crawl
+            pass
+
+
+class JSONLinesBackend(MetricsBackend):
+    """
+    Appends each event to `json_filename` as a JSON object per line,
+    e.g. {"time": ..., "metric": "trawler_requests_total",
+          "type": "counter", "value": 1, "labels": {...}}
+    """
+    def __init__(self, json_filename):
+        self._file = open(json_filename, 'a')
+        self._lock = threading.Lock()
+
+    def increment(self, name, value, labels):
+        self._write(name, 'counter', value, labels)
+
+    def gauge(self, name, value, labels):
+        self._write(name, 'gauge', value, labels)
+
+    def observe(self, name, value, labels):
+        self._write(name, 'histogram', value, labels)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _write(self, name, metric_type, value, labels):
+        line = json.dumps({'time': time.time(), 'metric': name, 'type': metric_type,
+                           'value': value, 'labels': labels})
+        with self._lock:
+            self._file.write(line + '\n')
+
+
+class _Spans:
+    """
+    Context manager entering the context managers returned by each span
+    hook, and exiting them in reverse order
+    """
+    def __init__(self, span_hooks, name, labels):
+        self._span_hooks = span_hooks
+        self._name = name
+        self._labels = labels
+        self._entered = []
+
+    def __enter__(self):
+        for span_hook in self._span_hooks:
+            span = span_hook(self._name, self._labels)
+            span.__enter__()
+            self._entered.append(span)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        while self._entered:
+            self._entered.pop().__exit__(exc_type, exc_value, traceback)
+        return False
+
+
+class Metrics:
+    """
+    Records metrics to every backend, and wraps spans with every span
+    hook.  With no backends and no hooks, this does nothing.
+    """
+    def __init__(self, backends=None, span_hooks=None):
+        self.backends = list(backends or [])
+        self.span_hooks = list(span_hooks or [])
+
+    def add_backend(self, backend):
+        self.backends.append(backend)
+
+    def add_span_hook(self, span_hook):
+        self.span_hooks.append(span_hook)
+
+    def increment(self, name, value=1, **labels):
+        for backend in self.backends:
+            backend.increment(name, value, labels)
+
+    def gauge(self, name, value, **labels):
+        for backend in self.backends:
+            backend.gauge(name, value, labels)
+
+    def observe(self, name, value, **labels):
+        for backend in self.backends:
+            backend.observe(name, value, labels)
+
+    def span(self, name, **labels):
+        return _Spans(self.span_hooks, name, labels)
+
+    def flush(self):
+        for backend in self.backends:
+            backend.flush()
+
+    def close(self):
+        for backend in self.backends:
+            backend.close()
+
+
+# Used by RateLimitedTwitterEndpoint when it is not given any Metrics
+NULL_METRICS = Metrics()
@@ -0,0 +1,252 @@
+"""
+Reads just the fields wanted from JSON Tweets, one per line, without
+decoding the rest.
+
+Tweets carry large embedded `user`, `entities` and `retweeted_status`
+objects, but most filters and exports only look at a few fields, e.g.
+`id`, `text` and `user.id`.  json.loads() builds every dict, list and
+string in the Tweet; a TweetProjection scans past the values it was
+not asked for, decodes only those it was, and stops scanning once it
+has found them all:
+
+  projection = TweetProjection(['id', 'text', 'user.id'], exists=['retweeted_status'])
+  fields = projection.project(json_tweet_string)
+  # {'id': 1, 'text': u'...', 'user.id': 12, 'retweeted_status': False}
+
+Fields are named by their dotted paths.  Fields missing from a Tweet
+are missing from the result, and `exists` fields are True or False
+according to whether the Tweet has them, without being decoded.
+
+The scanner is pure Python, with the character-level work done by
+regular expressions and the json module's C decoder.  It is several
+times quicker than json.loads() for fields near the start of a Tweet
+(`created_at`, `id`, `text`, `user`), where the API puts them, but
+slower for fields it must scan the whole line for (`lang`, or an
+`exists` field the Tweet lacks).  With `validate`, each line is instead
+decoded in full by json.loads(), the quickest way to check that a whole
+line is valid JSON, and the fields are picked from the result.
+"""
+
+# Standard Library modules
+import json
+import json.decoder
+import re
+
+
+_WHITESPACE_PATTERN = r'[ \t\n\r]*'
+_STRING_PATTERN = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+_SCALAR_PATTERN = r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?|true|false|null'
+
+_WHITESPACE = re.compile(_WHITESPACE_PATTERN)
+# A JSON string, from its opening to its closing quote
+_STRING = re.compile(_STRING_PATTERN, re.DOTALL)
+# A number, true, false or null
+_SCALAR = re.compile(_SCALAR_PATTERN)
+# An object's key and the colon after it
+_KEY = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"%s:%s' % (_WHITESPACE_PATTERN, _WHITESPACE_PATTERN), re.DOTALL)
+# The comma or brace after an object's value
+_SEPARATOR = re.compile(r'%s([,}])%s' % (_WHITESPACE_PATTERN, _WHITESPACE_PATTERN))
+# Everything up to the next bracket inside an array or object,
+# including any strings, which may hold brackets
+_TO_BRACKET = re.compile(r'(?:[^"{}\[\]]+|%s)*' % _STRING_PATTERN, re.DOTALL)
+
+_DECODER = json.JSONDecoder()
+
+# Markers in the tree of paths for fields to decode and fields to check for
+_DECODE = 'decode'
+_EXISTS = 'exists'
+# The key marking an object in the tree that is itself an `exists` field
+_SELF = ('self',)
+
+
+def _skip_members_pattern(keys):
+    """
+    Returns a regular expression matching any run of an object's
+    members, with a string or scalar value and a comma after, whose keys
+    are not `keys`.  Skipping these in one match, rather than a member
+    at a time, is what makes projection quicker than decoding.  Keys with
+    escapes are left for _KEY, as they may be `keys` once unescaped.
+    """
+    return re.compile(r'(?:(?!"(?:%s)"%s:|"[^"\\]*\\)%s%s:%s(?:%s|%s)%s,%s)*' % (
+        '|'.join(re.escape(key) for key in keys), _WHITESPACE_PATTERN, _STRING_PATTERN, _WHITESPACE_PATTERN,
+        _WHITESPACE_PATTERN, _STRING_PATTERN, _SCALAR_PATTERN, _WHITESPACE_PATTERN, _WHITESPACE_PATTERN), re.DOTALL)
+
+
+class TweetProjection:
+    """
+    Extracts the fields with dotted paths `paths` (e.g. 'user.id') from
+    JSON Tweet strings, see the module documentation
+    """
+    def __init__(self, paths, exists=(), validate=False):
+        self.paths = tuple(paths)
+        self.exists = tuple(exists)
+        self._validate = validate
+        tree = {}
+        for path, marker in [(path, _DECODE) for path in self.paths] + [(path, _EXISTS) for path in self.exists]:
+            node = tree
+            names = path.split('.')
+            for name in names[:-1]:
+                child = node.setdefault(name, {})
+                if child is _DECODE:
+                    raise ValueError("Path '%s' is inside another path" % path)
+                if child is _EXISTS:
+                    child = node[name] = {_SELF: _EXISTS}
+                node = child
+            name = names[-1]
+            if name in node and (marker is _DECODE or not isinstance(node[name], dict)):
+                raise ValueError("Path '%s' overlaps another path" % path)
+            if name in node:
+                node[name][_SELF] = _EXISTS
+            else:
+                node[name] = marker
+        self._level = self._compile(tree)
+
+    def project(self, json_string):
+        """
+        Returns a dictionary of the paths found in `json_string` to their
+        values.  Raises ValueError if `json_string` is not a JSON object
+        (or, with `validate`, is not entirely valid JSON).
+        """
+        if self._validate:
+            return self.pick(json.loads(json_string))
+        fields = dict((path, False) for path in self.exists)
+        i = _WHITESPACE.match(json_string, 0).end()
+        if json_string[i:i + 1] != '{':
+            raise ValueError('Not a JSON object')
+        self._project_object(json_string, i, self._level, '', fields, [len(self.paths) + len(self.exists)])
+        return fields
+
+    def pick(self, tweet):
+        """
+        Returns the dictionary project() would for the decoded Tweet
+        `tweet`
+        """
+        if not isinstance(tweet, dict):
+            raise ValueError('Not a JSON object')
+        fields = {}
+        for path in self.paths:
+            found, value = _lookup(tweet, path)
+            if found:
+                fields[path] = value
+        for path in self.exists:
+            fields[path] = _lookup(tweet, path)[0]
+        return fields
+
+    def _compile(self, tree):
+        """
+        Returns the (keys to markers or levels, skip pattern, whether
+        the object is an `exists` field) of each level of the tree of
+        paths
+        """
+        level = {}
+        for key, node in tree.items():
+            if isinstance(node, dict):
+                level[key] = self._compile(node)
+            elif key is not _SELF:
+                level[key] = node
+        return level, _skip_members_pattern(level.keys()), _SELF in tree
+
+    def _project_object(self, s, i, level, prefix, fields, remaining):
+        """
+        Projects the object starting at s[i] into `fields`, and returns
+        the index after it, or None once every field has been found
+        """
+        tree, skip_members, exists = level
+        i = _WHITESPACE.match(s, i + 1).end()
+        if s[i:i + 1] == '}':
+            return i + 1
+        while True:
+            i = skip_members.match(s, i).end()
+            match = _KEY.match(s, i)
+            if match is None:
+                raise ValueError('Expected a key at %d' % i)
+            key = match.group(1)
+            if '\\' in key:
+                key = json.decoder.scanstring(s, i + 1)[0]
+            i = match.end()
+
+            node = tree.get(key)
+            if node is _DECODE:
+                fields[prefix + key], i = _DECODER.raw_decode(s, i)
+                remaining[0] -= 1
+            elif node is _EXISTS:
+                fields[prefix + key] = True
+                remaining[0] -= 1
+                i = _skip_value(s, i)
+            elif node is not None:
+                if node[2]:
+                    fields[prefix + key] = True
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        return None
+                if s[i:i + 1] == '{':
+                    i = self._project_object(s, i, node, prefix + key + '.', fields, remaining)
+                    if i is None:
+                        return None
+                else:
+                    i = _skip_value(s, i)
+            else:
+                i = _skip_value(s, i)
+
+            if remaining[0] == 0:
+                return None
+            match = _SEPARATOR.match(s, i)
+            if match is None:
+                raise ValueError("Expected ',' or '}' at %d" % i)
+            if match.group(1) == '}':
+                return match.end()
+            i = match.end()
+
+
+def _lookup(tweet, path):
+    """
+    Returns (True, value) for the field with dotted path `path` in
+    decoded Tweet `tweet`, or (False, None) if it has no such field
+    """
+    value = tweet
+    for name in path.split('.'):
+        if not isinstance(value, dict) or name not in value:
+            return False, None
+        value = value[name]
+    return True, value
+
+
+def _skip_value(s, i):
+    """
+    Returns the index after the JSON value starting at s[i]
+    """
+    c = s[i:i + 1]
+    if c == '"':
+        match = _STRING.match(s, i)
+    elif c == '{' or c == '[':
+        depth = 1
+        i += 1
+        while True:
+            # Only brackets need looking at one by one
+            i = _TO_BRACKET.match(s, i).end()
+            c = s[i:i + 1]
+            if c == '{' or c == '[':
+                depth += 1
+            elif c == '}' or c == ']':
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+            else:
+                raise ValueError('Unterminated JSON value')
+            i += 1
+    else:
+        match = _SCALAR.match(s, i)
+    if match is None:
+        raise ValueError('Invalid JSON value at %d' % i)
+    return match.end()
+
+
+def project_lines(lines, paths, exists=()):
+    """
+    Yields the projection of each non-blank line in `lines` (e.g. a file
+    of Tweets) onto `paths` and `exists`
+    """
+    projection = TweetProjection(paths, exists)
+    for line in lines:
+        if line.strip():
+            yield projection.project(line)
@@ -0,0 +1,191 @@
+"""
+Rate limit windows kept in a store shared between crawler processes,
+so that processes on one host, or on many, can split a pool of API
+keys without going over any key's rate limit.
+
+  store = SQLiteRateLimitStore('/var/lib/trawler/rate_limits.db')
+  crawler = get_timeline_crawler(twython, registry=EndpointRegistry(store))
+
+Stores:
+  SQLiteRateLimitStore -- a SQLite database, for processes on one host
+                          (or a filesystem with working SQLite locking)
+  RedisRateLimitStore  -- a Redis server, for processes on many hosts
+
+Each window holds the calls remaining until, and the time of, the next
+rate limit reset, as last reported by Twitter's rate_limit_status.  A
+crawler reserves a call before making it with an atomic
+decrement-if-positive (or if more than the calls it must leave for
+other priority classes remain), so two processes can never both take
+the last call in a window.
+
+A rate_limit_status reply may be out of date by the time it is stored,
+so updates are applied atomically, and only move a window forwards: an
+update for a later reset replaces the window, one for the same reset
+can only lower the calls remaining (so calls other processes have since
+reserved are not handed out again), and one for an earlier reset is
+ignored.
+
+Each window's `lock` is a threading.RLock, which only serialises the
+threads of one process; across processes, only the store's atomic
+update() and reserve() are relied on.
+"""
+
+# Standard Library modules
+import sqlite3
+import threading
+
+
+class SQLiteRateLimitStore:
+    """
+    Keeps rate limit windows in the SQLite database `filename`, which
+    is created if necessary.  Each thread uses its own connection, and
+    waits up to `timeout` seconds for other processes' writes.
+    """
+    def __init__(self, filename, timeout=30.0):
+        self._filename = filename
+        self._timeout = timeout
+        self._local = threading.local()
+        self._connection().execute('CREATE TABLE IF NOT EXISTS rate_limit_windows '
+                                   '(key TEXT PRIMARY KEY, calls_remaining INTEGER, resets_at REAL)')
+
+    def window(self, token, twitter_api_endpoint):
+        return SQLiteRateLimitWindow(self, '%s %s' % (token, twitter_api_endpoint))
+
+    def state(self, key):
+        row = self._connection().execute('SELECT calls_remaining, resets_at FROM rate_limit_windows WHERE key = ?',
+                                         (key,)).fetchone()
+        if row is None:
+            return None, None
+        return row
+
+    def update(self, key, calls_remaining, resets_at):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('INSERT OR IGNORE INTO rate_limit_windows VALUES (?, ?, ?)',
+                               (key, calls_remaining, resets_at))
+            connection.execute('UPDATE rate_limit_windows SET '
+                               'calls_remaining = CASE WHEN resets_at = ? THEN MIN(calls_remaining, ?) ELSE ? END, '
+                               'resets_at = ? WHERE key = ? AND resets_at <= ?',
+                               (resets_at, calls_remaining, calls_remaining, resets_at, key, resets_at))
+            connection.execute('COMMIT')
+        except:
+            connection.execute('ROLLBACK')
+            raise
+
+    def reserve(self, key, keep=0):
+        connection = self._connection()
+        # Take the write lock before reading, so that the decrement and
+        # the count read back are one transaction
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = connection.execute('UPDATE rate_limit_windows SET calls_remaining = calls_remaining - 1 '
+                                        'WHERE key = ? AND calls_remaining > ?', (key, keep))
+            calls_remaining = None
+            if cursor.rowcount == 1:
+                calls_remaining = connection.execute('SELECT calls_remaining FROM rate_limit_windows WHERE key = ?',
+                                                     (key,)).fetchone()[0]
+            connection.execute('COMMIT')
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        return calls_remaining
+
+    def _connection(self):
+        if not hasattr(self._local, 'connection'):
+            # isolation_level=None leaves transactions to update() and reserve()
+            self._local.connection = sqlite3.connect(self._filename, timeout=self._timeout,
+                                                     isolation_level=None)
+        return self._local.connection
+
+
+class SQLiteRateLimitWindow:
+    """
+    One (API key, endpoint) window in a SQLiteRateLimitStore, with the
+    same methods as twitter_crawler.RateLimitWindow.  `lock` only
+    serialises this process's threads.
+    """
+    def __init__(self, store, key):
+        self._store = store
+        self._key = key
+        self.lock = threading.RLock()
+
+    def state(self):
+        return self._store.state(self._key)
+
+    def update(self, calls_remaining, resets_at):
+        self._store.update(self._key, calls_remaining, resets_at)
+
+    def reserve(self, keep=0):
+        return self._store.reserve(self._key, keep)
+
+
+class RedisRateLimitStore:
+    """
+    Keeps rate limit windows in Redis, as hashes named `prefix` + key,
+    using `redis_client` (e.g. redis.StrictRedis(host, port)).  Windows
+    expire an hour after they reset.
+    """
+    def __init__(self, redis_client, prefix='trawler:rate_limit:'):
+        self._redis = redis_client
+        self._prefix = prefix
+
+    def window(self, token, twitter_api_endpoint):
+        return RedisRateLimitWindow(self._redis, '%s%s:%s' % (self._prefix, token, twitter_api_endpoint))
+
+
+class RedisRateLimitWindow:
+    """
+    One (API key, endpoint) window in a RedisRateLimitStore, with the
+    same methods as twitter_crawler.RateLimitWindow.  `lock` only
+    serialises this process's threads.
+    """
+    # Decrements calls_remaining if it is more than ARGV[1], atomically
+    # on the server, and returns the count left, or -1 if it was not
+    RESERVE_SCRIPT = """
+local calls_remaining = tonumber(redis.call('HGET', KEYS[1], 'calls_remaining'))
+if calls_remaining == nil or calls_remaining <= tonumber(ARGV[1]) then
+    return -1
+end
+return redis.call('HINCRBY', KEYS[1], 'calls_remaining', -1)
+"""
+
+    # Sets the window to ARGV[1] calls remaining until ARGV[2], expiring
+    # at ARGV[3], unless it already resets later, and keeps the lower
+    # count if it resets at the same time
+    UPDATE_SCRIPT = """
+local resets_at = tonumber(redis.call('HGET', KEYS[1], 'resets_at'))
+local calls_remaining = tonumber(ARGV[1])
+if resets_at ~= nil then
+    if tonumber(ARGV[2]) < resets_at then
+        return 0
+    end
+    if tonumber(ARGV[2]) == resets_at then
+        calls_remaining = math.min(calls_remaining, tonumber(redis.call('HGET', KEYS[1], 'calls_remaining')))
+    end
+end
+redis.call('HMSET', KEYS[1], 'calls_remaining', calls_remaining, 'resets_at', ARGV[2])
+redis.call('EXPIREAT', KEYS[1], ARGV[3])
+return 1
+"""
+
+    def __init__(self, redis_client, key):
+        self._redis = redis_client
+        self._key = key
+        self.lock = threading.RLock()
+
+    def state(self):
+        calls_remaining, resets_at = self._redis.hmget(self._key, ['calls_remaining', 'resets_at'])
+        if calls_remaining is None or resets_at is None:
+            return None, None
+        return int(calls_remaining), float(resets_at)
+
+    def update(self, calls_remaining, resets_at):
+        self._redis.eval(self.UPDATE_SCRIPT, 1, self._key, calls_remaining, repr(float(resets_at)),
+                         int(resets_at) + 3600)
+
+    def reserve(self, keep=0):
+        calls_remaining = int(self._redis.eval(self.RESERVE_SCRIPT, 1, self._key, keep))
+        if calls_remaining < 0:
+            return None
+        return calls_remaining
@@ -0,0 +1,164 @@
+"""
+Write-time schemas that slim Tweets down to the fields wanted before
+they are saved.
+
+The API returns every field of a Tweet, including the `profile_*`
+colours and image URLs of its user, which are repeated in each of the
+user's Tweets.  A TweetSchema keeps a whitelist of Tweet fields (by
+dotted path, e.g. 'entities.hashtags.text', applied to each item of a
+list), and moves each Tweet's user into a separate user table, leaving
+a reference in the Tweet:
+
+  {"id": 1, "text": "...", "user": {"id": 12, "id_str": "12", "screen_name": "jack"}}
+
+The writers in twitter_crawler.py take a `schema=`, either a TweetSchema,
+a list of Tweet fields, or the name of one of SCHEMA_PROFILES, and save
+each file's distinct users, once each, to a user table alongside it
+(see user_table_filename()).  Without a schema, or with 'raw', Tweets
+are saved as returned by the API.
+"""
+
+# Local modules
+from trawler_text import NORMALISED_FIELD, normalise_tweet
+
+
+# The fields of a Tweet's user kept in the Tweet itself
+USER_REFERENCE_FIELDS = ('id', 'id_str', 'screen_name')
+
+# Fields holding whole Tweets, which are slimmed with the same schema
+_TWEET_FIELDS = ('retweeted_status', 'quoted_status')
+
+
+class TweetSchema:
+    """
+    Keeps the Tweet fields with dotted paths `tweet_fields`, and the user
+    fields `user_fields` (or all user fields, if None) in the user table.
+    With `drop_null`, fields whose value is null are dropped as well, and
+    with `normalise_text`, the Tweet's text and flags are normalised (see
+    trawler_text.py) before it is slimmed.
+    """
+    def __init__(self, tweet_fields, user_fields=None, drop_null=False, normalise_text=False):
+        if normalise_text:
+            tweet_fields = list(tweet_fields) + [NORMALISED_FIELD]
+        self.tweet_fields = tuple(tweet_fields)
+        self.user_fields = None if user_fields is None else tuple(user_fields)
+        self._drop_null = drop_null
+        self._normalise_text = normalise_text
+        self._tweet_tree = _field_tree(self.tweet_fields)
+        self._user_tree = None if user_fields is None else _field_tree(self.user_fields)
+
+    def slim_tweet(self, tweet, users):
+        """
+        Returns the slimmed copy of `tweet`, adding its user (and the
+        users of any retweeted or quoted Tweet) to dictionary `users` of
+        user IDs to slimmed users, unless already there
+        """
+        if self._normalise_text and NORMALISED_FIELD not in tweet:
+            tweet = normalise_tweet(dict(tweet))
+        return self._slim_tweet(tweet, users)
+
+    def _slim_tweet(self, tweet, users):
+        slim = self._slim(tweet, self._tweet_tree)
+        for tweet_field in _TWEET_FIELDS:
+            if tweet_field in slim:
+                slim[tweet_field] = self._slim_tweet(tweet[tweet_field], users)
+        user = tweet.get('user')
+        if isinstance(user, dict) and 'id' in user:
+            if user['id'] not in users:
+                users[user['id']] = user if self._user_tree is None else self._slim(user, self._user_tree)
+            slim['user'] = dict((field, user[field]) for field in USER_REFERENCE_FIELDS if field in user)
+        return slim
+
+    def _slim(self, value, tree):
+        if isinstance(value, list):
+            return [self._slim(item, tree) for item in value]
+        if not isinstance(value, dict):
+            return value
+        slim = {}
+        for field, subtree in tree.items():
+            if field in value and not (self._drop_null and value[field] is None):
+                slim[field] = value[field] if subtree is None else self._slim(value[field], subtree)
+        return slim
+
+
+def _field_tree(paths):
+    """
+    Returns a tree of dictionaries of the names in dotted paths `paths`,
+    with None at each leaf
+    """
+    tree = {}
+    for path in paths:
+        node = tree
+        names = path.split('.')
+        for name in names[:-1]:
+            if node.get(name, {}) is None:
+                # A parent of this path is kept whole
+                break
+            node = node.setdefault(name, {})
+        else:
+            node[names[-1]] = None
+    return tree
+
+
+_ENTITY_FIELDS = ['entities.hashtags.text', 'entities.symbols.text',
+                  'entities.user_mentions.id', 'entities.user_mentions.id_str', 'entities.user_mentions.screen_name',
+                  'entities.urls.expanded_url', 'entities.media.id', 'entities.media.expanded_url',
+                  'entities.media.type']
+
+SCHEMA_PROFILES = {
+    'research-slim': TweetSchema(
+        ['created_at', 'id', 'id_str', 'text', 'full_text', 'truncated', 'display_text_range', 'lang', 'source',
+         'in_reply_to_status_id', 'in_reply_to_status_id_str', 'in_reply_to_user_id', 'in_reply_to_user_id_str',
+         'in_reply_to_screen_name', 'is_quote_status', 'quoted_status_id', 'quoted_status_id_str',
+         'retweet_count', 'favorite_count', 'coordinates', 'place.id', 'place.full_name', 'place.country_code',
+         'retweeted_status', 'quoted_status', 'extended_tweet.full_text', 'extended_tweet.display_text_range'] +
+        _ENTITY_FIELDS + ['extended_tweet.' + field for field in _ENTITY_FIELDS],
+        user_fields=['id', 'id_str', 'screen_name', 'name', 'description', 'location', 'url', 'lang', 'created_at',
+                     'time_zone', 'utc_offset', 'followers_count', 'friends_count', 'statuses_count',
+                     'favourites_count', 'listed_count', 'verified', 'protected', 'default_profile_image'],
+        drop_null=True, normalise_text=True),
+}
+
+
+def get_tweet_schema(schema):
+    """
+    Returns the TweetSchema for `schema` (a TweetSchema, a list of Tweet
+    fields or the name of one of SCHEMA_PROFILES), or None for raw Tweets
+    """
+    if schema is None or schema == 'raw':
+        return None
+    if isinstance(schema, TweetSchema):
+        return schema
+    if isinstance(schema, basestring):
+        if schema not in SCHEMA_PROFILES:
+            raise ValueError("Unknown schema '%s', expected one of: %s" %
+                             (schema, ', '.join(['raw'] + sorted(SCHEMA_PROFILES))))
+        return SCHEMA_PROFILES[schema]
+    return TweetSchema(schema)
+
+
+def user_table_filename(json_filename):
+    """
+    Returns the name of the user table for Tweet file `json_filename`,
+    e.g. 'jack.tweets.users.gz' for 'jack.tweets.gz' and
+    'search.00000.users.json.gz' for 'search.00000.json.gz'
+    """
+    for extension in ['.json.gz', '.json', '.gz']:
+        if json_filename.endswith(extension):
+            return json_filename[:-len(extension)] + '.users' + extension
+    return json_filename + '.users'
+
+
+def expand_users(tweet, users):
+    """
+    Replaces the user reference in slimmed Tweet `tweet` (and in any
+    retweeted or quoted Tweet) with the user from dictionary `users` of
+    user IDs to users, where there is one, and returns the Tweet
+    """
+    user = tweet.get('user')
+    if isinstance(user, dict) and user.get('id') in users:
+        tweet['user'] = users[user['id']]
+    for tweet_field in _TWEET_FIELDS:
+        if isinstance(tweet.get(tweet_field), dict):
+            expand_users(tweet[tweet_field], users)
+    return tweet
@@ -0,0 +1,99 @@
+"""
+Reconciles the fields a Tweet's text can be in, and precomputes the
+flags filters need from it, once, when Tweets are saved.
+
+Depending on how it was fetched, a Tweet's text is in `text` (possibly
+truncated to 140 characters, with `truncated` set), `full_text` (with
+tweet_mode='extended') or `extended_tweet.full_text` (in the streaming
+API), and the text of a retweet is always truncated after the 'RT
+@screen_name: ' prefix.  normalise_tweet() adds a `trawler` field to a
+Tweet holding:
+
+  text           the full text, from whichever field has it
+  is_retweet     whether the Tweet is a retweet, or starts with 'RT'
+  has_url        whether the Tweet has URL or media entities
+  mention_count  the number of user mention entities
+  hashtag_count  the number of hashtag entities
+
+Tweets saved without entities (e.g. hand-written test Tweets) have their
+flags computed from their text instead.  normalised_fields() returns the
+same for a Tweet projected onto NORMALISE_PATHS, so that filters can use
+the precomputed `trawler` field where there is one, and compute it
+where there is not, from a single projection.
+"""
+
+# Standard Library modules
+import re
+
+# Local modules
+from trawler_projection import TweetProjection
+
+
+# The field normalise_tweet() adds to Tweets
+NORMALISED_FIELD = 'trawler'
+
+# The fields normalised_fields() reads, as dotted paths for TweetProjection
+NORMALISE_PATHS = (
+    NORMALISED_FIELD, 'text', 'full_text', 'extended_tweet.full_text',
+    'entities.urls', 'entities.media', 'entities.user_mentions', 'entities.hashtags',
+    'extended_tweet.entities.urls', 'extended_tweet.entities.media',
+    'extended_tweet.entities.user_mentions', 'extended_tweet.entities.hashtags',
+    'retweeted_status.id', 'retweeted_status.text', 'retweeted_status.full_text',
+    'retweeted_status.extended_tweet.full_text', 'retweeted_status.user.screen_name')
+
+_NORMALISE_PROJECTION = TweetProjection(NORMALISE_PATHS)
+
+_RETWEET_PREFIX = re.compile(r'\s*RT\b')
+_URL = re.compile(r'https?://')
+_MENTION = re.compile(r'(?<!\w)@\w+', re.UNICODE)
+_HASHTAG = re.compile(r'(?<!\w)#\w+', re.UNICODE)
+
+
+def normalised_fields(fields):
+    """
+    Returns the normalised text and flags of the Tweet projected onto
+    NORMALISE_PATHS as `fields`: its `trawler` field, if it has one
+    """
+    if NORMALISED_FIELD in fields:
+        return fields[NORMALISED_FIELD]
+
+    text = _full_text(fields, '')
+    if 'retweeted_status.id' in fields:
+        # The retweeted text is truncated in the retweet, but not in the retweeted Tweet
+        retweeted_text = _full_text(fields, 'retweeted_status.')
+        if retweeted_text is not None and 'retweeted_status.user.screen_name' in fields:
+            text = u'RT @%s: %s' % (fields['retweeted_status.user.screen_name'], retweeted_text)
+    text = text or u''
+
+    prefix = 'extended_tweet.' if 'extended_tweet.full_text' in fields else ''
+    if prefix + 'entities.urls' in fields or prefix + 'entities.hashtags' in fields:
+        has_url = bool(fields.get(prefix + 'entities.urls') or fields.get(prefix + 'entities.media'))
+        mention_count = len(fields.get(prefix + 'entities.user_mentions') or [])
+        hashtag_count = len(fields.get(prefix + 'entities.hashtags') or [])
+    else:
+        has_url = _URL.search(text) is not None
+        mention_count = len(_MENTION.findall(text))
+        hashtag_count = len(_HASHTAG.findall(text))
+
+    return {'text': text,
+            'is_retweet': 'retweeted_status.id' in fields or _RETWEET_PREFIX.match(text) is not None,
+            'has_url': has_url,
+            'mention_count': mention_count,
+            'hashtag_count': hashtag_count}
+
+
+def _full_text(fields, prefix):
+    for path in ['extended_tweet.full_text', 'full_text', 'text']:
+        if prefix + path in fields:
+            return fields[prefix + path]
+    return None
+
+
+def normalise_tweet(tweet):
+    """
+    Adds the normalised text and flags to `tweet` as its `trawler`
+    field, replacing any there already, and returns the Tweet
+    """
+    tweet.pop(NORMALISED_FIELD, None)
+    tweet[NORMALISED_FIELD] = normalised_fields(_NORMALISE_PROJECTION.pick(tweet))
+    return tweet
@@ -0,0 +1,540 @@
+"""
+Work queues for sharing a crawl job (e.g. a list of user IDs or screen
+names) between any number of worker processes, on one host or many.
+
+  work_queue = open_work_queue('sqlite:crawl_queue.db')
+  work_queue.put(twitter_crawler.iter_ids_from_file('user_ids.txt'))
+  ...
+  # In each worker process:
+  run_worker(work_queue, crawl_user)
+
+A worker claims a job by taking a lease on it.  When the worker is
+done it acknowledges the job with ack(), or reports an error with
+fail(), after which the job is retried until it has been attempted
+`max_attempts` times.  If a worker dies, its lease expires and the job
+is handed to another worker, so no job is lost.  run_worker() extends
+the lease of the job it is working on, so long crawls (which may wait
+out several rate limit windows) keep their jobs.
+
+Each item is queued once, however many times it is put().
+
+Queues:
+  SQLiteWorkQueue    -- a SQLite database, for workers on one host
+  DirectoryWorkQueue -- a directory, updated only by atomic renames, for
+                        workers on one host or sharing a filesystem
+  RedisWorkQueue     -- a Redis server, for workers on many hosts
+"""
+
+# Standard Library modules
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+
+# Job states, as reported by counts()
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+STATES = (PENDING, LEASED, DONE, FAILED)
+
+
+class Job:
+    """
+    A claimed item.  `lease` identifies the claim, so that a worker
+    whose lease expired and was given to another worker cannot
+    acknowledge, fail or extend the job.
+    """
+    def __init__(self, key, item, attempts, lease):
+        self.key = key
+        self.item = item
+        self.attempts = attempts
+        self.lease = lease
+
+    def __repr__(self):
+        return 'Job(%r, attempts=%d)' % (self.item, self.attempts)
+
+
+class WorkQueue:
+    """
+    Base class for work queues.  Items are unicode strings, such as
+    screen names or user IDs.
+    """
+    def put(self, items):
+        """
+        Adds every item in the iterable `items` that has not been
+        queued before, and returns the number added.
+        """
+        raise NotImplementedError
+
+    def claim(self):
+        """
+        Returns the Job for a pending item, leased for `lease_seconds`,
+        or None if no item is pending.
+        """
+        raise NotImplementedError
+
+    def extend(self, job):
+        """
+        Extends the lease on `job` by `lease_seconds` from now.  Returns
+        False if the lease has already expired and been taken.
+        """
+        raise NotImplementedError
+
+    def ack(self, job):
+        """
+        Marks `job` as done.  Returns False if its lease had already
+        expired and been taken.
+        """
+        raise NotImplementedError
+
+    def fail(self, job, error=None):
+        """
+        Returns `job` to the queue to be retried, or marks it as failed
+        if it has been attempted `max_attempts` times.  Returns False if
+        its lease had already expired and been taken.
+        """
+        raise NotImplementedError
+
+    def counts(self, states=STATES):
+        """
+        Returns a dictionary of the number of jobs in each of `states`.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def item_key(item):
+    """
+    Returns a short, filename-safe key for `item`
+    """
+    return hashlib.sha1(unicode(item).encode('utf-8')).hexdigest()[:20]
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """
+    Keeps jobs in the SQLite database `filename`, which is created if
+    necessary.  Each thread uses its own connection.
+    """
+    def __init__(self, filename, lease_seconds=3600, max_attempts=3, timeout=30.0):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._filename = filename
+        self._timeout = timeout
+        self._local = threading.local()
+        self._connection().execute('CREATE TABLE IF NOT EXISTS jobs '
+                                   '(id INTEGER PRIMARY KEY AUTOINCREMENT, item TEXT UNIQUE, state TEXT, '
+                                   'attempts INTEGER, lease TEXT, lease_expires REAL, error TEXT)')
+        self._connection().execute('CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, id)')
+
+    def put(self, items, batch_size=10000):
+        added = 0
+        batch = []
+        for item in items:
+            batch.append((unicode(item), PENDING))
+            if len(batch) >= batch_size:
+                added += self._insert(batch)
+                batch = []
+        if batch:
+            added += self._insert(batch)
+        return added
+
+    def claim(self):
+        now = time.time()
+        with self._transaction() as connection:
+            self._expire_leases(connection, now)
+            row = connection.execute('SELECT id, item, attempts FROM jobs WHERE state = ? ORDER BY id LIMIT 1',
+                                     (PENDING,)).fetchone()
+            if row is None:
+                return None
+            job_id, item, attempts = row
+            lease = uuid.uuid4().hex
+            connection.execute('UPDATE jobs SET state = ?, attempts = ?, lease = ?, lease_expires = ? WHERE id = ?',
+                               (LEASED, attempts + 1, lease, now + self.lease_seconds, job_id))
+            return Job(job_id, item, attempts + 1, lease)
+
+    def extend(self, job):
+        return self._update_leased(job, 'lease_expires = ?', (time.time() + self.lease_seconds,))
+
+    def ack(self, job):
+        return self._update_leased(job, 'state = ?, lease = NULL', (DONE,))
+
+    def fail(self, job, error=None):
+        state = FAILED if job.attempts >= self.max_attempts else PENDING
+        return self._update_leased(job, 'state = ?, lease = NULL, error = ?', (state, error))
+
+    def counts(self, states=STATES):
+        counts = dict((state, 0) for state in states)
+        for state, count in self._connection().execute('SELECT state, COUNT(*) FROM jobs WHERE state IN (%s) '
+                                                       'GROUP BY state' % ', '.join('?' * len(states)), states):
+            counts[state] = count
+        return counts
+
+    def close(self):
+        if hasattr(self._local, 'connection'):
+            self._local.connection.close()
+            del self._local.connection
+
+    def _insert(self, rows):
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.executemany('INSERT OR IGNORE INTO jobs (item, state, attempts) VALUES (?, ?, 0)', rows)
+            return connection.total_changes - before
+
+    def _expire_leases(self, connection, now):
+        connection.execute('UPDATE jobs SET state = ?, lease = NULL, error = ? '
+                           'WHERE state = ? AND lease_expires < ? AND attempts >= ?',
+                           (FAILED, 'Lease expired', LEASED, now, self.max_attempts))
+        connection.execute('UPDATE jobs SET state = ?, lease = NULL WHERE state = ? AND lease_expires < ?',
+                           (PENDING, LEASED, now))
+
+    def _update_leased(self, job, assignments, values):
+        with self._transaction() as connection:
+            cursor = connection.execute('UPDATE jobs SET %s WHERE id = ? AND state = ? AND lease = ?' % assignments,
+                                        values + (job.key, LEASED, job.lease))
+            return cursor.rowcount == 1
+
+    def _transaction(self):
+        return _SQLiteTransaction(self._connection())
+
+    def _connection(self):
+        if not hasattr(self._local, 'connection'):
+            # isolation_level=None leaves transactions to _SQLiteTransaction
+            self._local.connection = sqlite3.connect(self._filename, timeout=self._timeout,
+                                                     isolation_level=None)
+        return self._local.connection
+
+
+class _SQLiteTransaction:
+    """
+    Context manager holding the database's write lock from the first
+    read, so that claims by different processes cannot interleave
+    """
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __enter__(self):
+        self._connection.execute('BEGIN IMMEDIATE')
+        return self._connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+class DirectoryWorkQueue(WorkQueue):
+    """
+    Keeps jobs as empty files in subdirectories of `directory`, named
+    for each state, and each item's text in items/.  Every change of
+    state is a single os.rename(), which only one process can win, and
+    a job's attempt count and lease expiry are part of its filename:
+
+      pending/KEY@ATTEMPTS
+      leased/KEY@ATTEMPTS@LEASE_EXPIRES
+      done/KEY
+      failed/KEY     (holding the last error, if any)
+
+    Pending jobs are claimed in no particular order: each worker lists
+    pending/ once, shuffled so that workers do not all race for the same
+    jobs, and claims from that list until it runs out, skipping jobs
+    other workers have claimed since.  Expired leases are looked for
+    every tenth of `lease_seconds`, rather than on every claim.
+    """
+    def __init__(self, directory, lease_seconds=3600, max_attempts=3):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._directory = directory
+        self._pending = []
+        self._next_expiry = 0
+        for subdirectory in ('items',) + STATES:
+            path = os.path.join(directory, subdirectory)
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # Another worker created it first
+                    if not os.path.isdir(path):
+                        raise
+
+    def put(self, items):
+        added = 0
+        for item in items:
+            key = item_key(item)
+            try:
+                item_file = os.open(self._path('items', key), os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            except OSError:
+                # Already queued
+                continue
+            os.write(item_file, unicode(item).encode('utf-8'))
+            os.close(item_file)
+            open(self._path(PENDING, '%s@0' % key), 'w').close()
+            added += 1
+        return added
+
+    def claim(self):
+        now = time.time()
+        if now >= self._next_expiry:
+            self._expire_leases(now)
+            self._next_expiry = now + self.lease_seconds / 10.0
+        for listed in (False, True):
+            if listed:
+                # Every job listed before has been tried, so list again
+                self._pending = os.listdir(self._path(PENDING))
+                random.shuffle(self._pending)
+            while self._pending:
+                filename = self._pending.pop()
+                key, attempts = filename.split('@')
+                attempts = int(attempts) + 1
+                lease = '%s@%d@%.3f' % (key, attempts, now + self.lease_seconds)
+                if self._rename((PENDING, filename), (LEASED, lease)):
+                    item = open(self._path('items', key)).read().decode('utf-8')
+                    return Job(key, item, attempts, lease)
+        return None
+
+    def extend(self, job):
+        lease = '%s@%d@%.3f' % (job.key, job.attempts, time.time() + self.lease_seconds)
+        if not self._rename((LEASED, job.lease), (LEASED, lease)):
+            return False
+        job.lease = lease
+        return True
+
+    def ack(self, job):
+        return self._rename((LEASED, job.lease), (DONE, job.key))
+
+    def fail(self, job, error=None):
+        if job.attempts < self.max_attempts:
+            return self._rename((LEASED, job.lease), (PENDING, '%s@%d' % (job.key, job.attempts)))
+        if not self._rename((LEASED, job.lease), (FAILED, job.key)):
+            return False
+        if error:
+            with open(self._path(FAILED, job.key), 'w') as failed_file:
+                failed_file.write(unicode(error).encode('utf-8'))
+        return True
+
+    def counts(self, states=STATES):
+        return dict((state, len(os.listdir(self._path(state)))) for state in states)
+
+    def _expire_leases(self, now):
+        for filename in os.listdir(self._path(LEASED)):
+            key, attempts, lease_expires = filename.split('@')
+            if float(lease_expires) < now:
+                if int(attempts) >= self.max_attempts:
+                    self._rename((LEASED, filename), (FAILED, key))
+                else:
+                    self._rename((LEASED, filename), (PENDING, '%s@%s' % (key, attempts)))
+
+    def _rename(self, source, destination):
+        try:
+            os.rename(self._path(*source), self._path(*destination))
+        except OSError:
+            # Another worker moved it first
+            return False
+        return True
+
+    def _path(self, *parts):
+        return os.path.join(self._directory, *parts)
+
+
+class RedisWorkQueue(WorkQueue):
+    """
+    Keeps jobs in Redis under keys starting with `prefix`, using
+    `redis_client` (e.g. redis.StrictRedis(host, port)).  Every change
+    of state is a Lua script, so it is atomic on the server.
+    """
+    # KEYS: items, attempts, pending, leases, done, failed
+    # ARGV: now, lease_seconds, max_attempts
+    CLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', '(' .. ARGV[1])
+for i, key in ipairs(expired) do
+    redis.call('ZREM', KEYS[4], key)
+    if tonumber(redis.call('HGET', KEYS[2], key)) >= tonumber(ARGV[3]) then
+        redis.call('SADD', KEYS[6], key)
+    else
+        redis.call('RPUSH', KEYS[3], key)
+    end
+end
+local key = redis.call('LPOP', KEYS[3])
+if not key then
+    return false
+end
+local attempts = redis.call('HINCRBY', KEYS[2], key, 1)
+local lease = tostring(tonumber(ARGV[1]) + tonumber(ARGV[2]))
+redis.call('ZADD', KEYS[4], lease, key)
+return {key, redis.call('HGET', KEYS[1], key), attempts, lease}
+"""
+
+    # KEYS: leases, destination (a set, list, or the leases themselves)
+    # ARGV: job key, lease, 'set', 'list' or 'lease', new lease
+    MOVE_SCRIPT = """
+local lease = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not lease or tonumber(lease) ~= tonumber(ARGV[2]) then
+    return 0
+end
+if ARGV[3] == 'lease' then
+    redis.call('ZADD', KEYS[1], ARGV[4], ARGV[1])
+    return 1
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+if ARGV[3] == 'set' then
+    redis.call('SADD', KEYS[2], ARGV[1])
+else
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+end
+return 1
+"""
+
+    def __init__(self, redis_client, prefix='trawler:queue:', lease_seconds=3600, max_attempts=3):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._redis = redis_client
+        self._keys = dict((name, prefix + name) for name in ('items', 'attempts', PENDING, 'leases', DONE, FAILED,
+                                                             'errors'))
+
+    def put(self, items, batch_size=10000):
+        added = 0
+        batch = {}
+        for item in items:
+            batch[item_key(item)] = unicode(item).encode('utf-8')
+            if len(batch) >= batch_size:
+                added += self._insert(batch)
+                batch = {}
+        if batch:
+            added += self._insert(batch)
+        return added
+
+    def claim(self):
+        keys = [self._keys[name] for name in ('items', 'attempts', PENDING, 'leases', DONE, FAILED)]
+        claimed = self._redis.eval(self.CLAIM_SCRIPT, len(keys), *(keys + [time.time(), self.lease_seconds,
+                                                                          self.max_attempts]))
+        if not claimed:
+            return None
+        key, item, attempts, lease = claimed
+        return Job(key, item.decode('utf-8'), int(attempts), lease)
+
+    def extend(self, job):
+        lease = repr(time.time() + self.lease_seconds)
+        if not self._move(job, 'leases', 'lease', lease):
+            return False
+        job.lease = lease
+        return True
+
+    def ack(self, job):
+        return self._move(job, DONE, 'set')
+
+    def fail(self, job, error=None):
+        if job.attempts < self.max_attempts:
+            return self._move(job, PENDING, 'list')
+        if not self._move(job, FAILED, 'set'):
+            return False
+        if error:
+            self._redis.hset(self._keys['errors'], job.key, unicode(error).encode('utf-8'))
+        return True
+
+    def counts(self, states=STATES):
+        counters = {PENDING: lambda: self._redis.llen(self._keys[PENDING]),
+                    LEASED: lambda: self._redis.zcard(self._keys['leases']),
+                    DONE: lambda: self._redis.scard(self._keys[DONE]),
+                    FAILED: lambda: self._redis.scard(self._keys[FAILED])}
+        return dict((state, counters[state]()) for state in states)
+
+    def _insert(self, batch):
+        pipeline = self._redis.pipeline()
+        for key, item in batch.items():
+            pipeline.hsetnx(self._keys['items'], key, item)
+        added = [key for key, is_new in zip(batch.keys(), pipeline.execute()) if is_new]
+        if added:
+            pipeline = self._redis.pipeline()
+            for key in added:
+                pipeline.hset(self._keys['attempts'], key, 0)
+            pipeline.rpush(self._keys[PENDING], *added)
+            pipeline.execute()
+        return len(added)
+
+    def _move(self, job, destination, destination_type, new_lease=''):
+        return bool(self._redis.eval(self.MOVE_SCRIPT, 2, self._keys['leases'], self._keys[destination],
+                                     job.key, job.lease, destination_type, new_lease))
+
+
+def open_work_queue(url, lease_seconds=3600, max_attempts=3):
+    """
+    Opens the work queue at `url`, one of:
+      sqlite:PATH
+      dir:PATH
+      redis://HOST:PORT/NAME   (needs the redis package)
+    """
+    if url.startswith('sqlite:'):
+        return SQLiteWorkQueue(url[len('sqlite:'):], lease_seconds, max_attempts)
+    if url.startswith('dir:'):
+        return DirectoryWorkQueue(url[len('dir:'):], lease_seconds, max_attempts)
+    if url.startswith('redis://'):
+        import redis
+        address, _, name = url[len('redis://'):].partition('/')
+        host, _, port = address.partition(':')
+        return RedisWorkQueue(redis.StrictRedis(host, int(port or 6379)), 'trawler:queue:%s:' % (name or 'default'),
+                              lease_seconds, max_attempts)
+    raise ValueError("Unrecognised work queue '%s' - use sqlite:PATH, dir:PATH or redis://HOST:PORT/NAME" % url)
+
+
+class _LeaseKeeper(threading.Thread):
+    """
+    Extends the lease on a job every third of the lease, until stopped
+    """
+    def __init__(self, work_queue, job):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._work_queue = work_queue
+        self._job = job
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self._work_queue.lease_seconds / 3.0):
+            if not self._work_queue.extend(self._job):
+                return
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def run_worker(work_queue, crawl, logger=None, stop_when_empty=True, poll_seconds=60):
+    """
+    Claims jobs from `work_queue` and calls `crawl(item)` for each,
+    acknowledging the job if it returns and failing it (to be retried)
+    if it raises an exception.  Returns the number of jobs completed
+    once no jobs are pending or leased (if `stop_when_empty`), and
+    otherwise waits `poll_seconds` for more work.
+    """
+    logger = logger or logging.getLogger(__name__)
+    completed = 0
+    while True:
+        job = work_queue.claim()
+        if job is None:
+            # The done and failed jobs are not counted, as there may be millions
+            counts = work_queue.counts((PENDING, LEASED))
+            if stop_when_empty and counts[PENDING] == 0 and counts[LEASED] == 0:
+                return completed
+            # Wait for more work, or for a dead worker's lease to expire
+            time.sleep(poll_seconds)
+            continue
+
+        lease_keeper = _LeaseKeeper(work_queue, job)
+        lease_keeper.start()
+        try:
+            crawl(job.item)
+        except Exception as e:
+            logger.exception("Attempt %d of '%s' failed" % (job.attempts, job.item))
+            lease_keeper.stop()
+            work_queue.fail(job, repr(e))
+        else:
+            lease_keeper.stop()
+            if work_queue.ack(job):
+                completed += 1
+            else:
+                logger.warn("Lease on '%s' expired before it was done" % job.item)
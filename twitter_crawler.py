@@ -3,10 +3,23 @@ Shared classes and functions for crawling Twitter
 """
 
 # Standard Library modules
+import array
+import bisect
+import calendar
 import codecs
+import collections
 import datetime
+import hashlib
+import heapq
 import itertools
 import logging
+import math
+import multiprocessing
+import os
+import Queue
+import random
+import re
+import threading
 import time
 import gzip
 
@@ -16,8 +29,14 @@ except:
     import json
 
 # Third party modules
+import requests.adapters
 from twython import Twython, TwythonError
 
+# Local modules
+import trawler_metrics
+from trawler_projection import TweetProjection
+from trawler_schema import expand_users, get_tweet_schema, user_table_filename
+
 
 
 ###  Functions  ###
@@ -39,27 +58,36 @@ def get_screen_names_from_file(filename):
     Opens a text file containing one Twitter screen name per line,
     returns a list of the screen names.
     """
-    screen_name_file = codecs.open(filename, "r", "utf-8")
-    screen_names = []
-    for line in screen_name_file.readlines():
-        if line.strip():
-            screen_names.append(line.strip().replace('@',''))
-    screen_name_file.close()
-    return screen_names
+    return list(iter_screen_names_from_file(filename))
+
+def iter_screen_names_from_file(filename):
+    """
+    Yields the screen names in a text file containing one Twitter
+    screen name per line, without reading the whole file into memory.
+    """
+    with codecs.open(filename, "r", "utf-8") as screen_name_file:
+        for line in screen_name_file:
+            if line.strip():
+                yield line.strip().replace('@','')
 
 def get_ids_from_file(filename):
     """
     Opens a text file containing one Twitter `user_id` per line,
     returns a list of the properly casted `user_id`s.
     """
-    id_file = codecs.open(filename, "r", "utf-8")
-    ids = []
-    for line in id_file.readlines():
-        stripped = line.strip()
-        if stripped:
-            ids.append(int(stripped))
-    id_file.close()
-    return ids
+    return list(iter_ids_from_file(filename))
+
+def iter_ids_from_file(filename):
+    """
+    Yields the properly casted `user_id`s in a text file containing one
+    Twitter `user_id` per line, without reading the whole file into
+    memory.  Works just as well for files of Tweet IDs.
+    """
+    with codecs.open(filename, "r", "utf-8") as id_file:
+        for line in id_file:
+            stripped = line.strip()
+            if stripped:
+                yield int(stripped)
 
 
 def grouper(iterable, n, fillvalue=None):
@@ -83,23 +111,279 @@ def save_screen_names_to_file(screen_names, filename, logger=None):
     f.close()
 
 
-def save_tweets_to_json_file(tweets, json_filename, gzip_out=True):
+def save_tweets_to_json_file(tweets, json_filename, gzip_out=True, schema=None):
     """
     Takes a Python dictionary of Tweets from the Twython API, and
     saves the Tweets to a JSON file, storing one JSON object per
     line.
     `gzip_out=True` will write it to a gzip file, rather than a flat file
+    `schema` slims the Tweets and saves their users to a user table (see
+    trawler_schema.py)
     """
-    if gzip_out:
+    schema = get_tweet_schema(schema)
+    if schema is not None:
+        users = collections.OrderedDict()
+        save_tweets_to_json_file((schema.slim_tweet(tweet, users) for tweet in tweets), json_filename, gzip_out)
+        save_tweets_to_json_file(users.values(), user_table_filename(json_filename), gzip_out)
+    elif gzip_out:
         OUT = gzip.open(json_filename, 'wb')
         for tweet in tweets:
             OUT.write(unicode("%s\n" % json.dumps(tweet)).encode('utf-8'))
+        OUT.close()
     else:
         json_file = codecs.open(json_filename, "w", "utf-8")
         for tweet in tweets:
             json_file.write("%s\n" % json.dumps(tweet))
         json_file.close()
 
+def parse_twitter_time(created_at):
+    """
+    Returns the Unix time of a Twitter `created_at` string, e.g.
+    'Wed Aug 27 13:08:45 +0000 2008'
+    """
+    return calendar.timegm(datetime.datetime.strptime(created_at, '%a %b %d %H:%M:%S +0000 %Y').timetuple())
+
+def load_user_table(json_filename):
+    """
+    Returns a dictionary of user IDs to users from the user table saved
+    with slimmed Tweet file `json_filename`, for expand_users()
+    """
+    users = {}
+    user_file = open_json_file(user_table_filename(json_filename))
+    try:
+        for line in user_file:
+            if line.strip():
+                user = json.loads(line)
+                users[user['id']] = user
+    finally:
+        user_file.close()
+    return users
+
+def load_tweets_from_json_file(json_filename):
+    """
+    Returns the Tweets saved in `json_filename`, with their users
+    restored from its user table if the Tweets were slimmed
+    """
+    json_file = open_json_file(json_filename)
+    try:
+        tweets = [json.loads(line) for line in json_file if line.strip()]
+    finally:
+        json_file.close()
+    if os.path.exists(user_table_filename(json_filename)):
+        users = load_user_table(json_filename)
+        for tweet in tweets:
+            expand_users(tweet, users)
+    return tweets
+
+def open_json_file(json_filename):
+    """
+    Opens a file of JSON objects, one per line, for reading lines as
+    UTF-8 bytes, whether or not it is gzipped (which files saved by
+    `save_tweets_to_json_file` are, whatever they are named).
+    """
+    with open(json_filename, 'rb') as json_file:
+        magic = json_file.read(2)
+    if magic == '\x1f\x8b':
+        return gzip.open(json_filename, 'rb')
+    return open(json_filename, 'rb')
+
+def _tweet_lines_newest_first(json_filename, stream_number):
+    """
+    Yields (-Tweet ID, `stream_number`, line) for each Tweet in a file
+    saved newest first, as timelines are, for merging with heapq
+    """
+    # The Tweet ID is near the start of each line, so need not be decoded with the rest
+    id_projection = TweetProjection(['id'])
+    previous_tweet_id = None
+    json_file = open_json_file(json_filename)
+    try:
+        for line in json_file:
+            if not line.strip():
+                continue
+            tweet_id = id_projection.project(line)['id']
+            if previous_tweet_id is not None and tweet_id > previous_tweet_id:
+                raise ValueError("Tweets in '%s' are not saved newest first" % json_filename)
+            previous_tweet_id = tweet_id
+            if not line.endswith('\n'):
+                line += '\n'
+            yield -tweet_id, stream_number, line
+    finally:
+        json_file.close()
+
+def merge_tweet_files(json_filenames, output_filename, gzip_out=True):
+    """
+    Merges files of Tweets saved newest first (e.g. the snapshots of a
+    user's timeline saved by successive crawls) into one file of every
+    distinct Tweet, newest first, and returns the number of Tweets
+    written.  Only the next Tweet from each file is held in memory, and
+    Tweets are copied without being re-encoded.  The output is written
+    to a temporary file that replaces `output_filename` once complete,
+    so `output_filename` may be one of `json_filenames`.  The user
+    tables of files saved with a schema are merged too, keeping each
+    user as they were in the last file.
+    """
+    users = collections.OrderedDict()
+    for json_filename in json_filenames:
+        if os.path.exists(user_table_filename(json_filename)):
+            users.update(load_user_table(json_filename))
+    temporary_filename = output_filename + '.tmp'
+    if gzip_out:
+        output_file = gzip.open(temporary_filename, 'wb')
+    else:
+        output_file = open(temporary_filename, 'wb')
+    tweet_count = 0
+    previous_tweet_id = None
+    try:
+        streams = [_tweet_lines_newest_first(json_filename, stream_number)
+                   for stream_number, json_filename in enumerate(json_filenames)]
+        for negative_tweet_id, stream_number, line in heapq.merge(*streams):
+            # Duplicates come out of the merge one after another
+            if negative_tweet_id != previous_tweet_id:
+                output_file.write(line)
+                tweet_count += 1
+                previous_tweet_id = negative_tweet_id
+    except:
+        output_file.close()
+        os.remove(temporary_filename)
+        raise
+    output_file.close()
+    os.rename(temporary_filename, output_filename)
+    if users:
+        save_tweets_to_json_file(users.values(), user_table_filename(output_filename), gzip_out)
+    return tweet_count
+
+def _merge_tweet_files(args):
+    json_filenames, output_filename = args
+    return os.path.basename(output_filename), merge_tweet_files(json_filenames, output_filename)
+
+def compact_tweet_snapshots(snapshot_directories, output_directory, processes=None, logger=None):
+    """
+    Merges the files with the same name (e.g. '[screen_name].tweets') in
+    each of `snapshot_directories`, as written by successive runs of
+    save_recent_tweets_to_json.py, into one gzipped file of that name in
+    `output_directory`, using `processes` processes (by default, one per
+    CPU).  Returns a dictionary of file names to the number of Tweets
+    written.
+    """
+    json_filenames = collections.OrderedDict()
+    for snapshot_directory in snapshot_directories:
+        filenames = sorted(os.listdir(snapshot_directory))
+        # User tables are merged along with their Tweet files
+        user_table_filenames = set(user_table_filename(filename) for filename in filenames)
+        for filename in filenames:
+            if not filename.endswith('.tmp') and filename not in user_table_filenames:
+                json_filenames.setdefault(filename, []).append(os.path.join(snapshot_directory, filename))
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+    jobs = [(filenames, os.path.join(output_directory, filename)) for filename, filenames in json_filenames.items()]
+
+    tweet_counts = {}
+    pool = multiprocessing.Pool(processes)
+    try:
+        for filename, tweet_count in pool.imap_unordered(_merge_tweet_files, jobs):
+            if logger:
+                logger.info("Merged %d Tweets into '%s'" % (tweet_count, filename))
+            tweet_counts[filename] = tweet_count
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return tweet_counts
+
+def search_term_filename(term):
+    """
+    Returns a filesystem-safe name for search term `term`.
+
+    Terms that only differ in punctuation (e.g. '#python', '@python'
+    and 'python') would have the same readable part, so a short hash
+    of the raw term is appended to keep the names distinct.
+    """
+    if isinstance(term, unicode):
+        raw_term = term.encode('utf-8')
+    else:
+        raw_term = term
+    readable = re.sub(r'[^\w\-]+', '_', term, flags=re.UNICODE).strip('_') or 'search'
+    return '%s-%s' % (readable, hashlib.sha1(raw_term).hexdigest()[:8])
+
+def search_term_filenames(terms):
+    """
+    Returns a dictionary mapping each of `terms` to its
+    `search_term_filename()`.  Raises ValueError if two different terms
+    would share a filename, since their writers would overwrite each
+    other's files.
+    """
+    filenames = {}
+    terms_by_filename = {}
+    for term in terms:
+        filename = search_term_filename(term)
+        if terms_by_filename.get(filename, term) != term:
+            raise ValueError("Search terms '%s' and '%s' share the filename '%s'"
+                             % (terms_by_filename[filename], term, filename))
+        terms_by_filename[filename] = term
+        filenames[term] = filename
+    return filenames
+
+def search_term_is_batchable(term):
+    """
+    Returns True if `term` can be OR-combined with other terms into a
+    single query.  Terms using search operators (e.g. 'python -snake',
+    'from:nasa', 'cats OR dogs') or quoted phrases are always searched
+    on their own, since their results cannot be reliably matched back
+    to the term by looking at a Tweet's words.
+    """
+    if re.search(r'["()]', term):
+        return False
+    for word in term.split():
+        if word.startswith('-') or ':' in word or word in ('OR', 'AND'):
+            return False
+    return True
+
+def search_query_for_terms(terms):
+    """
+    Returns a single search API query that matches any of `terms`.
+    Multi-word terms are parenthesised so they keep their AND meaning.
+    """
+    if len(terms) == 1:
+        return terms[0]
+    return ' OR '.join(['(%s)' % term if ' ' in term else term for term in terms])
+
+def tweet_search_words(tweet):
+    """
+    Returns the set of lowercased words the search API may have matched
+    `tweet` on: its (full or extended) text, hashtags, mentions,
+    expanded URLs and author, and those of any retweeted or quoted
+    Tweet.
+    """
+    words = set()
+    for t in [tweet, tweet.get('retweeted_status'), tweet.get('quoted_status')]:
+        if not t:
+            continue
+        text = (t.get('extended_tweet', {}).get('full_text') or t.get('full_text') or t.get('text') or '')
+        words.update(re.findall(r'\w+', text.lower(), flags=re.UNICODE))
+        entities = t.get('extended_tweet', {}).get('entities') or t.get('entities') or {}
+        for hashtag in entities.get('hashtags', []):
+            words.add(hashtag['text'].lower())
+        for mention in entities.get('user_mentions', []):
+            words.add(mention['screen_name'].lower())
+        for url in entities.get('urls', []):
+            words.update(re.findall(r'\w+', (url.get('expanded_url') or url.get('url') or '').lower(),
+                                    flags=re.UNICODE))
+        words.add(t.get('user', {}).get('screen_name', '').lower())
+    return words
+
+def tweet_matches_search_term(tweet, term):
+    """
+    Returns True if `tweet` contains every word of search term `term`,
+    ignoring case and any leading '#' or '@'.  Used to work out which
+    terms of an OR-combined search a Tweet belongs to, so only
+    meaningful for terms where `search_term_is_batchable()` is True.
+    """
+    words = tweet_search_words(tweet)
+    for word in re.findall(r'\w+', term.lower(), flags=re.UNICODE):
+        if word not in words:
+            return False
+    return True
+
 def tweets_to_kafka_stream(tweets, channel='trawler', kafka_producer=None,
                                 host=None, port=None):
     """
@@ -114,19 +398,503 @@ def tweets_to_kafka_stream(tweets, channel='trawler', kafka_producer=None,
         kafka_producer = SimpleProducer(kafka_client)
 
     for tweet in tweets:
-        producer.send_messages(channel, json.dums(tweet))
+        kafka_producer.send_messages(channel, json.dumps(tweet))
+
+def publishing_endpoint(twitter_endpoint, sink=None):
+    """
+    Returns `twitter_endpoint` wrapped so that every page it fetches is
+    published to `sink`, or `twitter_endpoint` itself if `sink` is None.
+    """
+    if sink is None:
+        return twitter_endpoint
+    return PublishingTwitterEndpoint(twitter_endpoint, sink)
+
+def twython_token_key(twython):
+    """
+    Returns the credentials a Twython instance makes requests with, so
+    that instances using the same API key (and access token) can be
+    recognised as sharing the same rate limits.
+    """
+    return tuple(getattr(twython, attribute, None) for attribute in ['app_key', 'oauth_token', 'access_token'])
+
+def twython_token_hash(twython):
+    """
+    Returns a stable hash of `twython_token_key(twython)`, for naming the
+    rate limits of a set of credentials in a shared store without
+    exposing the credentials themselves.
+    """
+    key = u'\t'.join([unicode(part or u'') for part in twython_token_key(twython)])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def get_rate_limited_endpoint(twython, twitter_api_endpoint, logger=None, metrics=None, registry=None):
+    """
+    Returns a RateLimitedTwitterEndpoint for `twitter_api_endpoint` and
+    the API key used by `twython`.  If an `EndpointRegistry` is given,
+    the endpoint shares its rate limit window with every other endpoint
+    from that registry for the same (API key, endpoint), while still
+    logging to `logger` and recording to `metrics`.
+    """
+    if registry is None:
+        return RateLimitedTwitterEndpoint(twython, twitter_api_endpoint, logger=logger, metrics=metrics)
+    return registry.get_endpoint(twython, twitter_api_endpoint, logger, metrics)
+
+def page_records(response):
+    """
+    Returns the list of records (Tweets, users, IDs or lists) held in an
+    API response, which is either the list itself or a dictionary
+    wrapping it, e.g. {'statuses': [...]} or {'ids': [...], 'next_cursor': 0}.
+    """
+    if isinstance(response, list):
+        return response
+    for records_field in ['statuses', 'ids', 'users', 'lists']:
+        if records_field in response:
+            return response[records_field]
+    return []
 
 
 ###  Classes  ###
 
+class RotatingJSONWriter:
+    """
+    Appends Tweets to a series of JSON files (one JSON object per line)
+    named '[prefix].00000.json.gz', '[prefix].00001.json.gz', ...,
+    starting a new file once `max_tweets_per_file` Tweets have been
+    written to the current one.
+
+    Existing files are never overwritten: a new writer continues with
+    the first unused file number, so each page written is only ever
+    written once, and a long-running harvest never rewrites old output.
+    `gzip_out=False` writes flat '.json' files instead.  With `schema`,
+    Tweets are slimmed and each file's users saved to its own user table
+    (see trawler_schema.py).
+    """
+    def __init__(self, prefix, max_tweets_per_file=100000, gzip_out=True, schema=None):
+        self._prefix = prefix
+        self._max_tweets_per_file = max_tweets_per_file
+        self._gzip_out = gzip_out
+        self._schema = get_tweet_schema(schema)
+        self._users = collections.OrderedDict()
+        self._json_file = None
+        self._tweets_in_file = 0
+        self._file_number = 0
+        while os.path.exists(self._filename(self._file_number)):
+            self._file_number += 1
+
+    def write_tweets(self, tweets):
+        for tweet in tweets:
+            if self._json_file is None or self._tweets_in_file >= self._max_tweets_per_file:
+                self._rotate()
+            if self._schema is not None:
+                tweet = self._schema.slim_tweet(tweet, self._users)
+            if self._gzip_out:
+                self._json_file.write(unicode("%s\n" % json.dumps(tweet)).encode('utf-8'))
+            else:
+                self._json_file.write("%s\n" % json.dumps(tweet))
+            self._tweets_in_file += 1
+        if self._json_file:
+            self._json_file.flush()
+
+    def close(self):
+        if self._json_file:
+            self._json_file.close()
+            self._json_file = None
+            if self._users:
+                save_tweets_to_json_file(self._users.values(),
+                                         user_table_filename(self._filename(self._file_number - 1)), self._gzip_out)
+                self._users = collections.OrderedDict()
+
+    def _filename(self, file_number):
+        if self._gzip_out:
+            return "%s.%05d.json.gz" % (self._prefix, file_number)
+        return "%s.%05d.json" % (self._prefix, file_number)
+
+    def _rotate(self):
+        self.close()
+        if self._gzip_out:
+            self._json_file = gzip.open(self._filename(self._file_number), 'wb')
+        else:
+            self._json_file = codecs.open(self._filename(self._file_number), 'w', 'utf-8')
+        self._file_number += 1
+        self._tweets_in_file = 0
+
+class CrawlSink:
+    """
+    Base class for destinations that crawlers publish to as each page of
+    results arrives, rather than once a whole timeline or follower list
+    has been collected.
+
+    `publish()` is given the records from one page (Tweets, user
+    objects, user IDs or lists), the name of the API endpoint they came
+    from (e.g. 'statuses/user_timeline'), and the key the page was
+    requested for (the `user_id`, `screen_name`, `list_id` or search
+    query), so that downstream consumers can route them.
+
+    Implementations may block in `publish()`; doing so pauses the
+    crawler, which is how a slow destination applies backpressure.
+    """
+    def publish(self, records, endpoint, key=None):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class InMemorySink(CrawlSink):
+    """
+    CrawlSink that keeps every published page in memory as an
+    (endpoint, key, records) tuple.  Intended for tests.
+    """
+    def __init__(self):
+        self.pages = []
+
+    def publish(self, records, endpoint, key=None):
+        self.pages.append((endpoint, key, list(records)))
+
+    def records(self, endpoint=None):
+        """
+        Returns every record published (for `endpoint`, if given), in
+        the order published.
+        """
+        return [record for page_endpoint, key, records in self.pages
+                if endpoint is None or page_endpoint == endpoint
+                for record in records]
+
+
+class PublishingTwitterEndpoint:
+    """
+    Wraps a RateLimitedTwitterEndpoint so that the records in each page
+    returned by get_data() are also published to a CrawlSink.  All
+    other attributes are those of the wrapped endpoint.
+    """
+    # The first of these parameters present in a request is used as its key
+    KEY_PARAMETERS = ['user_id', 'screen_name', 'list_id', 'q']
+
+    def __init__(self, twitter_endpoint, sink):
+        self._twitter_endpoint = twitter_endpoint
+        self._sink = sink
+
+    def __getattr__(self, name):
+        return getattr(self._twitter_endpoint, name)
+
+    def get_data(self, **twitter_api_parameters):
+        response = self._twitter_endpoint.get_data(**twitter_api_parameters)
+        records = page_records(response)
+        if records:
+            key = None
+            for key_parameter in self.KEY_PARAMETERS:
+                if key_parameter in twitter_api_parameters:
+                    key = twitter_api_parameters[key_parameter]
+                    break
+            self._sink.publish(records, self._twitter_endpoint._twitter_api_endpoint, key)
+        return response
+
+
+class CursorCheckpoint:
+    """
+    Remembers the cursor (e.g. a `next_cursor` or `max_id`) reached for
+    each crawl key, so an interrupted crawl can resume where it stopped
+    rather than re-spending API calls on pages it already has.
+
+    Updates are appended to `checkpoint_filename` as tab-separated
+    'key<TAB>cursor' lines, and the last line for a key wins when the
+    file is reloaded.  Appending keeps each update O(1) no matter how
+    many keys are being tracked.  Once the file holds more than twice
+    as many lines as there are keys (and at least `compact_lines`), it
+    is rewritten with just the last cursor for each key, so a long-running
+    crawl that updates the same keys over and over (e.g. SearchMonitor)
+    does not grow it without bound.
+    """
+    def __init__(self, checkpoint_filename=None, compact_lines=10000):
+        self._checkpoint_filename = checkpoint_filename
+        self._compact_lines = compact_lines
+        self._cursors = {}
+        self._checkpoint_file = None
+        self._line_count = 0
+
+        if checkpoint_filename:
+            if os.path.exists(checkpoint_filename):
+                for line in codecs.open(checkpoint_filename, 'r', 'utf-8'):
+                    if '\t' in line:
+                        key, cursor = line.rstrip('\n').split('\t', 1)
+                        self._cursors[key] = json.loads(cursor)
+                        self._line_count += 1
+            self._checkpoint_file = codecs.open(checkpoint_filename, 'a', 'utf-8')
+
+    def get(self, key, default=None):
+        return self._cursors.get(unicode(key), default)
+
+    def set(self, key, cursor):
+        key = unicode(key)
+        self._cursors[key] = cursor
+        if self._checkpoint_file:
+            self._checkpoint_file.write(u"%s\t%s\n" % (key, json.dumps(cursor)))
+            self._checkpoint_file.flush()
+            self._line_count += 1
+            if self._line_count > max(2 * len(self._cursors), self._compact_lines):
+                self.compact()
+
+    def compact(self):
+        """
+        Rewrites the checkpoint file with only the last cursor for each key
+        """
+        if not self._checkpoint_file:
+            return
+        compact_filename = self._checkpoint_filename + '.compact'
+        with codecs.open(compact_filename, 'w', 'utf-8') as compact_file:
+            for key, cursor in self._cursors.items():
+                compact_file.write(u"%s\t%s\n" % (key, json.dumps(cursor)))
+        self._checkpoint_file.close()
+        # Renaming over the old file means a crash leaves one or the other
+        os.rename(compact_filename, self._checkpoint_filename)
+        self._checkpoint_file = codecs.open(self._checkpoint_filename, 'a', 'utf-8')
+        self._line_count = len(self._cursors)
+
+    def close(self):
+        if self._checkpoint_file:
+            self._checkpoint_file.close()
+            self._checkpoint_file = None
+
+
+class ProfileStore:
+    """
+    Append-only store of hydrated Twitter user objects, one JSON object
+    per line, that writes each user at most once.
+
+    Only the set of user IDs already written is kept in memory, so
+    crawls that see the same users over and over (e.g. members of many
+    overlapping lists) neither re-write nor re-hold their profiles.
+    Re-opening an existing store reloads that ID set.
+    """
+    def __init__(self, json_filename, gzip_out=True):
+        self._user_ids = set()
+        self._json_filename = json_filename
+        self._gzip_out = gzip_out
+
+        if os.path.exists(json_filename):
+            for user in self._read_users(json_filename):
+                self._user_ids.add(user['id'])
+
+        if gzip_out:
+            self._json_file = gzip.open(json_filename, 'ab')
+        else:
+            self._json_file = codecs.open(json_filename, 'a', 'utf-8')
+
+    def __contains__(self, user_id):
+        return user_id in self._user_ids
+
+    def __len__(self):
+        return len(self._user_ids)
+
+    def add_user(self, user):
+        """
+        Writes `user` to the store unless a user with the same `id` has
+        already been written.  Returns True if the user was new.
+        """
+        if user['id'] in self._user_ids:
+            return False
+        self._user_ids.add(user['id'])
+        if self._gzip_out:
+            self._json_file.write(unicode("%s\n" % json.dumps(user)).encode('utf-8'))
+        else:
+            self._json_file.write("%s\n" % json.dumps(user))
+        return True
+
+    def add_users(self, users):
+        """
+        Writes each previously unseen user in `users`, returns the number
+        of users written.
+        """
+        return len([user for user in users if self.add_user(user)])
+
+    def users(self):
+        """
+        Yields every user in the store, e.g. to seed a TimelinePlanner
+        """
+        # A gzip member can only be read once it has been closed
+        self._json_file.close()
+        for user in self._read_users(self._json_filename):
+            yield user
+        if self._gzip_out:
+            self._json_file = gzip.open(self._json_filename, 'ab')
+        else:
+            self._json_file = codecs.open(self._json_filename, 'a', 'utf-8')
+
+    def close(self):
+        self._json_file.close()
+
+    def _read_users(self, json_filename):
+        if self._gzip_out:
+            user_file = gzip.open(json_filename, 'rb')
+        else:
+            user_file = codecs.open(json_filename, 'r', 'utf-8')
+        for line in user_file:
+            if line.strip():
+                yield json.loads(line)
+        user_file.close()
+
+
+class TimelinePlanner:
+    """
+    Orders the users whose timelines are to be crawled by the number of
+    calls each crawl is expected to take, estimated from the users'
+    profiles (user objects from users/lookup), so that a tight quota is
+    spent where it does the most good.  Protected accounts, accounts
+    without Tweets and, given `inactive_days`, accounts that have not
+    Tweeted for that many days are skipped before any timeline call.
+
+    Goals:
+      'users_per_hour'  -- cheapest crawls first, to complete the most
+                           users per rate limit window
+      'tweets_per_call' -- fullest timeline pages first, to get the most
+                           Tweets per call
+
+    Profiles are taken from `profiles` (e.g. ProfileStore.users()), and
+    any others are looked up with `user_lookup` (a UserLookup) and added
+    to `profile_store`, if given.  Users without a profile are planned
+    last, in the order given.
+    """
+    GOALS = ('users_per_hour', 'tweets_per_call')
+
+    # The user timeline API only reaches back this far
+    MAXIMUM_TIMELINE_TWEETS = 3200
+
+    def __init__(self, profiles=(), user_lookup=None, profile_store=None, goal='users_per_hour',
+                 inactive_days=None, logger=None):
+        if goal not in self.GOALS:
+            raise ValueError("Unknown planning goal '%s'" % goal)
+        self._goal = goal
+        self._user_lookup = user_lookup
+        self._profile_store = profile_store
+        self._inactive_days = inactive_days
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+        # (statuses_count, protected, time of last Tweet) for each user ID
+        self._profiles = {}
+        # The reason each user left out of a plan was skipped
+        self.skipped = {}
+        self.add_profiles(profiles)
+
+    def add_profiles(self, users):
+        for user in users:
+            last_tweet_time = None
+            if user.get('status'):
+                last_tweet_time = parse_twitter_time(user['status']['created_at'])
+            self._profiles[user['id']] = (user.get('statuses_count', 0), user.get('protected', False), last_tweet_time)
+
+    def estimated_calls(self, user_id):
+        """
+        Returns the number of calls CrawlTwitterTimelines is expected to
+        make for all of `user_id`'s Tweets, or None without a profile
+        """
+        if user_id not in self._profiles:
+            return None
+        tweet_count = self._available_tweets(user_id)
+        # Crawls stop after the first page with fewer than 100 Tweets,
+        # which takes an extra, empty page if the last page had more
+        if tweet_count % 200 < 100:
+            return tweet_count // 200 + 1
+        return tweet_count // 200 + 2
+
+    def plan(self, user_ids):
+        """
+        Returns `user_ids` in the order their timelines should be
+        crawled, without those that should be skipped
+        """
+        user_ids = list(user_ids)
+        self._look_up([user_id for user_id in user_ids if user_id not in self._profiles])
+        planned_user_ids = []
+        unknown_user_ids = []
+        for user_id in user_ids:
+            if user_id in self._profiles:
+                reason = self._skip_reason(user_id)
+            else:
+                reason = self.skipped.get(user_id)
+            if reason:
+                self.skipped[user_id] = reason
+            elif user_id in self._profiles:
+                planned_user_ids.append(user_id)
+            else:
+                unknown_user_ids.append(user_id)
+        skipped_count = len(user_ids) - len(planned_user_ids) - len(unknown_user_ids)
+        if skipped_count:
+            self._logger.info("Skipping %d of %d users" % (skipped_count, len(user_ids)))
+        if self._goal == 'users_per_hour':
+            planned_user_ids.sort(key=lambda user_id: (self.estimated_calls(user_id),
+                                                       -self._available_tweets(user_id)))
+        else:
+            planned_user_ids.sort(key=lambda user_id: (-float(self._available_tweets(user_id)) /
+                                                       self.estimated_calls(user_id),
+                                                       self.estimated_calls(user_id)))
+        return planned_user_ids + unknown_user_ids
+
+    def batches(self, user_ids, calls_per_window):
+        """
+        Packs `user_ids` (e.g. a plan) into lists of users expected to
+        take at most `calls_per_window` calls between them, so that each
+        list can be crawled within one rate limit window.  Each user goes
+        in the first list with room, so the order of a plan is mostly
+        kept; a user expected to take more calls than a window holds
+        gets a list of their own.
+        """
+        batches = []
+        for user_id in user_ids:
+            calls = self.estimated_calls(user_id) or 1
+            for batch in batches:
+                if batch[0] + calls <= calls_per_window:
+                    batch[0] += calls
+                    batch[1].append(user_id)
+                    break
+            else:
+                batches.append([calls, [user_id]])
+        return [batch_user_ids for calls, batch_user_ids in batches]
+
+    def _available_tweets(self, user_id):
+        return min(self._profiles[user_id][0], self.MAXIMUM_TIMELINE_TWEETS)
+
+    def _skip_reason(self, user_id):
+        statuses_count, protected, last_tweet_time = self._profiles[user_id]
+        if protected:
+            return 'protected'
+        if not statuses_count:
+            return 'empty'
+        if (self._inactive_days is not None and last_tweet_time is not None and
+                time.time() - last_tweet_time > self._inactive_days * 86400):
+            return 'inactive'
+        return None
+
+    def _look_up(self, user_ids):
+        if self._user_lookup is None or not user_ids:
+            return
+        for id_subset in grouper(user_ids, 100):
+            id_subset = [user_id for user_id in id_subset if user_id is not None]
+            try:
+                users = self._user_lookup.lookup_users(id_subset)
+            except TwythonError as e:
+                # Raised when none of the users exist
+                if e.error_code != 404:
+                    raise
+                users = []
+            self.add_profiles(users)
+            if self._profile_store is not None:
+                self._profile_store.add_users(users)
+            for user_id in id_subset:
+                if user_id not in self._profiles:
+                    self.skipped[user_id] = 'missing'
+
+
 class CrawlTwitterTimelines:
-    def __init__(self, twython, logger=None):
+    def __init__(self, twython, logger=None, sink=None, metrics=None, registry=None):
         if logger is None:
             self._logger = get_console_info_logger()
         else:
             self._logger = logger
 
-        self._twitter_endpoint = RateLimitedTwitterEndpoint(twython, "statuses/user_timeline", logger=self._logger)
+        self._twitter_endpoint = publishing_endpoint(get_rate_limited_endpoint(twython, "statuses/user_timeline", logger=self._logger, metrics=metrics, registry=registry), sink)
 
 ###
 ### Accessing the users by `screen_name`
@@ -259,7 +1027,7 @@ class CrawlTwitterTimelines:
 
         try:
             # Retrieve first batch of Tweets
-            tweets = self._twitter_endpoint.get_data(user_id=user_id, count=200)
+            tweets = self._twitter_endpoint.get_data(user_id=user_id, count=200, tweet_mode='extended')
             self._logger.info("  Retrieved first %d Tweets for user_id '%s'" % (len(tweets), user_id))
         except TwythonError as e:
             if e.error_code == 404:
@@ -318,7 +1086,7 @@ class CrawlTwitterTimelines:
 
         # Retrieve first batch of Tweets
         if not max_id:
-            tweets = self._twitter_endpoint.get_data(user_id=user_id, count=200, since_id=since_id)
+            tweets = self._twitter_endpoint.get_data(user_id=user_id, count=200, since_id=since_id, tweet_mode='extended')
             self._logger.info("  Retrieved first %d Tweets for user '%s'" % (len(tweets), user_id))
 
             if len(tweets) < MINIMUM_TWEETS_REQUIRED_FOR_MORE_API_CALLS:
@@ -378,15 +1146,15 @@ class CrawlTwitterTimelines:
 
 import datetime as dt
 class FindFriendFollowers:
-    def __init__(self, twython, logger=None):
+    def __init__(self, twython, logger=None, sink=None, metrics=None, registry=None):
         if logger is None:
             self._logger = get_console_info_logger()
         else:
             self._logger = logger
 
-        self._friend_endpoint = RateLimitedTwitterEndpoint(twython, "friends/ids", logger=self._logger)
-        self._follower_endpoint = RateLimitedTwitterEndpoint(twython, "followers/ids", logger=self._logger)
-        self._user_lookup_endpoint = RateLimitedTwitterEndpoint(twython, "users/lookup", logger=self._logger)
+        self._friend_endpoint = publishing_endpoint(get_rate_limited_endpoint(twython, "friends/ids", logger=self._logger, metrics=metrics, registry=registry), sink)
+        self._follower_endpoint = publishing_endpoint(get_rate_limited_endpoint(twython, "followers/ids", logger=self._logger, metrics=metrics, registry=registry), sink)
+        self._user_lookup_endpoint = publishing_endpoint(get_rate_limited_endpoint(twython, "users/lookup", logger=self._logger, metrics=metrics, registry=registry), sink)
         self.calls_remaining = 1
         self.last_checked_status = dt.datetime.now()
 
@@ -398,9 +1166,9 @@ class FindFriendFollowers:
             self._friend_endpoint.update_rate_limit_status()
             self._follower_endpoint.update_rate_limit_status()
             self._user_lookup_endpoint.update_rate_limit_status()
-        return min(self._friend_endpoint.api_calls_remaining_for_current_window,
-                   self._follower_endpoint.api_calls_remaining_for_current_window,
-                   self._user_lookup_endpoint.api_calls_remaining_for_current_window)
+        return min(self._friend_endpoint.calls_remaining(),
+                   self._follower_endpoint.calls_remaining(),
+                   self._user_lookup_endpoint.calls_remaining())
 
 
 ###
@@ -422,12 +1190,12 @@ class FindFriendFollowers:
         try:
             response = self._friend_endpoint.get_data(screen_name=screen_name)
             friend_ids = response['ids']
-            next_cursor = response['next_cursor_str']
+            next_cursor = response['next_cursor']
             while all and next_cursor:
                 response = self._friend_endpoint.get_data(screen_name=screen_name, 
                                                             cursor=next_cursor)
                 friend_ids += response['ids']
-                next_cursor = response['next_cursor_str']
+                next_cursor = response['next_cursor']
         except TwythonError as e:
             if e.error_code == 404:
                 self._logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % screen_name)
@@ -441,12 +1209,12 @@ class FindFriendFollowers:
         # We shouldn't get 404s and 401s on this call, so need for the try/except
         response = self._follower_endpoint.get_data(screen_name=screen_name)
         follower_ids = response['ids']
-        next_cursor = response['next_cursor_str']
+        next_cursor = response['next_cursor']
         while len(follower_ids) < count and next_cursor:
             response = self._follower_endpoint.get_data(screen_name=screen_name, 
                                                             cursor=next_cursor)
             follower_ids += response['ids']
-            next_cursor = response['next_cursor_str']
+            next_cursor = response['next_cursor']
 
         # Return those in common
         return list(set(friend_ids).intersection(set(follower_ids)))
@@ -487,12 +1255,12 @@ class FindFriendFollowers:
         try:
             response = self._friend_endpoint.get_data(user_id=user_id)
             friend_ids = response['ids']
-            next_cursor = response['next_cursor_str']
+            next_cursor = response['next_cursor']
             while all and next_cursor:
                 response = self._friend_endpoint.get_data(user_id=user_id, 
                                                           cursor=next_cursor)
                 friend_ids += response['ids']
-                next_cursor = response['next_cursor_str']
+                next_cursor = response['next_cursor']
         except TwythonError as e:
             if e.error_code == 404:
                 self._logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % user_id)
@@ -506,12 +1274,12 @@ class FindFriendFollowers:
         # We shouldn't get 404s and 401s on this call, so need for the try/except
         response = self._follower_endpoint.get_data(user_id=user_id)
         follower_ids = response['ids']
-        next_cursor = response['next_cursor_str']
+        next_cursor = response['next_cursor']
         while len(follower_ids) < count and next_cursor:
             response = self._follower_endpoint.get_data(user_id=user_id, 
                                                             cursor=next_cursor)
             follower_ids += response['ids']
-            next_cursor = response['next_cursor_str']
+            next_cursor = response['next_cursor']
 
         # Return those in common
         return list(set(friend_ids).intersection(set(follower_ids)))
@@ -535,14 +1303,14 @@ class FindFriendFollowers:
 
 
 class FindFollowers:
-    def __init__(self, twython, logger=None):
+    def __init__(self, twython, logger=None, sink=None, metrics=None, registry=None):
         if logger is None:
             self._logger = get_console_info_logger()
         else:
             self._logger = logger
 
-        self._follower_endpoint = RateLimitedTwitterEndpoint(twython, "followers/ids", logger=self._logger)
-        self._user_lookup_endpoint = RateLimitedTwitterEndpoint(twython, "users/lookup", logger=self._logger)
+        self._follower_endpoint = publishing_endpoint(get_rate_limited_endpoint(twython, "followers/ids", logger=self._logger, metrics=metrics, registry=registry), sink)
+        self._user_lookup_endpoint = publishing_endpoint(get_rate_limited_endpoint(twython, "users/lookup", logger=self._logger, metrics=metrics, registry=registry), sink)
         self.calls_remaining = 1
         self.last_checked_status = dt.datetime.now()
 
@@ -553,8 +1321,8 @@ class FindFollowers:
             self.last_checked_status = dt.datetime.now()
             self._follower_endpoint.update_rate_limit_status()
             self._user_lookup_endpoint.update_rate_limit_status()
-        return min(self._follower_endpoint.api_calls_remaining_for_current_window,
-                   self._user_lookup_endpoint.api_calls_remaining_for_current_window)
+        return min(self._follower_endpoint.calls_remaining(),
+                   self._user_lookup_endpoint.calls_remaining())
 
 ###
 ### Access Users by `screen_name`
@@ -580,20 +1348,18 @@ class FindFollowers:
         try:
             response = self._follower_endpoint.get_data(screen_name=screen_name)
             follower_ids = response['ids']
-            next_cursor = response['next_cursor_str']
-            print "*",next_cursor,"*"
+            next_cursor = response['next_cursor']
             keep_going = True
             while len(follower_ids) < count and next_cursor and keep_going:
                 response = self._follower_endpoint.get_data(screen_name=screen_name, 
                                                             cursor=next_cursor)
                 new_ids = response['ids']
                 follower_ids += new_ids
-                print new_ids
                 if len(new_ids)<1:
                     keep_going = False
                 if incremental_output:
                     incremental_output( new_ids)
-                next_cursor = response['next_cursor_str']
+                next_cursor = response['next_cursor']
                 
         except TwythonError as e:
             if e.error_code == 404:
@@ -647,12 +1413,12 @@ class FindFollowers:
         try:
             response = self._follower_endpoint.get_data(user_id=user_id)
             follower_ids = response['ids']
-            next_cursor = response['next_cursor_str']
+            next_cursor = response['next_cursor']
             while len(follower_ids) < count and next_cursor:
                 response = self._follower_endpoint.get_data(user_id=user_id, 
                                                             cursor=next_cursor)
                 follower_ids += response['ids']
-                next_cursor = response['next_cursor_str']
+                next_cursor = response['next_cursor']
         except TwythonError as e:
             if e.error_code == 404:
                 self._logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % user_id)
@@ -683,14 +1449,14 @@ class FindFollowers:
 
 
 class FindFollowees:
-    def __init__(self, twython, logger=None):
+    def __init__(self, twython, logger=None, sink=None, metrics=None, registry=None):
         if logger is None:
             self._logger = get_console_info_logger()
         else:
             self._logger = logger
 
-        self._followee_endpoint = RateLimitedTwitterEndpoint(twython, "friends/ids", logger=self._logger)
-        self._user_lookup_endpoint = RateLimitedTwitterEndpoint(twython, "users/lookup", logger=self._logger)
+        self._followee_endpoint = publishing_endpoint(get_rate_limited_endpoint(twython, "friends/ids", logger=self._logger, metrics=metrics, registry=registry), sink)
+        self._user_lookup_endpoint = publishing_endpoint(get_rate_limited_endpoint(twython, "users/lookup", logger=self._logger, metrics=metrics, registry=registry), sink)
         self.calls_remaining = 1
         self.last_checked_status = dt.datetime.now()
 
@@ -701,8 +1467,8 @@ class FindFollowees:
             self.last_checked_status = dt.datetime.now()
             self._followee_endpoint.update_rate_limit_status()
             self._user_lookup_endpoint.update_rate_limit_status()
-        return min(self._followee_endpoint.api_calls_remaining_for_current_window,
-                   self._user_lookup_endpoint.api_calls_remaining_for_current_window)
+        return min(self._followee_endpoint.calls_remaining(),
+                   self._user_lookup_endpoint.calls_remaining())
 
 ###
 ### Access Users by `screen_name`
@@ -723,12 +1489,12 @@ class FindFollowees:
         try:
             response = self._followee_endpoint.get_data(screen_name=screen_name)
             followee_ids = response['ids']
-            next_cursor = response['next_cursor_str']
+            next_cursor = response['next_cursor']
             while len(followee_ids) < count and next_cursor:
                 response = self._followee_endpoint.get_data(screen_name=screen_name, 
                                                             cursor=next_cursor)
                 followee_ids += response['ids']
-                next_cursor = response['next_cursor_str']
+                next_cursor = response['next_cursor']
         except TwythonError as e:
             if e.error_code == 404:
                 self._logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % screen_name)
@@ -778,12 +1544,12 @@ class FindFollowees:
         try:
             response = self._followee_endpoint.get_data(user_id=user_id)
             followee_ids = response['ids']
-            next_cursor = response['next_cursor_str']
-            while len(follower_ids) < count and next_cursor:
+            next_cursor = response['next_cursor']
+            while len(followee_ids) < count and next_cursor:
                 response = self._followee_endpoint.get_data(user_id=user_id, 
                                                             cursor=next_cursor)
                 followee_ids += response['ids']
-                next_cursor = response['next_cursor_str']
+                next_cursor = response['next_cursor']
         except TwythonError as e:
             if e.error_code == 404:
                 self._logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % user_id)
@@ -812,13 +1578,13 @@ class FindFollowees:
         return followee_screen_names
 
 class UserLookup:
-    def __init__(self, twython, logger=None):
+    def __init__(self, twython, logger=None, sink=None, metrics=None, registry=None):
         if logger is None:
             self._logger = get_console_info_logger()
         else:
             self._logger = logger
 
-        self._user_lookup_endpoint = RateLimitedTwitterEndpoint(twython, "users/lookup", logger=self._logger)
+        self._user_lookup_endpoint = publishing_endpoint(get_rate_limited_endpoint(twython, "users/lookup", logger=self._logger, metrics=metrics, registry=registry), sink)
         self.calls_remaining = 1
         self.last_checked_status = dt.datetime.now()
 
@@ -828,7 +1594,7 @@ class UserLookup:
         if (now - self.last_checked_status) > dt.timedelta(minutes=7):
             self.last_checked_status = dt.datetime.now()
             self._user_lookup_endpoint.update_rate_limit_status()
-        return min(self._user_lookup_endpoint.api_calls_remaining_for_current_window)
+        return min(self._user_lookup_endpoint.calls_remaining())
 
     def lookup_users(self, twitter_ids):
         """
@@ -844,16 +1610,92 @@ class UserLookup:
             amassed_users += users
         return amassed_users
 
+class TweetLookup:
+    def __init__(self, twython, logger=None, sink=None, metrics=None, registry=None):
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+
+        self._tweet_lookup_endpoint = publishing_endpoint(get_rate_limited_endpoint(twython, "statuses/lookup", logger=self._logger, metrics=metrics, registry=registry), sink)
+
+    def lookup_tweets(self, tweet_ids):
+        """
+        Returns the Tweets with the IDs `tweet_ids`, looking up 100 with
+        each call.  Deleted and protected Tweets, and IDs that were never
+        Tweets, are left out.
+        """
+        amassed_tweets = []
+        for id_subset in grouper(tweet_ids, 100):
+            ids = ','.join([str(id) for id in id_subset if id is not None])
+            tweets = self._tweet_lookup_endpoint.get_data(id=ids, tweet_mode='extended')
+            amassed_tweets += tweets
+        return amassed_tweets
+
+class CompactIDSet:
+    """
+    A set of Twitter IDs held as 8 bytes apiece in a sorted array,
+    rather than the 60 or more bytes each int takes in a set, for
+    recording millions of IDs (e.g. the Tweets a hydration crawl did
+    not find).  Added IDs are sorted in when the set is next read.
+    """
+    def __init__(self, ids=()):
+        # Unsigned long, which is 64 bits on the platforms trawler runs on
+        self._ids = array.array('L')
+        self._unsorted = 0
+        self.update(ids)
+
+    def add(self, id):
+        self._ids.append(id)
+        self._unsorted += 1
+
+    def update(self, ids):
+        for id in ids:
+            self.add(id)
+
+    def __contains__(self, id):
+        self._sort()
+        index = bisect.bisect_left(self._ids, id)
+        return index < len(self._ids) and self._ids[index] == id
+
+    def __iter__(self):
+        self._sort()
+        return iter(self._ids)
+
+    def __len__(self):
+        self._sort()
+        return len(self._ids)
+
+    def save(self, filename):
+        """
+        Writes the IDs, in order, one per line, the format read by
+        `iter_ids_from_file`
+        """
+        with open(filename, 'w') as id_file:
+            for id in self:
+                id_file.write('%d\n' % id)
+
+    def _sort(self):
+        if self._unsorted:
+            ids = array.array('L')
+            previous_id = None
+            for id in sorted(self._ids):
+                if id != previous_id:
+                    ids.append(id)
+                    previous_id = id
+            self._ids = ids
+            self._unsorted = 0
+
 class ListMembership:
-    def __init__(self, twython, logger=None):
+    def __init__(self, twython, logger=None, sink=None, metrics=None, registry=None):
         if logger is None:
             self._logger = get_console_info_logger()
         else:
             self._logger = logger
 
-        self._lists_memberships_endpoint = RateLimitedTwitterEndpoint(twython, "lists/memberships", logger=self._logger)
-        self._lists_members_endpoint = RateLimitedTwitterEndpoint(twython, "lists/members", logger=self._logger)
-        self._user_lookup_endpoint = RateLimitedTwitterEndpoint(twython, "users/lookup", logger=self._logger)
+        self._lists_memberships_endpoint = publishing_endpoint(get_rate_limited_endpoint(twython, "lists/memberships", logger=self._logger, metrics=metrics, registry=registry), sink)
+        self._lists_members_endpoint = publishing_endpoint(get_rate_limited_endpoint(twython, "lists/members", logger=self._logger, metrics=metrics, registry=registry), sink)
+        self._user_lookup_endpoint = publishing_endpoint(get_rate_limited_endpoint(twython, "users/lookup", logger=self._logger, metrics=metrics, registry=registry), sink)
         self.calls_remaining = 1
         self.last_checked_status = dt.datetime.now()
 
@@ -865,9 +1707,9 @@ class ListMembership:
             self._lists_memberships_endpoint.update_rate_limit_status()
             self._lists_members_endpoint.update_rate_limit_status()
             self._user_lookup_endpoint.update_rate_limit_status()
-        return min(self._lists_memberships_endpoint.api_calls_remaining_for_current_window,
-                   self._lists_members_endpoint.api_calls_remaining_for_current_window,
-                   self._user_lookup_endpoint.api_calls_remaining_for_current_window)
+        return min(self._lists_memberships_endpoint.calls_remaining(),
+                   self._lists_members_endpoint.calls_remaining(),
+                   self._user_lookup_endpoint.calls_remaining())
 
 
 ###
@@ -881,20 +1723,28 @@ class ListMembership:
         Paging will be applied if user is a member of more than 1000 lists,
         until we reach `count` lists or we run out of cursors.
         """
-        try:
-            response = self._lists_memberships_endpoint.get_data(screen_name=screen_name)
-            list_memberships = response[u'lists']
-            next_cursor = response['next_cursor']
-            while next_cursor and len(list_memberships) < count:
-                response = self._lists_memberships_endpoint.get_data(screen_name=screen_name, cursor=next_cursor)
-                list_memberships += response['lists']
-        except TwythonError as e:
-            print "Error:", e.error_code
-            print e
-            raise e
-            list_memberships = []
+        list_memberships = []
+        for lists, next_cursor in self.iter_list_membership_pages_for_screen_name(screen_name):
+            list_memberships += lists
+            if len(list_memberships) >= count:
+                break
         return list_memberships
 
+    def iter_list_membership_pages_for_screen_name(self, screen_name, cursor=-1):
+        """
+        Yields `(lists, next_cursor)` for each page of lists that
+        `screen_name` was added to, starting from `cursor`.
+
+        Only one page is held at a time, and `next_cursor` is the value
+        to pass back in as `cursor` to resume after this page.
+        """
+        while cursor:
+            response = self._lists_memberships_endpoint.get_data(screen_name=screen_name,
+                                                                 count=1000, cursor=cursor)
+            cursor = response['next_cursor']
+            self._logger.info("  Retrieved %d List memberships for user '%s'" % (len(response['lists']), screen_name))
+            yield response['lists'], cursor
+
     def get_list_membership_ids_for_screen_name( self, screen_name):
         """
         Returns the list `id`s for each list that `screen_name` is a member of.
@@ -903,32 +1753,104 @@ class ListMembership:
 
     def get_list_members_by_list_id( self, list_id):
         """
-        Returns the users who are members of list `list_id`.
-        This output is cursored, which is not currently implemented, so only the
-        first 5000 members of each list are returned.
+        Returns the users who are members of list `list_id`, following
+        cursors until all members have been retrieved.
         """
-        # Retrieve first batch of members
-        response = self._lists_members_endpoint.get_data(list_id=list_id, count=5000 )
-        members = response['users']
-        next_cursor = response['next_cursor']
-        while next_cursor:
-            response = self._lists_members_endpoint.get_data(list_id=list_id, count=5000, 
-                                                             cursor=next_cursor)
-            members += response['users']
-            next_cursor = response['next_cursor']
+        members = []
+        for users, next_cursor in self.iter_list_member_pages_by_list_id(list_id):
+            members += users
 
-        self._logger.info("  Retrieved first %d Members for List '%s'" % (len(members), list_id))
+        self._logger.info("  Retrieved %d Members for List '%s'" % (len(members), list_id))
 
         return members
 
+    def iter_list_member_pages_by_list_id(self, list_id, cursor=-1, **kwargs):
+        """
+        Yields `(users, next_cursor)` for each page of up to 5000 members
+        of list `list_id`, starting from `cursor`.  Any additional keyword
+        arguments are passed on to the 'lists/members' endpoint.
+        """
+        while cursor:
+            response = self._lists_members_endpoint.get_data(list_id=list_id, count=5000,
+                                                             cursor=cursor, **kwargs)
+            cursor = response['next_cursor']
+            yield response['users'], cursor
+
+###
+### Crawling many lists
+###
+
+    def crawl_list_memberships(self, screen_names, checkpoint=None):
+        """
+        Yields `(screen_name, lists)` for each page of lists that each
+        user in `screen_names` was added to.
+
+        If a `CursorCheckpoint` is given, the cursor for each user is
+        recorded once the caller has consumed a page, so a restarted
+        crawl picks up at the next unfetched page and skips users that
+        were already finished.
+        """
+        checkpoint = checkpoint or CursorCheckpoint()
+        for screen_name in screen_names:
+            key = 'memberships:%s' % screen_name
+            cursor = checkpoint.get(key, -1)
+            if not cursor:
+                continue
+            try:
+                for lists, next_cursor in self.iter_list_membership_pages_for_screen_name(screen_name, cursor):
+                    yield screen_name, lists
+                    checkpoint.set(key, next_cursor)
+            except TwythonError as e:
+                if e.error_code == 404:
+                    self._logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % screen_name)
+                elif e.error_code == 401:
+                    self._logger.warn("HTTP 401 error - Most likely, Twitter user '%s' no longer publicly accessible" % screen_name)
+                else:
+                    # Unhandled exception
+                    raise e
+                checkpoint.set(key, 0)
+
+    def crawl_list_members(self, list_ids, profile_store, checkpoint=None):
+        """
+        Yields `(list_id, member_ids)` for each page of members of each
+        list in `list_ids`.
+
+        Member profiles are written to `profile_store` (a `ProfileStore`)
+        as each page arrives, and a user who belongs to several lists is
+        only written the first time they are seen, so memory use is
+        bounded by the set of member IDs rather than by the full user
+        objects.  If a `CursorCheckpoint` is given, crawls resume from
+        the last page consumed for each list.
+        """
+        checkpoint = checkpoint or CursorCheckpoint()
+        for list_id in list_ids:
+            key = 'members:%s' % list_id
+            cursor = checkpoint.get(key, -1)
+            if not cursor:
+                continue
+            try:
+                for users, next_cursor in self.iter_list_member_pages_by_list_id(list_id, cursor,
+                                                                                 skip_status=True):
+                    new_users = profile_store.add_users(users)
+                    self._logger.info("  Retrieved %d Members (%d new) for List '%s'" % (len(users), new_users, list_id))
+                    yield list_id, [user['id'] for user in users]
+                    checkpoint.set(key, next_cursor)
+            except TwythonError as e:
+                if e.error_code == 404:
+                    self._logger.warn("HTTP 404 error - Most likely, List '%s' no longer exists" % list_id)
+                else:
+                    # Unhandled exception
+                    raise e
+                checkpoint.set(key, 0)
+
 class SearchTwitterTimelines:
-    def __init__(self, twython, logger=None):
+    def __init__(self, twython, logger=None, sink=None, metrics=None, registry=None):
         if logger is None:
             self._logger = get_console_info_logger()
         else:
             self._logger = logger
 
-        self._twitter_endpoint = RateLimitedTwitterEndpoint(twython, "search/tweets", logger=self._logger)
+        self._twitter_endpoint = publishing_endpoint(get_rate_limited_endpoint(twython, "search/tweets", logger=self._logger, metrics=metrics, registry=registry), sink)
 
 ###
 ### Accessing the users by `screen_name`
@@ -941,9 +1863,24 @@ class SearchTwitterTimelines:
         search term.
         `max_id` can specify a tweet to search prior to, and all
         other arguments will be passed on to the search API
+
+        All Tweets are held in memory; for long harvests use
+        `iter_search_tweet_pages_for_term` or `SearchHarvester`.
+        """
+        tweets = []
+        for more_tweets in self.iter_search_tweet_pages_for_term(term, max_id=max_id, **kwargs):
+            tweets += more_tweets
+        return tweets
+
+    def iter_search_tweet_pages_for_term(self, term, max_id=None, **kwargs):
+        """
+        Yields each page of (up to 100) Tweets from the search API for
+        the given search term, newest first.
+        `max_id` can specify a tweet to search prior to, and all
+        other arguments will be passed on to the search API
         """
         # This function stops requesting additional Tweets from the timeline only
-        # if the most recent number of Tweets retrieved is less than 50.
+        # if the most recent number of Tweets retrieved is less than 1.
         #
         # This threshold may need to be adjusted.
         #
@@ -954,49 +1891,939 @@ class SearchTwitterTimelines:
         #   https://dev.twitter.com/docs/api/1.1/get/statuses/user_timeline
         MINIMUM_TWEETS_REQUIRED_FOR_MORE_API_CALLS = 1
 
+        # As for timelines, fetch the full text of Tweets over 140 characters
+        kwargs.setdefault('tweet_mode', 'extended')
+
         self._logger.info("Retrieving Tweets for '%s'" % term)
 
-        
+        while 1:
+            if max_id:
+                max_id = int(max_id) - 1
+                tweets = self._twitter_endpoint.get_data(q=term, count=100,
+                                                         max_id=max_id,
+                                                         **kwargs)['statuses']
+                self._logger.info("  Retrieved %d Tweets for '%s' with max_id='%d'"
+                                  % (len(tweets), term, max_id))
+            else:
+                tweets = self._twitter_endpoint.get_data(q=term, count=100,
+                                                         **kwargs)['statuses']
+                self._logger.info("  Retrieved first %d Tweets for '%s'" % (len(tweets), term))
 
-        # Retrieve first batch of Tweets
-        if max_id:
-            tweets = self._twitter_endpoint.get_data(q=term, count=100, 
-                                                     max_id=max_id-1,
-                                                     **kwargs)['statuses']
+            if tweets:
+                yield tweets
+
+            if len(tweets) < MINIMUM_TWEETS_REQUIRED_FOR_MORE_API_CALLS:
+                return
+            max_id = tweets[-1]['id']
+
+
+class SearchHarvester:
+    """
+    Harvests the search API for many terms at once, streaming each page
+    of results to disk as it arrives.
+
+    Terms are interleaved one page at a time, so every term makes
+    progress under the single 'search/tweets' rate limit instead of the
+    first term consuming the whole window.  Each term's results are
+    appended to a `RotatingJSONWriter` in `output_directory`.
+
+    The (optional) `CursorCheckpoint` records, for each term, the oldest
+    and newest Tweet IDs written by the harvest in progress, so a
+    restarted harvest continues further back in time rather than
+    starting over.  Once a term's harvest reaches the end of the search
+    results, the newest ID written is kept as its `since_id`, and the
+    next harvest of the term fetches only Tweets newer than that.
+    """
+    def __init__(self, search_crawler, output_directory, checkpoint=None,
+                 max_tweets_per_file=100000, logger=None):
+        if logger is None:
+            self._logger = get_console_info_logger()
         else:
-            tweets = self._twitter_endpoint.get_data(q=term, count=100,
-                                                     **kwargs)['statuses']
-        self._logger.info("  Retrieved first %d Tweets for '%s'" % (len(tweets), term))
+            self._logger = logger
 
-        if len(tweets) < MINIMUM_TWEETS_REQUIRED_FOR_MORE_API_CALLS:
-            return tweets
-        iterations = 0
-        # Retrieve rest of Tweets
-        while 1:
-            iterations += 1
-            max_id = int(tweets[-1]['id']) - 1
-            more_tweets = self._twitter_endpoint.get_data(q=term, count=100, 
-                                                          max_id=max_id,
-                                                          **kwargs)['statuses']
-            tweets += more_tweets
-            self._logger.info("  Retrieved %d Tweets for '%s' with max_id='%d'" 
-                              % (len(more_tweets), term, max_id))
+        self._search_crawler = search_crawler
+        self._output_directory = output_directory
+        self._checkpoint = checkpoint or CursorCheckpoint()
+        self._max_tweets_per_file = max_tweets_per_file
 
-            if len(more_tweets) < MINIMUM_TWEETS_REQUIRED_FOR_MORE_API_CALLS:
-                return tweets
+    def harvest(self, terms, **kwargs):
+        """
+        Harvests all available Tweets for each of `terms`, returns a
+        dictionary mapping each term to the number of Tweets written.
+        Any additional keyword arguments are passed on to the search API.
+        """
+        # Each term is only harvested once, however often it is listed
+        terms = list(collections.OrderedDict.fromkeys(terms))
+        filenames = search_term_filenames(terms)
+        tweet_counts = dict((term, 0) for term in terms)
+        writers = {}
+        pages = {}
+        states = {}
+        for term in terms:
+            # {'since_id': newest ID of the last finished harvest,
+            #  'newest_id' and 'max_id': newest and oldest IDs written so far}
+            states[term] = self._checkpoint.get('search:%s' % term) or {}
+            term_kwargs = dict(kwargs)
+            if states[term].get('since_id'):
+                term_kwargs['since_id'] = states[term]['since_id']
+            writers[term] = RotatingJSONWriter(os.path.join(self._output_directory, filenames[term]),
+                                               max_tweets_per_file=self._max_tweets_per_file)
+            pages[term] = self._search_crawler.iter_search_tweet_pages_for_term(
+                term, max_id=states[term].get('max_id'), **term_kwargs)
+
+        try:
+            while pages:
+                for term in terms:
+                    if term not in pages:
+                        continue
+                    state = states[term]
+                    try:
+                        tweets = next(pages[term])
+                    except StopIteration:
+                        del pages[term]
+                        writers.pop(term).close()
+                        self._checkpoint.set('search:%s' % term,
+                                             {'since_id': state.get('newest_id') or state.get('since_id')})
+                        self._logger.info("Finished harvesting %d Tweets for '%s'" % (tweet_counts[term], term))
+                        continue
+                    writers[term].write_tweets(tweets)
+                    tweet_counts[term] += len(tweets)
+                    state = {'since_id': state.get('since_id'),
+                             'newest_id': state.get('newest_id') or tweets[0]['id'],
+                             'max_id': tweets[-1]['id']}
+                    states[term] = state
+                    self._checkpoint.set('search:%s' % term, state)
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        return tweet_counts
+
+class SearchTermState:
+    """
+    What a `SearchMonitor` remembers about one monitored search term.
+    """
+    def __init__(self, term, since_id=None):
+        self.term = term
+        self.since_id = since_id
+        self.tweets_per_second = 0.0
+        self.last_polled_at = None
+        self.next_poll_at = 0
+        self.tweet_count = 0
+
+
+class SearchMonitor:
+    """
+    Continuously polls the search API for many terms, emitting only
+    Tweets newer than the last poll of each term (via `since_id`).
+
+    The 'search/tweets' budget of `calls_per_window` calls per 15 minute
+    window is shared out in proportion to each term's observed Tweet
+    rate, so busy terms are polled often and quiet terms rarely (but at
+    least every `max_poll_interval` seconds).  Quiet terms that fall due
+    at the same time are OR-combined into a single query, and the
+    results are demultiplexed back to the individual terms before being
+    passed to `output(term, tweets)`.  Terms with search operators or
+    quotes are never combined, nor are terms being polled for the first
+    time (which have no `since_id` yet), and the results of a query for
+    a single term are passed on unfiltered.
+
+    Only a small `SearchTermState` is kept per term, so memory use does
+    not grow while the monitor runs.
+    """
+    # Twitter rejects search queries longer than 500 characters
+    MAXIMUM_QUERY_LENGTH = 500
+    TWEETS_PER_PAGE = 100
+
+    def __init__(self, search_crawler, terms, output, calls_per_window=180,
+                 window_seconds=15*60, min_poll_interval=5, max_poll_interval=15*60,
+                 low_volume_tweets_per_poll=10, max_pages_per_poll=15,
+                 checkpoint=None, logger=None, **search_parameters):
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+
+        self._search_crawler = search_crawler
+        self._output = output
+        self._calls_per_window = calls_per_window
+        self._window_seconds = window_seconds
+        self._min_poll_interval = min_poll_interval
+        self._max_poll_interval = max_poll_interval
+        self._low_volume_tweets_per_poll = low_volume_tweets_per_poll
+        self._max_pages_per_poll = max_pages_per_poll
+        self._checkpoint = checkpoint or CursorCheckpoint()
+        self._search_parameters = search_parameters
+        search_parameters.setdefault('result_type', 'recent')
+        search_parameters.setdefault('tweet_mode', 'extended')
+
+        self._states = {}
+        for term in terms:
+            self.add_term(term)
+
+    def add_term(self, term):
+        if term not in self._states:
+            self._states[term] = SearchTermState(term, self._checkpoint.get('since:%s' % term))
+
+    def remove_term(self, term):
+        self._states.pop(term, None)
+
+    def lag(self):
+        """
+        Returns a dictionary mapping each term to the number of seconds
+        since its results were last brought up to date (None if the term
+        has not been polled yet).
+        """
+        now = time.time()
+        return dict((state.term, now - state.last_polled_at if state.last_polled_at else None)
+                    for state in self._states.values())
+
+    def poll_once(self):
+        """
+        Polls every term that is due, returns the number of Tweets emitted.
+        """
+        now = time.time()
+        due_states = [state for state in self._states.values() if state.next_poll_at <= now]
+        tweet_count = 0
+        for states in self._plan_queries(due_states):
+            tweet_count += self._poll(states)
+        return tweet_count
+
+    def run(self, max_rounds=None):
+        """
+        Polls indefinitely (or for `max_rounds` rounds), sleeping between
+        rounds until the next term falls due.
+        """
+        rounds = 0
+        while max_rounds is None or rounds < max_rounds:
+            self.poll_once()
+            rounds += 1
+            if self._states:
+                next_poll_at = min(state.next_poll_at for state in self._states.values())
+                seconds_to_sleep = max(next_poll_at - time.time(), 0)
+            else:
+                seconds_to_sleep = self._max_poll_interval
+            if max_rounds is None or rounds < max_rounds:
+                time.sleep(seconds_to_sleep)
+
+    def _poll_interval(self, state):
+        # Giving each term calls in proportion to its Tweet rate means every
+        # call returns about the same number of Tweets:
+        #   interval = window * sum(rates) / (calls_per_window * rate)
+        total_tweets_per_second = sum(s.tweets_per_second for s in self._states.values())
+        if state.tweets_per_second <= 0:
+            return self._max_poll_interval
+        interval = (self._window_seconds * total_tweets_per_second /
+                    (self._calls_per_window * state.tweets_per_second))
+        return min(max(interval, self._min_poll_interval), self._max_poll_interval)
+
+    def _is_low_volume(self, state):
+        return state.tweets_per_second * self._poll_interval(state) < self._low_volume_tweets_per_poll
+
+    def _plan_queries(self, due_states):
+        """
+        Splits `due_states` into groups to be polled with a single query,
+        keeping high volume terms and terms that cannot be batched on
+        their own.
+        """
+        groups = []
+        batch = []
+        batch_tweets = 0
+        for state in sorted(due_states, key=lambda s: s.term):
+            # The first poll of a term, without a since_id, fetches just one
+            # page, which would skip the Tweets since the last poll of any
+            # other term in its batch
+            if (state.since_id is None or not self._is_low_volume(state) or
+                    not search_term_is_batchable(state.term)):
+                groups.append([state])
+                continue
+            expected_tweets = state.tweets_per_second * self._poll_interval(state)
+            if batch and (len(search_query_for_terms([s.term for s in batch + [state]])) > self.MAXIMUM_QUERY_LENGTH or
+                          batch_tweets + expected_tweets >= self.TWEETS_PER_PAGE):
+                groups.append(batch)
+                batch = []
+                batch_tweets = 0
+            batch.append(state)
+            batch_tweets += expected_tweets
+        if batch:
+            groups.append(batch)
+        return groups
+
+    def _poll(self, states):
+        query = search_query_for_terms([state.term for state in states])
+        since_ids = [state.since_id for state in states]
+        if None in since_ids:
+            since_id = None
+        else:
+            since_id = min(since_ids)
+        parameters = dict(self._search_parameters)
+        if since_id:
+            parameters['since_id'] = since_id
+
+        now = time.time()
+        newest_id = since_id
+        matched_tweets = dict((state.term, []) for state in states)
+        pages = 0
+        for tweets in self._search_crawler.iter_search_tweet_pages_for_term(query, **parameters):
+            pages += 1
+            if newest_id is None or tweets[0]['id'] > newest_id:
+                newest_id = tweets[0]['id']
+            for state in states:
+                # The search API already matched every Tweet to a lone term
+                new_tweets = [tweet for tweet in tweets
+                              if (state.since_id is None or tweet['id'] > state.since_id) and
+                              (len(states) == 1 or tweet_matches_search_term(tweet, state.term))]
+                if new_tweets:
+                    self._output(state.term, new_tweets)
+                    matched_tweets[state.term] += [tweet['id'] for tweet in new_tweets]
+            if len(tweets) < self.TWEETS_PER_PAGE or since_id is None:
+                # Without a since_id there is no gap to fill, so the first
+                # poll of a term only establishes where to start from
+                break
+            if pages >= self._max_pages_per_poll:
+                self._logger.warn("Stopped paging '%s' after %d pages - older Tweets since the last poll were skipped" %
+                                  (query, pages))
+                break
+
+        tweet_count = 0
+        for state in states:
+            new_tweet_count = len(matched_tweets[state.term])
+            if state.last_polled_at:
+                # Exponentially weighted moving average of the Tweet rate
+                tweets_per_second = new_tweet_count / max(now - state.last_polled_at, 1.0)
+                state.tweets_per_second = 0.5 * state.tweets_per_second + 0.5 * tweets_per_second
+            if newest_id:
+                state.since_id = newest_id
+                self._checkpoint.set('since:%s' % state.term, newest_id)
+            state.last_polled_at = now
+            state.tweet_count += new_tweet_count
+            tweet_count += new_tweet_count
+        for state in states:
+            state.next_poll_at = now + self._poll_interval(state)
+        return tweet_count
+
+
+class ScheduledTask:
+    """
+    A unit of work queued on a CrawlScheduler, and a future for its
+    result: result() blocks until the task has run, then returns its
+    result or raises its exception, and callbacks added with
+    add_done_callback() are called once it has run.
+    """
+    def __init__(self, function, args, kwargs, priority_class=None, deadline=None):
+        self._function = function
+        self._args = args
+        self._kwargs = kwargs
+        self.priority_class = priority_class
+        self.deadline = deadline
+        self.submitted_at = time.time()
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+        self.deferrals = 0
+        self.attempts = 0
+
+    def run(self, twython, max_attempts=0):
+        """
+        Runs the task, unless it raises RetryLater, in which case the
+        RetryLater is returned and the task should be run again once it
+        is due.  Once the task has been tried `max_attempts` times
+        (not counting deferrals for a rate limit), the RetryLater's
+        cause is raised by result() instead.
+        """
+        try:
+            self._result = self._function(twython, *self._args, **self._kwargs)
+        except RetryLater as e:
+            self.deferrals += 1
+            if e.reason != 'rate_limit':
+                self.attempts += 1
+            if self.attempts < max_attempts:
+                return e
+            self._exception = e.cause or e
+        except Exception as e:
+            self._exception = e
+        with self._callbacks_lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+        return None
+
+    def done(self):
+        return self._done.is_set()
+
+    def add_done_callback(self, callback):
+        """
+        Calls `callback(task)` once the task has run, from the worker
+        thread that ran it, or at once if it already has.
+        """
+        with self._callbacks_lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def result(self, timeout=None):
+        # Event.wait() without a timeout cannot be interrupted in Python 2
+        while not self._done.wait(timeout if timeout is not None else 1):
+            if timeout is not None:
+                raise RuntimeError("Task did not finish within %s seconds" % timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class PriorityClass:
+    """
+    A class of crawl tasks for CrawlScheduler.  Tasks of a class with a
+    lower `priority` are always dispatched first, and tasks of the same
+    class by earliest deadline.  `reserved_shares` maps endpoints to the
+    share of each rate limit window that only this class may use, e.g.
+    {'users/lookup': 0.2} keeps a fifth of every users/lookup window
+    for this class, however much other work is queued.
+    """
+    def __init__(self, name, priority, reserved_shares=None):
+        self.name = name
+        self.priority = priority
+        self.reserved_shares = reserved_shares or {}
+
+    def __repr__(self):
+        return 'PriorityClass(%r, %r, %r)' % (self.name, self.priority, self.reserved_shares)
+
+
+DEFAULT_PRIORITY_CLASSES = [PriorityClass('interactive', 0), PriorityClass('batch', 1)]
 
-            #HARDCODE -- temporary
+# The shares of each endpoint reserved for other priority classes than
+# that of the task the current thread is running
+_priority_context = threading.local()
+
+
+def as_completed(tasks):
+    """
+    Yields each of the ScheduledTasks in `tasks` as soon as it has run,
+    e.g. to save each timeline as it arrives rather than in the order
+    the crawls were submitted.
+    """
+    tasks = list(tasks)
+    finished = Queue.Queue()
+    for task in tasks:
+        task.add_done_callback(finished.put)
+    for i in range(len(tasks)):
+        # Queue.get() without a timeout cannot be interrupted in Python 2
+        while True:
             try:
-                if iterations % 100 == 0:
-                    print "Hit a round number, dumping to file"
-                    import ujson as json
-                    import gzip
-                    with gzip.open('%s.json.gz' % term,'w') as OUT:
-                        for t in tweets:
-                            OUT.write('%s\n' % json.dumps(t))
+                yield finished.get(timeout=1)
+                break
+            except Queue.Empty:
+                pass
+
+
+def hydrate_tweets(scheduler, tweet_ids, writer, missing_ids=None, max_pending=100, **options):
+    """
+    Looks up `tweet_ids` (any iterable, e.g. `iter_ids_from_file()`) 100
+    at a time on statuses/lookup, through CrawlScheduler `scheduler`, so
+    that lookups run concurrently on every worker and API key.  Each
+    batch of Tweets is passed to `writer.write_tweets()` (e.g. a
+    RotatingJSONWriter) as it arrives, so Tweets are written in no
+    particular order, and the IDs of Tweets not found are added to
+    `missing_ids` (e.g. a CompactIDSet).  At most `max_pending` batches
+    are queued at once.  `options` (e.g. `priority`) are passed to
+    `scheduler.submit()`.  Returns the number of Tweets written.
+    """
+    finished = Queue.Queue()
+    tweet_count = [0]
+    def write_batch():
+        # Queue.get() without a timeout cannot be interrupted in Python 2
+        while True:
+            try:
+                id_subset, task = finished.get(timeout=1)
+                break
+            except Queue.Empty:
+                pass
+        tweets = task.result()
+        writer.write_tweets(tweets)
+        tweet_count[0] += len(tweets)
+        if missing_ids is not None:
+            found_ids = set(tweet['id'] for tweet in tweets)
+            missing_ids.update(id for id in id_subset if id not in found_ids)
+
+    pending = 0
+    for id_subset in grouper(tweet_ids, 100):
+        id_subset = [id for id in id_subset if id is not None]
+        if pending >= max_pending:
+            write_batch()
+            pending -= 1
+        task = scheduler.lookup_tweets(id_subset, **options)[0]
+        task.add_done_callback(lambda task, id_subset=id_subset: finished.put((id_subset, task)))
+        pending += 1
+    for i in range(pending):
+        write_batch()
+    return tweet_count[0]
+
+
+class CrawlScheduler:
+    """
+    Runs crawl tasks across every endpoint (and every API key) at once.
+
+    Tasks are queued by the endpoint whose quota they use, and each
+    (API key, endpoint) pair has its own worker thread that only takes
+    a task once its endpoint has quota left.  Work for one endpoint
+    therefore never waits behind another endpoint's rate limit, and a
+    job mixing timelines, follower IDs and user lookups runs at the sum
+    of those endpoints' quotas rather than at the pace of the slowest.
+    With several API keys, each endpoint's tasks go to whichever key
+    has quota.
+
+    Usage:
+      scheduler = CrawlScheduler([twython1, twython2])
+      timelines = [scheduler.get_all_timeline_tweets_for_id(user_id) for user_id in user_ids]
+      followers = [scheduler.get_follower_ids_for_id(user_id) for user_id in user_ids]
+      for task in timelines + followers:
+          do_something(task.result())
+      scheduler.close()
+
+    Each method of CrawlTwitterTimelines, FindFollowers and UserLookup
+    that the scheduler offers runs asynchronously, returning a
+    ScheduledTask (a future) at once; use as_completed() to handle
+    results in the order they finish.  Python 2 has no asyncio, so
+    requests are made from worker threads: `workers_per_token` threads
+    per (API key, endpoint) pair, which keeps that many requests in
+    flight for each key while quota lasts.
+
+    Tasks are dispatched by priority class (see PriorityClass), then by
+    deadline, then in the order they were submitted; pass `priority`
+    (a class name, by default `default_priority`) and `deadline` (a
+    time.time() value) to submit() or any crawl method.  Tasks of one
+    class never use the share of a window reserved for another: a
+    worker left with only calls reserved for other classes hands its
+    task back, and waits for a task of another class or for the window
+    to reset.  With
+    `metrics`, the time each task waited in its queue is recorded as
+    trawler_metrics.QUEUE_SECONDS, and tasks started after their
+    deadline as DEADLINES_MISSED, both labelled with 'endpoint' and
+    'priority'.
+
+    If the registry's RetryPolicy defers retries, a task whose request
+    fails (or whose endpoint's circuit breaker is open, or rate limit
+    reached) is put back on its queue once the retry is due, rather than
+    holding a worker while it waits, and fails after `max_attempts`
+    tries, not counting rate limits.  A deferred task
+    starts again from the beginning, so a sink may see its first pages
+    more than once.
+    """
+    def __init__(self, twythons, logger=None, sink=None, metrics=None, registry=None, workers_per_token=1,
+                 priority_classes=None, default_priority='batch'):
+        if not isinstance(twythons, (list, tuple)):
+            twythons = [twythons]
+        self._twythons = twythons
+        self._workers_per_token = workers_per_token
+        self._priority_classes = dict((priority_class.name, priority_class)
+                                      for priority_class in priority_classes or DEFAULT_PRIORITY_CLASSES)
+        if default_priority not in self._priority_classes:
+            raise ValueError("Unknown default priority class '%s'" % default_priority)
+        self._default_priority = default_priority
+        self._sequence = itertools.count()
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+        self._sink = sink
+        self._metrics = metrics
+        self._registry = registry or EndpointRegistry()
+        self._queues = {}
+        self._workers = []
+        self._crawlers = {}
+        self._lock = threading.Lock()
+        # Tasks waiting to be put back on their queues
+        self._deferred = 0
+        self._deferred_done = threading.Condition(self._lock)
+        # Tasks submitted or put back after a deferral, for workers
+        # waiting for a task they may run
+        self._tasks_added = 0
+        self._task_added = threading.Condition(self._lock)
+        # Times at which a thread will wake workers waiting for a window
+        self._wake_times = set()
+
+    def submit(self, twitter_api_endpoint, function, *args, **kwargs):
+        """
+        Queues `function(twython, *args, **kwargs)` to run once
+        `twitter_api_endpoint` has quota, and returns a ScheduledTask.
+        The keyword arguments `priority` and `deadline` are taken by
+        the scheduler, and not passed to `function`.
+        """
+        priority = kwargs.pop('priority', None) or self._default_priority
+        deadline = kwargs.pop('deadline', None)
+        if priority not in self._priority_classes:
+            raise ValueError("Unknown priority class '%s'" % priority)
+        task = ScheduledTask(function, args, kwargs, self._priority_classes[priority], deadline)
+        self._put(self._queue(twitter_api_endpoint), task)
+        return task
+
+    def get_all_timeline_tweets_for_id(self, user_id, **options):
+        return self.submit('statuses/user_timeline', self._call, get_timeline_crawler,
+                           'get_all_timeline_tweets_for_id', user_id, **options)
+
+    def get_all_timeline_tweets_for_id_since(self, user_id, since_id, max_id=None, **options):
+        return self.submit('statuses/user_timeline', self._call, get_timeline_crawler,
+                           'get_all_timeline_tweets_for_id_since', user_id, since_id, max_id, **options)
+
+    def get_most_recent_tweets_by_id(self, user_id, **options):
+        return self.submit('statuses/user_timeline', self._call, get_timeline_crawler,
+                           'get_most_recent_tweets_by_id', user_id, **options)
+
+    def get_all_timeline_tweets_for_screen_name(self, screen_name, **options):
+        return self.submit('statuses/user_timeline', self._call, get_timeline_crawler,
+                           'get_all_timeline_tweets_for_screen_name', screen_name, **options)
+
+    def get_most_recent_tweets(self, screen_name, **options):
+        return self.submit('statuses/user_timeline', self._call, get_timeline_crawler,
+                           'get_most_recent_tweets', screen_name, **options)
+
+    def get_follower_ids_for_id(self, user_id, count=-1, **options):
+        return self.submit('followers/ids', self._call, get_follower_crawler,
+                           'get_follower_ids_for_id', user_id, count, **options)
+
+    def get_follower_ids_for_screen_name(self, screen_name, count=-1, **options):
+        return self.submit('followers/ids', self._call, get_follower_crawler,
+                           'get_follower_ids_for_screen_name', screen_name, count, **options)
+
+    def get_followee_ids_for_id(self, user_id, count=-1, **options):
+        return self.submit('friends/ids', self._call, get_followee_crawler,
+                           'get_followee_ids_for_id', user_id, count, **options)
+
+    def lookup_users(self, twitter_ids, **options):
+        """
+        Queues one task per 100 IDs, so lookups are spread across API
+        keys, and returns the list of tasks
+        """
+        return [self.submit('users/lookup', self._call, UserLookup, 'lookup_users',
+                            [twitter_id for twitter_id in id_subset if twitter_id is not None], **options)
+                for id_subset in grouper(twitter_ids, 100)]
+
+    def lookup_tweets(self, tweet_ids, **options):
+        """
+        Queues one task per 100 IDs, so lookups are spread across API
+        keys, and returns the list of tasks
+        """
+        return [self.submit('statuses/lookup', self._call, TweetLookup, 'lookup_tweets',
+                            [tweet_id for tweet_id in id_subset if tweet_id is not None], **options)
+                for id_subset in grouper(tweet_ids, 100)]
+
+    def join(self):
+        """
+        Blocks until every queued task has run
+        """
+        while True:
+            with self._lock:
+                queues = self._queues.values()
+            for queue in queues:
+                queue.join()
+            with self._lock:
+                if not self._deferred:
+                    return
+                # Event.wait() without a timeout cannot be interrupted in Python 2
+                self._deferred_done.wait(1)
+
+    def close(self):
+        """
+        Waits for queued tasks to finish, then stops the workers.  A
+        worker waiting for its rate limit window to reset exits when the
+        window does.
+        """
+        self.join()
+        with self._lock:
+            for twitter_api_endpoint, queue in self._queues.items():
+                for i in range(len(self._twythons) * self._workers_per_token):
+                    # Sorts after every task
+                    queue.put((float('inf'), float('inf'), next(self._sequence), None))
+            self._queues = {}
+            self._workers = []
+
+    def _call(self, twython, crawler_factory, method_name, *args):
+        # Crawlers can be shared between workers, since their endpoints
+        # share rate limit windows through the registry
+        with self._lock:
+            key = (twython_token_key(twython), crawler_factory)
+            if key not in self._crawlers:
+                self._crawlers[key] = crawler_factory(twython, self._logger, self._sink, self._metrics,
+                                                      self._registry)
+            crawler = self._crawlers[key]
+        return getattr(crawler, method_name)(*args)
+
+    def _queue(self, twitter_api_endpoint):
+        with self._lock:
+            if twitter_api_endpoint not in self._queues:
+                queue = Queue.PriorityQueue()
+                self._queues[twitter_api_endpoint] = queue
+                for twython in self._twythons:
+                    for i in range(self._workers_per_token):
+                        worker = threading.Thread(target=self._work, args=(twython, twitter_api_endpoint, queue),
+                                                  name='%s %s %d' % (twitter_api_endpoint,
+                                                                     twython_token_key(twython)[0], i))
+                        worker.daemon = True
+                        worker.start()
+                        self._workers.append(worker)
+            return self._queues[twitter_api_endpoint]
+
+    def _put(self, queue, task, wake_workers=True):
+        if task.deadline is None:
+            deadline = float('inf')
+        else:
+            deadline = task.deadline
+        queue.put((task.priority_class.priority, deadline, next(self._sequence), task))
+        if wake_workers:
+            with self._lock:
+                self._tasks_added += 1
+                self._task_added.notify_all()
+
+    def _reserved_shares(self, priority_class):
+        """
+        Returns the share of each endpoint reserved for other classes
+        than `priority_class`
+        """
+        reserved_shares = {}
+        for other_class in self._priority_classes.values():
+            if other_class is not priority_class:
+                for twitter_api_endpoint, share in other_class.reserved_shares.items():
+                    reserved_shares[twitter_api_endpoint] = reserved_shares.get(twitter_api_endpoint, 0) + share
+        return reserved_shares
+
+    def _work(self, twython, twitter_api_endpoint, queue):
+        endpoint = self._registry.get_endpoint(twython, twitter_api_endpoint, self._logger, self._metrics)
+        metrics = self._metrics or trawler_metrics.NULL_METRICS
+        while True:
+            # Leave the task for another API key while this one is out of quota
+            endpoint.wait_for_quota()
+            task = queue.get()[-1]
+            try:
+                if task is None:
+                    return
+                _priority_context.reserved_shares = self._reserved_shares(task.priority_class)
+                if endpoint.calls_available() < 1:
+                    # Only calls reserved for other classes are left, so
+                    # hand the task back (to another API key's worker, or
+                    # to this one once its window resets) and wait for a
+                    # task of another class, or the next window
+                    self._put(queue, task, wake_workers=False)
+                    self._wait_for_task(endpoint.next_window_at())
+                    endpoint.update_rate_limit_status_if_expired()
+                    continue
+                labels = {'endpoint': twitter_api_endpoint, 'priority': task.priority_class.name}
+                now = time.time()
+                if task.deferrals == 0:
+                    metrics.observe(trawler_metrics.QUEUE_SECONDS, now - task.submitted_at, **labels)
+                if task.deadline is not None and now > task.deadline:
+                    metrics.increment(trawler_metrics.DEADLINES_MISSED, **labels)
+                retry_later = task.run(twython, self._registry.retry_policy.max_attempts)
+                if retry_later is not None:
+                    self._defer(queue, task, retry_later.retry_at)
+            finally:
+                _priority_context.reserved_shares = {}
+                queue.task_done()
+
+    def _wait_for_task(self, until):
+        """
+        Blocks until a task is submitted (or put back after a deferral),
+        or until `until`
+        """
+        with self._lock:
+            tasks_added = self._tasks_added
+            if until not in self._wake_times:
+                # One thread per wake time, however many workers wait
+                self._wake_times.add(until)
+                thread = threading.Thread(target=self._wake_at, args=(until,))
+                thread.daemon = True
+                thread.start()
+            while self._tasks_added == tasks_added and time.time() < until:
+                # Condition.wait() without a timeout cannot be interrupted in Python 2
+                self._task_added.wait(1)
+
+    def _wake_at(self, until):
+        time.sleep(max(until - time.time(), 0))
+        with self._lock:
+            self._wake_times.discard(until)
+            self._task_added.notify_all()
+
+    def _defer(self, queue, task, retry_at):
+        with self._lock:
+            self._deferred += 1
+        thread = threading.Thread(target=self._requeue, args=(queue, task, retry_at))
+        thread.daemon = True
+        thread.start()
+
+    def _requeue(self, queue, task, retry_at):
+        time.sleep(max(retry_at - time.time(), 0))
+        self._put(queue, task)
+        with self._lock:
+            self._deferred -= 1
+            self._deferred_done.notify_all()
+
+
+class RetryLater(TwythonError):
+    """
+    Raised instead of sleeping by endpoints whose RetryPolicy defers
+    retries, so that the caller (e.g. a CrawlScheduler) can reschedule
+    the request for `retry_at` and do other work in the meantime.
+    `cause` is the error that would have been retried, and `reason` why
+    (e.g. 'rate_limit' or 'server_error').
+    """
+    def __init__(self, msg, retry_at, cause=None, reason=None):
+        TwythonError.__init__(self, msg)
+        self.retry_at = retry_at
+        self.cause = cause
+        self.reason = reason
+
+
+class CircuitOpenError(RetryLater):
+    """
+    Raised without making a request while an endpoint's CircuitBreaker
+    is open.  No request should be tried again before `retry_at`.
+    """
+    pass
+
+
+class RetryPolicy:
+    """
+    How RateLimitedTwitterEndpoint retries requests that fail with a
+    429, a 502/503/504 or an empty response: at most `max_attempts`
+    attempts in all, the n-th retry after a random delay between 0 and
+    min(`max_backoff`, `initial_backoff` * 2 ** (n - 1)) seconds ("full
+    jitter"), so that crawlers that failed together do not all retry
+    together.  Once the attempts are used up, the last error is raised.
+    A 429 is not counted as an attempt: the request is tried again once
+    the rate limit window resets, however many windows that takes.
+
+    If `defer` is True, endpoints raise RetryLater instead of sleeping
+    (and CircuitOpenError instead of waiting for an open CircuitBreaker).
+    """
+    def __init__(self, initial_backoff=60, max_backoff=900, max_attempts=8, jitter=True, defer=False,
+                 seed=None):
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.jitter = jitter
+        self.defer = defer
+        self._random = random.Random(seed)
+
+    def backoff(self, retry):
+        """
+        Returns the number of seconds to wait before retry number
+        `retry` (counting from 1)
+        """
+        ceiling = min(self.max_backoff, self.initial_backoff * 2 ** min(retry - 1, 32))
+        if self.jitter:
+            return self._random.uniform(0, ceiling)
+        return ceiling
+
+
+class CircuitBreaker:
+    """
+    Stops requests to an endpoint for `reset_seconds` once
+    `failure_threshold` requests in a row have failed with a server
+    error or an empty response, so that crawlers stop spending time and
+    retries on an endpoint that is down.  After `reset_seconds` one
+    request is let through; if it succeeds the breaker closes, and if
+    it fails the breaker stays open for another `reset_seconds`.
+    Rate limit errors are not failures.
+    """
+    def __init__(self, failure_threshold=10, reset_seconds=300):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Returns None if a request may be made, or else the time at which
+        the breaker will let one through.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return None
+            now = time.time()
+            if now < self._opened_at + self.reset_seconds:
+                return self._opened_at + self.reset_seconds
+            # Let this request through, and hold back every other one
+            # until it succeeds
+            self._opened_at = now
+            return None
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        """
+        Returns True if this failure opened the breaker
+        """
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                was_closed = self._opened_at is None
+                self._opened_at = time.time()
+                return was_closed
+            return False
+
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+
+class RateLimitWindow:
+    """
+    The calls remaining in, and reset time of, the current rate limit
+    window of one (API key, endpoint) pair, shared by every thread in
+    this process.  `lock` is held while quota is checked, reserved and
+    looked up, but not while threads sleep until the window resets.
+
+    Windows shared between processes or hosts (see
+    trawler_rate_limits.py) have the same lock, state(), update() and
+    reserve().
+    """
+    def __init__(self):
+        self._calls_remaining = None
+        self._resets_at = None
+        self.lock = threading.RLock()
+
+    def state(self):
+        """
+        Returns (calls remaining, reset time), or (None, None) if the
+        window has never been updated.
+        """
+        return self._calls_remaining, self._resets_at
+
+    def update(self, calls_remaining, resets_at):
+        """
+        Sets the calls remaining until `resets_at`, unless the window
+        already resets later; for the same reset, only lowers the calls
+        remaining, since calls may have been reserved since the rate
+        limit status was fetched
+        """
+        with self.lock:
+            if self._resets_at is not None:
+                if resets_at < self._resets_at:
+                    return
+                if resets_at == self._resets_at:
+                    calls_remaining = min(calls_remaining, self._calls_remaining)
+            self._calls_remaining = calls_remaining
+            self._resets_at = resets_at
+
+    def reserve(self, keep=0):
+        """
+        Takes one call from the window, returning the number of calls
+        left afterwards, or None if there were no more than `keep`
+        calls (held back for others) to take from.
+        """
+        with self.lock:
+            if not self._calls_remaining or self._calls_remaining <= keep:
+                return None
+            self._calls_remaining -= 1
+            return self._calls_remaining
 
-            except:
-                print "Broke on HARDCODE temporary"
 
 class RateLimitedTwitterEndpoint:
     """
@@ -1017,9 +2844,16 @@ class RateLimitedTwitterEndpoint:
     Only one RateLimitedTwitterEndpoint instance should be running
     anywhere in the world per (Twitter API key, Twitter API endpoint)
     pair.  Each class instance assumes it is the only program using up
-    the API calls available for the current rate limit window.
+    the API calls available for the current rate limit window.  Within
+    a process, endpoints for the same pair can share a RateLimitWindow
+    (see EndpointRegistry), and any number of threads may use them.
+
+    Requests, latencies, records returned, retries, time spent sleeping
+    and remaining quota are recorded to a trawler_metrics.Metrics
+    instance, labelled by endpoint and token.
     """
-    def __init__(self, twython, twitter_api_endpoint, logger=None):
+    def __init__(self, twython, twitter_api_endpoint, logger=None, metrics=None, window=None,
+                 retry_policy=None, circuit_breaker=None):
         """
         twython -- an instance of a twython.Twython object that has
         been initialized with a valid set of Twitter API credentials.
@@ -1033,6 +2867,16 @@ class RateLimitedTwitterEndpoint:
           https://dev.twitter.com/docs/api/1.1
 
         logger -- an optional instance of a logging.Logger class.
+
+        metrics -- an optional instance of trawler_metrics.Metrics.
+
+        window -- an optional RateLimitWindow shared with other
+        endpoints for the same API key and endpoint.
+
+        retry_policy -- an optional RetryPolicy for failed requests.
+
+        circuit_breaker -- an optional CircuitBreaker, which may be
+        shared with endpoints for the same endpoint on other API keys.
         """
         self._twython = twython
         self._twitter_api_endpoint = twitter_api_endpoint
@@ -1044,10 +2888,89 @@ class RateLimitedTwitterEndpoint:
         else:
             self._logger = logger
 
-        self._update_rate_limit_status()
+        if metrics is None:
+            self._metrics = trawler_metrics.NULL_METRICS
+        else:
+            self._metrics = metrics
+        self._metric_labels = {'endpoint': twitter_api_endpoint,
+                               'token': trawler_metrics.token_label(twython)}
+
+        if window is None:
+            window = RateLimitWindow()
+        self._window = window
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._circuit_breaker = circuit_breaker or CircuitBreaker()
+        self._rate_limit = None
+        # Retries since the last successful request, for deferred retries,
+        # shared by every thread using the endpoint
+        self._consecutive_retries = 0
+        self._retries_lock = threading.Lock()
+
+        # A shared window is only looked up by the first endpoint using
+        # it, or once it has expired
+        self.update_rate_limit_status_if_expired()
 
     def update_rate_limit_status(self):
-        return self._update_rate_limit_status()
+        with self._window.lock:
+            return self._update_rate_limit_status()
+
+    def update_rate_limit_status_if_expired(self):
+        """
+        Looks up the rate limit status if the window has never been
+        looked up, or has reset since it last was
+        """
+        with self._window.lock:
+            calls_remaining, resets_at = self._window.state()
+            if resets_at is None or resets_at <= time.time():
+                self._update_rate_limit_status()
+
+    def calls_remaining(self):
+        """
+        Returns the number of API calls left in the current rate limit
+        window, as of the last request or rate limit status update.
+        """
+        return self._window.state()[0]
+
+    def wait_for_quota(self):
+        """
+        Blocks until at least one API call is available in the current
+        rate limit window.
+        """
+        self._sleep_if_rate_limit_reached()
+
+    def next_window_at(self):
+        """
+        Returns the time at which calls are next expected to be
+        available, once the current rate limit window has reset
+        """
+        return self._retry_at_reset(self._window.state()[1])
+
+    def rate_limit(self):
+        """
+        Returns the number of API calls allowed per rate limit window
+        """
+        with self._window.lock:
+            if self._rate_limit is None:
+                self._update_rate_limit_status()
+            return self._rate_limit
+
+    def reserved_calls(self):
+        """
+        Returns the number of calls in each window that the current
+        thread may not use, because they are reserved for other
+        priority classes (see CrawlScheduler)
+        """
+        reserved_share = getattr(_priority_context, 'reserved_shares', {}).get(self._twitter_api_endpoint)
+        if not reserved_share:
+            return 0
+        return int(math.ceil(reserved_share * self.rate_limit()))
+
+    def calls_available(self):
+        """
+        Returns the number of API calls left in the current rate limit
+        window that the current thread may use
+        """
+        return max((self.calls_remaining() or 0) - self.reserved_calls(), 0)
 
     def get_data(self, **twitter_api_parameters):
         """
@@ -1055,142 +2978,467 @@ class RateLimitedTwitterEndpoint:
         this class instance.
 
         This function can block for up to 15 minutes if the rate limit
-        for this endpoint's window has already been reached.
+        for this endpoint's window has already been reached, and while
+        the endpoint's CircuitBreaker is open.  Failed requests are
+        retried as set out by the endpoint's RetryPolicy.  If it defers
+        retries, RetryLater is raised instead of sleeping, and
+        CircuitOpenError while the CircuitBreaker is open.
         """
-        return self._get_data_with_backoff(60, **twitter_api_parameters)
-
-
-    def _get_data_with_backoff(self, backoff, **twitter_api_parameters):
-        self._sleep_if_rate_limit_reached()
-        self.api_calls_remaining_for_current_window -= 1
+        with self._metrics.span('twitter.get_data', **self._metric_labels):
+            return self._get_data_with_backoff(**twitter_api_parameters)
+
+
+    def _get_data_with_backoff(self, **twitter_api_parameters):
+        attempt = 1
+        while True:
+            retry_at = self._circuit_breaker.allow()
+            if retry_at is not None:
+                message = ("Circuit breaker for '%s' is open until %s" %
+                           (self._twitter_api_endpoint,
+                            datetime.datetime.fromtimestamp(retry_at).strftime("%Y-%m-%d %H:%M:%S")))
+                if self._retry_policy.defer:
+                    raise CircuitOpenError(message, retry_at, reason='circuit_open')
+                seconds_to_sleep = max(retry_at - time.time(), 0)
+                self._logger.info("%s - sleeping for %.2f seconds" % (message, seconds_to_sleep))
+                self._metrics.increment(trawler_metrics.SLEEP_SECONDS, seconds_to_sleep, reason='circuit_open',
+                                        **self._metric_labels)
+                time.sleep(seconds_to_sleep)
+                continue
+            try:
+                response = self._get_data_once(**twitter_api_parameters)
+            except TwythonError as e:
+                reason = self._retry_reason(e)
+                # For all other TwythonErrors, reraise the exception
+                if reason is None:
+                    raise e
+                if reason == 'rate_limit':
+                    # Not an attempt: the request is tried again once the
+                    # window resets, by _get_data_once()
+                    self._rate_limit_reached(e)
+                    continue
+                if self._circuit_breaker.record_failure():
+                    self._logger.error("Circuit breaker for '%s' opened after %d failed requests in a row" %
+                                       (self._twitter_api_endpoint, self._circuit_breaker.failure_threshold))
+                    self._metrics.increment(trawler_metrics.CIRCUIT_BREAKER_TRIPS, **self._metric_labels)
+                if attempt >= self._retry_policy.max_attempts:
+                    self._logger.error("Giving up on '%s' after %d attempts" % (self._twitter_api_endpoint, attempt))
+                    raise e
+                self._retry(reason, attempt, e)
+                attempt += 1
+            else:
+                self._circuit_breaker.record_success()
+                with self._retries_lock:
+                    self._consecutive_retries = 0
+                return response
+
+    def _get_data_once(self, **twitter_api_parameters):
+        keep = self.reserved_calls()
+        calls_remaining = None
+        while calls_remaining is None:
+            self._sleep_if_rate_limit_reached(keep)
+            # Another thread or process sharing the window may have
+            # taken the last call since it was checked
+            with self._window.lock:
+                calls_remaining = self._window.reserve(keep)
+        self._metrics.gauge(trawler_metrics.QUOTA_REMAINING, calls_remaining, **self._metric_labels)
+        request_start_time = time.time()
         try:
-            return self._twython.get(self._twitter_api_endpoint, params=twitter_api_parameters)
+            response = self._twython.get(self._twitter_api_endpoint, params=twitter_api_parameters)
         except TwythonError as e:
+            self._record_request(request_start_time, e.error_code or 'error')
             self._logger.error("TwythonError: %s" % e)
+            self._forget_rejected_token(e)
+            raise
+        self._record_request(request_start_time, 200)
+        self._metrics.increment(trawler_metrics.RECORDS, len(page_records(response)), **self._metric_labels)
+        return response
+
+    def _retry_reason(self, e):
+        """
+        Returns the reason for retrying after TwythonError `e`, or None
+        if it should not be retried
+        """
+        # Twitter error codes:
+        #    https://dev.twitter.com/docs/error-codes-responses
+        if e.error_code == 429:
+            return 'rate_limit'
+        # Twitter servers are misbehaving
+        elif e.error_code in [502, 503, 504]:
+            return 'server_error'
+        # Twitter servers returned an empty HTTPS response
+        elif "Caused by <class 'httplib.BadStatusLine'>: ''" in str(e):
+            # Twitter servers can sometimes return an empty HTTP response, e.g.:
+            #   https://dev.twitter.com/discussions/20832
+            #
+            # The code currently detects empty HTTPS responses by checking for a particular
+            # string:
+            #   Caused by <class 'httplib.BadStatusLine'>: ''"
+            # in the exception message text, which is fragile and definitely not ideal.  Twython
+            # uses the Requests library, and the "Caused by %s: %s" string comes from the
+            # version of urllib3 that is bundled with the Requests library.  Upgrading to a
+            # newer version of the Requests library (this code tested with requests 2.0.0) may
+            # break the detection of empty HTTPS responses.
+            #
+            # The httplib library (which is part of the Python Standard Library) throws the
+            # httplib.BadStatusLine exception, which is caught by urllib3, and then re-thrown
+            # (with the "Caused by" text) as a urllib3.MaxRetryError.  The Requests library
+            # catches the urllib3.MaxRetryError and throws a requests.ConnectionError, and
+            # Twython catches the requests.ConnectionError and throws a TwythonError exception -
+            # which we catch in this function.
+            return 'empty_response'
+        return None
+
+    def _rate_limit_reached(self, e):
+        """
+        Marks the rate limit window as used up after 429 error `e`, so
+        that the request waits for it to reset, or, if retries are
+        deferred, raises RetryLater for when it resets
+        """
+        self._logger.error("Rate limit exceeded for '%s'. Number of expected remaining API calls for current window: %d" %
+                           (self._twitter_api_endpoint, (self.calls_remaining() or 0) + 1))
+        self._metrics.increment(trawler_metrics.RATE_LIMIT_ERRORS, **self._metric_labels)
+        with self._window.lock:
+            calls_remaining, resets_at = self._window.state()
+            if resets_at is not None:
+                self._window.update(0, resets_at)
+        if self._retry_policy.defer:
+            self._metrics.increment(trawler_metrics.RETRIES, reason='rate_limit', **self._metric_labels)
+            # As in _sleep_if_rate_limit_reached()
+            retry_at = max((resets_at or 0) + 15, time.time() + 60)
+            raise RetryLater("Retry '%s' once its rate limit resets" % self._twitter_api_endpoint, retry_at, e,
+                             reason='rate_limit')
+
+    def _retry(self, reason, attempt, e):
+        """
+        Sleeps before retry number `attempt` after error `e`, or, if
+        retries are deferred, raises RetryLater
+        """
+        if self._retry_policy.defer:
+            # Back off by the endpoint's failures in a row, since a
+            # deferred request starts again from its first attempt
+            with self._retries_lock:
+                self._consecutive_retries += 1
+                consecutive_retries = self._consecutive_retries
+            backoff = self._retry_policy.backoff(consecutive_retries)
+        else:
+            backoff = self._retry_policy.backoff(attempt)
 
-            # Twitter error codes:
-            #    https://dev.twitter.com/docs/error-codes-responses
+        if reason == 'server_error':
+            self._logger.error("Twitter servers are misbehaving - retrying in %d seconds" % backoff)
+        else:
+            self._logger.error("Received an empty HTTPS response from Twitter servers - retrying in %d seconds" % backoff)
 
-            # Update rate limit status if exception is 'Too Many Requests'
-            if e.error_code == 429:
-                self._logger.error("Rate limit exceeded for '%s'. Number of expected remaining API calls for current window: %d" %
-                                  (self._twitter_api_endpoint, self.api_calls_remaining_for_current_window + 1))
-                time.sleep(backoff)
-                self._update_rate_limit_status()
-                return self._get_data_with_backoff(backoff*2, **twitter_api_parameters)
-            # Sleep if Twitter servers are misbehaving
-            elif e.error_code in [502, 503, 504]:
-                self._logger.error("Twitter servers are misbehaving - sleeping for %d seconds" % backoff)
-                time.sleep(backoff)
-                return self._get_data_with_backoff(backoff*2, **twitter_api_parameters)
-            # Sleep if Twitter servers returned an empty HTTPS response
-            elif "Caused by <class 'httplib.BadStatusLine'>: ''" in str(e):
-                # Twitter servers can sometimes return an empty HTTP response, e.g.:
-                #   https://dev.twitter.com/discussions/20832
-                #
-                # The code currently detects empty HTTPS responses by checking for a particular
-                # string:
-                #   Caused by <class 'httplib.BadStatusLine'>: ''"
-                # in the exception message text, which is fragile and definitely not ideal.  Twython
-                # uses the Requests library, and the "Caused by %s: %s" string comes from the
-                # version of urllib3 that is bundled with the Requests library.  Upgrading to a
-                # newer version of the Requests library (this code tested with requests 2.0.0) may
-                # break the detection of empty HTTPS responses.
-                #
-                # The httplib library (which is part of the Python Standard Library) throws the
-                # httplib.BadStatusLine exception, which is caught by urllib3, and then re-thrown
-                # (with the "Caused by" text) as a urllib3.MaxRetryError.  The Requests library
-                # catches the urllib3.MaxRetryError and throws a requests.ConnectionError, and
-                # Twython catches the requests.ConnectionError and throws a TwythonError exception -
-                # which we catch in this function.
-                self._logger.error("Received an empty HTTPS response from Twitter servers - sleeping for %d seconds" % backoff)
-                time.sleep(backoff)
-                return self._get_data_with_backoff(backoff*2, **twitter_api_parameters)
-            # For all other TwythonErrors, reraise the exception
-            else:
-                raise e
+        if self._retry_policy.defer:
+            self._metrics.increment(trawler_metrics.RETRIES, reason=reason, **self._metric_labels)
+            raise RetryLater("Retry '%s' in %d seconds" % (self._twitter_api_endpoint, backoff),
+                             time.time() + backoff, e, reason=reason)
 
+        self._record_retry(reason, backoff)
+        time.sleep(backoff)
 
-    def _sleep_if_rate_limit_reached(self):
-        if self.api_calls_remaining_for_current_window < 1:
-            current_time = time.time()
-            seconds_to_sleep = self._current_rate_limit_window_ends - current_time
+    def _record_request(self, request_start_time, status):
+        self._metrics.observe(trawler_metrics.REQUEST_SECONDS, time.time() - request_start_time,
+                              **self._metric_labels)
+        self._metrics.increment(trawler_metrics.REQUESTS, status=str(status), **self._metric_labels)
 
-            # Pad the sleep time by 15 seconds to compensate for possible clock skew
-            seconds_to_sleep += 15
+    def _record_retry(self, reason, backoff):
+        self._metrics.increment(trawler_metrics.RETRIES, reason=reason, **self._metric_labels)
+        self._metrics.increment(trawler_metrics.SLEEP_SECONDS, backoff, reason='backoff', **self._metric_labels)
 
-            # If the number of calls available is 0 and the rate limit window has already
-            # expired, we sleep for 60 seconds before calling self._update_rate_limit_status()
-            # again.
-            #
-            # In testing on 2013-11-06, the rate limit window could be expired for over a
-            # minute before calls to the Twitter rate_limit_status API would return with
-            # an updated window expiration timestamp and an updated (non-zero) count for
-            # the number of API calls available.
-            if seconds_to_sleep < 0:
-                seconds_to_sleep = 60
+
+    def _retry_at_reset(self, resets_at):
+        # Pad the sleep time by 15 seconds to compensate for possible clock skew
+        retry_at = resets_at + 15
+
+        # If the number of calls available is 0 and the rate limit window has already
+        # expired, we sleep for 60 seconds before calling self._update_rate_limit_status()
+        # again.
+        #
+        # In testing on 2013-11-06, the rate limit window could be expired for over a
+        # minute before calls to the Twitter rate_limit_status API would return with
+        # an updated window expiration timestamp and an updated (non-zero) count for
+        # the number of API calls available.
+        if retry_at < time.time():
+            retry_at = time.time() + 60
+        return retry_at
+
+    def _sleep_if_rate_limit_reached(self, keep=0):
+        """
+        Sleeps until more than `keep` calls are left in the window.  The
+        window's lock is not held while sleeping, so threads that may
+        use the calls held back meanwhile are not kept waiting.
+        """
+        while True:
+            with self._window.lock:
+                calls_remaining, resets_at = self._window.state()
+            if calls_remaining > keep:
+                return
+            current_time = time.time()
+            seconds_to_sleep = self._retry_at_reset(resets_at) - current_time
 
             sleep_until = datetime.datetime.fromtimestamp(current_time + seconds_to_sleep).strftime("%Y-%m-%d %H:%M:%S")
             self._logger.info("Rate limit reached for '%s', sleeping for %.2f seconds (until %s)" % \
                                  (self._twitter_api_endpoint, seconds_to_sleep, sleep_until))
+            self._metrics.increment(trawler_metrics.SLEEP_SECONDS, seconds_to_sleep, reason='rate_limit',
+                                    **self._metric_labels)
             time.sleep(seconds_to_sleep)
 
-            self._update_rate_limit_status()
-
-            # Recursion! Sleep some more if necessary after updating rate limit status
-            self._sleep_if_rate_limit_reached()
+            # Only the first of the threads that slept until the reset
+            # looks up the new window
+            with self._window.lock:
+                if self._window.state()[1] <= resets_at:
+                    self._update_rate_limit_status()
 
 
     def _update_rate_limit_status(self):
         #  https://dev.twitter.com/docs/api/1.1/get/application/rate_limit_status
-        rate_limit_status = self._twython.get_application_rate_limit_status(resources=self._twitter_api_resource)
+        try:
+            rate_limit_status = self._twython.get_application_rate_limit_status(resources=self._twitter_api_resource)
+        except TwythonError as e:
+            self._forget_rejected_token(e)
+            raise
 
-        self._current_rate_limit_window_ends = rate_limit_status['resources'][self._twitter_api_resource][self._twitter_api_endpoint_with_prefix]['reset']
+        resets_at = rate_limit_status['resources'][self._twitter_api_resource][self._twitter_api_endpoint_with_prefix]['reset']
 
-        self.api_calls_remaining_for_current_window = rate_limit_status['resources'][self._twitter_api_resource][self._twitter_api_endpoint_with_prefix]['remaining']
+        calls_remaining = rate_limit_status['resources'][self._twitter_api_resource][self._twitter_api_endpoint_with_prefix]['remaining']
+        self._rate_limit = rate_limit_status['resources'][self._twitter_api_resource][self._twitter_api_endpoint_with_prefix]['limit']
+        self._window.update(calls_remaining, resets_at)
+        self._metrics.gauge(trawler_metrics.QUOTA_REMAINING, calls_remaining,
+                            **self._metric_labels)
 
-        dt = int(self._current_rate_limit_window_ends - time.time())
-        rate_limit_ends = datetime.datetime.fromtimestamp(self._current_rate_limit_window_ends).strftime("%Y-%m-%d %H:%M:%S")
+        dt = int(resets_at - time.time())
+        rate_limit_ends = datetime.datetime.fromtimestamp(resets_at).strftime("%Y-%m-%d %H:%M:%S")
         self._logger.info("Rate limit status for '%s': %d calls remaining until %s (for next %d seconds)" % \
-                             (self._twitter_api_endpoint, self.api_calls_remaining_for_current_window, rate_limit_ends, dt))
+                             (self._twitter_api_endpoint, calls_remaining, rate_limit_ends, dt))
 
-def get_connection( consumer_key, consumer_secret):
-    ACCESS_TOKEN = Twython(consumer_key, consumer_secret, oauth_version=2).obtain_access_token()
-    twython = Twython(consumer_key, access_token=ACCESS_TOKEN)
-    return twython
+    def _forget_rejected_token(self, e):
+        """
+        If TwythonError `e` says the bearer token is invalid or expired,
+        removes it from the cache of the ConnectionManager that issued it,
+        so that the next connection obtains a new one
+        """
+        if is_invalid_token_error(e) and invalidate_token(self._twython):
+            self._logger.error("Bearer token for '%s' was rejected, and has been removed from the token cache" %
+                               self._twitter_api_endpoint)
 
-def get_timeline_crawler( twython, logger=None):
+class EndpointRegistry:
+    """
+    Holds one RateLimitWindow per (API key, endpoint), so that every
+    endpoint it hands out for a pair draws on the same quota.  Pass the
+    same registry (as `registry`) to every crawler that should share
+    rate limits; each crawler still logs to its own logger and records
+    to its own metrics.
+
+    By default windows are only shared within this process.  Given a
+    `store` from trawler_rate_limits.py (e.g. SQLiteRateLimitStore or
+    RedisRateLimitStore), windows are kept in the store instead, so
+    crawlers in other processes, or on other hosts, using the same
+    store split each API key's quota between them.
+
+    Every endpoint it hands out retries failed requests according to
+    `retry_policy`, and endpoints for the same Twitter API endpoint
+    share one CircuitBreaker, whatever API key they use.
+    """
+    def __init__(self, store=None, retry_policy=None):
+        self._store = store
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._windows = {}
+        self._circuit_breakers = {}
+        self._lock = threading.Lock()
+
+    def window(self, twython, twitter_api_endpoint):
+        key = (twython_token_key(twython), twitter_api_endpoint)
+        with self._lock:
+            if key not in self._windows:
+                if self._store is None:
+                    self._windows[key] = RateLimitWindow()
+                else:
+                    self._windows[key] = self._store.window(twython_token_hash(twython), twitter_api_endpoint)
+            return self._windows[key]
+
+    def circuit_breaker(self, twitter_api_endpoint):
+        with self._lock:
+            if twitter_api_endpoint not in self._circuit_breakers:
+                self._circuit_breakers[twitter_api_endpoint] = CircuitBreaker()
+            return self._circuit_breakers[twitter_api_endpoint]
+
+    def get_endpoint(self, twython, twitter_api_endpoint, logger=None, metrics=None):
+        return RateLimitedTwitterEndpoint(twython, twitter_api_endpoint, logger=logger, metrics=metrics,
+                                          window=self.window(twython, twitter_api_endpoint),
+                                          retry_policy=self.retry_policy,
+                                          circuit_breaker=self.circuit_breaker(twitter_api_endpoint))
+
+
+class ConnectionManager:
+    """
+    Hands out Twython connections that reuse OAuth2 bearer tokens and
+    HTTP connections, so that reconnecting, or starting another short
+    crawl job, costs neither a token request nor a TLS handshake.
+
+    Bearer tokens are cached in memory and, if `token_directory` is not
+    None, on disk in a file per consumer key (readable only by the
+    user), so later processes reuse them too.  Every connection shares
+    one pool of keep-alive HTTP connections of up to `pool_size`
+    connections per host; set it to the number of threads making
+    requests at once (e.g. with CrawlScheduler, the number of API keys
+    times `workers_per_token` times the number of endpoints in use), or
+    call resize() once the concurrency is known.
+    """
+    def __init__(self, token_directory=os.path.join(os.path.expanduser("~"), ".trawler", "tokens"),
+                 pool_size=10, twython_class=Twython):
+        self._token_directory = token_directory
+        self._twython_class = twython_class
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self.pool_size = pool_size
+        self._adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+
+    def get_connection(self, consumer_key, consumer_secret):
+        twython = self._twython_class(consumer_key, access_token=self.access_token(consumer_key, consumer_secret))
+        self._share_connections(twython)
+        # So that invalidate_token() can find the cache a token came from
+        twython.connection_manager = self
+        return twython
+
+    def access_token(self, consumer_key, consumer_secret):
+        """
+        Returns the cached bearer token for `consumer_key`, obtaining
+        (and caching) one if there is none.
+        """
+        with self._lock:
+            if consumer_key not in self._tokens:
+                access_token = self._read_token(consumer_key)
+                if access_token is None:
+                    oauth = self._twython_class(consumer_key, consumer_secret, oauth_version=2)
+                    self._share_connections(oauth)
+                    access_token = oauth.obtain_access_token()
+                    self._write_token(consumer_key, access_token)
+                self._tokens[consumer_key] = access_token
+            return self._tokens[consumer_key]
+
+    def invalidate(self, consumer_key):
+        """
+        Forgets the bearer token for `consumer_key`, e.g. after Twitter
+        has rejected it as invalid (error code 89)
+        """
+        with self._lock:
+            self._tokens.pop(consumer_key, None)
+            if self._token_directory is not None and os.path.exists(self._token_filename(consumer_key)):
+                os.remove(self._token_filename(consumer_key))
+
+    def resize(self, pool_size):
+        """
+        Sets the number of keep-alive connections kept per host.  Open
+        connections are closed.
+        """
+        self.pool_size = pool_size
+        self._adapter.init_poolmanager(requests.adapters.DEFAULT_POOLSIZE, pool_size)
+
+    def close(self):
+        self._adapter.close()
+
+    def _share_connections(self, twython):
+        twython.client.mount('https://', self._adapter)
+        twython.client.mount('http://', self._adapter)
+
+    def _token_filename(self, consumer_key):
+        return os.path.join(self._token_directory, hashlib.sha1(consumer_key.encode('utf-8')).hexdigest())
+
+    def _read_token(self, consumer_key):
+        if self._token_directory is None or not os.path.exists(self._token_filename(consumer_key)):
+            return None
+        return open(self._token_filename(consumer_key)).read().strip() or None
+
+    def _write_token(self, consumer_key, access_token):
+        if self._token_directory is None:
+            return
+        if not os.path.isdir(self._token_directory):
+            os.makedirs(self._token_directory, 0700)
+        token_file = os.open(self._token_filename(consumer_key), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        os.write(token_file, access_token)
+        os.close(token_file)
+
+
+# Used by get_connection() when it is not given a ConnectionManager
+_connection_manager = None
+_connection_manager_lock = threading.Lock()
+
+def get_connection( consumer_key, consumer_secret, connection_manager=None):
+    """
+    Returns a Twython instance with an OAuth2 bearer token for
+    `consumer_key`.  Tokens and HTTP connections are reused through
+    `connection_manager`, or by default through a ConnectionManager
+    shared by the whole process that caches tokens in ~/.trawler/tokens.
+    """
+    global _connection_manager
+    if connection_manager is None:
+        with _connection_manager_lock:
+            if _connection_manager is None:
+                _connection_manager = ConnectionManager()
+            connection_manager = _connection_manager
+    return connection_manager.get_connection(consumer_key, consumer_secret)
+
+def is_invalid_token_error(e):
+    """
+    Returns True if TwythonError `e` is Twitter rejecting the bearer
+    token (a 401 with error code 89, 'Invalid or expired token'), as
+    opposed to e.g. a 401 for a protected user's timeline
+    """
+    return e.error_code == 401 and 'invalid or expired token' in str(e).lower()
+
+def invalidate_token(twython):
+    """
+    Removes the bearer token of a Twython instance returned by
+    get_connection() from its ConnectionManager's cache, in memory and
+    on disk.  Returns False if the instance did not come from a
+    ConnectionManager.
+    """
+    connection_manager = getattr(twython, 'connection_manager', None)
+    if connection_manager is None:
+        return False
+    connection_manager.invalidate(twython.app_key)
+    return True
+
+def get_timeline_crawler( twython, logger=None, sink=None, metrics=None, registry=None):
     """Requires a Twython instance passed to it, obtain such
-    from `get_connection`"""
-    timeline_crawler = CrawlTwitterTimelines(twython, logger)
+    from `get_connection`.  If a `CrawlSink` is given as `sink`, every
+    page fetched by the crawler is also published to it.  Crawlers given
+    the same `EndpointRegistry` as `registry` share rate limits."""
+    timeline_crawler = CrawlTwitterTimelines(twython, logger, sink, metrics, registry)
     return timeline_crawler
 
-def get_friend_follower_crawler( twython, logger=None):
+def get_friend_follower_crawler( twython, logger=None, sink=None, metrics=None, registry=None):
     """Requires a Twython instance passed to it, obtain such
     from `get_connection`"""
-    ff_finder = FindFriendFollowers(twython, logger)
+    ff_finder = FindFriendFollowers(twython, logger, sink, metrics, registry)
     return ff_finder
 
-def get_follower_crawler( twython, logger=None):
+def get_follower_crawler( twython, logger=None, sink=None, metrics=None, registry=None):
     """Requires a Twython instance passed to it, obtain such
     from `get_connection`"""
-    follower_finder = FindFollowers(twython, logger)
+    follower_finder = FindFollowers(twython, logger, sink, metrics, registry)
     return follower_finder
 
-def get_followee_crawler( twython, logger=None):
+def get_followee_crawler( twython, logger=None, sink=None, metrics=None, registry=None):
     """Requires a Twython instance passed to it, obtain such
     from `get_connection`"""
-    followee_finder = FindFollowees(twython, logger)
+    followee_finder = FindFollowees(twython, logger, sink, metrics, registry)
     return followee_finder
 
-def get_list_membership_crawler(twython, logger=None):
+def get_list_membership_crawler(twython, logger=None, sink=None, metrics=None, registry=None):
     """Requires a Twython instance passed to it, obtain such
     from `get_connection`"""
-    membership_finder = ListMembership(twython, logger)
+    membership_finder = ListMembership(twython, logger, sink, metrics, registry)
     return membership_finder
 
-def get_search_crawler(twython, logger=None):
+def get_tweet_lookup_crawler(twython, logger=None, sink=None, metrics=None, registry=None):
+    """Requires a Twython instance passed to it, obtain such
+    from `get_connection`"""
+    tweet_finder = TweetLookup(twython, logger, sink, metrics, registry)
+    return tweet_finder
+
+def get_search_crawler(twython, logger=None, sink=None, metrics=None, registry=None):
     """Requires a Twython instance passed to it, obtain such
     from `get_connection`"""
-    search_finder = SearchTwitterTimelines(twython,logger)
+    search_finder = SearchTwitterTimelines(twython,logger, sink, metrics, registry)
     return search_finder